@@ -66,6 +66,10 @@ def create_app():
     # 注册所有 API 路由
     register_routes(app)
 
+    # 启动后台任务工作线程（继续执行上次退出时未完成的任务）
+    from backend.services.jobs import get_job_manager
+    get_job_manager().start()
+
     # 启动时验证配置
     _validate_config_on_startup(logger)
 
@@ -27,6 +27,47 @@ class Config:
     # 设置为 true 允许永久删除记录，设置为 false 则删除操作会变成归档
     ALLOW_DELETE = os.environ.get('ALLOW_DELETE', 'false').lower() == 'true'
 
+    # 压缩图片缓存的内存预算（MB），所有任务共享，按 LRU 淘汰
+    COMPRESS_CACHE_MAX_MB = int(os.environ.get('COMPRESS_CACHE_MAX_MB', 64))
+
+    # 缩略图后台生成：工作线程数和待处理队列上限
+    THUMBNAIL_WORKERS = int(os.environ.get('THUMBNAIL_WORKERS', 2))
+    THUMBNAIL_QUEUE_SIZE = int(os.environ.get('THUMBNAIL_QUEUE_SIZE', 64))
+
+    # 衍生图（?w=&fmt=）磁盘缓存配额（MB），所有任务共享，按最近访问淘汰
+    DERIVATIVE_CACHE_MAX_MB = int(os.environ.get('DERIVATIVE_CACHE_MAX_MB', 512))
+
+    # 图片处理（压缩/缩略图/衍生图）进程池大小，0 表示禁用，在调用线程中执行
+    IMAGE_PROCESS_WORKERS = int(os.environ.get('IMAGE_PROCESS_WORKERS', min(4, os.cpu_count() or 1)))
+
+    # 后台任务队列：数据库路径（默认 history/jobs.db）、同时执行的任务数上限（0 为不限，页面的并发由调度器决定）、已结束任务的保留时长（小时）、
+    # 每个任务最多执行的次数（服务重启时中断的执行也计入）、任务租约有效期（秒，执行方退出后任务最多等待这么久被重新排队）
+    JOBS_DB_PATH = os.environ.get('JOBS_DB_PATH')
+    JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 0))
+    JOB_RETENTION_HOURS = float(os.environ.get('JOB_RETENTION_HOURS', 72))
+    JOB_MAX_ATTEMPTS = int(os.environ.get('JOB_MAX_ATTEMPTS', 3))
+    JOB_LEASE_SECONDS = float(os.environ.get('JOB_LEASE_SECONDS', 30))
+
+    # 任务状态（重试所需的上下文）：内存预算（MB）、内存中最多缓存的任务数、空闲多久后移出内存（分钟）
+    # 移出内存的任务状态保存在任务目录的 .state 中，需要时重新加载
+    TASK_STATE_MAX_MB = int(os.environ.get('TASK_STATE_MAX_MB', 128))
+    TASK_STATE_MAX_TASKS = int(os.environ.get('TASK_STATE_MAX_TASKS', 200))
+    TASK_STATE_TTL_MINUTES = float(os.environ.get('TASK_STATE_TTL_MINUTES', 30))
+
+    # 跨进程并发限制（多个 worker / 副本共享服务商的 max_concurrent）：
+    # 后端 local（不启用）/ sqlite（同一台机器，默认 history/leases.db）/ redis（多台机器），租约有效期（秒）
+    CONCURRENCY_BACKEND = os.environ.get('CONCURRENCY_BACKEND', 'local').lower()
+    CONCURRENCY_DB_PATH = os.environ.get('CONCURRENCY_DB_PATH')
+    CONCURRENCY_REDIS_URL = os.environ.get('CONCURRENCY_REDIS_URL')
+    CONCURRENCY_LEASE_TTL = float(os.environ.get('CONCURRENCY_LEASE_TTL', 30))
+
+    # 自适应并发上限从服务商 max_concurrent 起步，加性增长最多探测到该倍数（服务商配置 max_concurrent_ceiling 可覆盖）
+    CONCURRENCY_CEILING_FACTOR = float(os.environ.get('CONCURRENCY_CEILING_FACTOR', 4))
+
+    # 生成引擎：thread（默认，每张生成中的图片占用一个工作线程）/ asyncio（图片页面经调度器准入后、以及流式大纲
+    # 在一个事件循环中以协程执行，服务商调用使用原生异步客户端，几个线程即可承载数百个并发请求）
+    GENERATION_ENGINE = os.environ.get('GENERATION_ENGINE', 'thread').lower()
+
     _auth_config = None
 
     @classmethod
@@ -201,6 +242,58 @@ class Config:
         logger.debug(f"图片生成全局最大并发数: {max_concurrent}")
         return max_concurrent
 
+    @classmethod
+    def get_provider_concurrency(cls, provider_config: dict) -> tuple:
+        """
+        获取服务商的并发配置
+
+        Args:
+            provider_config: 服务商配置
+
+        Returns:
+            (max_concurrent, ceiling)：max_concurrent 为自适应并发上限的起始值（默认全局 max_concurrent）；
+            ceiling 为加性增长可以探测到的上界（服务商配置 max_concurrent_ceiling，
+            默认 max_concurrent 的 CONCURRENCY_CEILING_FACTOR 倍），也是连接池大小和跨进程合计上限的依据
+        """
+        max_concurrent = int(provider_config.get('max_concurrent') or cls.get_image_max_concurrent())
+        ceiling = provider_config.get('max_concurrent_ceiling')
+        if ceiling:
+            ceiling = int(ceiling)
+        else:
+            ceiling = int(max_concurrent * max(1.0, cls.CONCURRENCY_CEILING_FACTOR))
+        return max_concurrent, max(max_concurrent, ceiling)
+
+    @classmethod
+    def get_image_scheduler_workers(cls) -> int:
+        """
+        获取图片生成调度器的工作线程数
+
+        工作线程只是执行载体，实际并发由各服务商的自适应并发上限控制：线程数取正在使用的服务商
+        （服务商池成员或激活的服务商）并发上限可以探测到的上界之和，保证每个服务商都能用满上限，
+        至少为全局 max_concurrent
+        """
+        config = cls.load_image_providers_config()
+        global_max = cls.get_image_max_concurrent()
+        providers = config.get('providers', {}) or {}
+        names = list(cls.get_image_provider_pool()) or [cls.get_active_image_provider()]
+        total = sum(cls.get_provider_concurrency(providers.get(name) or {})[1] for name in names)
+        return max(global_max, total)
+
+    @classmethod
+    def get_image_provider_pool(cls) -> dict:
+        """
+        获取图片服务商池配置
+
+        Returns:
+            {服务商名称: 权重}；未启用服务商池时返回空字典
+        """
+        config = cls.load_image_providers_config()
+        pool = config.get('provider_pool') or {}
+        if not pool.get('enabled'):
+            return {}
+        members = pool.get('members') or {}
+        return {name: float(weight) for name, weight in members.items() if weight and float(weight) > 0}
+
     @classmethod
     def get_image_provider_config(cls, provider_name: str = None):
         config = cls.load_image_providers_config()
@@ -233,6 +326,8 @@ class Config:
             )
 
         provider_config = providers[provider_name].copy()
+        # 记录服务商名称，供按服务商共享的限流器使用
+        provider_config['name'] = provider_name
 
         # 验证必要字段
         if not provider_config.get('api_key'):
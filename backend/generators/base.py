@@ -1,6 +1,25 @@
 """图片生成器抽象基类"""
+import asyncio
+import io
 from abc import ABC, abstractmethod
-from typing import Dict, Any, Optional
+from typing import BinaryIO, Dict, Any, Optional
+from ..utils.rate_limiter import get_rate_limiter
+from ..utils.circuit_breaker import get_circuit_breaker
+from ..utils.http_pool import get_async_http_session, get_http_session
+from ..utils.image_pool import open_file_atomic
+from ..utils.retry_policy import CancelEvent
+
+
+class _TeeWriter:
+    """同时写入多个目标（写入文件的同时在内存中保留一份）"""
+
+    def __init__(self, *targets: BinaryIO):
+        self._targets = targets
+
+    def write(self, data: bytes) -> int:
+        for target in self._targets:
+            target.write(data)
+        return len(data)
 
 
 class ImageGeneratorBase(ABC):
@@ -17,6 +36,16 @@ class ImageGeneratorBase(ABC):
         self.api_key = config.get('api_key')
         self.base_url = config.get('base_url')
 
+        # 请求速率限制（同一服务商的所有生成器实例共享一个令牌桶）
+        provider_name = config.get('name') or config.get('type', self.__class__.__name__)
+        self.rate_limiter = get_rate_limiter('image', provider_name, config)
+        # 熔断器（同一服务商共享）
+        self.circuit_breaker = get_circuit_breaker('image', provider_name, config)
+        # HTTP 连接池（同一服务商共享长连接，包括生成后的图片下载）
+        self.http = get_http_session('image', provider_name, config)
+        # 异步生成引擎使用的 HTTP 连接池（第一次异步请求时才建立连接）
+        self.ahttp = get_async_http_session('image', provider_name, config)
+
     @abstractmethod
     def generate_image(
         self,
@@ -35,6 +64,95 @@ class ImageGeneratorBase(ABC):
         """
         pass
 
+    def write_image(self, out: BinaryIO, prompt: str, **kwargs) -> int:
+        """
+        生成图片并写入 out
+
+        默认写入 generate_image 的结果；能够流式读取响应的生成器覆盖此方法，
+        边下载边解码写入，不在内存中保留整张图片
+
+        Args:
+            out: 写入目标（文件或 BytesIO）
+            prompt: 提示词
+            **kwargs: 同 generate_image
+
+        Returns:
+            写入的字节数
+        """
+        image_data = self.generate_image(prompt, **kwargs)
+        out.write(image_data)
+        return len(image_data)
+
+    def generate_image_to_file(
+        self,
+        prompt: str,
+        path: str,
+        copy_to: Optional[BinaryIO] = None,
+        **kwargs
+    ) -> int:
+        """
+        生成图片并直接写入文件（原子替换，出错时不留下不完整的文件）
+
+        Args:
+            prompt: 提示词
+            path: 目标文件路径
+            copy_to: 同时写入的另一个目标（如封面需要作为参考图时的 BytesIO），不必再读回文件
+            **kwargs: 同 generate_image
+
+        Returns:
+            写入的字节数
+        """
+        with open_file_atomic(path) as f:
+            return self.write_image(f if copy_to is None else _TeeWriter(f, copy_to), prompt, **kwargs)
+
+    async def agenerate_image(self, prompt: str, **kwargs) -> bytes:
+        """
+        generate_image 的异步版本（异步生成引擎使用）
+
+        Args:
+            prompt: 提示词
+            **kwargs: 同 generate_image（不需要 cancel_event，撤销通过撤销协程完成）
+
+        Returns:
+            图片二进制数据
+        """
+        out = io.BytesIO()
+        await self.awrite_image(out, prompt, **kwargs)
+        return out.getvalue()
+
+    async def awrite_image(self, out: BinaryIO, prompt: str, **kwargs) -> int:
+        """
+        write_image 的异步版本
+
+        默认在线程池中执行 write_image（协程被撤销时通过 cancel_event 通知生成器放弃）；
+        有原生异步客户端的生成器覆盖此方法，等待响应期间不占用线程
+
+        Returns:
+            写入的字节数
+        """
+        cancel_event = kwargs.setdefault('cancel_event', CancelEvent())
+        try:
+            return await asyncio.to_thread(self.write_image, out, prompt, **kwargs)
+        except asyncio.CancelledError:
+            cancel_event.set()
+            raise
+
+    async def agenerate_image_to_file(
+        self,
+        prompt: str,
+        path: str,
+        copy_to: Optional[BinaryIO] = None,
+        **kwargs
+    ) -> int:
+        """
+        generate_image_to_file 的异步版本（原子替换，出错或被撤销时不留下不完整的文件）
+
+        Returns:
+            写入的字节数
+        """
+        with open_file_atomic(path) as f:
+            return await self.awrite_image(f if copy_to is None else _TeeWriter(f, copy_to), prompt, **kwargs)
+
     @abstractmethod
     def validate_config(self) -> bool:
         """
@@ -1,17 +1,26 @@
 """Google GenAI 图片生成器"""
 import logging
-import time
-import random
-import base64
-from functools import wraps
-from typing import Dict, Any, Optional
+from typing import BinaryIO, Dict, Any, Optional, Tuple, Union
 from google import genai
 from google.genai import types
 from .base import ImageGeneratorBase
-from ..utils.image_compressor import compress_image
+from ..utils.reference_asset import ReferenceAsset
+from ..utils.retry_policy import (
+    KIND_SAFETY, KIND_UNKNOWN, ProviderError, RequestCancelled, classify_error, raise_if_cancelled
+)
 
 logger = logging.getLogger(__name__)
 
+# 表示内容被安全过滤拦截的结束原因
+_SAFETY_FINISH_REASONS = frozenset({
+    types.FinishReason.SAFETY,
+    types.FinishReason.IMAGE_SAFETY,
+    types.FinishReason.PROHIBITED_CONTENT,
+    types.FinishReason.IMAGE_PROHIBITED_CONTENT,
+    types.FinishReason.BLOCKLIST,
+    types.FinishReason.SPII,
+})
+
 
 def parse_genai_error(error: Exception) -> str:
     """
@@ -279,58 +288,6 @@ def parse_genai_error(error: Exception) -> str:
     )
 
 
-def retry_on_error(max_retries=5, base_delay=3):
-    """智能重试装饰器，根据错误类型决定是否重试"""
-    def decorator(func):
-        @wraps(func)
-        def wrapper(*args, **kwargs):
-            last_error = None
-            for attempt in range(max_retries):
-                try:
-                    return func(*args, **kwargs)
-                except Exception as e:
-                    last_error = e
-                    error_str = str(e).lower()
-
-                    # 不可重试的错误类型
-                    non_retryable = [
-                        "401", "unauthenticated",  # 认证错误
-                        "403", "permission_denied", "forbidden",  # 权限错误
-                        "404", "not_found",  # 资源不存在
-                        "invalid_argument",  # 参数错误
-                        "safety", "blocked", "filter",  # 安全过滤
-                    ]
-
-                    should_retry = True
-                    for keyword in non_retryable:
-                        if keyword in error_str:
-                            should_retry = False
-                            break
-
-                    if not should_retry:
-                        # 直接抛出，不重试
-                        raise Exception(parse_genai_error(e))
-
-                    # 可重试的错误
-                    if attempt < max_retries - 1:
-                        if "429" in error_str or "resource_exhausted" in error_str:
-                            wait_time = (base_delay ** attempt) + random.uniform(0, 1)
-                            logger.warning(f"⏳ 遇到速率限制，{wait_time:.1f}秒后重试 (尝试 {attempt + 2}/{max_retries})")
-                        else:
-                            wait_time = min(2 ** attempt, 10) + random.uniform(0, 1)
-                            logger.warning(f"⚠️ 请求失败，{wait_time:.1f}秒后重试 (尝试 {attempt + 2}/{max_retries})")
-                        time.sleep(wait_time)
-                        continue
-
-                    # 重试次数耗尽
-                    raise Exception(parse_genai_error(e))
-
-            # 理论上不会到这里，但保险起见
-            raise Exception(parse_genai_error(last_error))
-        return wrapper
-    return decorator
-
-
 class GoogleGenAIGenerator(ImageGeneratorBase):
     """Google GenAI 图片生成器"""
 
@@ -381,14 +338,13 @@ class GoogleGenAIGenerator(ImageGeneratorBase):
         """验证配置"""
         return bool(self.api_key)
 
-    @retry_on_error(max_retries=5, base_delay=3)
     def generate_image(
         self,
         prompt: str,
         aspect_ratio: str = "3:4",
         temperature: float = 1.0,
         model: str = "gemini-3-pro-image-preview",
-        reference_image: Optional[bytes] = None,
+        reference_image: Optional[Union[ReferenceAsset, bytes]] = None,
         **kwargs
     ) -> bytes:
         """
@@ -399,29 +355,104 @@ class GoogleGenAIGenerator(ImageGeneratorBase):
             aspect_ratio: 宽高比 (如 "3:4", "1:1", "16:9")
             temperature: 温度
             model: 模型名称
-            reference_image: 参考图片二进制数据（用于保持风格一致）
-            **kwargs: 其他参数
+            reference_image: 参考图片（ReferenceAsset 或二进制数据，用于保持风格一致）
+            **kwargs: 其他参数，cancel_event（threading.Event）置位时尽快放弃请求；
+                rate_token_acquired 为 True 时调用方已取得速率令牌，不再等待
 
         Returns:
             图片二进制数据
         """
         logger.info(f"Google GenAI 生成图片: model={model}, aspect_ratio={aspect_ratio}")
         logger.debug(f"  prompt 长度: {len(prompt)} 字符, 有参考图: {reference_image is not None}")
+        contents, generate_content_config = self._build_request(prompt, aspect_ratio, temperature, reference_image)
+
+        image_data = None
+        blocked = None
+        logger.debug(f"  开始调用 API: model={model}")
+        cancel_event = kwargs.get('cancel_event')
+        if not kwargs.get('rate_token_acquired', False):
+            self.rate_limiter.acquire()
+        raise_if_cancelled(cancel_event)
+        try:
+            for chunk in self.client.models.generate_content_stream(
+                model=model,
+                contents=contents,
+                config=generate_content_config,
+            ):
+                raise_if_cancelled(cancel_event)
+                image_data = self._image_from_chunk(chunk) or image_data
+                blocked = self._blocked_reason(chunk) or blocked
+        except RequestCancelled:
+            raise
+        except Exception as e:
+            self.rate_limiter.observe_error(e)
+            # 保留原始错误类型，错误信息转为用户友好的说明
+            raise ProviderError(parse_genai_error(e), kind=classify_error(e)) from e
+
+        return self._check_image(image_data, blocked)
+
+    async def awrite_image(
+        self,
+        out: BinaryIO,
+        prompt: str,
+        aspect_ratio: str = "3:4",
+        temperature: float = 1.0,
+        model: str = "gemini-3-pro-image-preview",
+        reference_image: Optional[Union[ReferenceAsset, bytes]] = None,
+        **kwargs
+    ) -> int:
+        """
+        write_image 的异步版本（client.aio，等待响应期间不占用线程）
 
+        Returns:
+            写入的字节数
+        """
+        logger.info(f"Google GenAI 异步生成图片: model={model}, aspect_ratio={aspect_ratio}")
+        contents, generate_content_config = self._build_request(prompt, aspect_ratio, temperature, reference_image)
+
+        image_data = None
+        blocked = None
+        if not kwargs.get('rate_token_acquired', False):
+            await self.rate_limiter.aacquire()
+        try:
+            stream = await self.client.aio.models.generate_content_stream(
+                model=model,
+                contents=contents,
+                config=generate_content_config,
+            )
+            async for chunk in stream:
+                image_data = self._image_from_chunk(chunk) or image_data
+                blocked = self._blocked_reason(chunk) or blocked
+        except Exception as e:
+            self.rate_limiter.observe_error(e)
+            raise ProviderError(parse_genai_error(e), kind=classify_error(e)) from e
+
+        image_data = self._check_image(image_data, blocked)
+        out.write(image_data)
+        return len(image_data)
+
+    def _build_request(
+        self,
+        prompt: str,
+        aspect_ratio: str,
+        temperature: float,
+        reference_image: Optional[Union[ReferenceAsset, bytes]]
+    ) -> Tuple[list, "types.GenerateContentConfig"]:
+        """构建请求内容和生成配置"""
         # 构建 parts 列表
         parts = []
 
         # 如果有参考图，先添加参考图和说明
         if reference_image:
-            logger.debug(f"  添加参考图片 ({len(reference_image)} bytes)")
-            # 压缩参考图到 200KB 以内
-            compressed_ref = compress_image(reference_image, max_size_kb=200)
-            logger.debug(f"  参考图压缩后: {len(compressed_ref)} bytes")
+            reference = ReferenceAsset.coerce(reference_image)
+            logger.debug(f"  添加参考图片 ({len(reference)} bytes)")
+            # 使用压缩到 200KB 以内的数据（同一任务内只压缩一次）
+            logger.debug(f"  参考图压缩后: {len(reference.compressed)} bytes")
             # 添加参考图
             parts.append(types.Part(
                 inline_data=types.Blob(
-                    mime_type="image/png",
-                    data=compressed_ref
+                    mime_type=reference.compressed_mime,
+                    data=reference.compressed
                 )
             ))
             # 添加带参考说明的提示词
@@ -463,25 +494,41 @@ class GoogleGenAIGenerator(ImageGeneratorBase):
             safety_settings=self.safety_settings,
             image_config=types.ImageConfig(**image_config_kwargs),
         )
-
-        image_data = None
-        logger.debug(f"  开始调用 API: model={model}")
-        for chunk in self.client.models.generate_content_stream(
-            model=model,
-            contents=contents,
-            config=generate_content_config,
-        ):
-            if chunk.candidates and chunk.candidates[0].content and chunk.candidates[0].content.parts:
-                for part in chunk.candidates[0].content.parts:
-                    # 检查是否有图片数据
-                    if hasattr(part, 'inline_data') and part.inline_data:
-                        image_data = part.inline_data.data
-                        logger.debug(f"  收到图片数据: {len(image_data)} bytes")
-                        break
-
+        return contents, generate_content_config
+
+    def _image_from_chunk(self, chunk) -> Optional[bytes]:
+        """取出流式响应块中的图片数据"""
+        if chunk.candidates and chunk.candidates[0].content and chunk.candidates[0].content.parts:
+            for part in chunk.candidates[0].content.parts:
+                # 检查是否有图片数据
+                if hasattr(part, 'inline_data') and part.inline_data:
+                    logger.debug(f"  收到图片数据: {len(part.inline_data.data)} bytes")
+                    return part.inline_data.data
+        return None
+
+    def _blocked_reason(self, chunk) -> Optional[str]:
+        """响应块中服务商明确给出的安全拦截原因（没有时为 None）"""
+        feedback = getattr(chunk, 'prompt_feedback', None)
+        if feedback is not None and feedback.block_reason:
+            return str(feedback.block_reason)
+        if chunk.candidates and chunk.candidates[0].finish_reason in _SAFETY_FINISH_REASONS:
+            return str(chunk.candidates[0].finish_reason)
+        return None
+
+    def _check_image(self, image_data: Optional[bytes], blocked: Optional[str] = None) -> bytes:
+        """检查是否得到了图片"""
+        if not image_data and blocked:
+            logger.error(f"提示词被安全过滤: {blocked}")
+            raise ProviderError(
+                "❌ 图片生成失败：提示词触发了安全过滤\n\n"
+                f"【拦截原因】{blocked}\n\n"
+                "【解决方案】\n"
+                "修改提示词，避免涉及暴力、血腥、色情、真实人物等内容",
+                kind=KIND_SAFETY
+            )
         if not image_data:
             logger.error("API 返回为空，未生成图片")
-            raise ValueError(
+            raise ProviderError(
                 "❌ 图片生成失败：API 返回为空\n\n"
                 "【可能原因】\n"
                 "1. 提示词触发了安全过滤（最常见）\n"
@@ -493,7 +540,8 @@ class GoogleGenAIGenerator(ImageGeneratorBase):
                 "   - 避免涉及真实人物（明星、政治人物等）\n"
                 "   - 使用更中性、积极的描述\n"
                 "2. 尝试简化提示词\n"
-                "3. 检查网络连接后重试"
+                "3. 检查网络连接后重试",
+                kind=KIND_UNKNOWN
             )
 
         logger.info(f"✅ Google GenAI 图片生成成功: {len(image_data)} bytes")
@@ -1,35 +1,21 @@
 """Image API 图片生成器"""
+import io
 import logging
-import time
-import random
-import base64
 import requests
-from typing import Dict, Any, Optional, List, Union
+from typing import BinaryIO, Dict, Any, Optional, List, Union
 from .base import ImageGeneratorBase
-from ..utils.image_compressor import compress_image
+from ..utils.image_stream import (
+    acopy_response, adecode_b64_field, awrite_chat_image, copy_response, decode_b64_field, write_chat_image
+)
+from ..utils.sse_parser import aiter_chat_content, iter_chat_content
+from ..utils.retry_policy import (
+    KIND_TIMEOUT, KIND_UNKNOWN, ProviderError, classify_error, raise_if_cancelled
+)
+from ..utils.reference_asset import ReferenceAsset, collect_reference_assets
 
 logger = logging.getLogger(__name__)
 
 
-def retry_on_error(max_retries: int = 3, base_delay: float = 2):
-    """错误重试装饰器"""
-    def decorator(func):
-        def wrapper(*args, **kwargs):
-            last_error = None
-            for attempt in range(max_retries):
-                try:
-                    return func(*args, **kwargs)
-                except Exception as e:
-                    last_error = e
-                    if attempt < max_retries - 1:
-                        delay = base_delay * (2 ** attempt) + random.uniform(0, 1)
-                        logger.warning(f"请求失败，{delay:.1f}秒后重试 (尝试 {attempt + 2}/{max_retries}): {str(e)[:100]}")
-                        time.sleep(delay)
-            raise last_error
-        return wrapper
-    return decorator
-
-
 class ImageApiGenerator(ImageGeneratorBase):
     """Image API 生成器"""
 
@@ -73,30 +59,48 @@ class ImageApiGenerator(ImageGeneratorBase):
         """获取支持的宽高比"""
         return ["1:1", "2:3", "3:2", "3:4", "4:3", "4:5", "5:4", "9:16", "16:9", "21:9"]
 
-    @retry_on_error(max_retries=3, base_delay=2)
-    def generate_image(
+    def generate_image(self, prompt: str, **kwargs) -> bytes:
+        """
+        生成图片
+
+        Args:
+            prompt: 图片描述
+            **kwargs: 同 write_image
+
+        Returns:
+            生成的图片二进制数据
+        """
+        out = io.BytesIO()
+        self.write_image(out, prompt, **kwargs)
+        return out.getvalue()
+
+    def write_image(
         self,
+        out: BinaryIO,
         prompt: str,
         aspect_ratio: str = None,
         temperature: float = 1.0,
         model: str = None,
-        reference_image: Optional[bytes] = None,
-        reference_images: Optional[List[bytes]] = None,
+        reference_image: Optional[Union[ReferenceAsset, bytes]] = None,
+        reference_images: Optional[List[Union[ReferenceAsset, bytes]]] = None,
         **kwargs
-    ) -> bytes:
+    ) -> int:
         """
-        生成图片
+        生成图片并流式写入 out（b64_json 边读边解码，图片链接边下载边写入）
 
         Args:
+            out: 写入目标（文件或 BytesIO）
             prompt: 图片描述
             aspect_ratio: 宽高比
             temperature: 创意度（未使用，保留接口兼容）
             model: 模型名称
-            reference_image: 单张参考图片数据（向后兼容）
-            reference_images: 多张参考图片数据列表
+            reference_image: 单张参考图片（向后兼容）
+            reference_images: 多张参考图片列表（ReferenceAsset 或二进制数据）
+            **kwargs: 其他参数，cancel_event（threading.Event）置位时尽快放弃请求；
+                rate_token_acquired 为 True 时调用方已取得速率令牌，不再等待
 
         Returns:
-            生成的图片二进制数据
+            写入的字节数
         """
         self.validate_config()
 
@@ -108,26 +112,72 @@ class ImageApiGenerator(ImageGeneratorBase):
 
         logger.info(f"Image API 生成图片: model={model}, aspect_ratio={aspect_ratio}, endpoint={self.endpoint_type}")
 
+        # 收集所有参考图片（压缩和 base64 编码结果挂在 ReferenceAsset 上，重试时直接复用）
+        references = collect_reference_assets(reference_images, reference_image)
+
         # 根据端点类型选择不同的生成方式
-        if 'chat' in self.endpoint_type or 'completions' in self.endpoint_type:
-            return self._generate_via_chat_api(prompt, aspect_ratio, model, reference_image, reference_images)
+        cancel_event = kwargs.get('cancel_event')
+        rate_token_acquired = kwargs.get('rate_token_acquired', False)
+        if self._uses_chat_api():
+            return self._generate_via_chat_api(
+                out, prompt, aspect_ratio, model, references, cancel_event, rate_token_acquired
+            )
         else:
-            return self._generate_via_images_api(prompt, aspect_ratio, model, reference_image, reference_images)
+            return self._generate_via_images_api(
+                out, prompt, aspect_ratio, model, references, cancel_event, rate_token_acquired
+            )
 
-    def _generate_via_images_api(
+    async def awrite_image(
         self,
+        out: BinaryIO,
         prompt: str,
-        aspect_ratio: str,
-        model: str,
-        reference_image: Optional[bytes] = None,
-        reference_images: Optional[List[bytes]] = None
-    ) -> bytes:
-        """通过 /v1/images/generations 端点生成图片"""
-        headers = {
+        aspect_ratio: str = None,
+        temperature: float = 1.0,
+        model: str = None,
+        reference_image: Optional[Union[ReferenceAsset, bytes]] = None,
+        reference_images: Optional[List[Union[ReferenceAsset, bytes]]] = None,
+        **kwargs
+    ) -> int:
+        """
+        write_image 的异步版本（httpx.AsyncClient，等待响应期间不占用线程）
+
+        Returns:
+            写入的字节数
+        """
+        self.validate_config()
+
+        if aspect_ratio is None:
+            aspect_ratio = self.default_aspect_ratio
+
+        if model is None:
+            model = self.model
+
+        logger.info(f"Image API 异步生成图片: model={model}, aspect_ratio={aspect_ratio}, endpoint={self.endpoint_type}")
+
+        references = collect_reference_assets(reference_images, reference_image)
+        rate_token_acquired = kwargs.get('rate_token_acquired', False)
+        if self._uses_chat_api():
+            return await self._agenerate_via_chat_api(out, prompt, model, references, rate_token_acquired)
+        return await self._agenerate_via_images_api(out, prompt, aspect_ratio, model, references, rate_token_acquired)
+
+    def _uses_chat_api(self) -> bool:
+        """端点是否为 chat/completions"""
+        return 'chat' in self.endpoint_type or 'completions' in self.endpoint_type
+
+    def _headers(self) -> Dict[str, str]:
+        return {
             "Authorization": f"Bearer {self.api_key}",
             "Content-Type": "application/json"
         }
 
+    def _images_api_payload(
+        self,
+        prompt: str,
+        aspect_ratio: str,
+        model: str,
+        references: List[ReferenceAsset]
+    ) -> Dict[str, Any]:
+        """/v1/images/generations 的请求体"""
         payload = {
             "model": model,
             "prompt": prompt,
@@ -136,27 +186,17 @@ class ImageApiGenerator(ImageGeneratorBase):
             "image_size": self.image_size
         }
 
-        # 收集所有参考图片
-        all_reference_images = []
-        if reference_images and len(reference_images) > 0:
-            all_reference_images.extend(reference_images)
-        if reference_image and reference_image not in all_reference_images:
-            all_reference_images.append(reference_image)
-
         # 如果有参考图片，添加到 image 数组
-        if all_reference_images:
-            logger.debug(f"  添加 {len(all_reference_images)} 张参考图片")
+        if references:
+            logger.debug(f"  添加 {len(references)} 张参考图片")
             image_uris = []
-            for idx, img_data in enumerate(all_reference_images):
-                compressed_img = compress_image(img_data, max_size_kb=200)
-                logger.debug(f"  参考图 {idx}: {len(img_data)} -> {len(compressed_img)} bytes")
-                base64_image = base64.b64encode(compressed_img).decode('utf-8')
-                data_uri = f"data:image/png;base64,{base64_image}"
-                image_uris.append(data_uri)
+            for idx, reference in enumerate(references):
+                logger.debug(f"  参考图 {idx}: {len(reference)} -> {len(reference.compressed)} bytes")
+                image_uris.append(reference.data_uri)
 
             payload["image"] = image_uris
 
-            ref_count = len(all_reference_images)
+            ref_count = len(references)
             enhanced_prompt = f"""参考提供的 {ref_count} 张图片的风格（色彩、光影、构图、氛围），生成一张新图片。
 
 新图片内容：{prompt}
@@ -167,96 +207,116 @@ class ImageApiGenerator(ImageGeneratorBase):
 3. 保持一致的画面质感
 4. 如果参考图中有人物或产品，可以适当融入"""
             payload["prompt"] = enhanced_prompt
+        return payload
+
+    def _images_api_error(self, status_code: int, error_detail: str, api_url: str) -> ProviderError:
+        """/v1/images/generations 请求失败的错误"""
+        logger.error(f"Image API 请求失败: status={status_code}, error={error_detail}")
+        return ProviderError(
+            f"Image API 请求失败 (状态码: {status_code})\n"
+            f"错误详情: {error_detail}\n"
+            f"请求地址: {api_url}\n"
+            "可能原因：\n"
+            "1. API密钥无效或已过期\n"
+            "2. 请求参数不符合API要求\n"
+            "3. API服务端错误\n"
+            "4. Base URL配置错误\n"
+            "建议：检查API密钥和base_url配置",
+            status_code=status_code
+        )
 
-        api_url = f"{self.base_url}{self.endpoint_type}"
-        logger.debug(f"  发送请求到: {api_url}")
-        response = requests.post(api_url, headers=headers, json=payload, timeout=300)
-
-        if response.status_code != 200:
-            error_detail = response.text[:500]
-            logger.error(f"Image API 请求失败: status={response.status_code}, error={error_detail}")
-            raise Exception(
-                f"Image API 请求失败 (状态码: {response.status_code})\n"
-                f"错误详情: {error_detail}\n"
-                f"请求地址: {api_url}\n"
-                "可能原因：\n"
-                "1. API密钥无效或已过期\n"
-                "2. 请求参数不符合API要求\n"
-                "3. API服务端错误\n"
-                "4. Base URL配置错误\n"
-                "建议：检查API密钥和base_url配置"
-            )
-
-        result = response.json()
-        logger.debug(f"  API 响应: data 长度={len(result.get('data', []))}")
-
-        if "data" in result and len(result["data"]) > 0:
-            item = result["data"][0]
-
-            if "b64_json" in item:
-                b64_data_uri = item["b64_json"]
-                if b64_data_uri.startswith('data:'):
-                    b64_string = b64_data_uri.split(',', 1)[1]
-                else:
-                    b64_string = b64_data_uri
-                image_data = base64.b64decode(b64_string)
-                logger.info(f"✅ Image API 图片生成成功: {len(image_data)} bytes")
-                return image_data
+    def _images_api_result(self, decoder) -> int:
+        """/v1/images/generations 响应读完后：返回写入的字节数，没有图片数据时抛出异常"""
+        if decoder.found:
+            logger.info(f"✅ Image API 图片生成成功: {decoder.nbytes} bytes")
+            return decoder.nbytes
 
-        logger.error(f"无法从响应中提取图片数据: {str(result)[:200]}")
-        raise Exception(
+        logger.error(f"无法从响应中提取图片数据: {decoder.snippet(200)}")
+        raise ProviderError(
             f"图片数据提取失败：未找到 b64_json 数据。\n"
-            f"API响应片段: {str(result)[:500]}\n"
+            f"API响应片段: {decoder.snippet()}\n"
             "可能原因：\n"
             "1. API返回格式与预期不符\n"
             "2. response_format 参数未生效\n"
             "3. 该模型不支持 b64_json 格式\n"
-            "建议：检查API文档确认返回格式要求"
+            "建议：检查API文档确认返回格式要求",
+            kind=KIND_UNKNOWN
         )
 
-    def _generate_via_chat_api(
+    def _generate_via_images_api(
         self,
+        out: BinaryIO,
         prompt: str,
         aspect_ratio: str,
         model: str,
-        reference_image: Optional[bytes] = None,
-        reference_images: Optional[List[bytes]] = None
-    ) -> bytes:
-        """通过 /v1/chat/completions 端点生成图片（如即梦 API）"""
-        import re
+        references: List[ReferenceAsset],
+        cancel_event=None,
+        rate_token_acquired: bool = False
+    ) -> int:
+        """通过 /v1/images/generations 端点生成图片（流式读取响应，b64_json 边读边解码写入 out）"""
+        payload = self._images_api_payload(prompt, aspect_ratio, model, references)
 
-        headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json"
-        }
+        api_url = f"{self.base_url}{self.endpoint_type}"
+        logger.debug(f"  发送请求到: {api_url}")
+        if not rate_token_acquired:
+            self.rate_limiter.acquire()
+        raise_if_cancelled(cancel_event)
+        with self.http.post(
+            api_url, headers=self._headers(), json=payload, timeout=300, stream=True,
+            cancel_event=cancel_event
+        ) as response:
+            self.rate_limiter.observe_response(response.status_code, response.headers)
+
+            if response.status_code != 200:
+                raise self._images_api_error(response.status_code, response.text[:500], api_url)
+
+            # b64_json 可能带 data URI 前缀，解码器会跳过前缀
+            decoder = decode_b64_field(response, out, "b64_json", cancel_event)
+        return self._images_api_result(decoder)
+
+    async def _agenerate_via_images_api(
+        self,
+        out: BinaryIO,
+        prompt: str,
+        aspect_ratio: str,
+        model: str,
+        references: List[ReferenceAsset],
+        rate_token_acquired: bool = False
+    ) -> int:
+        """_generate_via_images_api 的异步版本"""
+        payload = self._images_api_payload(prompt, aspect_ratio, model, references)
 
+        api_url = f"{self.base_url}{self.endpoint_type}"
+        logger.debug(f"  发送请求到: {api_url}")
+        if not rate_token_acquired:
+            await self.rate_limiter.aacquire()
+        async with self.ahttp.stream("POST", api_url, headers=self._headers(), json=payload, timeout=300) as response:
+            self.rate_limiter.observe_response(response.status_code, response.headers)
+            if response.status_code != 200:
+                raise self._images_api_error(response.status_code, (await response.atext())[:500], api_url)
+            decoder = await adecode_b64_field(response, out, "b64_json")
+        return self._images_api_result(decoder)
+
+    def _chat_api_payload(self, prompt: str, model: str, references: List[ReferenceAsset]) -> Dict[str, Any]:
+        """/v1/chat/completions 的请求体（流式）"""
         # 构建用户消息内容
         user_content: Any = prompt
 
-        # 收集所有参考图片
-        all_reference_images = []
-        if reference_images and len(reference_images) > 0:
-            all_reference_images.extend(reference_images)
-        if reference_image and reference_image not in all_reference_images:
-            all_reference_images.append(reference_image)
-
         # 如果有参考图片，构建多模态消息
-        if all_reference_images:
-            logger.debug(f"  添加 {len(all_reference_images)} 张参考图片到 chat 消息")
+        if references:
+            logger.debug(f"  添加 {len(references)} 张参考图片到 chat 消息")
             content_parts = [{"type": "text", "text": prompt}]
 
-            for idx, img_data in enumerate(all_reference_images):
-                compressed_img = compress_image(img_data, max_size_kb=200)
-                logger.debug(f"  参考图 {idx}: {len(img_data)} -> {len(compressed_img)} bytes")
-                base64_image = base64.b64encode(compressed_img).decode('utf-8')
+            for idx, reference in enumerate(references):
+                logger.debug(f"  参考图 {idx}: {len(reference)} -> {len(reference.compressed)} bytes")
                 content_parts.append({
                     "type": "image_url",
-                    "image_url": {"url": f"data:image/png;base64,{base64_image}"}
+                    "image_url": {"url": reference.data_uri}
                 })
 
             user_content = content_parts
 
-        payload = {
+        return {
             "model": model,
             "messages": [{"role": "user", "content": user_content}],
             "max_tokens": 4096,
@@ -264,140 +324,153 @@ class ImageApiGenerator(ImageGeneratorBase):
             "stream": True
         }
 
-        api_url = f"{self.base_url}{self.endpoint_type}"
-        logger.info(f"Chat API 流式生成图片: {api_url}, model={model}")
+    def _chat_api_error(self, status_code: int, error_detail: str, api_url: str, model: str) -> ProviderError:
+        """/v1/chat/completions 请求失败的错误"""
+        if status_code == 401:
+            return ProviderError(
+                "❌ API Key 认证失败\n\n"
+                "【可能原因】\n"
+                "1. API Key 无效或已过期\n"
+                "2. API Key 格式错误\n\n"
+                "【解决方案】\n"
+                "在系统设置页面检查 API Key 是否正确",
+                status_code=status_code
+            )
+        elif status_code == 429:
+            return ProviderError(
+                "⏳ API 配额或速率限制\n\n"
+                "【解决方案】\n"
+                "1. 稍后再试\n"
+                "2. 检查 API 配额使用情况",
+                status_code=status_code
+            )
+        else:
+            return ProviderError(
+                f"❌ Chat API 请求失败 (状态码: {status_code})\n\n"
+                f"【错误详情】\n{error_detail[:300]}\n\n"
+                f"【请求地址】{api_url}\n"
+                f"【模型】{model}",
+                status_code=status_code
+            )
+
+    def _chat_api_result(self, extractor) -> int:
+        """chat 接口流式响应读完后：返回写入的字节数，没有找到图片时抛出异常"""
+        logger.debug(f"Chat API 流式响应完成，内容长度: {extractor.length}")
+        if extractor.found:
+            return extractor.nbytes
 
-        response = requests.post(api_url, headers=headers, json=payload, timeout=600, stream=True)
-
-        if response.status_code != 200:
-            error_detail = response.text[:500]
-            status_code = response.status_code
-
-            if status_code == 401:
-                raise Exception(
-                    "❌ API Key 认证失败\n\n"
-                    "【可能原因】\n"
-                    "1. API Key 无效或已过期\n"
-                    "2. API Key 格式错误\n\n"
-                    "【解决方案】\n"
-                    "在系统设置页面检查 API Key 是否正确"
-                )
-            elif status_code == 429:
-                raise Exception(
-                    "⏳ API 配额或速率限制\n\n"
-                    "【解决方案】\n"
-                    "1. 稍后再试\n"
-                    "2. 检查 API 配额使用情况"
-                )
-            else:
-                raise Exception(
-                    f"❌ Chat API 请求失败 (状态码: {status_code})\n\n"
-                    f"【错误详情】\n{error_detail[:300]}\n\n"
-                    f"【请求地址】{api_url}\n"
-                    f"【模型】{model}"
-                )
-
-        # 流式读取响应
-        content = self._read_stream_response(response)
-        logger.debug(f"Chat API 流式响应完成，内容长度: {len(content)}")
-
-        # 解析内容提取图片
-        if content:
-            # Markdown 图片链接: ![xxx](url)
-            pattern = r'!\[.*?\]\((https?://[^\s\)]+)\)'
-            urls = re.findall(pattern, content)
-            if urls:
-                logger.info(f"从 Markdown 提取到 {len(urls)} 张图片，下载第一张...")
-                return self._download_image(urls[0])
-
-            # Markdown 图片 Base64: ![xxx](data:image/...)
-            base64_pattern = r'!\[.*?\]\((data:image\/[^;]+;base64,[^\s\)]+)\)'
-            base64_urls = re.findall(base64_pattern, content)
-            if base64_urls:
-                logger.info("从 Markdown 提取到 Base64 图片数据")
-                base64_data = base64_urls[0].split(",")[1]
-                return base64.b64decode(base64_data)
-
-            # Base64 data URL (可能在文本中间)
-            if "data:image" in content:
-                base64_match = re.search(r'data:image/[^;]+;base64,([A-Za-z0-9+/=]+)', content)
-                if base64_match:
-                    logger.info("检测到 Base64 图片数据")
-                    return base64.b64decode(base64_match.group(1))
-
-            # 纯 URL（带图片扩展名）
-            url_match = re.search(r'(https?://[^\s\)\"\'<>]+\.(?:png|jpg|jpeg|gif|webp))', content, re.IGNORECASE)
-            if url_match:
-                logger.info("检测到图片 URL")
-                return self._download_image(url_match.group(1))
-
-            # 任意 URL（兜底）
-            url_match = re.search(r'(https?://[^\s\)\"\'<>]+)', content)
-            if url_match:
-                logger.info("检测到可能的图片 URL，尝试下载...")
-                return self._download_image(url_match.group(1))
-
-        raise Exception(
+        raise ProviderError(
             "❌ 无法从 Chat API 响应中提取图片数据\n\n"
-            f"【响应内容】\n{content[:500] if content else '空'}\n\n"
+            f"【响应内容】\n{extractor.snippet() or '空'}\n\n"
             "【可能原因】\n"
             "1. 该模型不支持图片生成\n"
             "2. 响应格式与预期不符\n"
             "3. 提示词被安全过滤\n\n"
             "【解决方案】\n"
             "1. 确认模型名称正确\n"
-            "2. 修改提示词后重试"
+            "2. 修改提示词后重试",
+            kind=KIND_UNKNOWN
         )
 
-    def _read_stream_response(self, response) -> str:
-        """读取流式 SSE 响应，支持心跳包"""
-        import json
-        content_parts = []
-
-        for line in response.iter_lines():
-            if not line:
-                continue
-
-            line_str = line.decode('utf-8')
-
-            # SSE 注释行（心跳包），如 :heart, :ping
-            if line_str.startswith(':'):
-                logger.debug(f"收到心跳: {line_str}")
-                continue
+    def _generate_via_chat_api(
+        self,
+        out: BinaryIO,
+        prompt: str,
+        aspect_ratio: str,
+        model: str,
+        references: List[ReferenceAsset],
+        cancel_event=None,
+        rate_token_acquired: bool = False
+    ) -> int:
+        """通过 /v1/chat/completions 端点生成图片（如即梦 API），图片写入 out"""
+        payload = self._chat_api_payload(prompt, model, references)
 
-            # 跳过非 data 行
-            if not line_str.startswith('data:'):
-                continue
+        api_url = f"{self.base_url}{self.endpoint_type}"
+        logger.info(f"Chat API 流式生成图片: {api_url}, model={model}")
 
-            data_str = line_str[5:].strip()
+        if not rate_token_acquired:
+            self.rate_limiter.acquire()
+        raise_if_cancelled(cancel_event)
+        with self.http.post(
+            api_url, headers=self._headers(), json=payload, timeout=600, stream=True,
+            cancel_event=cancel_event
+        ) as response:
+            self.rate_limiter.observe_response(response.status_code, response.headers)
+
+            if response.status_code != 200:
+                raise self._chat_api_error(response.status_code, response.text[:500], api_url, model)
+
+            # 边接收边扫描图片：链接完整后立即开始下载，base64 数据边到达边解码写入
+            extractor = write_chat_image(
+                iter_chat_content(response, cancel_event),
+                out,
+                lambda image_url: self._download_image(image_url, out, cancel_event)
+            )
+        return self._chat_api_result(extractor)
 
-            # 检查是否结束
-            if data_str == '[DONE]':
-                break
+    async def _agenerate_via_chat_api(
+        self,
+        out: BinaryIO,
+        prompt: str,
+        model: str,
+        references: List[ReferenceAsset],
+        rate_token_acquired: bool = False
+    ) -> int:
+        """_generate_via_chat_api 的异步版本"""
+        payload = self._chat_api_payload(prompt, model, references)
 
-            try:
-                data = json.loads(data_str)
-                if 'choices' in data and len(data['choices']) > 0:
-                    delta = data['choices'][0].get('delta', {})
-                    if 'content' in delta:
-                        content_parts.append(delta['content'])
-            except json.JSONDecodeError:
-                logger.debug(f"跳过非JSON数据: {data_str[:50]}")
-                continue
+        api_url = f"{self.base_url}{self.endpoint_type}"
+        logger.info(f"Chat API 异步流式生成图片: {api_url}, model={model}")
+
+        if not rate_token_acquired:
+            await self.rate_limiter.aacquire()
+        async with self.ahttp.stream("POST", api_url, headers=self._headers(), json=payload, timeout=600) as response:
+            self.rate_limiter.observe_response(response.status_code, response.headers)
+            if response.status_code != 200:
+                raise self._chat_api_error(response.status_code, (await response.atext())[:500], api_url, model)
+            extractor = await awrite_chat_image(
+                aiter_chat_content(response),
+                out,
+                lambda image_url: self._adownload_image(image_url, out)
+            )
+        return self._chat_api_result(extractor)
 
-        return ''.join(content_parts)
+    def _download_image(self, url: str, out: BinaryIO, cancel_event=None) -> int:
+        """流式下载图片写入 out，返回写入的字节数"""
+        logger.info(f"下载图片: {url[:100]}...")
+        try:
+            with self.http.get(url, timeout=60, stream=True, cancel_event=cancel_event) as response:
+                if response.status_code != 200:
+                    raise ProviderError(
+                        f"❌ 下载图片失败: HTTP {response.status_code}",
+                        status_code=response.status_code
+                    )
+                nbytes = copy_response(response, out, cancel_event)
+            logger.info(f"✅ 图片下载成功: {nbytes} bytes")
+            return nbytes
+        except ProviderError:
+            raise
+        except requests.exceptions.Timeout:
+            raise ProviderError("❌ 下载图片超时，请重试", kind=KIND_TIMEOUT)
+        except Exception as e:
+            raise ProviderError(f"❌ 下载图片失败: {str(e)}", kind=classify_error(e)) from e
 
-    def _download_image(self, url: str) -> bytes:
-        """下载图片并返回二进制数据"""
+    async def _adownload_image(self, url: str, out: BinaryIO) -> int:
+        """_download_image 的异步版本"""
         logger.info(f"下载图片: {url[:100]}...")
         try:
-            response = requests.get(url, timeout=60)
-            if response.status_code == 200:
-                logger.info(f"✅ 图片下载成功: {len(response.content)} bytes")
-                return response.content
-            else:
-                raise Exception(f"下载图片失败: HTTP {response.status_code}")
+            async with self.ahttp.stream("GET", url, timeout=60) as response:
+                if response.status_code != 200:
+                    raise ProviderError(
+                        f"❌ 下载图片失败: HTTP {response.status_code}",
+                        status_code=response.status_code
+                    )
+                nbytes = await acopy_response(response, out)
+            logger.info(f"✅ 图片下载成功: {nbytes} bytes")
+            return nbytes
+        except ProviderError:
+            raise
         except requests.exceptions.Timeout:
-            raise Exception("❌ 下载图片超时，请重试")
+            raise ProviderError("❌ 下载图片超时，请重试", kind=KIND_TIMEOUT)
         except Exception as e:
-            raise Exception(f"❌ 下载图片失败: {str(e)}")
+            raise ProviderError(f"❌ 下载图片失败: {str(e)}", kind=classify_error(e)) from e
@@ -1,53 +1,20 @@
 """OpenAI 兼容接口图片生成器"""
+import io
 import logging
-import time
-import random
-import base64
-from functools import wraps
-from typing import Dict, Any
+from typing import BinaryIO, Dict, Any
 import requests
 from .base import ImageGeneratorBase
+from ..utils.image_stream import (
+    acopy_response, adecode_b64_field, awrite_chat_image, copy_response, decode_b64_field, write_chat_image
+)
+from ..utils.sse_parser import aiter_chat_content, iter_chat_content
+from ..utils.retry_policy import (
+    KIND_TIMEOUT, KIND_UNKNOWN, ProviderError, classify_error, raise_if_cancelled
+)
 
 logger = logging.getLogger(__name__)
 
 
-def retry_on_error(max_retries=5, base_delay=3):
-    """错误自动重试装饰器"""
-    def decorator(func):
-        @wraps(func)
-        def wrapper(*args, **kwargs):
-            for attempt in range(max_retries):
-                try:
-                    return func(*args, **kwargs)
-                except Exception as e:
-                    error_str = str(e)
-                    # 检查是否是速率限制错误
-                    if "429" in error_str or "rate" in error_str.lower():
-                        if attempt < max_retries - 1:
-                            wait_time = (base_delay ** attempt) + random.uniform(0, 1)
-                            logger.warning(f"遇到速率限制，{wait_time:.1f}秒后重试 (尝试 {attempt + 2}/{max_retries})")
-                            time.sleep(wait_time)
-                            continue
-                    # 其他错误或重试耗尽
-                    if attempt < max_retries - 1:
-                        wait_time = 2 ** attempt
-                        logger.warning(f"请求失败: {error_str[:100]}，{wait_time}秒后重试")
-                        time.sleep(wait_time)
-                        continue
-                    raise
-            logger.error(f"图片生成失败: 重试 {max_retries} 次后仍失败")
-            raise Exception(
-                f"图片生成失败：重试 {max_retries} 次后仍失败。\n"
-                "可能原因：\n"
-                "1. API持续限流或配额不足\n"
-                "2. 网络连接持续不稳定\n"
-                "3. API服务暂时不可用\n"
-                "建议：稍后再试，或检查API配额和网络状态"
-            )
-        return wrapper
-    return decorator
-
-
 class OpenAICompatibleGenerator(ImageGeneratorBase):
     """OpenAI 兼容接口图片生成器"""
 
@@ -90,27 +57,44 @@ class OpenAICompatibleGenerator(ImageGeneratorBase):
         """验证配置"""
         return bool(self.api_key and self.base_url)
 
-    @retry_on_error(max_retries=5, base_delay=3)
-    def generate_image(
+    def generate_image(self, prompt: str, **kwargs) -> bytes:
+        """
+        生成图片
+
+        Args:
+            prompt: 提示词
+            **kwargs: 同 write_image
+
+        Returns:
+            图片二进制数据
+        """
+        out = io.BytesIO()
+        self.write_image(out, prompt, **kwargs)
+        return out.getvalue()
+
+    def write_image(
         self,
+        out: BinaryIO,
         prompt: str,
         size: str = "1024x1024",
         model: str = None,
         quality: str = "standard",
         **kwargs
-    ) -> bytes:
+    ) -> int:
         """
-        生成图片
+        生成图片并流式写入 out（b64_json 边读边解码，图片链接边下载边写入）
 
         Args:
+            out: 写入目标（文件或 BytesIO）
             prompt: 提示词
             size: 图片尺寸 (如 "1024x1024", "2048x2048", "4096x4096")
             model: 模型名称
             quality: 质量 ("standard" 或 "hd")
-            **kwargs: 其他参数
+            **kwargs: 其他参数，cancel_event（threading.Event）置位时尽快放弃请求；
+                rate_token_acquired 为 True 时调用方已取得速率令牌，不再等待
 
         Returns:
-            图片二进制数据
+            写入的字节数
         """
         if model is None:
             model = self.default_model
@@ -118,30 +102,56 @@ class OpenAICompatibleGenerator(ImageGeneratorBase):
         logger.info(f"OpenAI 兼容 API 生成图片: model={model}, size={size}, endpoint={self.endpoint_type}")
 
         # 根据端点路径决定使用哪种 API 方式
-        if 'chat' in self.endpoint_type or 'completions' in self.endpoint_type:
-            return self._generate_via_chat_api(prompt, size, model)
+        cancel_event = kwargs.get('cancel_event')
+        rate_token_acquired = kwargs.get('rate_token_acquired', False)
+        if self._uses_chat_api():
+            return self._generate_via_chat_api(out, prompt, size, model, cancel_event, rate_token_acquired)
         else:
             # 默认使用 images API
-            return self._generate_via_images_api(prompt, size, model, quality)
+            return self._generate_via_images_api(out, prompt, size, model, quality, cancel_event, rate_token_acquired)
 
-    def _generate_via_images_api(
+    async def awrite_image(
         self,
+        out: BinaryIO,
         prompt: str,
-        size: str,
-        model: str,
-        quality: str
-    ) -> bytes:
-        """通过 images API 端点生成"""
+        size: str = "1024x1024",
+        model: str = None,
+        quality: str = "standard",
+        **kwargs
+    ) -> int:
+        """
+        write_image 的异步版本（httpx.AsyncClient，等待响应期间不占用线程）
+
+        Returns:
+            写入的字节数
+        """
+        if model is None:
+            model = self.default_model
+
+        logger.info(f"OpenAI 兼容 API 异步生成图片: model={model}, size={size}, endpoint={self.endpoint_type}")
+
+        rate_token_acquired = kwargs.get('rate_token_acquired', False)
+        if self._uses_chat_api():
+            return await self._agenerate_via_chat_api(out, prompt, size, model, rate_token_acquired)
+        return await self._agenerate_via_images_api(out, prompt, size, model, quality, rate_token_acquired)
+
+    def _uses_chat_api(self) -> bool:
+        """端点是否为 chat/completions"""
+        return 'chat' in self.endpoint_type or 'completions' in self.endpoint_type
+
+    def _endpoint_url(self) -> str:
         # 确保端点以 / 开头
         endpoint = self.endpoint_type if self.endpoint_type.startswith('/') else '/' + self.endpoint_type
-        url = f"{self.base_url}{endpoint}"
-        logger.debug(f"  发送请求到: {url}")
+        return f"{self.base_url}{endpoint}"
 
-        headers = {
+    def _headers(self) -> Dict[str, str]:
+        return {
             "Authorization": f"Bearer {self.api_key}",
             "Content-Type": "application/json"
         }
 
+    def _images_api_payload(self, prompt: str, size: str, model: str, quality: str) -> Dict[str, Any]:
+        """images API 的请求体"""
         payload = {
             "model": model,
             "prompt": prompt,
@@ -153,96 +163,133 @@ class OpenAICompatibleGenerator(ImageGeneratorBase):
         # 如果模型支持quality参数
         if quality and model.startswith('dall-e'):
             payload["quality"] = quality
+        return payload
+
+    def _images_api_error(self, status_code: int, error_detail: str, url: str, model: str) -> ProviderError:
+        """images API 请求失败的错误"""
+        logger.error(f"OpenAI Images API 请求失败: status={status_code}, error={error_detail}")
+        return ProviderError(
+            f"OpenAI Images API 请求失败 (状态码: {status_code})\n"
+            f"错误详情: {error_detail}\n"
+            f"请求地址: {url}\n"
+            f"模型: {model}\n"
+            "可能原因：\n"
+            "1. API密钥无效或已过期\n"
+            "2. 模型名称不正确或无权访问\n"
+            "3. 请求参数不符合要求\n"
+            "4. API配额已用尽\n"
+            "5. Base URL配置错误\n"
+            "建议：检查API密钥、base_url和模型名称配置",
+            status_code=status_code
+        )
 
-        response = requests.post(url, headers=headers, json=payload, timeout=180)
-
-        if response.status_code != 200:
-            error_detail = response.text[:500]
-            logger.error(f"OpenAI Images API 请求失败: status={response.status_code}, error={error_detail}")
-            raise Exception(
-                f"OpenAI Images API 请求失败 (状态码: {response.status_code})\n"
-                f"错误详情: {error_detail}\n"
-                f"请求地址: {url}\n"
-                f"模型: {model}\n"
-                "可能原因：\n"
-                "1. API密钥无效或已过期\n"
-                "2. 模型名称不正确或无权访问\n"
-                "3. 请求参数不符合要求\n"
-                "4. API配额已用尽\n"
-                "5. Base URL配置错误\n"
-                "建议：检查API密钥、base_url和模型名称配置"
-            )
-
-        result = response.json()
+    def _images_api_image_url(self, decoder) -> str:
+        """响应中没有 b64_json（url 格式或错误信息）时，按普通 JSON 取出图片链接"""
+        result = decoder.json()
         logger.debug(f"  API 响应: data 长度={len(result.get('data', []))}")
 
         if "data" not in result or len(result["data"]) == 0:
             logger.error(f"API 未返回图片数据: {str(result)[:200]}")
-            raise ValueError(
+            raise ProviderError(
                 "OpenAI API 未返回图片数据。\n"
                 f"响应内容: {str(result)[:500]}\n"
                 "可能原因：\n"
                 "1. 提示词被安全过滤拦截\n"
                 "2. 模型不支持图片生成\n"
                 "3. 请求格式不正确\n"
-                "建议：修改提示词或检查模型配置"
+                "建议：修改提示词或检查模型配置",
+                kind=KIND_UNKNOWN
             )
 
         image_data = result["data"][0]
 
-        # 处理base64格式
-        if "b64_json" in image_data:
-            img_bytes = base64.b64decode(image_data["b64_json"])
-            logger.info(f"✅ OpenAI Images API 图片生成成功: {len(img_bytes)} bytes")
-            return img_bytes
-
         # 处理URL格式
-        elif "url" in image_data:
-            logger.debug(f"  下载图片 URL...")
-            img_response = requests.get(image_data["url"], timeout=60)
-            if img_response.status_code == 200:
-                logger.info(f"✅ OpenAI Images API 图片生成成功: {len(img_response.content)} bytes")
-                return img_response.content
-            else:
-                logger.error(f"下载图片失败: {img_response.status_code}")
-                raise Exception(f"下载图片失败: {img_response.status_code}")
-
-        else:
-            logger.error(f"无法从响应中提取图片数据: {str(image_data)[:200]}")
-            raise ValueError(
-                "无法从API响应中提取图片数据。\n"
-                f"响应数据: {str(image_data)[:500]}\n"
-                "可能原因：\n"
-                "1. 响应格式不包含 b64_json 或 url 字段\n"
-                "2. response_format 参数未生效\n"
-                "建议：检查API文档确认图片返回格式"
-            )
+        if "url" in image_data:
+            return image_data["url"]
+
+        logger.error(f"无法从响应中提取图片数据: {str(image_data)[:200]}")
+        raise ProviderError(
+            "无法从API响应中提取图片数据。\n"
+            f"响应数据: {str(image_data)[:500]}\n"
+            "可能原因：\n"
+            "1. 响应格式不包含 b64_json 或 url 字段\n"
+            "2. response_format 参数未生效\n"
+            "建议：检查API文档确认图片返回格式",
+            kind=KIND_UNKNOWN
+        )
 
-    def _generate_via_chat_api(
+    def _generate_via_images_api(
         self,
+        out: BinaryIO,
         prompt: str,
         size: str,
-        model: str
-    ) -> bytes:
-        """
-        通过 chat/completions 端点生成图片（默认使用流式传输）
-
-        支持多种返回格式：
-        1. Markdown 图片链接: ![xxx](url) - 即梦、部分中转站使用
-        2. Base64 data URL: data:image/xxx;base64,xxx
-        3. 纯图片 URL
-        """
-        # 确保端点以 / 开头
-        endpoint = self.endpoint_type if self.endpoint_type.startswith('/') else '/' + self.endpoint_type
-        url = f"{self.base_url}{endpoint}"
-        logger.info(f"Chat API 流式生成图片: {url}, model={model}")
-
-        headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json"
-        }
-
-        payload = {
+        model: str,
+        quality: str,
+        cancel_event=None,
+        rate_token_acquired: bool = False
+    ) -> int:
+        """通过 images API 端点生成（流式读取响应，b64_json 边读边解码写入 out）"""
+        url = self._endpoint_url()
+        logger.debug(f"  发送请求到: {url}")
+        payload = self._images_api_payload(prompt, size, model, quality)
+
+        if not rate_token_acquired:
+            self.rate_limiter.acquire()
+        raise_if_cancelled(cancel_event)
+        with self.http.post(
+            url, headers=self._headers(), json=payload, timeout=180, stream=True,
+            cancel_event=cancel_event
+        ) as response:
+            self.rate_limiter.observe_response(response.status_code, response.headers)
+
+            if response.status_code != 200:
+                raise self._images_api_error(response.status_code, response.text[:500], url, model)
+
+            # 响应中有 b64_json 时直接解码写入，不在内存中保留整个响应
+            decoder = decode_b64_field(response, out, "b64_json", cancel_event)
+        if decoder.found:
+            logger.info(f"✅ OpenAI Images API 图片生成成功: {decoder.nbytes} bytes")
+            return decoder.nbytes
+
+        logger.debug(f"  下载图片 URL...")
+        nbytes = self._download_image(self._images_api_image_url(decoder), out, cancel_event)
+        logger.info(f"✅ OpenAI Images API 图片生成成功: {nbytes} bytes")
+        return nbytes
+
+    async def _agenerate_via_images_api(
+        self,
+        out: BinaryIO,
+        prompt: str,
+        size: str,
+        model: str,
+        quality: str,
+        rate_token_acquired: bool = False
+    ) -> int:
+        """_generate_via_images_api 的异步版本"""
+        url = self._endpoint_url()
+        logger.debug(f"  发送请求到: {url}")
+        payload = self._images_api_payload(prompt, size, model, quality)
+
+        if not rate_token_acquired:
+            await self.rate_limiter.aacquire()
+        async with self.ahttp.stream("POST", url, headers=self._headers(), json=payload, timeout=180) as response:
+            self.rate_limiter.observe_response(response.status_code, response.headers)
+            if response.status_code != 200:
+                raise self._images_api_error(response.status_code, (await response.atext())[:500], url, model)
+            decoder = await adecode_b64_field(response, out, "b64_json")
+
+        if decoder.found:
+            logger.info(f"✅ OpenAI Images API 图片生成成功: {decoder.nbytes} bytes")
+            return decoder.nbytes
+
+        logger.debug(f"  下载图片 URL...")
+        nbytes = await self._adownload_image(self._images_api_image_url(decoder), out)
+        logger.info(f"✅ OpenAI Images API 图片生成成功: {nbytes} bytes")
+        return nbytes
+
+    def _chat_api_payload(self, prompt: str, model: str) -> Dict[str, Any]:
+        """chat/completions 的请求体（流式）"""
+        return {
             "model": model,
             "messages": [
                 {
@@ -255,81 +302,133 @@ class OpenAICompatibleGenerator(ImageGeneratorBase):
             "stream": True
         }
 
-        response = requests.post(url, headers=headers, json=payload, timeout=600, stream=True)
-
-        if response.status_code != 200:
-            error_detail = response.text[:500]
-            status_code = response.status_code
-
-            # 详细的错误信息
-            if status_code == 401:
-                raise Exception(
-                    "❌ API Key 认证失败\n\n"
-                    "【可能原因】\n"
-                    "1. API Key 无效或已过期\n"
-                    "2. API Key 格式错误\n\n"
-                    "【解决方案】\n"
-                    "在系统设置页面检查 API Key 是否正确"
-                )
-            elif status_code == 429:
-                raise Exception(
-                    "⏳ API 配额或速率限制\n\n"
-                    "【解决方案】\n"
-                    "1. 稍后再试\n"
-                    "2. 检查 API 配额使用情况"
-                )
-            else:
-                raise Exception(
-                    f"❌ Chat API 请求失败 (状态码: {status_code})\n\n"
-                    f"【错误详情】\n{error_detail[:300]}\n\n"
-                    f"【请求地址】{url}\n"
-                    f"【模型】{model}"
-                )
-
-        # 流式读取响应内容
-        content = self._read_stream_response(response)
-        logger.debug(f"Chat API 流式响应完成，内容长度: {len(content)}")
-
-        # 解析内容提取图片
-        return self._extract_image_from_content(content)
-
-    def _read_stream_response(self, response) -> str:
-        """读取流式 SSE 响应，支持心跳包"""
-        import json
-        content_parts = []
-
-        for line in response.iter_lines():
-            if not line:
-                continue
-
-            line_str = line.decode('utf-8')
+    def _chat_api_error(self, status_code: int, error_detail: str, url: str, model: str) -> ProviderError:
+        """chat/completions 请求失败的错误"""
+        # 详细的错误信息
+        if status_code == 401:
+            return ProviderError(
+                "❌ API Key 认证失败\n\n"
+                "【可能原因】\n"
+                "1. API Key 无效或已过期\n"
+                "2. API Key 格式错误\n\n"
+                "【解决方案】\n"
+                "在系统设置页面检查 API Key 是否正确",
+                status_code=status_code
+            )
+        elif status_code == 429:
+            return ProviderError(
+                "⏳ API 配额或速率限制\n\n"
+                "【解决方案】\n"
+                "1. 稍后再试\n"
+                "2. 检查 API 配额使用情况",
+                status_code=status_code
+            )
+        else:
+            return ProviderError(
+                f"❌ Chat API 请求失败 (状态码: {status_code})\n\n"
+                f"【错误详情】\n{error_detail[:300]}\n\n"
+                f"【请求地址】{url}\n"
+                f"【模型】{model}",
+                status_code=status_code
+            )
 
-            # SSE 注释行（心跳包等），如 :heart, :ping，跳过但保持连接
-            if line_str.startswith(':'):
-                logger.debug(f"收到心跳: {line_str}")
-                continue
+    def _chat_api_result(self, extractor) -> int:
+        """chat 接口流式响应读完后：返回写入的字节数，没有找到图片时抛出异常"""
+        logger.debug(f"Chat API 流式响应完成，内容长度: {extractor.length}")
+        if extractor.found:
+            return extractor.nbytes
 
-            # 跳过非 data 行
-            if not line_str.startswith('data:'):
-                continue
+        if not extractor.length:
+            raise ProviderError(
+                "❌ Chat API 响应为空\n\n"
+                "【可能原因】\n"
+                "1. 该模型不支持图片生成\n"
+                "2. 提示词被安全过滤\n\n"
+                "【解决方案】\n"
+                "1. 确认模型名称正确\n"
+                "2. 修改提示词后重试",
+                kind=KIND_UNKNOWN
+            )
 
-            data_str = line_str[5:].strip()
+        raise ProviderError(
+            "❌ 无法从 Chat API 响应中提取图片数据\n\n"
+            f"【响应内容】\n{extractor.snippet()}\n\n"
+            "【可能原因】\n"
+            "1. 该模型不支持图片生成\n"
+            "2. 响应格式与预期不符\n"
+            "3. 提示词被安全过滤\n\n"
+            "【解决方案】\n"
+            "1. 确认模型名称正确（如 Nano-Banana-Pro）\n"
+            "2. 修改提示词后重试",
+            kind=KIND_UNKNOWN
+        )
 
-            # 检查是否结束
-            if data_str == '[DONE]':
-                break
+    def _generate_via_chat_api(
+        self,
+        out: BinaryIO,
+        prompt: str,
+        size: str,
+        model: str,
+        cancel_event=None,
+        rate_token_acquired: bool = False
+    ) -> int:
+        """
+        通过 chat/completions 端点生成图片（默认使用流式传输）
 
-            try:
-                data = json.loads(data_str)
-                if 'choices' in data and len(data['choices']) > 0:
-                    delta = data['choices'][0].get('delta', {})
-                    if 'content' in delta:
-                        content_parts.append(delta['content'])
-            except json.JSONDecodeError:
-                logger.debug(f"跳过非JSON数据: {data_str[:50]}")
-                continue
+        支持多种返回格式：
+        1. Markdown 图片链接: ![xxx](url) - 即梦、部分中转站使用
+        2. Base64 data URL: data:image/xxx;base64,xxx
+        3. 纯图片 URL
+        """
+        url = self._endpoint_url()
+        logger.info(f"Chat API 流式生成图片: {url}, model={model}")
+        payload = self._chat_api_payload(prompt, model)
+
+        if not rate_token_acquired:
+            self.rate_limiter.acquire()
+        raise_if_cancelled(cancel_event)
+        with self.http.post(
+            url, headers=self._headers(), json=payload, timeout=600, stream=True,
+            cancel_event=cancel_event
+        ) as response:
+            self.rate_limiter.observe_response(response.status_code, response.headers)
+
+            if response.status_code != 200:
+                raise self._chat_api_error(response.status_code, response.text[:500], url, model)
+
+            # 边接收边扫描图片：链接完整后立即开始下载，base64 数据边到达边解码写入
+            extractor = write_chat_image(
+                iter_chat_content(response, cancel_event),
+                out,
+                lambda image_url: self._download_image(image_url, out, cancel_event)
+            )
+        return self._chat_api_result(extractor)
 
-        return ''.join(content_parts)
+    async def _agenerate_via_chat_api(
+        self,
+        out: BinaryIO,
+        prompt: str,
+        size: str,
+        model: str,
+        rate_token_acquired: bool = False
+    ) -> int:
+        """_generate_via_chat_api 的异步版本"""
+        url = self._endpoint_url()
+        logger.info(f"Chat API 异步流式生成图片: {url}, model={model}")
+        payload = self._chat_api_payload(prompt, model)
+
+        if not rate_token_acquired:
+            await self.rate_limiter.aacquire()
+        async with self.ahttp.stream("POST", url, headers=self._headers(), json=payload, timeout=600) as response:
+            self.rate_limiter.observe_response(response.status_code, response.headers)
+            if response.status_code != 200:
+                raise self._chat_api_error(response.status_code, (await response.atext())[:500], url, model)
+            extractor = await awrite_chat_image(
+                aiter_chat_content(response),
+                out,
+                lambda image_url: self._adownload_image(image_url, out)
+            )
+        return self._chat_api_result(extractor)
 
     def _read_normal_response(self, response) -> str:
         """读取普通 JSON 响应"""
@@ -350,85 +449,45 @@ class OpenAICompatibleGenerator(ImageGeneratorBase):
             logger.warning(f"解析 JSON 响应失败: {e}")
             return response.text
 
-    def _extract_image_from_content(self, content: str) -> bytes:
-        """从响应内容中提取图片数据"""
-        if not content:
-            raise ValueError(
-                "❌ Chat API 响应为空\n\n"
-                "【可能原因】\n"
-                "1. 该模型不支持图片生成\n"
-                "2. 提示词被安全过滤\n\n"
-                "【解决方案】\n"
-                "1. 确认模型名称正确\n"
-                "2. 修改提示词后重试"
-            )
-
-        # 1. 尝试解析 Markdown 图片链接: ![xxx](url)
-        image_urls = self._extract_markdown_image_urls(content)
-        if image_urls:
-            logger.info(f"从 Markdown 提取到 {len(image_urls)} 张图片，下载第一张...")
-            return self._download_image(image_urls[0])
-
-        # 2. 尝试解析 Base64 data URL
-        if "data:image" in content:
-            logger.info("检测到 Base64 图片数据")
-            import re
-            base64_match = re.search(r'data:image/[^;]+;base64,([A-Za-z0-9+/=]+)', content)
-            if base64_match:
-                return base64.b64decode(base64_match.group(1))
-
-        # 3. 尝试提取纯 URL
-        import re
-        url_match = re.search(r'(https?://[^\s\)\"\'<>]+\.(?:png|jpg|jpeg|gif|webp))', content, re.IGNORECASE)
-        if url_match:
-            logger.info("检测到图片 URL")
-            return self._download_image(url_match.group(1))
-
-        # 4. 尝试提取任意 http URL（兜底）
-        url_match = re.search(r'(https?://[^\s\)\"\'<>]+)', content)
-        if url_match:
-            logger.info("检测到可能的图片 URL，尝试下载...")
-            return self._download_image(url_match.group(1))
-
-        raise ValueError(
-            "❌ 无法从 Chat API 响应中提取图片数据\n\n"
-            f"【响应内容】\n{content[:500]}\n\n"
-            "【可能原因】\n"
-            "1. 该模型不支持图片生成\n"
-            "2. 响应格式与预期不符\n"
-            "3. 提示词被安全过滤\n\n"
-            "【解决方案】\n"
-            "1. 确认模型名称正确（如 Nano-Banana-Pro）\n"
-            "2. 修改提示词后重试"
-        )
-
-    def _extract_markdown_image_urls(self, content: str) -> list:
-        """
-        从 Markdown 内容中提取图片 URL
+    def _download_image(self, url: str, out: BinaryIO, cancel_event=None) -> int:
+        """流式下载图片写入 out，返回写入的字节数"""
+        logger.info(f"下载图片: {url[:100]}...")
+        try:
+            with self.http.get(url, timeout=60, stream=True, cancel_event=cancel_event) as response:
+                if response.status_code != 200:
+                    raise ProviderError(
+                        f"❌ 下载图片失败: HTTP {response.status_code}",
+                        status_code=response.status_code
+                    )
+                nbytes = copy_response(response, out, cancel_event)
+            logger.info(f"✅ 图片下载成功: {nbytes} bytes")
+            return nbytes
+        except ProviderError:
+            raise
+        except requests.exceptions.Timeout:
+            raise ProviderError("❌ 下载图片超时，请重试", kind=KIND_TIMEOUT)
+        except Exception as e:
+            raise ProviderError(f"❌ 下载图片失败: {str(e)}", kind=classify_error(e)) from e
 
-        支持格式: ![alt text](url) 或 ![](url)
-        """
-        import re
-        # 匹配 ![任意文字](url) 格式
-        pattern = r'!\[.*?\]\((https?://[^\s\)]+)\)'
-        urls = re.findall(pattern, content)
-        logger.debug(f"从 Markdown 提取到 {len(urls)} 个图片 URL")
-        return urls
-
-    def _download_image(self, url: str) -> bytes:
-        """下载图片并返回二进制数据"""
+    async def _adownload_image(self, url: str, out: BinaryIO) -> int:
+        """_download_image 的异步版本"""
         logger.info(f"下载图片: {url[:100]}...")
         try:
-            response = requests.get(url, timeout=60)
-            if response.status_code == 200:
-                logger.info(f"✅ 图片下载成功: {len(response.content)} bytes")
-                return response.content
-            else:
-                raise Exception(f"下载图片失败: HTTP {response.status_code}")
+            async with self.ahttp.stream("GET", url, timeout=60) as response:
+                if response.status_code != 200:
+                    raise ProviderError(
+                        f"❌ 下载图片失败: HTTP {response.status_code}",
+                        status_code=response.status_code
+                    )
+                nbytes = await acopy_response(response, out)
+            logger.info(f"✅ 图片下载成功: {nbytes} bytes")
+            return nbytes
+        except ProviderError:
+            raise
         except requests.exceptions.Timeout:
-            raise Exception("❌ 下载图片超时，请重试")
+            raise ProviderError("❌ 下载图片超时，请重试", kind=KIND_TIMEOUT)
         except Exception as e:
-            raise Exception(f"❌ 下载图片失败: {str(e)}")
+            raise ProviderError(f"❌ 下载图片失败: {str(e)}", kind=classify_error(e)) from e
 
     def get_supported_sizes(self) -> list:
         """获取支持的图片尺寸"""
@@ -7,6 +7,8 @@ API 路由模块
 - history_routes: 历史记录 CRUD API
 - config_routes: 配置管理 API
 - auth_routes: 认证相关 API
+- status_routes: 运行状态 API
+- job_routes: 后台任务 API
 
 所有路由都注册到统一的 /api 前缀下
 """
@@ -28,6 +30,8 @@ def create_api_blueprint():
     from .history_routes import create_history_blueprint
     from .config_routes import create_config_blueprint
     from .auth_routes import create_auth_blueprint
+    from .status_routes import create_status_blueprint
+    from .job_routes import create_job_blueprint
 
     # 创建主 API 蓝图
     api_bp = Blueprint('api', __name__, url_prefix='/api')
@@ -38,6 +42,8 @@ def create_api_blueprint():
     api_bp.register_blueprint(create_history_blueprint())
     api_bp.register_blueprint(create_config_blueprint())
     api_bp.register_blueprint(create_auth_blueprint())
+    api_bp.register_blueprint(create_status_blueprint())
+    api_bp.register_blueprint(create_job_blueprint())
 
     return api_bp
 
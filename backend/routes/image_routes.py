@@ -2,7 +2,7 @@
 图片生成相关 API 路由
 
 包含功能：
-- 批量生成图片（SSE 流式返回）
+- 批量生成图片（提交后台任务，进度见 job_routes）
 - 获取图片
 - 重试/重新生成单张图片
 - 批量重试失败图片
@@ -10,12 +10,19 @@
 """
 
 import os
-import json
+import uuid
 import base64
 import logging
+import threading
 from flask import Blueprint, request, jsonify, Response, send_file
+from backend.services.event_bus import get_event_bus, run_producer
 from backend.services.image import get_image_service
-from .utils import log_request, log_error
+from backend.services.jobs import get_job_manager
+from backend.services.thumbnail import get_thumbnail_service
+from backend.services.derivative import get_derivative_service, snap_width, negotiate_format
+from backend.utils.image_compressor import detect_image_mime, DERIVATIVE_FORMATS
+from backend.utils.paths import is_single_path_segment
+from .utils import log_request, log_error, get_last_event_id, stream_events
 
 logger = logging.getLogger(__name__)
 
@@ -24,12 +31,19 @@ def create_image_blueprint():
     """创建图片路由蓝图（工厂函数，支持多次调用）"""
     image_bp = Blueprint('image', __name__)
 
+    # 正在进行的批量重试：任务 ID -> 重试的页面序号
+    retrying_pages = {}
+    retrying_lock = threading.Lock()
+
     # ==================== 图片生成 ====================
 
     @image_bp.route('/generate', methods=['POST'])
     def generate_images():
         """
-        批量生成图片（SSE 流式返回）
+        批量生成图片（提交后台任务）
+
+        生成在后台工作线程中执行，不依赖本次请求的连接；通过
+        GET /api/jobs/<job_id>/events 读取进度事件（断开后可从断开处继续读取）
 
         请求体：
         - pages: 页面列表（必填）
@@ -37,19 +51,21 @@ def create_image_blueprint():
         - full_outline: 完整大纲文本
         - user_topic: 用户原始输入主题
         - user_images: base64 编码的用户参考图片列表
+        - use_reference: 内容页是否以封面作为参考图（默认 true）
 
         返回：
-        SSE 事件流，包含以下事件类型：
-        - image: 单张图片生成完成
-        - error: 生成错误
-        - complete: 全部完成
+        - success: 是否成功
+        - job_id: 后台任务 ID
+        - task_id: 图片任务 ID（未传入时自动生成）
+        - events_url: 进度事件流地址（SSE 事件：progress / complete / error / finish）
         """
         try:
             data = request.get_json()
             pages = data.get('pages')
-            task_id = data.get('task_id')
+            task_id = data.get('task_id') or f"task_{uuid.uuid4().hex[:8]}"
             full_outline = data.get('full_outline', '')
             user_topic = data.get('user_topic', '')
+            use_reference = data.get('use_reference', True)
 
             # 解析 base64 格式的用户参考图片
             user_images = _parse_base64_images(data.get('user_images', []))
@@ -68,31 +84,22 @@ def create_image_blueprint():
                     "error": "参数错误：pages 不能为空。\n请提供要生成的页面列表数据。"
                 }), 400
 
-            logger.info(f"🖼️  开始图片生成任务: {task_id}, 共 {len(pages)} 页")
-            image_service = get_image_service()
+            job_id = get_job_manager().submit('generate_images', {
+                'pages': pages,
+                'task_id': task_id,
+                'full_outline': full_outline,
+                'user_topic': user_topic,
+                'user_images': [base64.b64encode(img).decode('ascii') for img in user_images],
+                'use_reference': use_reference,
+            }, task_id=task_id)
 
-            def generate():
-                """SSE 事件生成器"""
-                for event in image_service.generate_images(
-                    pages, task_id, full_outline,
-                    user_images=user_images if user_images else None,
-                    user_topic=user_topic
-                ):
-                    event_type = event["event"]
-                    event_data = event["data"]
-
-                    # 格式化为 SSE 格式
-                    yield f"event: {event_type}\n"
-                    yield f"data: {json.dumps(event_data, ensure_ascii=False)}\n\n"
-
-            return Response(
-                generate(),
-                mimetype='text/event-stream',
-                headers={
-                    'Cache-Control': 'no-cache',
-                    'X-Accel-Buffering': 'no',
-                }
-            )
+            logger.info(f"🖼️  图片生成任务已提交: {task_id}, 共 {len(pages)} 页, job={job_id}")
+            return jsonify({
+                "success": True,
+                "job_id": job_id,
+                "task_id": task_id,
+                "events_url": f"/api/jobs/{job_id}/events"
+            }), 200
 
         except Exception as e:
             log_error('/generate', e)
@@ -114,15 +121,25 @@ def create_image_blueprint():
         - filename: 文件名
 
         查询参数：
-        - thumbnail: 是否返回缩略图（默认 true）
+        - thumbnail: 是否返回缩略图（默认 true，缩略图尚未生成时按需生成）
+        - w: 返回指定宽度的衍生图（向上取整到 256/512/768/1080/1536），指定后忽略 thumbnail
+        - fmt: 衍生图格式（webp / jpeg），不指定时根据 Accept 请求头协商
 
         返回：
         - 成功：图片文件
-        - 失败：JSON 错误信息
+        - 失败：JSON 错误信息（task_id 或 filename 不是单层文件名时返回 400）
         """
         try:
             logger.debug(f"获取图片: {task_id}/{filename}")
 
+            # 缩略图和衍生图会写入任务目录，拒绝 ".." 等会指向任务目录之外的路径
+            if not is_single_path_segment(task_id) or not is_single_path_segment(filename):
+                logger.warning(f"拒绝无效的图片路径: {task_id}/{filename}")
+                return jsonify({
+                    "success": False,
+                    "error": f"参数错误：无效的图片路径 {task_id}/{filename}"
+                }), 400
+
             # 检查是否请求缩略图
             thumbnail = request.args.get('thumbnail', 'true').lower() == 'true'
 
@@ -132,13 +149,57 @@ def create_image_blueprint():
                 "history"
             )
 
-            if thumbnail:
-                # 尝试返回缩略图
-                thumb_filename = f"thumb_{filename}"
-                thumb_filepath = os.path.join(history_root, task_id, thumb_filename)
+            # 请求指定宽度的衍生图
+            width_arg = request.args.get('w')
+            if width_arg is not None:
+                try:
+                    width = int(width_arg)
+                    if width <= 0:
+                        raise ValueError(width_arg)
+                except ValueError:
+                    return jsonify({
+                        "success": False,
+                        "error": f"参数错误：w 必须是正整数，当前值: {width_arg}"
+                    }), 400
+
+                width = snap_width(width)
+                fmt = request.args.get('fmt')
+                negotiated = fmt is None
+                if negotiated:
+                    fmt = negotiate_format(request.headers.get('Accept', ''))
+                fmt = fmt.lower()
+                if fmt not in DERIVATIVE_FORMATS:
+                    return jsonify({
+                        "success": False,
+                        "error": f"参数错误：fmt 仅支持 {' / '.join(DERIVATIVE_FORMATS)}，当前值: {fmt}"
+                    }), 400
+
+                derivative_path = get_derivative_service().get_derivative(
+                    os.path.join(history_root, task_id), filename, width, fmt
+                )
+                if not derivative_path:
+                    return jsonify({
+                        "success": False,
+                        "error": f"图片不存在：{task_id}/{filename}"
+                    }), 404
+
+                response = send_file(derivative_path, mimetype=DERIVATIVE_FORMATS[fmt][1])
+                if negotiated:
+                    response.vary.add('Accept')
+                return response
 
-                if os.path.exists(thumb_filepath):
-                    return send_file(thumb_filepath, mimetype='image/png')
+            if thumbnail:
+                # 尝试返回缩略图（缺失或过期时按需生成，并发请求只生成一次）
+                try:
+                    thumb_filepath = get_thumbnail_service().ensure_thumbnail(
+                        os.path.join(history_root, task_id), filename, on_demand=True
+                    )
+                except Exception as e:
+                    logger.warning(f"按需生成缩略图失败，返回原图: {e}")
+                    thumb_filepath = None
+
+                if thumb_filepath:
+                    return _send_image(thumb_filepath)
 
             # 返回原图
             filepath = os.path.join(history_root, task_id, filename)
@@ -149,7 +210,7 @@ def create_image_blueprint():
                     "error": f"图片不存在：{task_id}/{filename}"
                 }), 404
 
-            return send_file(filepath, mimetype='image/png')
+            return _send_image(filepath)
 
         except Exception as e:
             log_error('/images', e)
@@ -217,12 +278,17 @@ def create_image_blueprint():
         """
         批量重试失败的图片（SSE 流式返回）
 
+        重试在后台执行，事件写入该任务的事件流（带 id）。同一任务的重试正在进行时，
+        页面都在该次重试中的请求直接接入正在进行的重试，不会再次发起生成；断线后带 Last-Event-ID
+        重新请求（或通过 /events/<task_id>）即可收到错过的事件。
+        包含其他页面的请求返回 409，需等当前重试结束后再提交
+
         请求体：
         - task_id: 任务 ID（必填）
         - pages: 要重试的页面列表（必填）
 
         返回：
-        SSE 事件流
+        SSE 事件流；同一任务的重试正在进行且请求包含其他页面时返回 409
         """
         try:
             data = request.get_json()
@@ -241,26 +307,49 @@ def create_image_blueprint():
                     "error": "参数错误：task_id 和 pages 不能为空。\n请提供任务ID和要重试的页面列表。"
                 }), 400
 
-            logger.info(f"🔄 批量重试失败图片: task={task_id}, 共 {len(pages)} 页")
-            image_service = get_image_service()
-
-            def generate():
-                """SSE 事件生成器"""
-                for event in image_service.retry_failed_images(task_id, pages):
-                    event_type = event["event"]
-                    event_data = event["data"]
-
-                    yield f"event: {event_type}\n"
-                    yield f"data: {json.dumps(event_data, ensure_ascii=False)}\n\n"
+            indices = {page.get('index') for page in pages}
+            bus = get_event_bus()
+            with retrying_lock:
+                started, from_seq = bus.begin(task_id, "retry_failed")
+                if started:
+                    retrying_pages[task_id] = indices
+                    running = indices
+                else:
+                    running = retrying_pages.get(task_id, set())
+
+            if started:
+                logger.info(f"🔄 批量重试失败图片: task={task_id}, 共 {len(pages)} 页")
+                image_service = get_image_service()
+
+                def retry_events():
+                    try:
+                        yield from image_service.retry_failed_images(task_id, pages)
+                    finally:
+                        with retrying_lock:
+                            retrying_pages.pop(task_id, None)
+
+                run_producer(task_id, "retry_failed", retry_events())
+            elif not indices <= running:
+                extra = sorted(i for i in indices - running if i is not None)
+                logger.warning(f"任务 {task_id} 的批量重试正在进行，拒绝包含其他页面的重试: {extra}")
+                return jsonify({
+                    "success": False,
+                    "error": f"该任务的批量重试正在进行，页面 {extra} 不在本次重试中。\n请等待当前重试结束后再重试这些页面。",
+                    "retrying_indices": sorted(i for i in running if i is not None)
+                }), 409
+            else:
+                logger.info(f"🔗 任务 {task_id} 的批量重试正在进行，接入现有事件流")
 
-            return Response(
-                generate(),
+            response = Response(
+                stream_events(task_id, get_last_event_id(from_seq)),
                 mimetype='text/event-stream',
                 headers={
                     'Cache-Control': 'no-cache',
                     'X-Accel-Buffering': 'no',
                 }
             )
+            response.implicit_sequence_conversion = False
+            return response
 
         except Exception as e:
             log_error('/retry-failed', e)
@@ -334,7 +423,7 @@ def create_image_blueprint():
     @image_bp.route('/task/<task_id>', methods=['GET'])
     def get_task_state(task_id):
         """
-        获取任务状态
+        获取任务状态（服务重启后从任务目录中保存的状态恢复）
 
         路径参数：
         - task_id: 任务 ID
@@ -353,14 +442,14 @@ def create_image_blueprint():
             if state is None:
                 return jsonify({
                     "success": False,
-                    "error": f"任务不存在：{task_id}\n可能原因：\n1. 任务ID错误\n2. 任务已过期或被清理\n3. 服务重启导致状态丢失"
+                    "error": f"任务不存在：{task_id}\n可能原因：\n1. 任务ID错误\n2. 任务目录已被删除，或任务由旧版本创建（没有保存任务状态）"
                 }), 404
 
             # 不返回封面图片数据（太大）
             safe_state = {
                 "generated": state.get("generated", {}),
                 "failed": state.get("failed", {}),
-                "has_cover": state.get("cover_image") is not None
+                "has_cover": state.get("has_cover", False)
             }
 
             return jsonify({
@@ -391,11 +480,54 @@ def create_image_blueprint():
             "message": "服务正常运行"
         }), 200
 
+    @image_bp.route('/health/providers', methods=['GET'])
+    def provider_health():
+        """
+        服务商健康状态接口
+
+        返回：
+        - success: 是否成功
+        - healthy: 是否所有服务商的熔断器都处于闭合状态
+        - providers: 按 "text:服务商" / "image:服务商" 给出的熔断器状态
+          （state、failure_rate、window_calls、retry_in、opened、rejected）
+        """
+        try:
+            from backend.utils.circuit_breaker import get_circuit_stats
+
+            providers = get_circuit_stats()
+            return jsonify({
+                "success": True,
+                "healthy": all(p["state"] == "closed" for p in providers.values()),
+                "providers": providers
+            }), 200
+
+        except Exception as e:
+            log_error('/health/providers', e)
+            return jsonify({
+                "success": False,
+                "error": f"获取服务商健康状态失败。\n错误详情: {str(e)}"
+            }), 500
+
     return image_bp
 
 
 # ==================== 辅助函数 ====================
 
+def _send_image(filepath: str):
+    """
+    按文件头识别的真实类型返回图片文件（缩略图是 JPEG，原图可能是 PNG/JPEG/WebP）
+
+    Args:
+        filepath: 图片文件路径
+
+    Returns:
+        Flask 响应
+    """
+    with open(filepath, 'rb') as f:
+        header = f.read(16)
+    return send_file(filepath, mimetype=detect_image_mime(header))
+
+
 def _parse_base64_images(images_base64: list) -> list:
     """
     解析 base64 编码的图片列表
@@ -0,0 +1,152 @@
+"""
+后台任务相关 API 路由
+
+包含功能：
+- 查询后台任务状态
+- 读取后台任务的进度事件（SSE，可从断开处继续读取）
+- 接入任务事件流（SSE，支持多个订阅方和 Last-Event-ID 续传）
+"""
+
+import logging
+from flask import Blueprint, Response, jsonify, request
+from backend.services.event_bus import get_event_bus
+from backend.services.jobs import FINISHED_STATES, get_job_manager
+from .utils import log_error, sse_event, get_last_event_id, stream_events
+
+logger = logging.getLogger(__name__)
+
+
+def create_job_blueprint():
+    """创建后台任务路由蓝图（工厂函数，支持多次调用）"""
+    job_bp = Blueprint('jobs', __name__)
+
+    @job_bp.route('/jobs/<job_id>', methods=['GET'])
+    def get_job(job_id):
+        """
+        获取后台任务状态
+
+        返回：
+        - success: 是否成功
+        - job: {id, kind, task_id, status, error, attempts, created_at, updated_at}
+          status 为 queued / running / done / failed
+        """
+        try:
+            job = get_job_manager().store.get(job_id)
+            if job is None:
+                return jsonify({
+                    "success": False,
+                    "error": f"任务不存在：{job_id}"
+                }), 404
+
+            job.pop("payload", None)
+            return jsonify({"success": True, "job": job}), 200
+
+        except Exception as e:
+            log_error(f'/jobs/{job_id}', e)
+            return jsonify({
+                "success": False,
+                "error": f"获取任务状态失败。\n错误详情: {str(e)}"
+            }), 500
+
+    @job_bp.route('/jobs/<job_id>/events', methods=['GET'])
+    def stream_job_events(job_id):
+        """
+        读取后台任务的进度事件（SSE）
+
+        查询参数：
+        - after: 只返回序号大于该值的事件（默认 0，即从头读取），断开重连时传入最后收到的 id
+          （也可使用 Last-Event-ID 请求头，EventSource 重连时会自动带上）
+
+        SSE 事件：
+        - 与原 /generate 相同：progress / complete / error / finish，每个事件带 id（事件序号）
+        - restart: 服务重启后任务重新执行
+        - heartbeat: 心跳包 {}
+        任务结束且事件全部发送后关闭连接
+        """
+        try:
+            manager = get_job_manager()
+            if manager.store.get(job_id) is None:
+                return jsonify({
+                    "success": False,
+                    "error": f"任务不存在：{job_id}"
+                }), 404
+
+            after = request.args.get('after', type=int)
+            if after is None:
+                after = get_last_event_id()
+
+            def generate():
+                """SSE 事件生成器"""
+                last_seq = after
+                while True:
+                    events = manager.wait_events(job_id, last_seq)
+                    for seq, event, data in events:
+                        last_seq = seq
+                        yield sse_event(event, data, seq)
+
+                    if not events:
+                        job = manager.store.get(job_id)
+                        if job is None or job["status"] in FINISHED_STATES:
+                            break
+                        yield sse_event("heartbeat", {})
+
+            response = Response(
+                generate(),
+                mimetype='text/event-stream',
+                headers={
+                    'Cache-Control': 'no-cache',
+                    'X-Accel-Buffering': 'no',
+                }
+            )
+            response.implicit_sequence_conversion = False
+            return response
+
+        except Exception as e:
+            log_error(f'/jobs/{job_id}/events', e)
+            return jsonify({
+                "success": False,
+                "error": f"读取任务进度失败。\n错误详情: {str(e)}"
+            }), 500
+
+    @job_bp.route('/events/<stream_id>', methods=['GET'])
+    def attach_event_stream(stream_id):
+        """
+        接入任务事件流（SSE）
+
+        stream_id 为图片任务的 task_id（/generate、/retry-failed 的事件），
+        或 /outline/stream 的 start 事件中返回的 stream_id。
+        可同时有任意多个订阅方；带上 Last-Event-ID 请求头（或 last_event_id 查询参数）
+        只收到之后的事件，不带则从保留的第一个事件开始
+
+        SSE 事件：
+        - 与对应接口相同，每个事件带 id（事件序号）
+        - truncated: 请求的事件已超出保留范围 {"first_id": 最早保留的序号}
+        - heartbeat: 心跳包 {}
+        所有发布方结束且事件全部发送后关闭连接
+        """
+        try:
+            if not get_event_bus().exists(stream_id):
+                return jsonify({
+                    "success": False,
+                    "error": f"事件流不存在或已过期：{stream_id}"
+                }), 404
+
+            response = Response(
+                stream_events(stream_id, get_last_event_id()),
+                mimetype='text/event-stream',
+                headers={
+                    'Cache-Control': 'no-cache',
+                    'X-Accel-Buffering': 'no',
+                }
+            )
+            response.implicit_sequence_conversion = False
+            return response
+
+        except Exception as e:
+            log_error(f'/events/{stream_id}', e)
+            return jsonify({
+                "success": False,
+                "error": f"接入事件流失败。\n错误详情: {str(e)}"
+            }), 500
+
+    return job_bp
@@ -4,17 +4,21 @@
 包含功能：
 - 生成大纲（支持图片上传）
 - 流式生成大纲（SSE）
+- 边生成大纲边生成图片（SSE）
 """
 
 import time
 import json
+import uuid
 import base64
 import logging
-import threading
-import queue
 from flask import Blueprint, request, jsonify, Response, stream_with_context
+from backend.services.async_engine import get_async_engine, use_asyncio
+from backend.services.event_bus import arun_producer, get_event_bus, run_producer
 from backend.services.outline import get_outline_service
-from .utils import log_request, log_error
+from backend.services.image import get_image_service
+from backend.services.outline_parser import IncrementalOutlineParser
+from .utils import log_request, log_error, stream_events
 
 logger = logging.getLogger(__name__)
 
@@ -96,9 +100,15 @@ def create_outline_blueprint():
            - images: base64 编码的图片数组（可选）
            - page_count: 指定页数（可选）
 
+        生成在后台执行，事件写入事件流（每个事件带 id）。断线后可通过
+        GET /events/<stream_id>（带 Last-Event-ID）接着读取，生成不会因断线中断或重复发起
+
         SSE 事件：
+        - start: 开始 {"message": "streaming started", "stream_id": "..."}
         - chunk: 生成的文本片段 {"content": "..."}
-        - done: 生成完成 {"outline": "完整大纲", "pages": [...]}
+        - page: 一页大纲已完整生成 {"index": 0, "type": "cover", "content": "..."}
+          （模型仍在输出后续页面时即发送，最后一页在 done 之前发送）
+        - done: 生成完成 {"outline": "完整大纲", "pages": [...]}，pages 以此为准
         - error: 错误 {"error": "错误信息"}
         - heartbeat: 心跳包 {}
         """
@@ -121,76 +131,21 @@ def create_outline_blueprint():
             outline_service = get_outline_service()
             images_data = images if images else None
 
-            def generate():
-                """
-                使用队列和后台线程实现带心跳的流式生成
-                即使 AI Provider 响应慢，也会定期发送心跳保持连接
-                """
-                data_queue = queue.Queue()
-                heartbeat_interval = 3  # 每 3 秒发送一次心跳
-                stop_event = threading.Event()
-
-                def ai_worker():
-                    """后台线程：调用 AI 并将结果放入队列"""
-                    try:
-                        for chunk in outline_service.generate_outline_stream(
-                            topic,
-                            images_data,
-                            page_count=page_count
-                        ):
-                            data_queue.put(('chunk', chunk))
-                        data_queue.put(('done', None))
-                    except Exception as e:
-                        data_queue.put(('error', str(e)))
-                    finally:
-                        stop_event.set()
-
-                # 启动后台 AI 工作线程
-                worker_thread = threading.Thread(target=ai_worker, daemon=True)
-                worker_thread.start()
-
-                full_text = ""
-                chunk_count = 0
-
-                # 发送开始事件
-                logger.debug("📤 发送 SSE 开始事件")
-                yield f"event: start\ndata: {json.dumps({'message': 'streaming started'})}\n\n"
-
-                # 主循环：处理队列数据，定期发送心跳
-                while not stop_event.is_set() or not data_queue.empty():
-                    try:
-                        # 尝试从队列获取数据，最多等待 heartbeat_interval 秒
-                        event_type, data = data_queue.get(timeout=heartbeat_interval)
-
-                        if event_type == 'chunk':
-                            chunk_count += 1
-                            full_text += data
-                            logger.debug(f"📤 发送 chunk #{chunk_count}: {len(data)} 字符")
-                            yield f"event: chunk\ndata: {json.dumps({'content': data}, ensure_ascii=False)}\n\n"
-
-                        elif event_type == 'done':
-                            # 生成完成，解析大纲
-                            pages = outline_service._parse_outline(full_text)
-                            has_images = images_data is not None and len(images_data) > 0
-                            logger.info(f"✅ 流式大纲生成完成，共 {len(pages)} 页，发送了 {chunk_count} 个 chunk")
-                            yield f"event: done\ndata: {json.dumps({'outline': full_text, 'pages': pages, 'has_images': has_images}, ensure_ascii=False)}\n\n"
-                            break
-
-                        elif event_type == 'error':
-                            logger.error(f"❌ 流式大纲生成失败: {data}")
-                            yield f"event: error\ndata: {json.dumps({'error': data}, ensure_ascii=False)}\n\n"
-                            break
-
-                    except queue.Empty:
-                        # 队列超时，发送心跳保持连接
-                        logger.debug("💓 发送心跳包")
-                        yield f"event: heartbeat\ndata: {{}}\n\n"
-
-                # 等待工作线程结束
-                worker_thread.join(timeout=1)
+            # 后台调用 AI 并发布事件，即使 AI Provider 响应慢，订阅方也会定期收到心跳；
+            # 异步生成引擎下在事件循环中以协程发布，不占用线程
+            stream_id = f"outline_{uuid.uuid4().hex[:12]}"
+            get_event_bus().begin(stream_id, "outline")
+            if use_asyncio():
+                get_async_engine().submit(arun_producer(stream_id, "outline", _aoutline_stream_events(
+                    outline_service, stream_id, topic, images_data, page_count
+                )))
+            else:
+                run_producer(stream_id, "outline", _outline_stream_events(
+                    outline_service, stream_id, topic, images_data, page_count
+                ))
 
             response = Response(
-                stream_with_context(generate()),
+                stream_events(stream_id),
                 mimetype='text/event-stream',
                 headers={
                     'Cache-Control': 'no-cache, no-store, must-revalidate',
@@ -212,6 +167,78 @@ def create_outline_blueprint():
                 "error": f"流式大纲生成异常。\n错误详情: {error_msg}"
             }), 500
 
+    @outline_bp.route('/outline/pipeline', methods=['POST'])
+    def generate_outline_pipeline():
+        """
+        边生成大纲边生成图片（SSE）
+
+        大纲每完成一页就提交图片生成：封面立即开始生成，内容页在封面完成后以封面为参考生成，
+        不必等整个大纲生成完、再调用 /generate
+
+        请求格式：同 /outline/stream，另可传 task_id（可选）
+
+        SSE 事件：
+        - start: {"task_id": "..."}
+        - chunk / page / done: 同 /outline/stream
+        - progress / complete / error / finish: 同 /generate
+        - error: 大纲生成失败 {"error": "错误信息", "phase": "outline"}
+        - heartbeat: 心跳包 {}
+        """
+        try:
+            topic, images, page_count = _parse_outline_request()
+            if request.content_type and 'multipart/form-data' in request.content_type:
+                task_id = request.form.get('task_id')
+            else:
+                task_id = (request.get_json(silent=True) or {}).get('task_id')
+
+            if not topic:
+                logger.warning("流水线生成请求缺少 topic 参数")
+                return jsonify({
+                    "success": False,
+                    "error": "参数错误：topic 不能为空。"
+                }), 400
+
+            page_info = f"，指定页数: {page_count}" if page_count else ""
+            logger.info(f"🔄 开始流水线生成，主题: {topic[:50]}...{page_info}")
+
+            outline_service = get_outline_service()
+            image_service = get_image_service()
+            images_data = images if images else None
+
+            def generate():
+                """SSE 事件生成器"""
+                # 异步生成引擎下大纲也在引擎中读取，不占用单独的线程
+                stream_outline = (
+                    outline_service.agenerate_outline_stream if use_asyncio()
+                    else outline_service.generate_outline_stream
+                )
+                for event in image_service.generate_images_pipelined(
+                    stream_outline(topic, images_data, page_count=page_count),
+                    task_id,
+                    user_images=images_data,
+                    user_topic=topic
+                ):
+                    yield f"event: {event['event']}\ndata: {json.dumps(event['data'], ensure_ascii=False)}\n\n"
+
+            response = Response(
+                stream_with_context(generate()),
+                mimetype='text/event-stream',
+                headers={
+                    'Cache-Control': 'no-cache, no-store, must-revalidate',
+                    'X-Accel-Buffering': 'no',
+                    'Content-Type': 'text/event-stream; charset=utf-8'
+                }
+            )
+            response.implicit_sequence_conversion = False
+            return response
+
+        except Exception as e:
+            log_error('/outline/pipeline', e)
+            return jsonify({
+                "success": False,
+                "error": f"流水线生成异常。\n错误详情: {str(e)}"
+            }), 500
+
     return outline_bp
 
 
@@ -267,3 +294,101 @@ def _parse_outline_request():
         page_count = max(1, min(100, page_count))
 
     return topic, images, page_count
+
+
+class _OutlineStreamEvents:
+    """把流式大纲的文本片段转换为 SSE 事件（线程和协程两种发布方式共用）"""
+
+    def __init__(self, outline_service, stream_id, images_data):
+        self.outline_service = outline_service
+        self.stream_id = stream_id
+        self.images_data = images_data
+        self.parser = IncrementalOutlineParser()
+        self.chunk_count = 0
+        self.page_count_sent = 0
+
+    def start(self):
+        logger.debug("📤 发送 SSE 开始事件")
+        return {"event": "start", "data": {"message": "streaming started", "stream_id": self.stream_id}}
+
+    def chunk(self, chunk):
+        """一个文本片段：chunk 事件，以及已完整生成的页面（不必等整个大纲结束）"""
+        self.chunk_count += 1
+        logger.debug(f"📤 发送 chunk #{self.chunk_count}: {len(chunk)} 字符")
+        events = [{"event": "chunk", "data": {"content": chunk}}]
+        for page in self.parser.feed(chunk):
+            self.page_count_sent += 1
+            logger.debug(f"📤 发送 page #{page['index']}: {page['type']}")
+            events.append({"event": "page", "data": page})
+        return events
+
+    def error(self, e):
+        logger.error(f"❌ 流式大纲生成失败: {e}")
+        return {"event": "error", "data": {"error": str(e)}}
+
+    def finish(self):
+        """生成完成：发送最后一页，再以完整文本的解析结果为准"""
+        events = []
+        for page in self.parser.finish():
+            self.page_count_sent += 1
+            events.append({"event": "page", "data": page})
+
+        full_text = self.parser.text
+        pages = self.outline_service._parse_outline(full_text)
+        has_images = self.images_data is not None and len(self.images_data) > 0
+        logger.info(
+            f"✅ 流式大纲生成完成，共 {len(pages)} 页，"
+            f"发送了 {self.chunk_count} 个 chunk、{self.page_count_sent} 个 page"
+        )
+        events.append({"event": "done", "data": {"outline": full_text, "pages": pages, "has_images": has_images}})
+        return events
+
+
+def _outline_stream_events(outline_service, stream_id, topic, images_data, page_count):
+    """
+    流式生成大纲，产出 SSE 事件（在后台线程中运行）
+
+    Yields:
+        {"event": "start" / "chunk" / "page" / "done" / "error", "data": {...}}
+    """
+    events = _OutlineStreamEvents(outline_service, stream_id, images_data)
+    yield events.start()
+
+    try:
+        for chunk in outline_service.generate_outline_stream(
+            topic,
+            images_data,
+            page_count=page_count
+        ):
+            yield from events.chunk(chunk)
+    except Exception as e:
+        yield events.error(e)
+        return
+
+    yield from events.finish()
+
+
+async def _aoutline_stream_events(outline_service, stream_id, topic, images_data, page_count):
+    """
+    _outline_stream_events 的异步版本（在异步生成引擎中运行，等待模型输出期间不占用线程）
+
+    Yields:
+        同 _outline_stream_events
+    """
+    events = _OutlineStreamEvents(outline_service, stream_id, images_data)
+    yield events.start()
+
+    try:
+        async for chunk in outline_service.agenerate_outline_stream(
+            topic,
+            images_data,
+            page_count=page_count
+        ):
+            for event in events.chunk(chunk):
+                yield event
+    except Exception as e:
+        yield events.error(e)
+        return
+
+    for event in events.finish():
+        yield event
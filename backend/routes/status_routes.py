@@ -0,0 +1,88 @@
+"""
+运行状态相关 API 路由
+
+包含功能：
+- 获取运行时状态（缓存命中率、缩略图队列等）
+"""
+
+import logging
+from flask import Blueprint, jsonify
+from .utils import log_error
+
+logger = logging.getLogger(__name__)
+
+
+def create_status_blueprint():
+    """创建状态路由蓝图（工厂函数，支持多次调用）"""
+    status_bp = Blueprint('status', __name__)
+
+    @status_bp.route('/status', methods=['GET'])
+    def get_status():
+        """
+        获取运行时状态
+
+        返回：
+        - success: 是否成功
+        - status: 运行时状态
+          - compress_cache: 压缩图片缓存统计（条目数、占用字节、命中/未命中次数）
+          - thumbnails: 缩略图后台任务统计（排队、丢弃、生成、按需生成次数）
+          - derivatives: 衍生图磁盘缓存统计（文件数、占用字节、命中/未命中/淘汰次数）
+          - image_pool: 图片处理进程池统计（进程数、交给子进程/在线程中执行/降级的次数）
+          - scheduler: 图片生成调度器状态（工作线程数、各任务排队/执行中数量、排队耗时）
+          - limiters: 各图片服务商的自适应并发上限（当前上限、在途请求数、延迟、错误率）
+          - rate_limits: 各服务商的请求速率令牌桶（速率、剩余令牌、暂停剩余时间、等待统计）
+          - hedging: 各图片服务商的对冲请求统计（触发阈值、对冲次数、对冲胜出次数）
+          - circuits: 各服务商的熔断器状态（状态、失败率、剩余熔断时间、拒绝次数）
+          - http_pools: 各服务商 HTTP 连接池（连接池大小、请求数、新建/复用连接数）
+          - engine: 生成引擎（thread/asyncio、事件循环是否运行、提交的协程数、进行中的协程数）
+          - leases: 跨进程并发限制（后端、所有进程合计的上限和在用租约数、本进程持有数）
+          - jobs: 后台任务统计（工作线程数、执行中的任务、各状态任务数）
+          - events: 任务事件总线统计（保留的事件流数、进行中的事件流数、发布/订阅次数）
+          - task_states: 任务状态存储统计（内存中的任务数、占用字节、从磁盘加载/淘汰次数）
+        """
+        try:
+            from backend.utils.image_cache import get_compress_cache
+            from backend.services.thumbnail import get_thumbnail_service
+            from backend.services.derivative import get_derivative_service
+            from backend.utils.image_pool import get_image_pool
+            from backend.services.scheduler import get_scheduler
+            from backend.utils.adaptive_limiter import get_limiter_stats
+            from backend.utils.rate_limiter import get_rate_limiter_stats
+            from backend.utils.hedging import get_hedger_stats
+            from backend.utils.circuit_breaker import get_circuit_stats
+            from backend.utils.lease_limiter import get_lease_stats
+            from backend.utils.http_pool import get_http_pool_stats
+            from backend.services.async_engine import get_async_engine
+            from backend.services.jobs import get_job_manager
+            from backend.services.event_bus import get_event_bus
+            from backend.services.task_state import get_task_state_store
+
+            return jsonify({
+                "success": True,
+                "status": {
+                    "compress_cache": get_compress_cache().stats(),
+                    "thumbnails": get_thumbnail_service().stats(),
+                    "derivatives": get_derivative_service().stats(),
+                    "image_pool": get_image_pool().stats(),
+                    "scheduler": get_scheduler().stats(),
+                    "limiters": get_limiter_stats(),
+                    "rate_limits": get_rate_limiter_stats(),
+                    "hedging": get_hedger_stats(),
+                    "circuits": get_circuit_stats(),
+                    "http_pools": get_http_pool_stats(),
+                    "engine": get_async_engine().stats(),
+                    "leases": get_lease_stats(),
+                    "jobs": get_job_manager().stats(),
+                    "events": get_event_bus().stats(),
+                    "task_states": get_task_state_store().stats()
+                }
+            }), 200
+
+        except Exception as e:
+            log_error('/status', e)
+            return jsonify({
+                "success": False,
+                "error": f"获取运行状态失败。\n错误详情: {str(e)}"
+            }), 500
+
+    return status_bp
@@ -4,8 +4,12 @@ API 路由工具函数
 包含通用的日志记录、错误处理等辅助函数
 """
 
+import json
 import logging
 import traceback
+from typing import Any, Dict, Iterator, Optional
+from flask import request
+from backend.services.event_bus import get_event_bus
 
 logger = logging.getLogger(__name__)
 
@@ -95,3 +99,49 @@ def prepare_providers_for_response(providers: dict) -> dict:
         result[name] = provider_copy
 
     return result
+
+
+def sse_event(event: str, data: Dict[str, Any], event_id: Optional[int] = None) -> str:
+    """
+    格式化一个 SSE 事件
+
+    id 行放在 data 之后，兼容只按前两行解析 event / data 的旧客户端
+
+    Args:
+        event: 事件类型
+        data: 事件数据
+        event_id: 事件序号（可选）
+    """
+    message = f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n"
+    if event_id:
+        message += f"id: {event_id}\n"
+    return message + "\n"
+
+
+def get_last_event_id(default: int = 0) -> int:
+    """
+    读取客户端已收到的最后一个事件序号
+
+    优先使用 EventSource 重连时自动带上的 Last-Event-ID 请求头，其次是 last_event_id 查询参数
+    """
+    value = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    try:
+        return int(value) if value else default
+    except ValueError:
+        return default
+
+
+def stream_events(stream_id: str, last_event_id: int = 0) -> Iterator[str]:
+    """
+    订阅事件总线上的事件流，产出 SSE 文本（无新事件时发送心跳）
+
+    Args:
+        stream_id: 事件流 ID
+        last_event_id: 只发送该序号之后的事件
+    """
+    for item in get_event_bus().subscribe(stream_id, last_event_id):
+        if item is None:
+            yield sse_event("heartbeat", {})
+            continue
+        seq, event, data = item
+        yield sse_event(event, data, seq)
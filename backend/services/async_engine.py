@@ -0,0 +1,155 @@
+"""
+异步生成引擎
+
+线程模式下每张生成中的图片占用一个调度器工作线程（对冲时再加一个），每个流式大纲占用一个发布线程。
+GENERATION_ENGINE=asyncio 时，这些调用改为在一个后台事件循环中以协程执行，服务商调用使用原生
+异步客户端（httpx.AsyncClient、google-genai 的 client.aio），等待响应期间不占用线程：
+
+- submit：把协程交给事件循环执行，返回 concurrent.futures.Future，任意线程都可以等待
+- iterate：把异步生成器桥接为普通生成器，Flask 的 SSE 响应、后台任务线程按原来的方式消费；
+  消费方提前结束（客户端断开）时撤销协程
+"""
+import asyncio
+import logging
+import queue
+import threading
+from concurrent.futures import Future
+from typing import Any, AsyncIterator, Coroutine, Dict, Iterator, Optional
+from backend.config import Config
+
+logger = logging.getLogger(__name__)
+
+ENGINE_THREAD = "thread"
+ENGINE_ASYNCIO = "asyncio"
+
+_END = object()
+
+
+class AsyncEngine:
+    """在后台线程中运行的事件循环"""
+
+    def __init__(self, name: str = "generation-loop"):
+        """
+        Args:
+            name: 事件循环线程名称
+        """
+        self.name = name
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+
+        # 统计计数
+        self.submitted = 0
+        self.streams = 0
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        """事件循环（首次使用时启动）"""
+        with self._lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                started = threading.Event()
+
+                def run():
+                    asyncio.set_event_loop(loop)
+                    loop.call_soon(started.set)
+                    loop.run_forever()
+
+                self._thread = threading.Thread(target=run, name=self.name, daemon=True)
+                self._thread.start()
+                started.wait()
+                self._loop = loop
+                logger.info(f"异步生成引擎已启动: {self.name}")
+            return self._loop
+
+    def submit(self, coro: Coroutine) -> Future:
+        """
+        在事件循环中执行协程
+
+        Returns:
+            协程结果的 Future（cancel() 会撤销协程）
+        """
+        loop = self.loop
+        with self._lock:
+            self.submitted += 1
+        return asyncio.run_coroutine_threadsafe(coro, loop)
+
+    def iterate(self, agen: AsyncIterator[Any]) -> Iterator[Any]:
+        """
+        在事件循环中消费异步生成器，在调用线程中逐个产出结果
+
+        异步生成器抛出的异常在调用线程中原样抛出；调用方提前结束迭代时撤销协程
+        """
+        items: "queue.Queue" = queue.Queue()
+
+        async def pump():
+            try:
+                async for item in agen:
+                    items.put((item, None))
+            except asyncio.CancelledError:
+                items.put((_END, None))
+                raise
+            except BaseException as e:
+                items.put((_END, e))
+            else:
+                items.put((_END, None))
+
+        with self._lock:
+            self.streams += 1
+        future = self.submit(pump())
+        try:
+            while True:
+                item, error = items.get()
+                if item is _END:
+                    if error is not None:
+                        raise error
+                    return
+                yield item
+        finally:
+            if not future.done():
+                future.cancel()
+
+    def stats(self) -> Dict[str, Any]:
+        """获取引擎状态"""
+        with self._lock:
+            loop = self._loop
+            stats = {
+                "engine": Config.GENERATION_ENGINE,
+                "running": loop is not None and loop.is_running(),
+                "submitted": self.submitted,
+                "streams": self.streams,
+            }
+        tasks = None
+        if loop is not None:
+            # 在事件循环中统计进行中的协程数
+            try:
+                tasks = asyncio.run_coroutine_threadsafe(_count_tasks(), loop).result(timeout=1)
+            except Exception:
+                tasks = None
+        stats["tasks"] = tasks
+        return stats
+
+
+async def _count_tasks() -> int:
+    """事件循环中进行中的协程数（不含本协程）"""
+    return len(asyncio.all_tasks()) - 1
+
+
+def use_asyncio() -> bool:
+    """是否使用异步生成引擎"""
+    return Config.GENERATION_ENGINE == ENGINE_ASYNCIO
+
+
+# 全局引擎
+_engine: Optional[AsyncEngine] = None
+_engine_lock = threading.Lock()
+
+
+def get_async_engine() -> AsyncEngine:
+    """获取全局异步生成引擎"""
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = AsyncEngine()
+    return _engine
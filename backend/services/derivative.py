@@ -0,0 +1,223 @@
+"""
+衍生图服务（按宽度/格式缩放的图片变体）
+
+衍生图存放在各任务目录下的 .cache 目录中，文件名形如 {stem}_w{width}.{fmt}；
+所有任务共享一个磁盘配额，超出时按最近访问时间（文件 mtime）做 LRU 淘汰
+"""
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, Optional
+from backend.config import Config
+from backend.utils.image_compressor import DERIVATIVE_FORMATS
+from backend.utils.image_pool import get_image_pool
+from backend.utils.paths import is_single_path_segment
+from backend.utils.single_flight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+# 允许的输出宽度，请求宽度向上取整到最近的一档，避免任意宽度把缓存打爆
+ALLOWED_WIDTHS = (256, 512, 768, 1080, 1536)
+# 任务目录下的衍生图缓存目录名
+CACHE_DIRNAME = ".cache"
+
+
+def snap_width(width: int) -> int:
+    """将请求宽度向上取整到允许的档位（超过最大档位时取最大档位）"""
+    for allowed in ALLOWED_WIDTHS:
+        if width <= allowed:
+            return allowed
+    return ALLOWED_WIDTHS[-1]
+
+
+def negotiate_format(accept: str) -> str:
+    """根据 Accept 请求头选择输出格式：支持 WebP 时优先 WebP，否则 JPEG"""
+    return 'webp' if 'image/webp' in (accept or '') else 'jpeg'
+
+
+class DerivativeService:
+    """
+    衍生图服务
+
+    首次请求时生成并写入缓存，之后直接返回缓存文件；原图被覆盖（mtime 更新）后自动重新生成。
+    同一个衍生图的并发请求通过 single-flight 合并。
+    """
+
+    def __init__(self, history_root: str, max_bytes: int):
+        """
+        初始化衍生图服务
+
+        Args:
+            history_root: history 根目录
+            max_bytes: 所有任务衍生图缓存的磁盘配额（字节）
+        """
+        self.history_root = history_root
+        self.max_bytes = max_bytes
+        self._single_flight = SingleFlight()
+
+        # 缓存文件路径 -> 文件大小，按访问先后排序（首次使用时扫描磁盘建立）
+        self._index: "Optional[OrderedDict[str, int]]" = None
+        self._current_bytes = 0
+        self._lock = threading.Lock()
+
+        # 统计计数
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _ensure_index(self):
+        """扫描已有的缓存文件，按 mtime 建立 LRU 索引（调用方需持有锁）"""
+        if self._index is not None:
+            return
+
+        entries = []
+        if os.path.isdir(self.history_root):
+            for task_id in os.listdir(self.history_root):
+                cache_dir = os.path.join(self.history_root, task_id, CACHE_DIRNAME)
+                if not os.path.isdir(cache_dir):
+                    continue
+                for name in os.listdir(cache_dir):
+                    if name.startswith('.'):
+                        continue
+                    path = os.path.join(cache_dir, name)
+                    try:
+                        st = os.stat(path)
+                    except FileNotFoundError:
+                        continue
+                    entries.append((st.st_mtime, path, st.st_size))
+
+        entries.sort()
+        self._index = OrderedDict((path, size) for _, path, size in entries)
+        self._current_bytes = sum(self._index.values())
+        logger.debug(f"衍生图缓存索引已建立: {len(self._index)} 个文件, {self._current_bytes} 字节")
+
+    def _touch(self, path: str):
+        """记录一次访问：移到 LRU 末尾并刷新 mtime，重启后仍能保持访问顺序"""
+        with self._lock:
+            self._ensure_index()
+            if path in self._index:
+                self._index.move_to_end(path)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+
+    def _record(self, path: str, size: int):
+        """登记新生成的缓存文件，并按磁盘配额淘汰最久未访问的文件"""
+        evicted = []
+        with self._lock:
+            self._ensure_index()
+            if path in self._index:
+                self._current_bytes -= self._index.pop(path)
+            self._index[path] = size
+            self._current_bytes += size
+
+            while self._current_bytes > self.max_bytes and len(self._index) > 1:
+                old_path, old_size = self._index.popitem(last=False)
+                self._current_bytes -= old_size
+                self.evictions += 1
+                evicted.append(old_path)
+
+        for old_path in evicted:
+            try:
+                os.remove(old_path)
+            except FileNotFoundError:
+                # 任务目录可能已被删除
+                pass
+
+        if evicted:
+            logger.debug(f"衍生图缓存超出配额，已淘汰 {len(evicted)} 个文件")
+
+    def get_derivative(self, task_dir: str, filename: str, width: int, fmt: str) -> Optional[str]:
+        """
+        获取衍生图路径，缺失或早于原图时生成
+
+        Args:
+            task_dir: 任务目录
+            filename: 原图文件名
+            width: 目标宽度（须为 ALLOWED_WIDTHS 中的档位）
+            fmt: 输出格式（webp / jpeg）
+
+        Returns:
+            衍生图路径；原图不存在时返回 None
+        """
+        if not is_single_path_segment(filename):
+            raise ValueError(f"无效的图片文件名: {filename}")
+        if width not in ALLOWED_WIDTHS:
+            raise ValueError(f"不支持的宽度: {width}，可选: {', '.join(map(str, ALLOWED_WIDTHS))}")
+        if fmt not in DERIVATIVE_FORMATS:
+            raise ValueError(f"不支持的图片格式: {fmt}，可选: {', '.join(DERIVATIVE_FORMATS)}")
+
+        source_path = os.path.join(task_dir, filename)
+        stem = os.path.splitext(filename)[0]
+        cache_dir = os.path.join(task_dir, CACHE_DIRNAME)
+        cache_path = os.path.join(cache_dir, f"{stem}_w{width}.{fmt}")
+
+        def is_fresh() -> bool:
+            return os.path.exists(cache_path) and \
+                os.path.getmtime(cache_path) >= os.path.getmtime(source_path)
+
+        if not os.path.exists(source_path):
+            return None
+
+        if is_fresh():
+            with self._lock:
+                self.hits += 1
+            self._touch(cache_path)
+            return cache_path
+
+        def build() -> Optional[str]:
+            if not os.path.exists(source_path):
+                return None
+            if is_fresh():
+                return cache_path
+
+            os.makedirs(cache_dir, exist_ok=True)
+            # 在图片处理进程池中读取、缩放并写入，只传递文件路径
+            size = get_image_pool().resize_file(source_path, cache_path, width, fmt)
+
+            with self._lock:
+                self.misses += 1
+            self._record(cache_path, size)
+            logger.debug(f"衍生图已生成: {cache_path} ({size} 字节)")
+            return cache_path
+
+        return self._single_flight.do(cache_path, build)
+
+    def stats(self) -> Dict[str, Any]:
+        """获取衍生图缓存统计信息"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "files": len(self._index) if self._index is not None else None,
+                "bytes": self._current_bytes if self._index is not None else None,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            }
+
+
+# 全局服务实例
+_service_instance = None
+_service_lock = threading.Lock()
+
+
+def get_derivative_service() -> DerivativeService:
+    """获取全局衍生图服务实例"""
+    global _service_instance
+    if _service_instance is None:
+        with _service_lock:
+            if _service_instance is None:
+                history_root = os.path.join(
+                    os.path.dirname(os.path.dirname(os.path.dirname(__file__))),
+                    "history"
+                )
+                _service_instance = DerivativeService(
+                    history_root,
+                    max_bytes=Config.DERIVATIVE_CACHE_MAX_MB * 1024 * 1024
+                )
+                logger.info(f"初始化衍生图服务: max={Config.DERIVATIVE_CACHE_MAX_MB}MB")
+    return _service_instance
@@ -0,0 +1,279 @@
+"""
+任务事件总线
+
+每个事件流（图片任务以 task_id 为流 ID，流式大纲另行分配）保留一段有界、有序的事件日志，
+每个事件分配递增的序号作为 SSE 的 id。生成在后台线程中进行并发布事件，任意数量的订阅方
+（多个标签页、断线重连的客户端）可以随时接入，带上 Last-Event-ID 即可收到错过的事件。
+
+- 同一事件流可以先后有多个发布方（如后台生成任务、批量重试），序号连续递增
+- 同一发布方已在运行时不会重复启动，重复的请求直接接入正在进行的事件流
+- 所有发布方结束后，订阅方收完剩余事件即结束；事件日志保留一段时间供重连
+- 流式大纲的文本片段（chunk）单独保留，不占用其他事件的保留数量，片段再多也不会把页面、进度事件挤出日志
+"""
+import heapq
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Any, AsyncIterator, Deque, Dict, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 每个事件流保留的事件数（不含 TRANSIENT_EVENTS）
+MAX_EVENTS = 1000
+# 不计入 MAX_EVENTS 的事件类型（文本片段，完整内容在结束事件中会再给出），以及每个事件流另外保留的数量
+TRANSIENT_EVENTS = frozenset({"chunk"})
+MAX_TRANSIENT_EVENTS = 5000
+# 事件流结束后保留的时长（秒）
+RETENTION_SECONDS = 600
+# 最多保留的事件流数量（超出时淘汰最早结束的）
+MAX_STREAMS = 256
+
+Event = Tuple[int, str, Dict[str, Any]]
+
+
+class _Stream:
+    """单个事件流"""
+
+    __slots__ = ("events", "transient", "dropped_seq", "last_seq", "producers", "ended_at")
+
+    def __init__(self, max_events: int, max_transient: int):
+        self.events: Deque[Event] = deque(maxlen=max_events)
+        self.transient: Deque[Event] = deque(maxlen=max_transient)
+        # 超出保留数量被淘汰的最后一个事件（TRANSIENT_EVENTS 以外）的序号
+        self.dropped_seq = 0
+        self.last_seq = 0
+        # 正在运行的发布方 -> 开始时的序号
+        self.producers: Dict[str, int] = {}
+        self.ended_at: Optional[float] = None
+
+
+class EventBus:
+    """多订阅方事件总线"""
+
+    def __init__(
+        self,
+        max_events: int = MAX_EVENTS,
+        retention_seconds: float = RETENTION_SECONDS,
+        max_streams: int = MAX_STREAMS,
+        max_transient: int = MAX_TRANSIENT_EVENTS
+    ):
+        """
+        Args:
+            max_events: 每个事件流保留的事件数（不含 TRANSIENT_EVENTS）
+            retention_seconds: 事件流结束后保留的时长（秒）
+            max_streams: 最多保留的事件流数量
+            max_transient: 每个事件流另外保留的 TRANSIENT_EVENTS 事件数
+        """
+        self.max_events = max_events
+        self.max_transient = max_transient
+        self.retention_seconds = retention_seconds
+        self.max_streams = max_streams
+        self._cond = threading.Condition()
+        self._streams: "OrderedDict[str, _Stream]" = OrderedDict()
+
+        # 统计计数
+        self.published = 0
+        self.subscribed = 0
+
+    def _new_stream(self) -> _Stream:
+        return _Stream(self.max_events, self.max_transient)
+
+    def begin(self, stream_id: str, producer: str, last_seq: int = 0) -> Tuple[bool, int]:
+        """
+        登记一个发布方
+
+        Args:
+            stream_id: 事件流 ID
+            producer: 发布方名称（如 "job"、"retry_failed"）
+            last_seq: 该发布方此前已发布到的序号（如进程重启后继续执行的后台任务，序号记录在事件日志中），
+                事件流的序号从不小于它的值继续，之前发出的 SSE id 仍然有效
+
+        Returns:
+            (started, from_seq)：started 为 False 表示该发布方已在运行；
+            from_seq 为该发布方开始时的序号，订阅时从这里开始即只收到该发布方之后的事件
+        """
+        with self._cond:
+            self._evict()
+            stream = self._streams.get(stream_id)
+            if stream is None:
+                stream = self._new_stream()
+                self._streams[stream_id] = stream
+            self._streams.move_to_end(stream_id)
+            if producer in stream.producers:
+                return False, stream.producers[producer]
+            stream.last_seq = max(stream.last_seq, last_seq)
+            stream.producers[producer] = stream.last_seq
+            stream.ended_at = None
+            return True, stream.last_seq
+
+    def publish(self, stream_id: str, event: str, data: Dict[str, Any]) -> int:
+        """
+        发布一个事件（TRANSIENT_EVENTS 中的事件单独保留，不挤占其他事件）
+
+        Returns:
+            事件序号
+        """
+        with self._cond:
+            stream = self._streams.get(stream_id)
+            if stream is None:
+                # 没有登记发布方的事件流，按已结束处理
+                stream = self._new_stream()
+                stream.ended_at = time.monotonic()
+                self._streams[stream_id] = stream
+            stream.last_seq += 1
+            if event in TRANSIENT_EVENTS:
+                stream.transient.append((stream.last_seq, event, data))
+            else:
+                if len(stream.events) == stream.events.maxlen:
+                    stream.dropped_seq = stream.events[0][0]
+                stream.events.append((stream.last_seq, event, data))
+            self.published += 1
+            self._cond.notify_all()
+            return stream.last_seq
+
+    def end(self, stream_id: str, producer: str):
+        """发布方结束；所有发布方都结束后，订阅方收完剩余事件即结束"""
+        with self._cond:
+            stream = self._streams.get(stream_id)
+            if stream is None:
+                return
+            stream.producers.pop(producer, None)
+            if not stream.producers:
+                stream.ended_at = time.monotonic()
+            self._cond.notify_all()
+
+    def exists(self, stream_id: str) -> bool:
+        """事件流是否存在（运行中或结束后仍在保留期内）"""
+        with self._cond:
+            self._evict()
+            return stream_id in self._streams
+
+    def subscribe(
+        self,
+        stream_id: str,
+        last_event_id: int = 0,
+        heartbeat: float = 3
+    ) -> Iterator[Optional[Event]]:
+        """
+        订阅事件流
+
+        Args:
+            stream_id: 事件流 ID
+            last_event_id: 已收到的最后一个事件序号，只返回之后的事件
+            heartbeat: 无新事件时产出 None（用于发送心跳）的间隔（秒）
+
+        Yields:
+            (seq, event, data)，或心跳 None。请求的事件（TRANSIENT_EVENTS 以外）已被淘汰时，先产出
+            (0, "truncated", {"first_id": 最早保留的序号})；被淘汰的 TRANSIENT_EVENTS 事件直接跳过
+        """
+        with self._cond:
+            self.subscribed += 1
+
+        last_seq = last_event_id
+        while True:
+            with self._cond:
+                stream = self._streams.get(stream_id)
+                if stream is None:
+                    return
+                pending = self._pending(stream, last_seq)
+                if not pending and stream.producers:
+                    self._cond.wait(heartbeat)
+                    pending = self._pending(stream, last_seq)
+                dropped_seq = stream.dropped_seq
+                finished = not stream.producers
+
+            if pending and dropped_seq > last_seq:
+                # 请求的事件已超出保留范围
+                yield 0, "truncated", {"first_id": pending[0][0]}
+            for item in pending:
+                last_seq = item[0]
+                yield item
+
+            if not pending:
+                if finished:
+                    return
+                yield None
+
+    @staticmethod
+    def _pending(stream: _Stream, after: int) -> List[Event]:
+        """序号大于 after 的事件，按序号排列（调用方需持有锁）"""
+        return [e for e in heapq.merge(stream.events, stream.transient) if e[0] > after]
+
+    def _evict(self):
+        """清理过期和超量的已结束事件流（调用方需持有锁）"""
+        now = time.monotonic()
+        ended = [
+            (stream.ended_at, stream_id) for stream_id, stream in self._streams.items()
+            if stream.ended_at is not None
+        ]
+        for ended_at, stream_id in ended:
+            if now - ended_at > self.retention_seconds:
+                del self._streams[stream_id]
+        overflow = len(self._streams) - self.max_streams
+        if overflow > 0:
+            for _, stream_id in sorted(ended)[:overflow]:
+                self._streams.pop(stream_id, None)
+
+    def stats(self) -> Dict[str, Any]:
+        """获取事件总线统计"""
+        with self._cond:
+            return {
+                "streams": len(self._streams),
+                "active": sum(1 for s in self._streams.values() if s.producers),
+                "published": self.published,
+                "subscribed": self.subscribed,
+            }
+
+
+# 全局事件总线
+_event_bus: Optional[EventBus] = None
+_event_bus_lock = threading.Lock()
+
+
+def get_event_bus() -> EventBus:
+    """获取全局事件总线"""
+    global _event_bus
+    if _event_bus is None:
+        with _event_bus_lock:
+            if _event_bus is None:
+                _event_bus = EventBus()
+    return _event_bus
+
+
+def run_producer(stream_id: str, producer: str, events: Iterator[Dict[str, Any]]):
+    """
+    在后台线程中消费事件迭代器（{"event", "data"}）并发布到事件流，结束时登记发布方结束
+
+    调用前需先用 begin 登记发布方
+    """
+    bus = get_event_bus()
+
+    def run():
+        try:
+            for event in events:
+                bus.publish(stream_id, event["event"], event["data"])
+        except Exception as e:
+            logger.error(f"❌ 事件流 [{stream_id}] 发布方 {producer} 异常: {e}", exc_info=True)
+            bus.publish(stream_id, "error", {"error": str(e)})
+        finally:
+            bus.end(stream_id, producer)
+
+    threading.Thread(target=run, name=f"events-{producer}-{stream_id}", daemon=True).start()
+
+
+async def arun_producer(stream_id: str, producer: str, events: AsyncIterator[Dict[str, Any]]):
+    """
+    run_producer 的异步版本：在异步生成引擎中消费异步事件迭代器并发布到事件流，不占用线程
+
+    调用前需先用 begin 登记发布方
+    """
+    bus = get_event_bus()
+    try:
+        async for event in events:
+            bus.publish(stream_id, event["event"], event["data"])
+    except Exception as e:
+        logger.error(f"❌ 事件流 [{stream_id}] 发布方 {producer} 异常: {e}", exc_info=True)
+        bus.publish(stream_id, "error", {"error": str(e)})
+    finally:
+        bus.end(stream_id, producer)
@@ -1,34 +1,56 @@
 """图片生成服务"""
+import asyncio
+import functools
+import io
 import logging
 import os
 import uuid
-import time
+import queue
 import threading
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from typing import Dict, Any, Generator, List, Optional, Tuple
-from backend.config import Config
-from backend.generators.factory import ImageGeneratorFactory
-from backend.utils.image_compressor import compress_image
+from concurrent.futures import Future, InvalidStateError
+from typing import Dict, Any, AsyncIterable, Callable, Generator, Iterable, List, Optional, Tuple, Union
+from backend.services.provider_pool import Admission, PoolMember, create_provider_pool
+from backend.services.outline_parser import MODE_PAGE, IncrementalOutlineParser, parse_outline
+from backend.utils.reference_asset import ReferenceAsset, as_reference_assets
+from backend.services.thumbnail import get_thumbnail_service
+from backend.services.scheduler import Deferred, get_scheduler
+from backend.services.async_engine import get_async_engine, use_asyncio
+from backend.services.task_state import get_task_state_store
+from backend.utils.hedging import get_hedger
+from backend.utils.retry_policy import RequestCancelled, RetryPolicy
 
 logger = logging.getLogger(__name__)
 
-# 全局并发控制信号量（限制所有任务的总并发数）
-_global_semaphore = None
-_global_semaphore_size = None  # 记录当前信号量大小，用于检测配置变更
 
+def _resolve_without_reference(cover_reference: Future):
+    """封面最终失败或被撤销：参考图结果为 None（封面成功时结果已由生成线程设置）"""
+    if not cover_reference.done():
+        try:
+            cover_reference.set_result(None)
+        except InvalidStateError:
+            pass
 
-def _get_global_semaphore() -> threading.Semaphore:
-    """获取全局并发控制信号量（懒加载，配置变更时重建）"""
-    global _global_semaphore, _global_semaphore_size
-    max_concurrent = Config.get_image_max_concurrent()
 
-    # 如果信号量不存在或配置变更，重新创建
-    if _global_semaphore is None or _global_semaphore_size != max_concurrent:
-        _global_semaphore = threading.Semaphore(max_concurrent)
-        _global_semaphore_size = max_concurrent
-        logger.info(f"初始化全局并发信号量: max_concurrent={max_concurrent}")
+def _remove_part(result: Tuple[str, Optional[bytes]]):
+    """删除对冲请求中未被采用的一方写好的临时文件（参数为 _call_generator 的返回值）"""
+    try:
+        os.remove(result[0])
+    except FileNotFoundError:
+        pass
 
-    return _global_semaphore
+
+def _prepare_references(
+    reference_image: Optional[ReferenceAsset],
+    user_images: Optional[List[ReferenceAsset]]
+):
+    """预先计算参考图的压缩和 base64 编码结果（结果缓存在 ReferenceAsset 上）"""
+    for reference in ([reference_image] if reference_image is not None else []) + list(user_images or []):
+        reference.data_uri
+
+
+def _cover_reference(data: bytes) -> ReferenceAsset:
+    """封面写入文件时保留的数据压缩后只保留压缩结果（后续页面复用同一份编码）"""
+    return ReferenceAsset(data).compact()
 
 
 class ImageService:
@@ -36,35 +58,25 @@ class ImageService:
 
     # 并发配置
     MAX_CONCURRENT = 15  # 最大并发数
-    AUTO_RETRY_COUNT = 3  # 自动重试次数
+    AUTO_RETRY_COUNT = 3  # 默认总尝试次数（服务商配置 retry_max_attempts 可覆盖）
 
     def __init__(self, provider_name: str = None):
         """
         初始化图片生成服务
 
         Args:
-            provider_name: 服务商名称，如果为None则使用配置文件中的激活服务商
+            provider_name: 服务商名称，如果为None则使用配置文件中的服务商池或激活服务商
         """
         logger.debug("初始化 ImageService...")
 
-        # 获取服务商配置
-        if provider_name is None:
-            provider_name = Config.get_active_image_provider()
-
-        logger.info(f"使用图片服务商: {provider_name}")
-        provider_config = Config.get_image_provider_config(provider_name)
-
-        # 创建生成器实例
-        provider_type = provider_config.get('type', provider_name)
-        logger.debug(f"创建生成器: type={provider_type}")
-        self.generator = ImageGeneratorFactory.create(provider_type, provider_config)
+        # 创建服务商池（未启用服务商池时只有一个服务商）
+        self.pool = create_provider_pool(provider_name)
 
-        # 保存配置信息
-        self.provider_name = provider_name
-        self.provider_config = provider_config
-
-        # 检查是否启用短 prompt 模式
-        self.use_short_prompt = provider_config.get('short_prompt', False)
+        # 第一个服务商的信息（单服务商模式下即当前服务商）
+        primary = self.pool.primary
+        self.generator = primary.generator
+        self.provider_name = primary.name
+        self.provider_config = primary.config
 
         # 加载提示词模板
         self.prompt_template = self._load_prompt_template()
@@ -80,10 +92,13 @@ class ImageService:
         # 当前任务的输出目录（每个任务一个子文件夹）
         self.current_task_dir = None
 
-        # 存储任务状态（用于重试）
-        self._task_states: Dict[str, Dict] = {}
+        # 任务状态（用于重试）：内存中有界缓存，持久化到任务目录，重启后仍可重试
+        self.task_states = get_task_state_store()
 
-        logger.info(f"ImageService 初始化完成: provider={provider_name}, type={provider_type}")
+        logger.info(
+            f"ImageService 初始化完成: providers={[m.name for m in self.pool.members]}, "
+            f"type={primary.type}"
+        )
 
     def _load_prompt_template(self, short: bool = False) -> str:
         """加载 Prompt 模板"""
@@ -99,12 +114,12 @@ class ImageService:
         with open(prompt_path, "r", encoding="utf-8") as f:
             return f.read()
 
-    def _save_image(self, image_data: bytes, filename: str, task_dir: str = None) -> str:
+    def _save_image(self, source_path: str, filename: str, task_dir: str = None) -> str:
         """
-        保存图片到本地，同时生成缩略图
+        把生成器写好的临时文件替换为任务图片，缩略图交给后台线程生成
 
         Args:
-            image_data: 图片二进制数据
+            source_path: 生成器写入的临时文件（与任务图片在同一目录）
             filename: 文件名
             task_dir: 任务目录（如果为None则使用当前任务目录）
 
@@ -117,134 +132,495 @@ class ImageService:
         if task_dir is None:
             raise ValueError("任务目录未设置")
 
-        # 保存原图
+        thumbnail_service = get_thumbnail_service()
+
+        # 重新生成时先删除旧缩略图，避免新原图配旧缩略图
+        thumbnail_service.invalidate(task_dir, filename)
+
+        # 保存原图（原子替换，图片接口不会读到写了一半的文件）
         filepath = os.path.join(task_dir, filename)
-        with open(filepath, "wb") as f:
-            f.write(image_data)
+        os.replace(source_path, filepath)
 
-        # 生成缩略图（50KB左右）
-        thumbnail_data = compress_image(image_data, max_size_kb=50)
-        thumbnail_filename = f"thumb_{filename}"
-        thumbnail_path = os.path.join(task_dir, thumbnail_filename)
-        with open(thumbnail_path, "wb") as f:
-            f.write(thumbnail_data)
+        # 投递缩略图任务（50KB左右），不阻塞生成流程
+        thumbnail_service.submit(task_dir, filename)
 
         return filepath
 
+    def _call_generator(
+        self,
+        member: PoolMember,
+        prompt: str,
+        reference_image: Optional[ReferenceAsset] = None,
+        user_images: Optional[List[ReferenceAsset]] = None,
+        target_path: str = None,
+        keep_data: bool = False,
+        cancel_event: Optional[threading.Event] = None,
+        rate_token_acquired: bool = False
+    ) -> Tuple[str, Optional[bytes]]:
+        """
+        按服务商类型调用生成器，图片直接写入磁盘
+
+        每次调用写入各自的临时文件（对冲请求的两次调用互不覆盖），由调用方替换为任务图片
+
+        Args:
+            member: 服务商池中选中的服务商
+            prompt: 提示词
+            reference_image: 参考图片（封面图）
+            user_images: 用户上传的参考图片列表
+            target_path: 任务图片路径，临时文件写在同一目录
+            keep_data: 写入文件的同时在内存中保留一份图片数据（封面作为参考图时使用，不必再读回文件）
+            cancel_event: CancelEvent，置位时生成器尽快放弃请求（对冲请求中落败的一方）
+            rate_token_acquired: 准入时已取得服务商的速率令牌，生成器不再等待令牌
+
+        Returns:
+            (写好图片的临时文件路径, keep_data 时的图片数据，否则为 None)
+        """
+        directory, name = os.path.split(target_path)
+        part_path = os.path.join(directory, f".{name}.{uuid.uuid4().hex[:8]}.part")
+        copy = io.BytesIO() if keep_data else None
+        self._write_generated_image(
+            member, prompt, reference_image, user_images, part_path, cancel_event, rate_token_acquired, copy
+        )
+        if cancel_event is not None and cancel_event.is_set():
+            # 对冲请求中落败的一方，结果不会被使用
+            os.remove(part_path)
+            raise RequestCancelled()
+        return part_path, copy.getvalue() if copy is not None else None
+
+    def _write_generated_image(
+        self,
+        member: PoolMember,
+        prompt: str,
+        reference_image: Optional[ReferenceAsset],
+        user_images: Optional[List[ReferenceAsset]],
+        path: str,
+        cancel_event: Optional[threading.Event],
+        rate_token_acquired: bool = False,
+        copy_to: Optional[io.BytesIO] = None
+    ) -> int:
+        """按服务商类型组织参数调用生成器，写入 path（和 copy_to），返回写入的字节数"""
+        return member.generator.generate_image_to_file(
+            prompt=prompt,
+            path=path,
+            copy_to=copy_to,
+            cancel_event=cancel_event,
+            rate_token_acquired=rate_token_acquired,
+            **self._generator_kwargs(member, reference_image, user_images)
+        )
+
+    def _generator_kwargs(
+        self,
+        member: PoolMember,
+        reference_image: Optional[ReferenceAsset],
+        user_images: Optional[List[ReferenceAsset]]
+    ) -> Dict[str, Any]:
+        """按服务商类型组织生成器参数（提示词、写入目标之外的部分）"""
+        if member.type == 'google_genai':
+            logger.debug(f"  使用 Google GenAI 生成器")
+            return dict(
+                aspect_ratio=member.config.get('default_aspect_ratio', '3:4'),
+                temperature=member.config.get('temperature', 1.0),
+                model=member.config.get('model', 'gemini-3-pro-image-preview'),
+                reference_image=reference_image,
+            )
+        elif member.type == 'image_api':
+            logger.debug(f"  使用 Image API 生成器")
+            # Image API 支持多张参考图片
+            # 组合参考图片：用户上传的图片 + 封面图
+            reference_images = []
+            if user_images:
+                reference_images.extend(user_images)
+            if reference_image:
+                reference_images.append(reference_image)
+
+            return dict(
+                aspect_ratio=member.config.get('default_aspect_ratio', '3:4'),
+                temperature=member.config.get('temperature', 1.0),
+                model=member.config.get('model', 'nano-banana-2'),
+                reference_images=reference_images if reference_images else None,
+            )
+        else:
+            logger.debug(f"  使用 OpenAI 兼容生成器")
+            return dict(
+                size=member.config.get('default_size', '1024x1024'),
+                model=member.config.get('model'),
+                quality=member.config.get('quality', 'standard'),
+            )
+
+    async def _acall_generator(
+        self,
+        member: PoolMember,
+        prompt: str,
+        reference_image: Optional[ReferenceAsset] = None,
+        user_images: Optional[List[ReferenceAsset]] = None,
+        target_path: str = None,
+        keep_data: bool = False,
+        rate_token_acquired: bool = False
+    ) -> Tuple[str, Optional[bytes]]:
+        """
+        _call_generator 的异步版本：被撤销时临时文件由生成器删除
+
+        Returns:
+            (写好图片的临时文件路径, keep_data 时的图片数据，否则为 None)
+        """
+        directory, name = os.path.split(target_path)
+        part_path = os.path.join(directory, f".{name}.{uuid.uuid4().hex[:8]}.part")
+        copy = io.BytesIO() if keep_data else None
+        await member.generator.agenerate_image_to_file(
+            prompt=prompt,
+            path=part_path,
+            copy_to=copy,
+            rate_token_acquired=rate_token_acquired,
+            **self._generator_kwargs(member, reference_image, user_images)
+        )
+        return part_path, copy.getvalue() if copy is not None else None
+
+    def _build_prompt(self, member: PoolMember, page: Dict, full_outline: str, user_topic: str) -> str:
+        """根据服务商配置选择模板（短 prompt 或完整 prompt）生成提示词"""
+        page_type = page["type"]
+        page_content = page["content"]
+        if member.config.get('short_prompt', False) and self.prompt_template_short:
+            # 短 prompt 模式：只包含页面类型和内容
+            prompt = self.prompt_template_short.format(
+                page_content=page_content,
+                page_type=page_type
+            )
+            logger.debug(f"  使用短 prompt 模式 ({len(prompt)} 字符)")
+            return prompt
+        # 完整 prompt 模式：包含大纲和用户需求
+        return self.prompt_template.format(
+            page_content=page_content,
+            page_type=page_type,
+            full_outline=full_outline,
+            user_topic=user_topic if user_topic else "未提供"
+        )
+
     def _generate_single_image(
         self,
         page: Dict,
         task_id: str,
         task_dir: str,
-        reference_image: Optional[bytes] = None,
-        retry_count: int = 0,
+        reference_image: Union[ReferenceAsset, Future, None] = None,
         full_outline: str = "",
-        user_images: Optional[List[bytes]] = None,
-        user_topic: str = ""
+        user_images: Optional[List[ReferenceAsset]] = None,
+        user_topic: str = "",
+        publish_reference: Optional[Future] = None,
+        admission: Optional[Admission] = None
     ) -> Tuple[int, bool, Optional[str], Optional[str]]:
         """
-        生成单张图片（带自动重试）
+        生成单张图片（单次尝试，失败时抛出异常，由调度器按重试策略重试）
 
         Args:
             page: 页面数据
             task_id: 任务ID
             task_dir: 任务目录（用于保存图片，确保线程安全）
-            reference_image: 参考图片（封面图）
-            retry_count: 当前重试次数
+            reference_image: 参考图片（封面图），或结果为参考图片的 Future（封面尚在生成时）
             full_outline: 完整的大纲文本
             user_images: 用户上传的参考图片列表
             user_topic: 用户原始输入
+            publish_reference: 生成封面时传入，成功后把压缩后的图片作为结果放入该 Future
+            admission: 调度器准入时（_admit_page）选好的服务商和已占用的并发名额；
+                不传时在当前线程中挑选服务商并等待名额
 
         Returns:
-            (index, success, filename, error_message)
+            (index, True, filename, None)
         """
         index = page["index"]
         page_type = page["type"]
-        page_content = page["content"]
 
-        max_retries = self.AUTO_RETRY_COUNT
+        logger.debug(f"生成图片 [{index}]: type={page_type}")
+
+        if isinstance(reference_image, Future):
+            # 调度器在封面结束后才会执行依赖它的页面，这里通常不会等待；封面失败时结果为 None
+            reference_image = reference_image.result()
+
+        if admission is None:
+            # 按实时状态挑选服务商；有参考图（封面或用户上传）时优先选择支持参考图的服务商，保持风格一致
+            admission = self.pool.admit(need_reference=reference_image is not None or bool(user_images))
+        member = admission.member
+        logger.debug(f"  图片 [{index}] 使用服务商: {member.name}")
+
+        # 调用生成器生成图片（使用准入时取得的速率令牌、并发名额和跨进程租约，结束后按结果调整并发上限；
+        # 启用对冲时，耗时超过近期分位数会在独立线程中再发一个请求，对冲请求自己等待令牌、租约和名额）
+        # 服务商熔断时直接失败
+        hedger = get_hedger(member.name, member.config)
+        # 生成器边接收边写入任务目录下的临时文件，整张图片不在内存中停留
+        filename = f"{index}.png"
+        try:
+            prompt = self._build_prompt(member, page, full_outline, user_topic)
+            part_path, data = member.generator.circuit_breaker.call(
+                hedger.call, functools.partial(admission.run, self._call_generator),
+                member, prompt, reference_image, user_images, os.path.join(task_dir, filename),
+                publish_reference is not None,
+                hedge_fn=functools.partial(admission.hedge, self._call_generator),
+                discard=_remove_part
+            )
+        except Exception as e:
+            logger.warning(f"图片 [{index}] 生成失败: {str(e)[:200]}")
+            raise
+        finally:
+            # 熔断等原因没有发出请求时，归还准入时占用的令牌、名额和租约
+            admission.release()
 
-        for attempt in range(max_retries):
-            try:
-                logger.debug(f"生成图片 [{index}]: type={page_type}, attempt={attempt + 1}/{max_retries}")
-
-                # 根据配置选择模板（短 prompt 或完整 prompt）
-                if self.use_short_prompt and self.prompt_template_short:
-                    # 短 prompt 模式：只包含页面类型和内容
-                    prompt = self.prompt_template_short.format(
-                        page_content=page_content,
-                        page_type=page_type
-                    )
-                    logger.debug(f"  使用短 prompt 模式 ({len(prompt)} 字符)")
-                else:
-                    # 完整 prompt 模式：包含大纲和用户需求
-                    prompt = self.prompt_template.format(
-                        page_content=page_content,
-                        page_type=page_type,
-                        full_outline=full_outline,
-                        user_topic=user_topic if user_topic else "未提供"
-                    )
-
-                # 调用生成器生成图片（使用全局信号量控制并发）
-                semaphore = _get_global_semaphore()
-                with semaphore:
-                    if self.provider_config.get('type') == 'google_genai':
-                        logger.debug(f"  使用 Google GenAI 生成器")
-                        image_data = self.generator.generate_image(
-                            prompt=prompt,
-                            aspect_ratio=self.provider_config.get('default_aspect_ratio', '3:4'),
-                            temperature=self.provider_config.get('temperature', 1.0),
-                            model=self.provider_config.get('model', 'gemini-3-pro-image-preview'),
-                            reference_image=reference_image,
-                        )
-                    elif self.provider_config.get('type') == 'image_api':
-                        logger.debug(f"  使用 Image API 生成器")
-                        # Image API 支持多张参考图片
-                        # 组合参考图片：用户上传的图片 + 封面图
-                        reference_images = []
-                        if user_images:
-                            reference_images.extend(user_images)
-                        if reference_image:
-                            reference_images.append(reference_image)
-
-                        image_data = self.generator.generate_image(
-                            prompt=prompt,
-                            aspect_ratio=self.provider_config.get('default_aspect_ratio', '3:4'),
-                            temperature=self.provider_config.get('temperature', 1.0),
-                            model=self.provider_config.get('model', 'nano-banana-2'),
-                            reference_images=reference_images if reference_images else None,
-                        )
-                    else:
-                        logger.debug(f"  使用 OpenAI 兼容生成器")
-                        image_data = self.generator.generate_image(
-                            prompt=prompt,
-                            size=self.provider_config.get('default_size', '1024x1024'),
-                            model=self.provider_config.get('model'),
-                            quality=self.provider_config.get('quality', 'standard'),
-                        )
+        # 保存图片（使用传入的任务目录，确保线程安全）
+        self._save_image(part_path, filename, task_dir)
+        logger.info(f"✅ 图片 [{index}] 生成成功: {filename}")
 
-                # 保存图片（使用传入的任务目录，确保线程安全）
-                filename = f"{index}.png"
-                self._save_image(image_data, filename, task_dir)
-                logger.info(f"✅ 图片 [{index}] 生成成功: {filename}")
+        if publish_reference is not None and not publish_reference.done():
+            # 封面写入文件时已在内存中保留一份，不再读回文件
+            publish_reference.set_result(_cover_reference(data))
 
-                return (index, True, filename, None)
+        return (index, True, filename, None)
 
-            except Exception as e:
-                error_msg = str(e)
-                logger.warning(f"图片 [{index}] 生成失败 (尝试 {attempt + 1}/{max_retries}): {error_msg[:200]}")
-
-                if attempt < max_retries - 1:
-                    # 等待后重试
-                    wait_time = 2 ** attempt
-                    logger.debug(f"  等待 {wait_time} 秒后重试...")
-                    time.sleep(wait_time)
-                    continue
+    async def _agenerate_single_image(
+        self,
+        page: Dict,
+        task_id: str,
+        task_dir: str,
+        reference_image: Union[ReferenceAsset, Future, None] = None,
+        full_outline: str = "",
+        user_images: Optional[List[ReferenceAsset]] = None,
+        user_topic: str = "",
+        publish_reference: Optional[Future] = None,
+        admission: Optional[Admission] = None
+    ) -> Tuple[int, bool, Optional[str], Optional[str]]:
+        """
+        _generate_single_image 的异步版本（异步生成引擎中执行，参数和返回值相同）
 
-                logger.error(f"❌ 图片 [{index}] 生成失败，已达最大重试次数")
-                return (index, False, None, error_msg)
+        调度器准入后把协程交给异步生成引擎：轮询、速率令牌、并发名额、跨进程租约和重试与线程模式相同，
+        区别在于等待服务商响应期间不占用线程
+        """
+        index = page["index"]
+        logger.debug(f"生成图片 [{index}]: type={page['type']}")
 
-        return (index, False, None, "超过最大重试次数")
+        if isinstance(reference_image, Future):
+            # 调度器在封面结束后才会执行依赖它的页面；封面失败时结果为 None
+            reference_image = reference_image.result()
+
+        if admission is None:
+            admission = await asyncio.to_thread(
+                self.pool.admit, need_reference=reference_image is not None or bool(user_images)
+            )
+        member = admission.member
+        logger.debug(f"  图片 [{index}] 使用服务商: {member.name}")
+
+        # 与线程模式相同的保护：熔断 -> 对冲 -> 准入时取得的令牌、名额和租约（对冲请求自己等待）
+        hedger = get_hedger(member.name, member.config)
+        filename = f"{index}.png"
+        try:
+            prompt = self._build_prompt(member, page, full_outline, user_topic)
+            if reference_image is not None or user_images:
+                # 参考图的压缩和 base64 编码放到线程池中（同一任务只计算一次），不阻塞事件循环
+                await asyncio.to_thread(_prepare_references, reference_image, user_images)
+            part_path, data = await member.generator.circuit_breaker.acall(
+                hedger.acall, functools.partial(admission.arun, self._acall_generator),
+                member, prompt, reference_image, user_images, os.path.join(task_dir, filename),
+                publish_reference is not None,
+                hedge_fn=functools.partial(admission.ahedge, self._acall_generator),
+                discard=_remove_part
+            )
+        except Exception as e:
+            logger.warning(f"图片 [{index}] 生成失败: {str(e)[:200]}")
+            raise
+        finally:
+            # 熔断等原因没有发出请求、或在发出请求前被撤销时，归还准入时占用的令牌、名额和租约
+            admission.release()
+
+        self._save_image(part_path, filename, task_dir)
+        logger.info(f"✅ 图片 [{index}] 生成成功: {filename}")
+
+        if publish_reference is not None and not publish_reference.done():
+            reference = await asyncio.to_thread(_cover_reference, data)
+            if not publish_reference.done():
+                publish_reference.set_result(reference)
+
+        return (index, True, filename, None)
+
+    def _page_generator(self) -> Callable:
+        """
+        调度器执行的页面生成函数
+
+        GENERATION_ENGINE=asyncio 时为 _agenerate_single_image：调度器准入后把协程交给异步生成引擎，
+        等待服务商响应期间不占用工作线程
+        """
+        return self._agenerate_single_image if use_asyncio() else self._generate_single_image
+
+    def _admit_page(
+        self,
+        reference_image: Union[ReferenceAsset, Future, None],
+        user_images: Optional[List[ReferenceAsset]]
+    ) -> Admission:
+        """
+        调度器的准入函数：挑选服务商并占用速率令牌、并发名额和跨进程租约，不阻塞工作线程
+
+        Raises:
+            Deferred: 所有候选服务商都不可用，页面回到队列：限流暂停或没有令牌时等到令牌恢复，
+                其他进程占满租约时稍后轮询，名额已满时在名额释放时被唤醒
+        """
+        if isinstance(reference_image, Future):
+            # 调度器在依赖完成后才调用准入函数；封面失败时结果为 None
+            reference_image = reference_image.result()
+        # 先注册唤醒回调，避免在申请失败和回到队列之间释放的名额被错过
+        self.pool.add_listener(get_scheduler().wake_deferred)
+        admission, wait = self.pool.try_admit(need_reference=reference_image is not None or bool(user_images))
+        if admission is not None:
+            # 失败后按实际选中的服务商的重试配置判断是否重试
+            admission.retry_policy = self._retry_policy(admission.member)
+            return admission
+        if wait is None:
+            raise Deferred(reason="服务商并发名额已满")
+        raise Deferred(delay=wait, reason="服务商限流暂停、速率令牌或跨进程租约不足")
+
+    def _retry_policy(self, member: Optional[PoolMember] = None) -> RetryPolicy:
+        """
+        重试策略（退避时间不短于服务商池全部被限流暂停或熔断的剩余时间，重试时会重新挑选服务商）
+
+        Args:
+            member: 本次尝试选中的服务商，按它的配置；不传时按第一个服务商的配置
+                （提交时的默认策略，准入后由 _admit_page 换成选中服务商的策略）
+        """
+        return RetryPolicy.from_config(
+            (member or self.pool.primary).config,
+            default_attempts=self.AUTO_RETRY_COUNT,
+            min_delay_fn=self.pool.paused_for
+        )
+
+    def _uses_cover_reference(self) -> bool:
+        """
+        内容页是否需要等待封面作为参考图
+
+        服务商池中有支持参考图、且未使用短 prompt 模式的服务商时需要；
+        否则（短 prompt 模式、OpenAI 兼容接口等）内容页不传封面，不必等待封面
+        """
+        return any(
+            m.supports_reference and not m.config.get('short_prompt', False)
+            for m in self.pool.members
+        )
+
+    def _submit_page(
+        self,
+        task_id: str,
+        task_dir: str,
+        page: Dict,
+        events: "queue.Queue",
+        max_inflight: Optional[int] = None,
+        reference_image: Union[ReferenceAsset, Future, None] = None,
+        full_outline: str = "",
+        user_images: Optional[List[ReferenceAsset]] = None,
+        user_topic: str = "",
+        publish_reference: Optional[Future] = None,
+        retry_policy: Optional[RetryPolicy] = None
+    ) -> Future:
+        """
+        将一个页面提交到全局公平调度器，开始和结束事件放入 events
+
+        reference_image 为 Future 时，页面在该 Future 完成后才开始执行，等待期间不占用工作线程
+
+        Returns:
+            调度器返回的 Future
+        """
+        future = get_scheduler().submit(
+            task_id,
+            self._page_generator(),
+            page,
+            task_id,
+            task_dir,  # 使用捕获的任务目录，确保线程安全
+            reference_image,
+            full_outline,
+            user_images,
+            user_topic,
+            publish_reference,
+            max_inflight=max_inflight,
+            on_start=lambda info: events.put(("start", page, info)),
+            retry_policy=retry_policy or self._retry_policy(),
+            after=reference_image if isinstance(reference_image, Future) else None,
+            admit=functools.partial(self._admit_page, reference_image, user_images)
+        )
+        future.add_done_callback(lambda f: events.put(("done", page, f)))
+        return future
+
+    def _schedule_pages(
+        self,
+        task_id: str,
+        task_dir: str,
+        pages: List[Dict],
+        max_inflight: Optional[int] = None,
+        reference_image: Optional[ReferenceAsset] = None,
+        full_outline: str = "",
+        user_images: Optional[List[ReferenceAsset]] = None,
+        user_topic: str = "",
+        cover_page: Optional[Dict] = None,
+        cover_reference: Optional[Future] = None
+    ) -> Generator[Tuple[str, Dict, Any], None, None]:
+        """
+        将页面一次性提交到全局公平调度器，按实际发生顺序产出事件
+
+        Args:
+            task_id: 任务ID（调度器按任务轮询）
+            task_dir: 任务目录
+            pages: 要生成的页面列表
+            max_inflight: 该任务同时生成的页面数上限
+            cover_page: 封面页（pages 中的一项），生成成功后把图片放入 cover_reference
+            cover_reference: 封面参考图的 Future；传入时其余页面按 _uses_cover_reference
+                决定是否等待封面并以封面为参考，此时忽略 reference_image
+            其余参数同 _generate_single_image
+
+        Yields:
+            ("start", page, {"wait_ms", "queue_depth"})：页面开始生成
+            ("done", page, (index, success, filename, error))：页面生成结束
+        """
+        scheduler = get_scheduler()
+        retry_policy = self._retry_policy()
+        events: "queue.Queue" = queue.Queue()
+        futures = []
+
+        if cover_reference is not None:
+            reference_image = cover_reference if self._uses_cover_reference() else None
+
+        for page in pages:
+            is_cover = page is cover_page
+            future = self._submit_page(
+                task_id, task_dir, page, events,
+                max_inflight=max_inflight,
+                reference_image=None if is_cover else reference_image,
+                full_outline=full_outline,
+                user_images=user_images,
+                user_topic=user_topic,
+                publish_reference=cover_reference if is_cover else None,
+                retry_policy=retry_policy
+            )
+            if is_cover and cover_reference is not None:
+                # 封面最终失败或被撤销时，等待它的页面不带封面参考图继续生成
+                future.add_done_callback(lambda f: _resolve_without_reference(cover_reference))
+            futures.append(future)
+
+        try:
+            remaining = len(pages)
+            while remaining:
+                kind, page, payload = events.get()
+                if kind == "done":
+                    remaining -= 1
+                    try:
+                        payload = payload.result()
+                    except Exception as e:
+                        logger.error(f"❌ 图片 [{page['index']}] 生成失败，不再重试")
+                        payload = (page["index"], False, None, str(e))
+                yield kind, page, payload
+        finally:
+            # 客户端断开时撤销尚未开始和等待重试的页面，把并发名额让给其他任务
+            for future in futures:
+                if not future.done():
+                    scheduler.cancel(task_id, future)
+
+    def _generated_pages(self, task_id: str, task_dir: str) -> Dict[int, str]:
+        """任务状态中已记录生成、且图片文件仍在的页面 {index: filename}"""
+        state = self.task_states.get(task_id)
+        if state is None:
+            return {}
+        return {
+            index: filename for index, filename in state["generated"].items()
+            if os.path.exists(os.path.join(task_dir, filename))
+        }
 
     def generate_images(
         self,
@@ -252,11 +628,13 @@ class ImageService:
         task_id: str = None,
         full_outline: str = "",
         user_images: Optional[List[bytes]] = None,
-        user_topic: str = ""
+        user_topic: str = "",
+        use_reference: bool = True,
+        resume: bool = False
     ) -> Generator[Dict[str, Any], None, None]:
         """
         生成图片（生成器，支持 SSE 流式返回）
-        优化版本：先生成封面，然后并发生成其他页面
+        所有页面一次性提交，需要封面参考图的内容页等待封面结束，其余页面立即开始
 
         Args:
             pages: 页面列表
@@ -264,6 +642,9 @@ class ImageService:
             full_outline: 完整的大纲文本（用于保持风格一致）
             user_images: 用户上传的参考图片列表（可选）
             user_topic: 用户原始输入（用于保持意图一致）
+            use_reference: 内容页是否以封面作为参考图
+            resume: 继续之前中断的任务（后台任务在服务重启后重新执行）：保留任务状态，
+                跳过任务状态中已记录生成、且图片文件仍在的页面
 
         Yields:
             进度事件字典
@@ -281,25 +662,30 @@ class ImageService:
         total = len(pages)
         generated_images = []
         failed_pages = []
-        cover_image_data = None
-
-        # 压缩用户上传的参考图到200KB以内（减少内存和传输开销）
-        compressed_user_images = None
-        if user_images:
-            compressed_user_images = [compress_image(img, max_size_kb=200) for img in user_images]
-
-        # 初始化任务状态
-        self._task_states[task_id] = {
-            "pages": pages,
-            "generated": {},
-            "failed": {},
-            "cover_image": None,
-            "full_outline": full_outline,
-            "user_images": compressed_user_images,
-            "user_topic": user_topic
-        }
 
-        # ==================== 第一阶段：生成封面 ====================
+        # 用户上传的参考图包装为 ReferenceAsset，压缩和编码结果在所有页面和重试间复用
+        user_references = as_reference_assets(user_images)
+
+        done_pages = self._generated_pages(task_id, task_dir) if resume else {}
+        if done_pages:
+            # 已生成的页面不再生成，事件日志中已有它们的完成事件
+            generated_images = [done_pages[page["index"]] for page in pages if page["index"] in done_pages]
+            logger.info(f"继续中断的任务: task_id={task_id}, 跳过已生成的 {len(generated_images)} 页")
+            yield {
+                "event": "progress",
+                "data": {
+                    "status": "resumed",
+                    "message": f"继续生成，跳过已完成的 {len(generated_images)} 页",
+                    "current": len(generated_images),
+                    "total": total,
+                    "skipped": sorted(done_pages)
+                }
+            }
+        else:
+            # 初始化任务状态
+            self.task_states.create(task_id, pages, full_outline, user_references, user_topic)
+
+        # ==================== 选出封面 ====================
         cover_page = None
         other_pages = []
 
@@ -314,38 +700,69 @@ class ImageService:
             cover_page = pages[0]
             other_pages = pages[1:]
 
-        if cover_page:
-            # 发送封面生成进度
+        cover_reference: Optional[Future] = Future() if cover_page and use_reference else None
+        if cover_page is not None and cover_page["index"] in done_pages:
+            # 封面已生成：内容页直接使用已有封面作为参考图
+            if cover_reference is not None:
+                cover_reference.set_result(self.task_states.get_cover(task_id))
+            cover_page = None
+        other_pages = [page for page in other_pages if page["index"] not in done_pages]
+
+        # ==================== 一次性提交所有页面 ====================
+        # 封面排在最前；需要封面参考图的内容页在封面结束后才开始（等待期间不占用工作线程），
+        # 不需要的（短 prompt 模式、不支持参考图的服务商、use_reference=False）立即开始
+        # 高并发模式：同一任务可同时占用多个并发名额；顺序模式：逐个生成
+        high_concurrency = any(m.config.get('high_concurrency', False) for m in self.pool.members)
+
+        if other_pages:
+            mode = "并发" if high_concurrency else "顺序"
             yield {
                 "event": "progress",
                 "data": {
-                    "index": cover_page["index"],
-                    "status": "generating",
-                    "message": "正在生成封面...",
-                    "current": 1,
+                    "status": "batch_start",
+                    "message": f"开始{mode}生成 {len(other_pages)} 页内容...",
+                    "current": len(generated_images),
                     "total": total,
-                    "phase": "cover"
+                    "phase": "content"
                 }
             }
 
-            # 生成封面（使用用户上传的图片作为参考）
-            index, success, filename, error = self._generate_single_image(
-                cover_page, task_id, task_dir, reference_image=None, full_outline=full_outline,
-                user_images=compressed_user_images, user_topic=user_topic
-            )
+        ordered_pages = ([cover_page] if cover_page else []) + other_pages
+        for kind, page, payload in self._schedule_pages(
+            task_id, task_dir, ordered_pages,
+            max_inflight=self.MAX_CONCURRENT if high_concurrency else 1,
+            full_outline=full_outline,
+            user_images=user_references,
+            user_topic=user_topic,
+            cover_page=cover_page,
+            cover_reference=cover_reference
+        ):
+            is_cover = page is cover_page
+            phase = "cover" if is_cover else "content"
+
+            if kind == "start":
+                # 页面开始生成（附带排队耗时和该任务剩余排队数）
+                yield {
+                    "event": "progress",
+                    "data": {
+                        "index": page["index"],
+                        "status": "generating",
+                        **({"message": "正在生成封面..."} if is_cover else {}),
+                        "current": len(generated_images) + 1,
+                        "total": total,
+                        "phase": phase,
+                        **payload
+                    }
+                }
+                continue
+
+            index, success, filename, error = payload
 
             if success:
                 generated_images.append(filename)
-                self._task_states[task_id]["generated"][index] = filename
-
-                # 读取封面图片作为参考，并立即压缩到200KB以内
-                cover_path = os.path.join(task_dir, filename)
-                with open(cover_path, "rb") as f:
-                    cover_image_data = f.read()
-
-                # 压缩封面图（减少内存占用和后续传输开销）
-                cover_image_data = compress_image(cover_image_data, max_size_kb=200)
-                self._task_states[task_id]["cover_image"] = cover_image_data
+                # 封面的压缩结果已由生成封面的一方在保存后读回一次得到（cover_reference），这里直接复用，不再读文件
+                cover = cover_reference.result() if is_cover and cover_reference is not None else None
+                self.task_states.mark_generated(task_id, index, filename, cover=cover)
 
                 yield {
                     "event": "complete",
@@ -353,12 +770,12 @@ class ImageService:
                         "index": index,
                         "status": "done",
                         "image_url": f"/api/images/{task_id}/{filename}",
-                        "phase": "cover"
+                        "phase": phase
                     }
                 }
             else:
-                failed_pages.append(cover_page)
-                self._task_states[task_id]["failed"][index] = error
+                failed_pages.append(page)
+                self.task_states.mark_failed(task_id, index, error)
 
                 yield {
                     "event": "error",
@@ -367,163 +784,261 @@ class ImageService:
                         "status": "error",
                         "message": error,
                         "retryable": True,
-                        "phase": "cover"
+                        "phase": phase
                     }
                 }
 
-        # ==================== 第二阶段：生成其他页面 ====================
-        if other_pages:
-            # 检查是否启用高并发模式
-            high_concurrency = self.provider_config.get('high_concurrency', False)
+        # ==================== 完成 ====================
+        yield {
+            "event": "finish",
+            "data": {
+                "success": len(failed_pages) == 0,
+                "task_id": task_id,
+                "images": generated_images,
+                "total": total,
+                "completed": len(generated_images),
+                "failed": len(failed_pages),
+                "failed_indices": [p["index"] for p in failed_pages]
+            }
+        }
 
-            if high_concurrency:
-                # 高并发模式：并行生成
-                yield {
-                    "event": "progress",
-                    "data": {
-                        "status": "batch_start",
-                        "message": f"开始并发生成 {len(other_pages)} 页内容...",
-                        "current": len(generated_images),
-                        "total": total,
-                        "phase": "content"
-                    }
-                }
+    def generate_images_pipelined(
+        self,
+        outline_chunks: Union[Iterable[str], AsyncIterable[str]],
+        task_id: str = None,
+        user_images: Optional[List[bytes]] = None,
+        user_topic: str = "",
+        heartbeat_interval: float = 3
+    ) -> Generator[Dict[str, Any], None, None]:
+        """
+        边生成大纲边生成图片（生成器，支持 SSE 流式返回）
 
-                # 使用线程池并发生成
-                with ThreadPoolExecutor(max_workers=self.MAX_CONCURRENT) as executor:
-                    # 提交所有任务（使用函数开头定义的 task_dir 局部变量，确保线程安全）
-                    future_to_page = {
-                        executor.submit(
-                            self._generate_single_image,
-                            page,
-                            task_id,
-                            task_dir,  # 使用捕获的任务目录，确保线程安全
-                            cover_image_data,  # 使用封面作为参考
-                            0,  # retry_count
-                            full_outline,  # 传入完整大纲
-                            compressed_user_images,  # 用户上传的参考图片（已压缩）
-                            user_topic  # 用户原始输入
-                        ): page
-                        for page in other_pages
-                    }
+        大纲每完成一页就提交生成：第一页（封面）立即开始，需要封面参考图的页面在调度器中等待封面结束，
+        其余页面立即开始（同 generate_images）。每页的提示词使用该页完成时已生成的大纲文本。
+        按 <page> 分割的大纲边生成边提交；旧的 --- 分割的大纲在大纲结束后再提交
 
-                    # 发送每个页面的进度
-                    for page in other_pages:
-                        yield {
-                            "event": "progress",
-                            "data": {
-                                "index": page["index"],
-                                "status": "generating",
-                                "current": len(generated_images) + 1,
-                                "total": total,
-                                "phase": "content"
-                            }
-                        }
+        GENERATION_ENGINE=asyncio 时页面同样经过全局公平调度器，准入后在异步生成引擎中以协程执行；
+        大纲片段为异步迭代器（如 OutlineService.agenerate_outline_stream）时在引擎中读取，不占用线程
 
-                    # 收集结果
-                    for future in as_completed(future_to_page):
-                        page = future_to_page[future]
-                        try:
-                            index, success, filename, error = future.result()
-
-                            if success:
-                                generated_images.append(filename)
-                                self._task_states[task_id]["generated"][index] = filename
-
-                                yield {
-                                    "event": "complete",
-                                    "data": {
-                                        "index": index,
-                                        "status": "done",
-                                        "image_url": f"/api/images/{task_id}/{filename}",
-                                        "phase": "content"
-                                    }
-                                }
-                            else:
-                                failed_pages.append(page)
-                                self._task_states[task_id]["failed"][index] = error
-
-                                yield {
-                                    "event": "error",
-                                    "data": {
-                                        "index": index,
-                                        "status": "error",
-                                        "message": error,
-                                        "retryable": True,
-                                        "phase": "content"
-                                    }
-                                }
-
-                        except Exception as e:
-                            failed_pages.append(page)
-                            error_msg = str(e)
-                            self._task_states[task_id]["failed"][page["index"]] = error_msg
-
-                            yield {
-                                "event": "error",
-                                "data": {
-                                    "index": page["index"],
-                                    "status": "error",
-                                    "message": error_msg,
-                                    "retryable": True,
-                                    "phase": "content"
-                                }
-                            }
+        Args:
+            outline_chunks: 大纲文本片段的迭代器或异步迭代器
+                （如 OutlineService.generate_outline_stream / agenerate_outline_stream）
+            task_id: 任务 ID（可选）
+            user_images: 用户上传的参考图片列表（可选）
+            user_topic: 用户原始输入
+            heartbeat_interval: 无事件时发送心跳的间隔（秒）
+
+        Yields:
+            事件字典：大纲事件 start / chunk / page / done，
+            图片事件 progress / complete / error / finish（同 generate_images），
+            大纲生成失败时为 error（{"error", "phase": "outline"}），以及 heartbeat
+        """
+        if task_id is None:
+            task_id = f"task_{uuid.uuid4().hex[:8]}"
+
+        logger.info(f"开始流水线生成任务: task_id={task_id}")
+
+        task_dir = os.path.join(self.history_root_dir, task_id)
+        os.makedirs(task_dir, exist_ok=True)
+
+        user_references = as_reference_assets(user_images)
+        self.task_states.create(task_id, [], "", user_references, user_topic)
+
+        scheduler = get_scheduler()
+        retry_policy = self._retry_policy()
+        high_concurrency = any(m.config.get('high_concurrency', False) for m in self.pool.members)
+        max_inflight = self.MAX_CONCURRENT if high_concurrency else 1
+        cover_reference: Future = Future()
+        content_reference = cover_reference if self._uses_cover_reference() else None
+        events: "queue.Queue" = queue.Queue()
+        stop_event = threading.Event()
+        parser = IncrementalOutlineParser()
+
+        def read_outline():
+            """后台线程：读取大纲文本片段"""
+            try:
+                for chunk in outline_chunks:
+                    if stop_event.is_set():
+                        break
+                    events.put(("chunk", None, chunk))
+                else:
+                    events.put(("outline_done", None, None))
+            except Exception as e:
+                events.put(("outline_error", None, str(e)))
+            finally:
+                close = getattr(outline_chunks, "close", None)
+                if close:
+                    close()
+
+        async def aread_outline():
+            """异步生成引擎中的协程：读取大纲文本片段"""
+            try:
+                async for chunk in outline_chunks:
+                    if stop_event.is_set():
+                        break
+                    events.put(("chunk", None, chunk))
+                else:
+                    events.put(("outline_done", None, None))
+            except Exception as e:
+                events.put(("outline_error", None, str(e)))
+            finally:
+                aclose = getattr(outline_chunks, "aclose", None)
+                if aclose:
+                    await aclose()
+
+        if hasattr(outline_chunks, "__aiter__"):
+            outline_future = get_async_engine().submit(aread_outline())
+        else:
+            outline_future = None
+            threading.Thread(target=read_outline, name=f"outline-{task_id}", daemon=True).start()
+
+        def submit(page: Dict, **kwargs) -> Future:
+            """提交一个页面到全局公平调度器"""
+            return self._submit_page(
+                task_id, task_dir, page, events,
+                max_inflight=max_inflight, retry_policy=retry_policy, **kwargs
+            )
+
+        pages: Dict[int, Dict] = {}
+        submitted: Dict[int, Future] = {}
+        cover_page = None
+        batch_started = False
+        outline_finished = False
+        generated_images = []
+        failed_pages = []
+
+        def accept(page: Dict) -> List[Dict[str, Any]]:
+            """一页大纲完成：第一页作为封面，提交生成"""
+            nonlocal cover_page, batch_started
+            if page["index"] in submitted:
+                return []
+            pages[page["index"]] = page
+
+            started = []
+            if cover_page is None:
+                cover_page = page
+                future = submit(
+                    page,
+                    full_outline=parser.text,  # 该页完成时已生成的大纲
+                    user_images=user_references,
+                    user_topic=user_topic,
+                    publish_reference=cover_reference
+                )
+                future.add_done_callback(lambda f: _resolve_without_reference(cover_reference))
             else:
-                # 顺序模式：逐个生成
-                yield {
-                    "event": "progress",
-                    "data": {
-                        "status": "batch_start",
-                        "message": f"开始顺序生成 {len(other_pages)} 页内容...",
-                        "current": len(generated_images),
-                        "total": total,
-                        "phase": "content"
+                if not batch_started:
+                    batch_started = True
+                    mode = "并发" if high_concurrency else "顺序"
+                    started.append({
+                        "event": "progress",
+                        "data": {
+                            "status": "batch_start",
+                            "message": f"开始{mode}生成内容页...",
+                            "current": len(generated_images),
+                            "total": len(pages),
+                            "phase": "content"
+                        }
+                    })
+                future = submit(
+                    page,
+                    reference_image=content_reference,
+                    full_outline=parser.text,
+                    user_images=user_references,
+                    user_topic=user_topic
+                )
+            submitted[page["index"]] = future
+            return started
+
+        yield {"event": "start", "data": {"task_id": task_id}}
+
+        try:
+            while not (outline_finished and len(generated_images) + len(failed_pages) == len(submitted)):
+                try:
+                    kind, page, payload = events.get(timeout=heartbeat_interval)
+                except queue.Empty:
+                    yield {"event": "heartbeat", "data": {}}
+                    continue
+
+                if kind == "chunk":
+                    yield {"event": "chunk", "data": {"content": payload}}
+                    for outline_page in parser.feed(payload):
+                        yield {"event": "page", "data": outline_page}
+                        # 按 --- 分割时分割结果可能在大纲结束后改变，等大纲结束再提交
+                        if parser.mode == MODE_PAGE:
+                            yield from accept(outline_page)
+
+                elif kind == "outline_done":
+                    for outline_page in parser.finish():
+                        yield {"event": "page", "data": outline_page}
+
+                    # 以完整文本的解析结果为准
+                    outline_text = parser.text
+                    final_pages = parse_outline(outline_text)
+                    self.task_states.update(task_id, pages=final_pages, full_outline=outline_text)
+                    outline_finished = True
+                    logger.info(f"大纲生成完成: task_id={task_id}, 共 {len(final_pages)} 页")
+                    yield {
+                        "event": "done",
+                        "data": {
+                            "outline": outline_text,
+                            "pages": final_pages,
+                            "has_images": bool(user_images)
+                        }
                     }
-                }
 
-                for page in other_pages:
-                    # 发送生成进度
+                    # 尚未提交的页面（旧格式或最后一页）：尚未选出封面时与 generate_images 相同，
+                    # 优先使用封面类型的页面
+                    if cover_page is None:
+                        final_pages = sorted(final_pages, key=lambda p: p["type"] != "cover")
+                    for outline_page in final_pages:
+                        yield from accept(outline_page)
+
+                elif kind == "outline_error":
+                    logger.error(f"❌ 大纲生成失败: {payload}")
+                    outline_finished = True
+                    self.task_states.update(task_id, pages=list(pages.values()), full_outline=parser.text)
+                    yield {"event": "error", "data": {"error": payload, "phase": "outline"}}
+
+                elif kind == "start":
+                    is_cover = page is cover_page
                     yield {
                         "event": "progress",
                         "data": {
                             "index": page["index"],
                             "status": "generating",
+                            **({"message": "正在生成封面..."} if is_cover else {}),
                             "current": len(generated_images) + 1,
-                            "total": total,
-                            "phase": "content"
+                            "total": len(pages),
+                            "phase": "cover" if is_cover else "content",
+                            **payload
                         }
                     }
 
-                    # 生成单张图片
-                    index, success, filename, error = self._generate_single_image(
-                        page,
-                        task_id,
-                        task_dir,
-                        cover_image_data,
-                        0,
-                        full_outline,
-                        compressed_user_images,
-                        user_topic
-                    )
+                else:
+                    is_cover = page is cover_page
+                    phase = "cover" if is_cover else "content"
+                    try:
+                        index, success, filename, error = payload.result()
+                    except Exception as e:
+                        logger.error(f"❌ 图片 [{page['index']}] 生成失败，不再重试")
+                        index, success, filename, error = page["index"], False, None, str(e)
 
                     if success:
                         generated_images.append(filename)
-                        self._task_states[task_id]["generated"][index] = filename
-
+                        cover = cover_reference.result() if is_cover else None
+                        self.task_states.mark_generated(task_id, index, filename, cover=cover)
                         yield {
                             "event": "complete",
                             "data": {
                                 "index": index,
                                 "status": "done",
                                 "image_url": f"/api/images/{task_id}/{filename}",
-                                "phase": "content"
+                                "phase": phase
                             }
                         }
                     else:
                         failed_pages.append(page)
-                        self._task_states[task_id]["failed"][index] = error
-
+                        self.task_states.mark_failed(task_id, index, error)
                         yield {
                             "event": "error",
                             "data": {
@@ -531,18 +1046,25 @@ class ImageService:
                                 "status": "error",
                                 "message": error,
                                 "retryable": True,
-                                "phase": "content"
+                                "phase": phase
                             }
                         }
+        finally:
+            # 客户端断开时停止读取大纲，并撤销尚未开始和等待重试的页面
+            stop_event.set()
+            if outline_future is not None and not outline_future.done():
+                outline_future.cancel()
+            for future in submitted.values():
+                if not future.done():
+                    scheduler.cancel(task_id, future)
 
-        # ==================== 完成 ====================
         yield {
             "event": "finish",
             "data": {
-                "success": len(failed_pages) == 0,
+                "success": len(failed_pages) == 0 and bool(submitted),
                 "task_id": task_id,
                 "images": generated_images,
-                "total": total,
+                "total": len(pages),
                 "completed": len(generated_images),
                 "failed": len(failed_pages),
                 "failed_indices": [p["index"] for p in failed_pages]
@@ -573,14 +1095,11 @@ class ImageService:
         self.current_task_dir = os.path.join(self.history_root_dir, task_id)
         os.makedirs(self.current_task_dir, exist_ok=True)
 
-        reference_image = None
         user_images = None
 
-        # 首先尝试从任务状态中获取上下文
-        if task_id in self._task_states:
-            task_state = self._task_states[task_id]
-            if use_reference:
-                reference_image = task_state.get("cover_image")
+        # 首先尝试从任务状态中获取上下文（内存中没有时从任务目录的清单加载）
+        task_state = self.task_states.get(task_id)
+        if task_state is not None:
             # 如果没有传入上下文，则使用任务状态中的
             if not full_outline:
                 full_outline = task_state.get("full_outline", "")
@@ -588,31 +1107,31 @@ class ImageService:
                 user_topic = task_state.get("user_topic", "")
             user_images = task_state.get("user_images")
 
-        # 如果任务状态中没有封面图，尝试从文件系统加载
-        if use_reference and reference_image is None:
-            cover_path = os.path.join(self.current_task_dir, "0.png")
-            if os.path.exists(cover_path):
-                with open(cover_path, "rb") as f:
-                    cover_data = f.read()
-                # 压缩封面图到 200KB
-                reference_image = compress_image(cover_data, max_size_kb=200)
+        # 封面参考图：内存中没有时从封面文件加载并压缩
+        reference_image = self.task_states.get_cover(task_id) if use_reference else None
 
-        index, success, filename, error = self._generate_single_image(
+        # 通过全局调度器执行，与批量生成任务公平分享并发名额
+        future = get_scheduler().submit(
+            task_id,
+            self._page_generator(),
             page,
             task_id,
             self.current_task_dir,
             reference_image,
-            0,
             full_outline,
             user_images,
-            user_topic
+            user_topic,
+            retry_policy=self._retry_policy(),
+            admit=functools.partial(self._admit_page, reference_image, user_images)
         )
+        try:
+            index, success, filename, error = future.result()
+        except Exception as e:
+            index, success, filename, error = page["index"], False, None, str(e)
 
         if success:
-            if task_id in self._task_states:
-                self._task_states[task_id]["generated"][index] = filename
-                if index in self._task_states[task_id]["failed"]:
-                    del self._task_states[task_id]["failed"][index]
+            # 封面被重新生成时，任务状态会丢弃缓存的旧封面参考图，下次从文件重新加载
+            self.task_states.mark_generated(task_id, index, filename)
 
             return {
                 "success": True,
@@ -646,10 +1165,9 @@ class ImageService:
         self.current_task_dir = os.path.join(self.history_root_dir, task_id)
         os.makedirs(self.current_task_dir, exist_ok=True)
 
-        # 获取参考图
-        reference_image = None
-        if task_id in self._task_states:
-            reference_image = self._task_states[task_id].get("cover_image")
+        # 获取参考图和上下文（服务重启后从任务目录的清单恢复）
+        reference_image = self.task_states.get_cover(task_id)
+        task_state = self.task_states.get(task_id) or {}
 
         total = len(pages)
         success_count = 0
@@ -664,70 +1182,51 @@ class ImageService:
         }
 
         # 并发重试
-        # 从任务状态中获取完整大纲
-        full_outline = ""
-        if task_id in self._task_states:
-            full_outline = self._task_states[task_id].get("full_outline", "")
-
-        with ThreadPoolExecutor(max_workers=self.MAX_CONCURRENT) as executor:
-            # 在提交时捕获 current_task_dir 的值，确保线程安全
-            task_dir = self.current_task_dir
-            future_to_page = {
-                executor.submit(
-                    self._generate_single_image,
-                    page,
-                    task_id,
-                    task_dir,  # 使用捕获的任务目录，确保线程安全
-                    reference_image,
-                    0,  # retry_count
-                    full_outline  # 传入完整大纲
-                ): page
-                for page in pages
-            }
-
-            for future in as_completed(future_to_page):
-                page = future_to_page[future]
-                try:
-                    index, success, filename, error = future.result()
+        for kind, page, payload in self._schedule_pages(
+            task_id, self.current_task_dir, pages,
+            max_inflight=self.MAX_CONCURRENT,
+            reference_image=reference_image,
+            full_outline=task_state.get("full_outline", ""),
+            user_images=task_state.get("user_images"),
+            user_topic=task_state.get("user_topic", "")
+        ):
+            if kind == "start":
+                yield {
+                    "event": "progress",
+                    "data": {
+                        "index": page["index"],
+                        "status": "generating",
+                        **payload
+                    }
+                }
+                continue
 
-                    if success:
-                        success_count += 1
-                        if task_id in self._task_states:
-                            self._task_states[task_id]["generated"][index] = filename
-                            if index in self._task_states[task_id]["failed"]:
-                                del self._task_states[task_id]["failed"][index]
+            index, success, filename, error = payload
 
-                        yield {
-                            "event": "complete",
-                            "data": {
-                                "index": index,
-                                "status": "done",
-                                "image_url": f"/api/images/{task_id}/{filename}"
-                            }
-                        }
-                    else:
-                        failed_count += 1
-                        yield {
-                            "event": "error",
-                            "data": {
-                                "index": index,
-                                "status": "error",
-                                "message": error,
-                                "retryable": True
-                            }
-                        }
+            if success:
+                success_count += 1
+                self.task_states.mark_generated(task_id, index, filename)
 
-                except Exception as e:
-                    failed_count += 1
-                    yield {
-                        "event": "error",
-                        "data": {
-                            "index": page["index"],
-                            "status": "error",
-                            "message": str(e),
-                            "retryable": True
-                        }
+                yield {
+                    "event": "complete",
+                    "data": {
+                        "index": index,
+                        "status": "done",
+                        "image_url": f"/api/images/{task_id}/{filename}"
                     }
+                }
+            else:
+                failed_count += 1
+                self.task_states.mark_failed(task_id, index, error)
+                yield {
+                    "event": "error",
+                    "data": {
+                        "index": index,
+                        "status": "error",
+                        "message": error,
+                        "retryable": True
+                    }
+                }
 
         yield {
             "event": "retry_finish",
@@ -781,13 +1280,12 @@ class ImageService:
         return os.path.join(task_dir, filename)
 
     def get_task_state(self, task_id: str) -> Optional[Dict]:
-        """获取任务状态"""
-        return self._task_states.get(task_id)
+        """获取任务状态（内存中没有时从任务目录的清单加载）"""
+        return self.task_states.get(task_id)
 
     def cleanup_task(self, task_id: str):
-        """清理任务状态（释放内存）"""
-        if task_id in self._task_states:
-            del self._task_states[task_id]
+        """清理任务状态（释放内存，任务目录中的清单保留）"""
+        self.task_states.discard(task_id)
 
 
 # 全局服务实例
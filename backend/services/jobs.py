@@ -0,0 +1,546 @@
+"""
+后台任务队列
+
+图片生成不再在 SSE 响应的生成器中执行：请求只把任务写入 SQLite 队列并返回任务 ID，
+由应用持有的后台工作线程取出执行，执行过程中产生的每个事件按顺序写入任务的事件日志。
+客户端断开（关闭标签页、代理断开连接）不影响生成，重新连接后从断开处继续读取事件。
+
+- 任务状态和事件日志保存在 history/jobs.db，进程重启后仍可查询
+- 执行中的任务记录执行方（进程）和租约到期时间，执行方定期续约；多个 worker 共享同一个队列时，
+  只有租约已过期（执行方已退出）的任务才会被重新排队执行，已生成的页面不再生成；
+  执行次数达到 JOB_MAX_ATTEMPTS 的任务（如每次都让进程崩溃的任务）不再排队，标记为失败
+- 已结束的任务保留 JOB_RETENTION_HOURS 小时后清理
+"""
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+from backend.config import Config
+from backend.services.event_bus import get_event_bus
+
+logger = logging.getLogger(__name__)
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+
+FINISHED_STATES = (JOB_DONE, JOB_FAILED)
+
+# 空闲工作线程检查队列的间隔（秒），同时覆盖其他进程写入的任务
+POLL_INTERVAL = 1.0
+# 任务租约默认有效期（秒），执行方每隔三分之一有效期续约一次
+LEASE_SECONDS = 30.0
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    task_id TEXT,
+    status TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    error TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    owner TEXT,
+    lease_until REAL,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, created_at);
+CREATE TABLE IF NOT EXISTS job_events (
+    job_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    event TEXT NOT NULL,
+    data TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    PRIMARY KEY (job_id, seq)
+);
+"""
+
+
+class JobStore:
+    """基于 SQLite 的任务队列和事件日志"""
+
+    def __init__(self, db_path: str):
+        """
+        Args:
+            db_path: 数据库文件路径
+        """
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        columns = {row["name"] for row in self._conn.execute("PRAGMA table_info(jobs)")}
+        for column, kind in (("owner", "TEXT"), ("lease_until", "REAL")):
+            if column not in columns:
+                # 旧版本创建的数据库：执行中任务的租约为空，按已过期处理
+                self._conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} {kind}")
+
+    def _execute(self, sql: str, params: tuple = ()) -> sqlite3.Cursor:
+        with self._lock:
+            return self._conn.execute(sql, params)
+
+    @staticmethod
+    def _row_to_job(row: sqlite3.Row) -> Dict[str, Any]:
+        job = dict(row)
+        job["payload"] = json.loads(job["payload"])
+        return job
+
+    def create(self, kind: str, payload: Dict[str, Any], task_id: Optional[str] = None) -> str:
+        """
+        新建一个排队中的任务
+
+        Args:
+            kind: 任务类型（对应 JobManager 中注册的处理函数）
+            payload: 任务参数（需可 JSON 序列化）
+            task_id: 关联的图片任务 ID
+
+        Returns:
+            任务 ID
+        """
+        job_id = f"job_{uuid.uuid4().hex[:12]}"
+        now = time.time()
+        self._execute(
+            "INSERT INTO jobs (id, kind, task_id, status, payload, created_at, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (job_id, kind, task_id, JOB_QUEUED, json.dumps(payload, ensure_ascii=False), now, now)
+        )
+        return job_id
+
+    def claim(self, owner: str, lease_seconds: float) -> Optional[Dict[str, Any]]:
+        """
+        取出最早排队的任务并标记为由 owner 执行中，没有排队任务时返回 None
+
+        Args:
+            owner: 执行方 ID（每个进程一个）
+            lease_seconds: 租约有效期（秒），执行方需在到期前续约
+        """
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT * FROM jobs WHERE status = ? ORDER BY created_at LIMIT 1", (JOB_QUEUED,)
+                ).fetchone()
+                if row is not None:
+                    now = time.time()
+                    self._conn.execute(
+                        "UPDATE jobs SET status = ?, attempts = attempts + 1, owner = ?, lease_until = ?, "
+                        "updated_at = ? WHERE id = ?",
+                        (JOB_RUNNING, owner, now + lease_seconds, now, row["id"])
+                    )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return self._row_to_job(row) if row is not None else None
+
+    def finish(self, job_id: str, owner: str, status: str, error: Optional[str] = None) -> bool:
+        """
+        标记任务结束
+
+        Returns:
+            False 表示任务已不由 owner 执行（租约过期后被重新排队或标记为失败），状态未修改
+        """
+        cursor = self._execute(
+            "UPDATE jobs SET status = ?, error = ?, lease_until = NULL, updated_at = ? "
+            "WHERE id = ? AND owner = ? AND status = ?",
+            (status, error, time.time(), job_id, owner, JOB_RUNNING)
+        )
+        return cursor.rowcount > 0
+
+    def renew(self, owner: str, lease_seconds: float) -> List[str]:
+        """
+        为 owner 执行中的所有任务续约
+
+        Returns:
+            仍由 owner 执行的任务 ID
+        """
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute(
+                    "UPDATE jobs SET lease_until = ? WHERE owner = ? AND status = ?",
+                    (time.time() + lease_seconds, owner, JOB_RUNNING)
+                )
+                ids = [
+                    row[0] for row in self._conn.execute(
+                        "SELECT id FROM jobs WHERE owner = ? AND status = ?", (owner, JOB_RUNNING)
+                    ).fetchall()
+                ]
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return ids
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """获取任务（不存在时返回 None）"""
+        row = self._execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._row_to_job(row) if row is not None else None
+
+    def last_seq(self, job_id: str) -> int:
+        """任务事件日志中最大的事件序号（没有事件时为 0）"""
+        row = self._execute("SELECT COALESCE(MAX(seq), 0) FROM job_events WHERE job_id = ?", (job_id,)).fetchone()
+        return row[0]
+
+    def append_event(self, job_id: str, event: str, data: Dict[str, Any], seq: Optional[int] = None) -> int:
+        """
+        追加一个事件
+
+        Args:
+            seq: 事件序号（需大于已有的序号）；不传时在已有的最大序号上加 1
+
+        Returns:
+            事件序号
+        """
+        with self._lock:
+            if seq is None:
+                row = self._conn.execute(
+                    "SELECT COALESCE(MAX(seq), 0) FROM job_events WHERE job_id = ?", (job_id,)
+                ).fetchone()
+                seq = row[0] + 1
+            self._conn.execute(
+                "INSERT INTO job_events (job_id, seq, event, data, created_at) VALUES (?, ?, ?, ?, ?)",
+                (job_id, seq, event, json.dumps(data, ensure_ascii=False), time.time())
+            )
+        return seq
+
+    def events(self, job_id: str, after: int = 0) -> List[Tuple[int, str, Dict[str, Any]]]:
+        """
+        获取序号大于 after 的事件
+
+        Returns:
+            [(seq, event, data), ...]
+        """
+        rows = self._execute(
+            "SELECT seq, event, data FROM job_events WHERE job_id = ? AND seq > ? ORDER BY seq",
+            (job_id, after)
+        ).fetchall()
+        return [(row["seq"], row["event"], json.loads(row["data"])) for row in rows]
+
+    def fail_exhausted(self, max_attempts: int, error: str) -> List[str]:
+        """
+        把租约已过期、且执行次数已达 max_attempts 的执行中任务标记为失败（在 requeue_expired 之前调用）
+
+        Returns:
+            被标记为失败的任务 ID
+        """
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                ids = [
+                    row[0] for row in self._conn.execute(
+                        "SELECT id FROM jobs WHERE status = ? AND COALESCE(lease_until, 0) < ? AND attempts >= ?",
+                        (JOB_RUNNING, time.time(), max_attempts)
+                    ).fetchall()
+                ]
+                for job_id in ids:
+                    self._conn.execute(
+                        "UPDATE jobs SET status = ?, error = ?, lease_until = NULL, updated_at = ? WHERE id = ?",
+                        (JOB_FAILED, error, time.time(), job_id)
+                    )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return ids
+
+    def requeue_expired(self) -> int:
+        """把租约已过期（执行方已退出）的执行中任务重新排队，返回数量"""
+        now = time.time()
+        cursor = self._execute(
+            "UPDATE jobs SET status = ?, owner = NULL, lease_until = NULL, updated_at = ? "
+            "WHERE status = ? AND COALESCE(lease_until, 0) < ?",
+            (JOB_QUEUED, now, JOB_RUNNING, now)
+        )
+        return cursor.rowcount
+
+    def prune(self, max_age_seconds: float) -> int:
+        """删除结束超过 max_age_seconds 的任务及其事件，返回删除的任务数"""
+        cutoff = time.time() - max_age_seconds
+        with self._lock:
+            ids = [
+                row[0] for row in self._conn.execute(
+                    f"SELECT id FROM jobs WHERE status IN ({','.join('?' * len(FINISHED_STATES))}) "
+                    "AND updated_at < ?",
+                    (*FINISHED_STATES, cutoff)
+                ).fetchall()
+            ]
+            for job_id in ids:
+                self._conn.execute("DELETE FROM job_events WHERE job_id = ?", (job_id,))
+                self._conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+        return len(ids)
+
+    def counts(self) -> Dict[str, int]:
+        """按状态统计任务数"""
+        rows = self._execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return {row[0]: row[1] for row in rows}
+
+
+class JobManager:
+    """
+    后台任务执行器
+
+    处理函数按任务类型注册，接收任务参数，返回事件字典（{"event", "data"}）的迭代器，
+    每个事件写入事件日志并唤醒等待中的读取方。任务在服务重启后重新执行时，
+    参数中带有 resume=True，处理函数应跳过已完成的部分。
+
+    每个进程（执行方）有唯一的 owner ID，后台线程定期为本进程执行中的任务续约，
+    并回收其他执行方租约已过期的任务；续约时发现任务已被回收（如进程长时间卡住），停止执行该任务
+    """
+
+    def __init__(
+        self,
+        store: JobStore,
+        workers: int = 0,
+        retention_hours: float = 72,
+        max_attempts: int = 3,
+        lease_seconds: float = LEASE_SECONDS
+    ):
+        """
+        Args:
+            store: 任务存储
+            workers: 同时执行的任务数上限，0 表示不限。每个任务一个线程，线程只转发事件：
+                页面都提交到全局公平调度器，实际的并发由调度器和服务商的限制决定
+            retention_hours: 已结束任务的保留时长（小时）
+            max_attempts: 每个任务最多执行的次数（执行方退出时中断的执行也计入）
+            lease_seconds: 任务租约有效期（秒），执行方退出后其任务最多等待这么久被重新排队
+        """
+        self.store = store
+        self.workers = max(0, workers)
+        self.retention_seconds = retention_hours * 3600
+        self.max_attempts = max(1, max_attempts)
+        self.lease_seconds = max(1.0, lease_seconds)
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._handlers: Dict[str, Callable[[Dict[str, Any]], Iterator[Dict[str, Any]]]] = {}
+        self._cond = threading.Condition()
+        self._threads: List[threading.Thread] = []
+        self._running: Dict[str, str] = {}
+        # 续约时发现已不由本进程执行的任务
+        self._lost: set = set()
+        self._start_lock = threading.Lock()
+
+    def register(self, kind: str, handler: Callable[[Dict[str, Any]], Iterator[Dict[str, Any]]]):
+        """注册任务类型的处理函数"""
+        self._handlers[kind] = handler
+
+    def start(self):
+        """启动分派线程和续约线程（只启动一次）；回收租约已过期的任务，清理过期任务"""
+        with self._start_lock:
+            if self._threads:
+                return
+            self._recover_expired()
+            pruned = self.store.prune(self.retention_seconds)
+            if pruned:
+                logger.info(f"🧹 清理过期的后台任务: {pruned} 个")
+
+            for target, name in ((self._dispatch_loop, "job-dispatch"), (self._lease_loop, "job-lease")):
+                thread = threading.Thread(target=target, name=name, daemon=True)
+                thread.start()
+                self._threads.append(thread)
+            logger.info(
+                f"后台任务执行器已启动: 同时执行上限 {self.workers or '不限'} (owner={self.owner})"
+            )
+
+    def _recover_expired(self):
+        """回收租约已过期的任务：执行次数已达上限的标记为失败，其余重新排队"""
+        error = f"任务执行中多次中断（已执行 {self.max_attempts} 次），不再自动重新执行"
+        for job_id in self.store.fail_exhausted(self.max_attempts, error):
+            logger.warning(f"⚠️ 后台任务多次中断，标记为失败: {job_id}")
+            self.store.append_event(job_id, "error", {"status": "error", "message": error, "retryable": True})
+        requeued = self.store.requeue_expired()
+        if requeued:
+            logger.info(f"🔁 重新排队租约已过期的后台任务: {requeued} 个")
+            with self._cond:
+                self._cond.notify_all()
+
+    def _lease_loop(self):
+        """续约线程：为本进程执行中的任务续约，回收其他执行方租约已过期的任务"""
+        while True:
+            time.sleep(self.lease_seconds / 3)
+            try:
+                held = set(self.store.renew(self.owner, self.lease_seconds))
+                with self._cond:
+                    lost = [job_id for job_id in self._running if job_id not in held]
+                    self._lost.update(lost)
+                for job_id in lost:
+                    logger.warning(f"⚠️ 后台任务的租约已被回收，停止执行: {job_id}")
+                self._recover_expired()
+            except Exception as e:
+                logger.error(f"后台任务续约失败: {e}")
+
+    def submit(self, kind: str, payload: Dict[str, Any], task_id: Optional[str] = None) -> str:
+        """
+        提交任务
+
+        Returns:
+            任务 ID
+        """
+        if kind not in self._handlers:
+            raise ValueError(f"未知的任务类型: {kind}")
+        self.start()
+        job_id = self.store.create(kind, payload, task_id)
+        logger.info(f"📥 后台任务已排队: {job_id} ({kind}, task_id={task_id})")
+        with self._cond:
+            self._cond.notify_all()
+        return job_id
+
+    def _dispatch_loop(self):
+        """分派线程：循环取出任务，每个任务在独立线程中执行"""
+        while True:
+            with self._cond:
+                while self.workers and len(self._running) >= self.workers:
+                    self._cond.wait(POLL_INTERVAL)
+            try:
+                job = self.store.claim(self.owner, self.lease_seconds)
+            except Exception as e:
+                logger.error(f"读取后台任务队列失败: {e}")
+                job = None
+
+            if job is None:
+                with self._cond:
+                    self._cond.wait(POLL_INTERVAL)
+                continue
+
+            with self._cond:
+                self._running[job["id"]] = job["kind"]
+            threading.Thread(target=self._run, args=(job,), name=f"job-{job['id']}", daemon=True).start()
+
+    def _run(self, job: Dict[str, Any]):
+        """执行一个任务，事件逐个写入事件日志"""
+        job_id = job["id"]
+        handler = self._handlers.get(job["kind"])
+
+        logger.info(f"▶️  开始执行后台任务: {job_id} ({job['kind']}, 第 {job['attempts'] + 1} 次)")
+        # 事件同时发布到以 task_id 命名的事件流，订阅方可通过 /events/<task_id> 接入；
+        # 事件序号由事件流分配、原样写入事件日志，两处的 SSE id 一致（重新执行时从日志中的序号继续）
+        stream_id = job.get("task_id") or job_id
+        bus = get_event_bus()
+        bus.begin(stream_id, "job", self.store.last_seq(job_id))
+        status, error = JOB_DONE, None
+        try:
+            if handler is None:
+                raise ValueError(f"未知的任务类型: {job['kind']}")
+            payload = job["payload"]
+            if job["attempts"] > 0:
+                self._append(job_id, "restart", {"message": "服务重启，任务继续执行"}, stream_id)
+                payload = dict(payload, resume=True)
+            events = handler(payload)
+            try:
+                for event in events:
+                    self._append(job_id, event["event"], event["data"], stream_id)
+                    if job_id in self._lost:
+                        # 任务已由其他执行方接手，停止生成（关闭生成器会撤销尚未开始的页面）
+                        break
+            finally:
+                close = getattr(events, "close", None)
+                if close:
+                    close()
+        except Exception as e:
+            logger.error(f"❌ 后台任务执行失败: {job_id}: {e}", exc_info=True)
+            status, error = JOB_FAILED, str(e)
+            self._append(job_id, "error", {"status": "error", "message": str(e), "retryable": True}, stream_id)
+        finally:
+            if not self.store.finish(job_id, self.owner, status, error):
+                logger.warning(f"⚠️ 后台任务已不由本进程执行，不更新状态: {job_id}")
+            bus.end(stream_id, "job")
+            with self._cond:
+                self._running.pop(job_id, None)
+                self._lost.discard(job_id)
+                self._cond.notify_all()
+            logger.info(f"⏹️  后台任务结束: {job_id} ({status})")
+
+    def _append(self, job_id: str, event: str, data: Dict[str, Any], stream_id: str):
+        """发布到事件流，以事件流分配的序号写入事件日志，并唤醒读取方"""
+        seq = get_event_bus().publish(stream_id, event, data)
+        self.store.append_event(job_id, event, data, seq)
+        with self._cond:
+            self._cond.notify_all()
+
+    def wait_events(
+        self,
+        job_id: str,
+        after: int = 0,
+        timeout: float = 3
+    ) -> List[Tuple[int, str, Dict[str, Any]]]:
+        """
+        获取序号大于 after 的事件，暂时没有新事件时最多等待 timeout 秒
+
+        Returns:
+            [(seq, event, data), ...]，超时返回空列表
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            events = self.store.events(job_id, after)
+            remaining = deadline - time.monotonic()
+            if events or remaining <= 0:
+                return events
+            job = self.store.get(job_id)
+            if job is None or job["status"] in FINISHED_STATES:
+                # 任务已结束，再读一次避免漏掉结束前写入的事件
+                return self.store.events(job_id, after)
+            with self._cond:
+                self._cond.wait(min(remaining, POLL_INTERVAL))
+
+    def stats(self) -> Dict[str, Any]:
+        """获取后台任务统计"""
+        with self._cond:
+            running = dict(self._running)
+        return {
+            "workers": self.workers,
+            "owner": self.owner,
+            "running": running,
+            "jobs": self.store.counts(),
+        }
+
+
+# 全局任务执行器
+_job_manager: Optional[JobManager] = None
+_job_manager_lock = threading.Lock()
+
+
+def _generate_images_job(payload: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    """图片批量生成任务"""
+    import base64
+    from backend.services.image import get_image_service
+
+    user_images = [base64.b64decode(b64) for b64 in payload.get("user_images") or []]
+    return get_image_service().generate_images(
+        payload["pages"],
+        payload.get("task_id"),
+        payload.get("full_outline", ""),
+        user_images=user_images or None,
+        user_topic=payload.get("user_topic", ""),
+        use_reference=payload.get("use_reference", True),
+        resume=payload.get("resume", False)
+    )
+
+
+def get_job_manager() -> JobManager:
+    """获取全局后台任务执行器"""
+    global _job_manager
+    if _job_manager is None:
+        with _job_manager_lock:
+            if _job_manager is None:
+                db_path = Config.JOBS_DB_PATH or os.path.join(
+                    os.path.dirname(os.path.dirname(os.path.dirname(__file__))), "history", "jobs.db"
+                )
+                manager = JobManager(
+                    JobStore(db_path),
+                    workers=Config.JOB_WORKERS,
+                    retention_hours=Config.JOB_RETENTION_HOURS,
+                    max_attempts=Config.JOB_MAX_ATTEMPTS,
+                    lease_seconds=Config.JOB_LEASE_SECONDS
+                )
+                manager.register("generate_images", _generate_images_job)
+                _job_manager = manager
+    return _job_manager
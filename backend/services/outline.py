@@ -1,11 +1,13 @@
 import logging
 import os
-import re
 import base64
 import yaml
 from pathlib import Path
 from typing import Dict, List, Any, Optional
 from backend.utils.text_client import get_text_chat_client
+from backend.utils.reference_asset import as_reference_assets
+from backend.services.outline_parser import parse_outline
+from backend.services.async_engine import get_async_engine, use_asyncio
 
 logger = logging.getLogger(__name__)
 
@@ -84,7 +86,7 @@ class OutlineService:
             )
 
         logger.info(f"使用文本服务商: {active_provider} (type={provider_config.get('type')})")
-        return get_text_chat_client(provider_config)
+        return get_text_chat_client(provider_config, active_provider)
 
     def _load_prompt_template(self) -> str:
         prompt_path = os.path.join(
@@ -96,55 +98,19 @@ class OutlineService:
             return f.read()
 
     def _parse_outline(self, outline_text: str) -> List[Dict[str, Any]]:
-        # 按 <page> 分割页面（兼容旧的 --- 分隔符）
-        if '<page>' in outline_text:
-            pages_raw = re.split(r'<page>', outline_text, flags=re.IGNORECASE)
-        else:
-            # 向后兼容：如果没有 <page> 则使用 ---
-            pages_raw = outline_text.split("---")
-
-        pages = []
-
-        for index, page_text in enumerate(pages_raw):
-            page_text = page_text.strip()
-            if not page_text:
-                continue
-
-            page_type = "content"
-            type_match = re.match(r"\[(\S+)\]", page_text)
-            if type_match:
-                type_cn = type_match.group(1)
-                type_mapping = {
-                    "封面": "cover",
-                    "内容": "content",
-                    "总结": "summary",
-                }
-                page_type = type_mapping.get(type_cn, "content")
-
-            pages.append({
-                "index": index,
-                "type": page_type,
-                "content": page_text
-            })
+        return parse_outline(outline_text)
 
-        return pages
-
-    def generate_outline_stream(
+    def _stream_request(
         self,
         topic: str,
         images: Optional[List[bytes]] = None,
         page_count: Optional[int] = None
-    ):
+    ) -> Dict[str, Any]:
         """
-        流式生成大纲（生成器函数）
+        构建流式生成大纲的请求参数
 
-        Args:
-            topic: 主题
-            images: 参考图片列表
-            page_count: 指定页数
-
-        Yields:
-            str: 生成的文本片段
+        Returns:
+            generate_text_stream / agenerate_text_stream 的关键字参数
         """
         page_info = f", page_count={page_count}" if page_count else ""
         logger.info(f"开始流式生成大纲: topic={topic[:50]}..., images={len(images) if images else 0}{page_info}")
@@ -173,13 +139,59 @@ class OutlineService:
 
         logger.info(f"调用流式文本生成 API: model={model}, temperature={temperature}")
 
+        return {
+            "prompt": prompt,
+            "model": model,
+            "temperature": temperature,
+            "max_output_tokens": max_output_tokens,
+            "images": as_reference_assets(images),
+        }
+
+    def generate_outline_stream(
+        self,
+        topic: str,
+        images: Optional[List[bytes]] = None,
+        page_count: Optional[int] = None
+    ):
+        """
+        流式生成大纲（生成器函数）
+
+        GENERATION_ENGINE=asyncio 时在异步生成引擎中用原生异步客户端请求
+
+        Args:
+            topic: 主题
+            images: 参考图片列表
+            page_count: 指定页数
+
+        Yields:
+            str: 生成的文本片段
+        """
+        if use_asyncio():
+            yield from get_async_engine().iterate(
+                self.agenerate_outline_stream(topic, images, page_count=page_count)
+            )
+            return
+
         # 使用流式生成
         for chunk in self.client.generate_text_stream(
-            prompt=prompt,
-            model=model,
-            temperature=temperature,
-            max_output_tokens=max_output_tokens,
-            images=images
+            **self._stream_request(topic, images, page_count)
+        ):
+            yield chunk
+
+    async def agenerate_outline_stream(
+        self,
+        topic: str,
+        images: Optional[List[bytes]] = None,
+        page_count: Optional[int] = None
+    ):
+        """
+        流式生成大纲（异步生成器），参数同 generate_outline_stream
+
+        Yields:
+            str: 生成的文本片段
+        """
+        async for chunk in self.client.agenerate_text_stream(
+            **self._stream_request(topic, images, page_count)
         ):
             yield chunk
 
@@ -221,7 +233,7 @@ class OutlineService:
                 model=model,
                 temperature=temperature,
                 max_output_tokens=max_output_tokens,
-                images=images
+                images=as_reference_assets(images)
             )
 
             logger.debug(f"API 返回文本长度: {len(outline_text)} 字符")
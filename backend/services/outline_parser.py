@@ -0,0 +1,192 @@
+"""
+大纲解析
+
+大纲文本用 <page> 标签（兼容旧的 --- 分隔符）分割页面，每页第一行是类型标记
+[封面] / [内容] / [总结]。
+
+- parse_outline: 解析完整的大纲文本
+- IncrementalOutlineParser: 在模型流式输出的过程中逐块解析，每遇到一个分隔符就产出前一页，
+  最后一页在流结束时产出。产出的页面与 parse_outline 对完整文本的解析结果一致
+"""
+import logging
+import re
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+PAGE_TAG = "<page>"
+LEGACY_SEPARATOR = "---"
+
+MODE_PAGE = "page"
+MODE_LEGACY = "legacy"
+
+_PAGE_TAG_PATTERN = re.compile(re.escape(PAGE_TAG), re.IGNORECASE)
+_TYPE_PATTERN = re.compile(r"\[(\S+)\]")
+
+_TYPE_MAPPING = {
+    "封面": "cover",
+    "内容": "content",
+    "总结": "summary",
+}
+
+
+def parse_page(index: int, page_text: str) -> Optional[Dict[str, Any]]:
+    """
+    解析单页文本
+
+    Args:
+        index: 页面在分割结果中的位置
+        page_text: 页面原始文本
+
+    Returns:
+        {"index", "type", "content"}；空白页返回 None
+    """
+    page_text = page_text.strip()
+    if not page_text:
+        return None
+
+    page_type = "content"
+    type_match = _TYPE_PATTERN.match(page_text)
+    if type_match:
+        page_type = _TYPE_MAPPING.get(type_match.group(1), "content")
+
+    return {
+        "index": index,
+        "type": page_type,
+        "content": page_text
+    }
+
+
+def parse_outline(outline_text: str) -> List[Dict[str, Any]]:
+    """
+    解析完整的大纲文本
+
+    Args:
+        outline_text: 大纲文本
+
+    Returns:
+        页面列表
+    """
+    # 按 <page> 分割页面（兼容旧的 --- 分隔符）
+    if PAGE_TAG in outline_text:
+        pages_raw = _PAGE_TAG_PATTERN.split(outline_text)
+    else:
+        # 向后兼容：如果没有 <page> 则使用 ---
+        pages_raw = outline_text.split(LEGACY_SEPARATOR)
+
+    pages = []
+    for index, page_text in enumerate(pages_raw):
+        page = parse_page(index, page_text)
+        if page:
+            pages.append(page)
+    return pages
+
+
+class IncrementalOutlineParser:
+    """
+    流式大纲解析器
+
+    分割方式由最先出现的分隔符决定：先出现 <page> 按 <page> 分割，先出现 --- 按 --- 分割。
+    按 --- 分割的过程中又出现 <page> 时（完整解析会改用 <page> 分割），停止产出页面，
+    以流结束后对完整文本的解析结果为准
+
+    用法：
+        parser = IncrementalOutlineParser()
+        for chunk in stream:
+            for page in parser.feed(chunk):
+                ...
+        for page in parser.finish():
+            ...
+    """
+
+    def __init__(self):
+        self.mode: Optional[str] = None
+        self.diverged = False
+        self._text_parts: List[str] = []
+        self._buffer = ""
+        self._index = 0
+
+    @property
+    def text(self) -> str:
+        """目前收到的完整文本"""
+        return "".join(self._text_parts)
+
+    def feed(self, chunk: str) -> List[Dict[str, Any]]:
+        """
+        输入一段文本
+
+        Args:
+            chunk: 模型输出的文本片段
+
+        Returns:
+            本次输入后完成的页面（可能为空）
+        """
+        if not chunk:
+            return []
+        self._text_parts.append(chunk)
+        if self.diverged:
+            return []
+
+        # 分隔符可能被拆在两个片段之间，从上次扫描位置往前留出分隔符长度
+        scan_from = max(0, len(self._buffer) - len(PAGE_TAG) + 1)
+        self._buffer += chunk
+
+        if self.mode is None and not self._detect_mode(scan_from):
+            return []
+
+        if self.mode == MODE_LEGACY and PAGE_TAG in self._buffer[scan_from:]:
+            logger.debug("大纲中先出现 --- 后出现 <page>，停止增量解析，以完整解析为准")
+            self.diverged = True
+            return []
+
+        pages = []
+        while True:
+            boundary = self._find_boundary()
+            if boundary is None:
+                break
+            start, end = boundary
+            page = self._take_page(self._buffer[:start])
+            if page:
+                pages.append(page)
+            self._buffer = self._buffer[end:]
+        return pages
+
+    def finish(self) -> List[Dict[str, Any]]:
+        """
+        流结束，产出最后一页
+
+        Returns:
+            剩余的页面（可能为空）
+        """
+        if self.diverged:
+            return []
+        page = self._take_page(self._buffer)
+        self._buffer = ""
+        return [page] if page else []
+
+    def _detect_mode(self, scan_from: int) -> bool:
+        """根据最先出现的分隔符确定分割方式，尚未出现分隔符时返回 False"""
+        tag_pos = self._buffer.find(PAGE_TAG, scan_from)
+        legacy_pos = self._buffer.find(LEGACY_SEPARATOR, scan_from)
+        if tag_pos < 0 and legacy_pos < 0:
+            return False
+        if tag_pos >= 0 and (legacy_pos < 0 or tag_pos < legacy_pos):
+            self.mode = MODE_PAGE
+        else:
+            self.mode = MODE_LEGACY
+        logger.debug(f"大纲分割方式: {self.mode}")
+        return True
+
+    def _find_boundary(self) -> Optional[tuple]:
+        """在缓冲区中查找第一个分隔符，返回 (起始位置, 结束位置)"""
+        if self.mode == MODE_PAGE:
+            match = _PAGE_TAG_PATTERN.search(self._buffer)
+            return match.span() if match else None
+        pos = self._buffer.find(LEGACY_SEPARATOR)
+        return (pos, pos + len(LEGACY_SEPARATOR)) if pos >= 0 else None
+
+    def _take_page(self, page_text: str) -> Optional[Dict[str, Any]]:
+        """解析一段完整的页面文本，推进页码"""
+        page = parse_page(self._index, page_text)
+        self._index += 1
+        return page
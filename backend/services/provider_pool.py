@@ -0,0 +1,382 @@
+"""
+图片服务商池
+
+把多个图片服务商（多个 API Key 或中转站）组合起来使用。每次生成前按权重挑选服务商，
+并根据实时状态调整：
+- 健康度：自适应并发限制器统计的错误率
+- 延迟：各服务商近期平均延迟的相对值
+- 剩余额度：并发余量，以及令牌桶是否因限流处于暂停状态
+- 熔断：熔断中的服务商不参与挑选
+
+有封面参考图时优先选择支持参考图的服务商，保证页面与封面风格一致
+
+图片生成调度器通过 try_admit 不阻塞地挑选服务商，并占用速率令牌、并发名额和跨进程租约：
+选中的服务商被限流暂停、没有令牌、名额或租约已满时改用其他服务商，都不可用时由调度器把页面放回队列
+"""
+import asyncio
+import logging
+import random
+import threading
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+from backend.config import Config
+from backend.generators.factory import ImageGeneratorFactory
+from backend.utils.adaptive_limiter import AdaptiveLimiter, get_provider_limiter
+from backend.utils.lease_limiter import POLL_INTERVAL, LeaseLimiter, get_lease_limiter
+from backend.utils.retry_policy import RequestCancelled, RetryPolicy
+
+logger = logging.getLogger(__name__)
+
+# 支持参考图的服务商类型
+REFERENCE_CAPABLE_TYPES = ("google_genai", "image_api")
+# 并发名额已满时保留的最低选择权重比例（仍可能被选中排队，而不是完全不可用）
+MIN_HEADROOM = 0.05
+
+
+class PoolMember:
+    """服务商池中的一个服务商"""
+
+    def __init__(self, name: str, config: Dict[str, Any], weight: float = 1.0):
+        """
+        Args:
+            name: 服务商名称
+            config: 服务商配置
+            weight: 基础权重
+        """
+        self.name = name
+        self.config = config
+        self.weight = weight
+        self.type = config.get('type', name)
+        logger.debug(f"创建生成器: provider={name}, type={self.type}")
+        self.generator = ImageGeneratorFactory.create(self.type, config)
+
+    @property
+    def supports_reference(self) -> bool:
+        """是否支持参考图"""
+        return self.type in REFERENCE_CAPABLE_TYPES
+
+    def unavailable_for(self) -> float:
+        """因限流暂停或熔断而不可用的剩余秒数"""
+        return max(self.generator.rate_limiter.paused_for(), self.generator.circuit_breaker.retry_in())
+
+    def score(self, best_latency_ms: Optional[int]) -> float:
+        """
+        计算当前的选择权重
+
+        Args:
+            best_latency_ms: 池中最低的近期平均延迟（用于计算相对延迟）
+        """
+        if self.unavailable_for() > 0:
+            return 0.0
+
+        limiter = get_provider_limiter(self.name, self.config).stats()
+        headroom = max(0, limiter["limit"] - limiter["inflight"]) / limiter["limit"]
+        health = (1 - limiter["error_rate"]) ** 2
+        latency = 1.0
+        if best_latency_ms and limiter["latency_ms"]:
+            latency = best_latency_ms / limiter["latency_ms"]
+        return self.weight * max(MIN_HEADROOM, headroom) * health * latency
+
+
+class Admission:
+    """
+    一次生成调用的准入结果：选中的服务商，以及已为它取得的速率令牌、并发名额和跨进程租约
+
+    由 ProviderPool.try_admit / admit 取得；run（协程函数用 arun）执行调用后释放名额和租约，
+    没有执行时用 release 释放
+    """
+
+    def __init__(
+        self,
+        member: PoolMember,
+        limiter: AdaptiveLimiter,
+        acquired_at: float,
+        rate_token: bool = False,
+        lease_limiter: Optional[LeaseLimiter] = None,
+        lease_id: str = ""
+    ):
+        """
+        Args:
+            member: 选中的服务商
+            limiter: 该服务商的并发限制器
+            acquired_at: 占用名额的时间戳
+            rate_token: 是否已取得该服务商的速率令牌（生成器不再等待令牌）
+            lease_limiter: 该服务商的跨进程并发限制器（未启用时为 None）
+            lease_id: 已取得的租约 ID（未启用或后端不可用时为空）
+        """
+        self.member = member
+        self.limiter = limiter
+        self.rate_token = rate_token
+        self.lease_limiter = lease_limiter
+        self._lease_id = lease_id
+        self._lock = threading.Lock()
+        self._acquired_at: Optional[float] = acquired_at
+        # 本次尝试失败后使用的重试策略（按选中服务商的配置，由调用方设置）
+        self.retry_policy: Optional[RetryPolicy] = None
+
+    def _take(self) -> Optional[float]:
+        """取走名额（只能取一次）"""
+        with self._lock:
+            acquired_at, self._acquired_at = self._acquired_at, None
+        return acquired_at
+
+    def _release_lease(self):
+        if self._lease_id:
+            self.lease_limiter.release(self._lease_id)
+
+    def _take_for_run(self, kwargs: dict) -> float:
+        """run / arun 取走名额，已取得速率令牌时给 fn 传 rate_token_acquired=True"""
+        acquired_at = self._take()
+        if acquired_at is None:
+            raise RuntimeError(f"服务商 {self.member.name} 的准入名额已使用")
+        if self.rate_token:
+            kwargs['rate_token_acquired'] = True
+        return acquired_at
+
+    def run(self, fn: Callable, *args, **kwargs) -> Any:
+        """
+        在已占用的名额和租约内执行 fn（只能执行一次），结束后释放名额和租约，并按结果调整并发上限
+
+        已取得速率令牌时给 fn 传 rate_token_acquired=True
+        """
+        acquired_at = self._take_for_run(kwargs)
+        try:
+            return self.limiter.run(acquired_at, fn, *args, **kwargs)
+        finally:
+            self._release_lease()
+
+    async def arun(self, fn: Callable[..., Awaitable], *args, **kwargs) -> Any:
+        """run 的异步版本（异步生成引擎使用）：fn 为协程函数，租约在线程池中释放"""
+        acquired_at = self._take_for_run(kwargs)
+        try:
+            return await self.limiter.arun(acquired_at, fn, *args, **kwargs)
+        finally:
+            if self._lease_id:
+                await asyncio.shield(asyncio.to_thread(self._release_lease))
+
+    def hedge(self, fn: Callable, *args, cancel_event: Optional[threading.Event] = None, **kwargs) -> Any:
+        """
+        对冲请求：在对冲线程中依次等待速率令牌、新的并发名额和租约执行 fn（不使用准入时的名额和租约）
+
+        顺序同 try_admit：先占进程内名额再申请租约，等待名额期间不占用其他进程可用的租约。
+        主请求先成功（cancel_event 置位）时停止等待，归还已取得的令牌、名额和租约并抛出 RequestCancelled
+        """
+        bucket = self.member.generator.rate_limiter
+        bucket.acquire(cancel_event)
+        acquired_at = None
+        lease_id = ""
+        try:
+            acquired_at = self.limiter.acquire(cancel_event)
+            if self.lease_limiter is not None:
+                lease_id = self.lease_limiter.acquire(cancel_event)
+            if cancel_event is not None and cancel_event.is_set():
+                raise RequestCancelled()
+        except BaseException:
+            if lease_id:
+                self.lease_limiter.release(lease_id)
+            if acquired_at is not None:
+                self.limiter.release(acquired_at, "cancelled")
+            bucket.refund()
+            raise
+        try:
+            return self.limiter.run(
+                acquired_at, fn, *args, cancel_event=cancel_event, rate_token_acquired=True, **kwargs
+            )
+        finally:
+            if lease_id:
+                self.lease_limiter.release(lease_id)
+
+    async def ahedge(self, fn: Callable[..., Awaitable], *args, **kwargs) -> Any:
+        """
+        hedge 的异步版本：在事件循环中依次等待速率令牌、新的并发名额和租约执行 fn（协程函数）
+
+        主请求先成功时对冲协程被撤销，归还已取得的令牌、名额和租约
+        """
+        bucket = self.member.generator.rate_limiter
+        await bucket.aacquire()
+        acquired_at = None
+        try:
+            acquired_at = await self.limiter.aacquire()
+            lease_id = await self.lease_limiter.aacquire() if self.lease_limiter is not None else ""
+        except BaseException:
+            if acquired_at is not None:
+                self.limiter.release(acquired_at, "cancelled")
+            bucket.refund()
+            raise
+        try:
+            return await self.limiter.arun(acquired_at, fn, *args, rate_token_acquired=True, **kwargs)
+        finally:
+            if lease_id:
+                await asyncio.shield(asyncio.to_thread(self.lease_limiter.release, lease_id))
+
+    def release(self):
+        """释放没有使用的令牌、名额和租约（已执行过 run 时不做任何事）"""
+        acquired_at = self._take()
+        if acquired_at is not None:
+            if self.rate_token:
+                self.member.generator.rate_limiter.refund()
+            self.limiter.release(acquired_at, "cancelled")
+            self._release_lease()
+
+
+class ProviderPool:
+    """按实时状态加权挑选服务商"""
+
+    def __init__(self, members: List[PoolMember]):
+        if not members:
+            raise ValueError("服务商池为空")
+        self.members = members
+        self._lock = threading.Lock()
+        self._picks: Dict[str, int] = {m.name: 0 for m in members}
+
+    @property
+    def primary(self) -> PoolMember:
+        """第一个服务商（单服务商模式下即唯一的服务商）"""
+        return self.members[0]
+
+    def _candidates(self, need_reference: bool) -> List[PoolMember]:
+        """可选的服务商（需要参考图时优先支持参考图的服务商）"""
+        if need_reference:
+            return [m for m in self.members if m.supports_reference] or self.members
+        return self.members
+
+    def _choose(self, candidates: List[PoolMember]) -> PoolMember:
+        """按实时状态加权随机挑选一个服务商"""
+        if len(candidates) == 1:
+            return candidates[0]
+
+        latencies = [
+            get_provider_limiter(m.name, m.config).stats()["latency_ms"] for m in candidates
+        ]
+        known = [latency for latency in latencies if latency]
+        best_latency = min(known) if known else None
+
+        scores = [m.score(best_latency) for m in candidates]
+        if sum(scores) > 0:
+            return random.choices(candidates, weights=scores)[0]
+        # 全部处于限流暂停或熔断：按基础权重挑选，请求会等待或直接失败后按重试策略退避
+        return random.choices(candidates, weights=[m.weight for m in candidates])[0]
+
+    def _count_pick(self, member: PoolMember):
+        with self._lock:
+            self._picks[member.name] += 1
+
+    def pick(self, need_reference: bool = False) -> PoolMember:
+        """
+        挑选一个服务商
+
+        Args:
+            need_reference: 是否需要传递参考图（有封面参考图时为 True）
+
+        Returns:
+            选中的服务商
+        """
+        member = self._choose(self._candidates(need_reference))
+        self._count_pick(member)
+        return member
+
+    def try_admit(self, need_reference: bool = False) -> Tuple[Optional[Admission], Optional[float]]:
+        """
+        挑选一个服务商并占用它的速率令牌、并发名额和跨进程租约（不阻塞）
+
+        先按 pick 的规则挑选；选中的服务商被限流暂停、没有令牌、名额或租约已满时，依次尝试其他候选服务商
+
+        Args:
+            need_reference: 是否需要传递参考图
+
+        Returns:
+            (准入结果, 等待秒数)：准入成功时等待秒数为 None；
+            都不可用时准入结果为 None，等待秒数为最早可能恢复的服务商还需等待的时间
+            （只是名额已满时为 None，名额释放时由监听回调唤醒）
+        """
+        candidates = self._candidates(need_reference)
+        first = self._choose(candidates)
+        wait = None
+        for member in [first] + [m for m in candidates if m is not first]:
+            bucket = member.generator.rate_limiter
+            # 先取令牌再占名额：没有令牌时不必占用、再归还名额
+            token_wait = bucket.try_acquire()
+            if token_wait is not None:
+                wait = token_wait if wait is None else min(wait, token_wait)
+                continue
+            limiter = get_provider_limiter(member.name, member.config)
+            acquired_at = limiter.try_acquire()
+            if acquired_at is None:
+                bucket.refund()
+                continue
+            # 进程内名额有空闲时才向共享后端申请租约，名额已满时不访问后端
+            lease_limiter = get_lease_limiter('image', member.name, member.config)
+            lease_id = lease_limiter.try_acquire() if lease_limiter is not None else ""
+            if lease_id is None:
+                # 其他进程占满了租约：回滚名额（不唤醒其他页面）和令牌，稍后轮询
+                limiter.cancel()
+                bucket.refund()
+                wait = POLL_INTERVAL if wait is None else min(wait, POLL_INTERVAL)
+                continue
+            self._count_pick(member)
+            return Admission(member, limiter, acquired_at, True, lease_limiter, lease_id), None
+        return None, wait
+
+    def admit(self, need_reference: bool = False) -> Admission:
+        """
+        挑选一个服务商，在当前线程中依次等待速率令牌、并发名额和跨进程租约（不经过调度器时使用）
+
+        顺序同 try_admit：先占进程内名额再申请租约，等待名额期间不占用其他进程可用的租约
+
+        Args:
+            need_reference: 是否需要传递参考图
+
+        Returns:
+            准入结果
+        """
+        member = self.pick(need_reference)
+        member.generator.rate_limiter.acquire()
+        limiter = get_provider_limiter(member.name, member.config)
+        acquired_at = limiter.acquire()
+        lease_limiter = get_lease_limiter('image', member.name, member.config)
+        try:
+            lease_id = lease_limiter.acquire() if lease_limiter is not None else ""
+        except BaseException:
+            limiter.release(acquired_at, "cancelled")
+            raise
+        return Admission(member, limiter, acquired_at, True, lease_limiter, lease_id)
+
+    def add_listener(self, callback: Callable[[], None]):
+        """注册回调：任一服务商释放并发名额时调用（如唤醒调度器中等待准入的页面）"""
+        for member in self.members:
+            get_provider_limiter(member.name, member.config).add_listener(callback)
+
+    def paused_for(self) -> float:
+        """所有服务商都被限流暂停或熔断时，最早恢复的剩余秒数；任一服务商可用时为 0"""
+        return min(m.unavailable_for() for m in self.members)
+
+    def stats(self) -> Dict[str, Any]:
+        """获取服务商池状态"""
+        with self._lock:
+            picks = dict(self._picks)
+        return {
+            m.name: {"type": m.type, "weight": m.weight, "picks": picks[m.name]}
+            for m in self.members
+        }
+
+
+def create_provider_pool(provider_name: Optional[str] = None) -> ProviderPool:
+    """
+    按配置创建服务商池
+
+    Args:
+        provider_name: 指定服务商名称时只使用该服务商；
+            为 None 时使用配置中启用的服务商池，未启用则使用激活的服务商
+
+    Returns:
+        ProviderPool
+    """
+    members = Config.get_image_provider_pool() if provider_name is None else {}
+    if not members:
+        provider_name = provider_name or Config.get_active_image_provider()
+        members = {provider_name: 1.0}
+
+    logger.info(f"使用图片服务商: {', '.join(f'{name}(权重 {w:g})' for name, w in members.items())}")
+    return ProviderPool([
+        PoolMember(name, Config.get_image_provider_config(name), weight)
+        for name, weight in members.items()
+    ])
@@ -0,0 +1,483 @@
+"""
+图片生成公平调度器
+
+所有任务共享一组工作线程（数量为各服务商并发上限之和），每个任务有自己的等待队列，
+工作线程空闲时按轮询顺序从各任务队列取任务，避免先提交的大任务长时间占满并发、
+饿死后提交的小任务
+
+调用失败且重试策略允许重试时，调用带着原来的 Future 回到任务队列，到点后再被取出，
+等待期间不占用工作线程
+
+调用可以依赖另一个 Future（如内容页依赖封面参考图），依赖完成前留在队列中，
+同一任务中排在后面、没有依赖的调用可以先执行
+
+提交时可以传入准入函数（admit）：工作线程取出调用后先不阻塞地申请资源（如服务商并发名额），
+申请不到时抛出 Deferred，调用回到队列，工作线程去执行其他任务的调用；资源释放时用
+wake_deferred 提前唤醒。工作线程因此不会停在某个服务商上等待名额
+
+函数返回协程时（异步生成引擎），协程交给事件循环执行，工作线程不等待它结束：
+轮询、准入和重试与普通调用相同，协程结束前一直占用任务的在途名额
+"""
+import asyncio
+import functools
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import CancelledError, Future
+from typing import Any, Callable, Deque, Dict, Optional
+from backend.config import Config
+from backend.services.async_engine import get_async_engine
+from backend.utils.retry_policy import RetryPolicy, classify_error
+
+logger = logging.getLogger(__name__)
+
+# 等待准入的调用没有被提前唤醒时，最长隔多久重新尝试
+DEFERRED_RECHECK_SECONDS = 1.0
+
+
+class Deferred(Exception):
+    """准入函数抛出：调用暂时不能开始，放回队列稍后再试（不计入尝试次数）"""
+
+    def __init__(self, delay: float = DEFERRED_RECHECK_SECONDS, reason: str = ""):
+        """
+        Args:
+            delay: 最长等待多久后重新尝试（wake_deferred 会提前唤醒）
+            reason: 原因（用于日志）
+        """
+        super().__init__(reason or "等待资源")
+        self.delay = max(0.0, delay)
+
+
+class _Job:
+    """一个等待执行的调用"""
+
+    __slots__ = (
+        "fn", "args", "kwargs", "future", "on_start", "enqueued_at",
+        "retry_policy", "attempts", "started_at", "not_before", "after", "admit", "deferred"
+    )
+
+    def __init__(
+        self,
+        fn: Callable,
+        args: tuple,
+        kwargs: dict,
+        on_start: Optional[Callable],
+        retry_policy: Optional[RetryPolicy],
+        after: Optional[Future] = None,
+        admit: Optional[Callable[[], Any]] = None
+    ):
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.future: Future = Future()
+        self.on_start = on_start
+        self.enqueued_at = time.monotonic()
+        self.retry_policy = retry_policy
+        self.attempts = 0
+        # 第一次开始执行的时间（重试总时长从这里算起）
+        self.started_at: Optional[float] = None
+        # 等待重试时，最早可以再次执行的时间
+        self.not_before = 0.0
+        # 依赖的 Future，完成后才可以执行
+        self.after = after
+        # 准入函数：返回值作为 admission 关键字参数传给 fn，暂时不能开始时抛出 Deferred
+        self.admit = admit
+        # 是否在等待准入（wake_deferred 唤醒）
+        self.deferred = False
+
+    def ready(self, now: float) -> bool:
+        """当前是否可以执行"""
+        return self.not_before <= now and (self.after is None or self.after.done())
+
+
+class _TaskQueue:
+    """单个任务的等待队列和在途计数"""
+
+    __slots__ = ("jobs", "inflight", "max_inflight")
+
+    def __init__(self, max_inflight: int):
+        self.jobs: Deque[_Job] = deque()
+        self.inflight = 0
+        self.max_inflight = max_inflight
+
+
+class FairScheduler:
+    """
+    按任务轮询的公平调度器
+
+    - 同一任务内先进先出
+    - 不同任务之间轮询：每取出一个任务的调用，就把该任务排到队尾
+    - 每个任务可以限制自身的在途调用数（顺序模式为 1）
+    """
+
+    def __init__(self, workers: int):
+        """
+        初始化调度器
+
+        Args:
+            workers: 工作线程数
+        """
+        self._cond = threading.Condition()
+        self._tasks: "OrderedDict[str, _TaskQueue]" = OrderedDict()
+        self._target_workers = 0
+        self._alive_workers = 0
+        self._busy_workers = 0
+        # 交给异步生成引擎执行中的协程：submit 返回的 Future -> 引擎返回的 Future
+        self._handoffs: Dict[Future, Future] = {}
+
+        # 统计计数
+        self._started = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+        self._retries = 0
+        self._deferrals = 0
+
+        self.resize(workers)
+
+    def resize(self, workers: int):
+        """
+        调整工作线程数（配置变更时调用）
+
+        增加时立即启动新线程；减少时多余的线程在空闲后退出
+        """
+        workers = max(1, workers)
+        with self._cond:
+            if workers == self._target_workers:
+                return
+            logger.info(f"调度器工作线程数: {self._target_workers} -> {workers}")
+            self._target_workers = workers
+            while self._alive_workers < workers:
+                self._alive_workers += 1
+                threading.Thread(
+                    target=self._worker_loop,
+                    name=f"image-scheduler-{self._alive_workers}",
+                    daemon=True
+                ).start()
+            self._cond.notify_all()
+
+    def submit(
+        self,
+        task_key: str,
+        fn: Callable,
+        *args,
+        max_inflight: Optional[int] = None,
+        on_start: Optional[Callable[[Dict[str, Any]], None]] = None,
+        retry_policy: Optional[RetryPolicy] = None,
+        after: Optional[Future] = None,
+        admit: Optional[Callable[[], Any]] = None,
+        **kwargs
+    ) -> Future:
+        """
+        提交一个调用到指定任务的队列
+
+        Args:
+            task_key: 任务标识（通常为 task_id）
+            fn: 要执行的函数；可以是协程函数，协程在异步生成引擎中执行，不占用工作线程
+            *args, **kwargs: 函数参数
+            max_inflight: 该任务同时执行的调用数上限，None 表示不限制（仅受全局线程数约束）
+            on_start: 第一次开始执行前的回调，参数为 {"wait_ms": 排队耗时, "queue_depth": 该任务剩余排队数}
+            retry_policy: 重试策略；失败且允许重试时，调用在退避结束后重新排队，等待期间不占用工作线程
+            after: 依赖的 Future；完成（无论成功与否）之前调用留在队列中，不占用工作线程
+            admit: 准入函数，每次尝试前在工作线程中调用，不应阻塞；返回值作为 admission
+                关键字参数传给 fn（fn 负责释放），暂时不能开始时抛出 Deferred；
+                返回值带 retry_policy 属性时，本次尝试失败后改用该策略
+
+        Returns:
+            Future；使用 cancel() 撤销尚未开始或正在等待重试的调用（协程执行中时撤销协程）
+        """
+        job = _Job(fn, args, kwargs, on_start, retry_policy, after, admit)
+        with self._cond:
+            task_queue = self._tasks.get(task_key)
+            if task_queue is None:
+                task_queue = _TaskQueue(max_inflight or self._target_workers)
+                self._tasks[task_key] = task_queue
+            elif max_inflight:
+                task_queue.max_inflight = max_inflight
+            task_queue.jobs.append(job)
+            self._cond.notify()
+        if after is not None:
+            after.add_done_callback(lambda _: self._wake())
+        return job.future
+
+    def _wake(self):
+        """依赖完成，唤醒工作线程重新挑选"""
+        with self._cond:
+            self._cond.notify_all()
+
+    def wake_deferred(self):
+        """资源释放（如服务商并发名额），让等待准入的调用立即重新尝试"""
+        with self._cond:
+            woken = False
+            for task_queue in self._tasks.values():
+                for job in task_queue.jobs:
+                    if job.deferred:
+                        job.deferred = False
+                        job.not_before = 0.0
+                        woken = True
+            if woken:
+                self._cond.notify_all()
+
+    def cancel(self, task_key: str, future: Future) -> bool:
+        """
+        撤销一个尚未开始、正在等待重试或在异步生成引擎中执行的调用
+
+        Args:
+            task_key: 提交时的任务标识
+            future: submit 返回的 Future
+
+        Returns:
+            是否撤销成功（已在工作线程中执行或已结束的调用无法撤销）
+        """
+        with self._cond:
+            handoff = self._handoffs.get(future)
+            task_queue = self._tasks.get(task_key)
+            if handoff is None and task_queue is None:
+                return False
+            if handoff is None:
+                for job in task_queue.jobs:
+                    if job.future is future:
+                        task_queue.jobs.remove(job)
+                        if not task_queue.jobs and task_queue.inflight == 0:
+                            del self._tasks[task_key]
+                        break
+                else:
+                    return False
+
+        if handoff is not None:
+            # 撤销协程，结束回调以 CancelledError 结束调用并释放在途名额
+            return handoff.cancel()
+
+        # 等待重试的调用已处于运行状态，无法 cancel()，以 CancelledError 结束
+        if not future.cancel():
+            future.set_exception(CancelledError())
+        return True
+
+    def queue_depth(self, task_key: str) -> int:
+        """获取任务当前排队中的调用数"""
+        with self._cond:
+            task_queue = self._tasks.get(task_key)
+            return len(task_queue.jobs) if task_queue else 0
+
+    def _next_job(self):
+        """
+        按轮询顺序取出下一个可执行的调用（调用方需持有锁）
+
+        Returns:
+            (picked, wake_at)：picked 为 (task_key, task_queue, job) 或 None；
+            没有可执行调用但有调用在等待重试时，wake_at 为最早可执行的时间
+        """
+        now = time.monotonic()
+        wake_at = None
+        for task_key, task_queue in self._tasks.items():
+            if task_queue.inflight >= task_queue.max_inflight:
+                continue
+            for job in task_queue.jobs:
+                if not job.ready(now):
+                    if job.not_before > now:
+                        wake_at = job.not_before if wake_at is None else min(wake_at, job.not_before)
+                    continue
+                task_queue.jobs.remove(job)
+                task_queue.inflight += 1
+                # 该任务本轮已被服务，排到队尾
+                self._tasks.move_to_end(task_key)
+                return (task_key, task_queue, job), None
+        return None, wake_at
+
+    def _release(self, task_key: str, task_queue: _TaskQueue):
+        """调用结束，释放任务的在途名额（调用方需持有锁）"""
+        task_queue.inflight -= 1
+        if not task_queue.jobs and task_queue.inflight == 0 and self._tasks.get(task_key) is task_queue:
+            del self._tasks[task_key]
+        self._cond.notify_all()
+
+    def _failed(self, job: _Job, error: Exception) -> Optional[float]:
+        """
+        一次尝试失败：按重试策略返回退避秒数，不再重试时以该异常结束调用并返回 None
+        """
+        retry_delay = None
+        if job.retry_policy:
+            retry_delay = job.retry_policy.next_delay(job.attempts, error, job.started_at)
+        if retry_delay is None:
+            job.future.set_exception(error)
+        else:
+            logger.warning(
+                f"⏳ 调用失败（{classify_error(error)}），{retry_delay:.1f}秒后重试 "
+                f"(尝试 {job.attempts + 1}/{job.retry_policy.max_attempts}): {str(error)[:100]}"
+            )
+        return retry_delay
+
+    def _settle(
+        self,
+        task_key: str,
+        task_queue: _TaskQueue,
+        job: _Job,
+        retry_delay: Optional[float] = None,
+        deferred: Optional[Deferred] = None
+    ):
+        """一次尝试结束：需要重试或等待准入时放回队首，释放任务的在途名额（调用方需持有锁）"""
+        if retry_delay is not None:
+            # 放回队首等待重试，释放工作线程和任务的在途名额
+            job.not_before = time.monotonic() + retry_delay
+            task_queue.jobs.appendleft(job)
+            self._retries += 1
+        elif deferred is not None:
+            # 放回队首等待准入，工作线程去执行其他调用
+            job.not_before = time.monotonic() + deferred.delay
+            job.deferred = True
+            task_queue.jobs.appendleft(job)
+            self._deferrals += 1
+        self._release(task_key, task_queue)
+
+    def _finish_handoff(self, task_key: str, task_queue: _TaskQueue, job: _Job, handoff: Future):
+        """异步生成引擎中的协程结束：记录结果或按重试策略放回队列，释放任务的在途名额"""
+        retry_delay = None
+        with self._cond:
+            self._handoffs.pop(job.future, None)
+        if handoff.cancelled():
+            # 调用已处于运行状态，无法 cancel()，以 CancelledError 结束
+            job.future.set_exception(CancelledError())
+        else:
+            error = handoff.exception()
+            if error is None:
+                job.future.set_result(handoff.result())
+            elif isinstance(error, Exception):
+                retry_delay = self._failed(job, error)
+            else:
+                job.future.set_exception(error)
+        with self._cond:
+            self._settle(task_key, task_queue, job, retry_delay)
+
+    def _worker_loop(self):
+        """工作线程：循环取出并执行调用"""
+        while True:
+            with self._cond:
+                while True:
+                    if self._alive_workers > self._target_workers:
+                        self._alive_workers -= 1
+                        return
+                    picked, wake_at = self._next_job()
+                    if picked is not None:
+                        break
+                    self._cond.wait(None if wake_at is None else max(0.0, wake_at - time.monotonic()))
+                task_key, task_queue, job = picked
+                queue_depth = len(task_queue.jobs)
+                self._busy_workers += 1
+
+            retry_delay = None
+            deferred = None
+            handed_off = False
+            try:
+                if job.started_at is None and not job.future.running():
+                    if not job.future.set_running_or_notify_cancel():
+                        continue
+
+                kwargs = job.kwargs
+                if job.admit is not None:
+                    try:
+                        admission = job.admit()
+                    except Deferred as e:
+                        deferred = e
+                        continue
+                    except Exception as e:
+                        job.future.set_exception(e)
+                        continue
+                    kwargs = dict(kwargs, admission=admission)
+                    # 准入结果带重试策略时（如按选中服务商的配置），本次尝试失败后按它判断是否重试
+                    policy = getattr(admission, "retry_policy", None)
+                    if policy is not None:
+                        job.retry_policy = policy
+
+                if job.started_at is None:
+                    job.started_at = time.monotonic()
+                    wait = job.started_at - job.enqueued_at
+                    with self._cond:
+                        self._started += 1
+                        self._total_wait += wait
+                        self._max_wait = max(self._max_wait, wait)
+
+                    if job.on_start:
+                        try:
+                            job.on_start({"wait_ms": int(wait * 1000), "queue_depth": queue_depth})
+                        except Exception as e:
+                            logger.warning(f"调度器 on_start 回调异常: {e}")
+
+                job.attempts += 1
+                try:
+                    result = job.fn(*job.args, **kwargs)
+                    if asyncio.iscoroutine(result):
+                        # 协程交给异步生成引擎执行，工作线程不等待；结束回调记录结果并释放在途名额
+                        handoff = get_async_engine().submit(result)
+                        with self._cond:
+                            self._handoffs[job.future] = handoff
+                        handed_off = True
+                        handoff.add_done_callback(
+                            functools.partial(self._finish_handoff, task_key, task_queue, job)
+                        )
+                        continue
+                except Exception as e:
+                    retry_delay = self._failed(job, e)
+                except BaseException as e:
+                    job.future.set_exception(e)
+                else:
+                    job.future.set_result(result)
+            finally:
+                with self._cond:
+                    self._busy_workers -= 1
+                    if not handed_off:
+                        self._settle(task_key, task_queue, job, retry_delay, deferred)
+
+    def stats(self) -> Dict[str, Any]:
+        """获取调度器统计信息"""
+        with self._cond:
+            started = self._started
+            return {
+                "workers": self._target_workers,
+                "busy": self._busy_workers,
+                "async_running": len(self._handoffs),
+                "active_tasks": len(self._tasks),
+                "queued": sum(len(q.jobs) for q in self._tasks.values()),
+                "waiting_retry": sum(
+                    1 for q in self._tasks.values() for job in q.jobs if job.attempts and not job.deferred
+                ),
+                "waiting_admission": sum(
+                    1 for q in self._tasks.values() for job in q.jobs if job.deferred
+                ),
+                "waiting_dependency": sum(
+                    1 for q in self._tasks.values() for job in q.jobs
+                    if job.after is not None and not job.after.done()
+                ),
+                "tasks": {
+                    key: {"queued": len(q.jobs), "running": q.inflight}
+                    for key, q in self._tasks.items()
+                },
+                "started": started,
+                "avg_wait_ms": int(self._total_wait / started * 1000) if started else 0,
+                "max_wait_ms": int(self._max_wait * 1000),
+                "retries": self._retries,
+                "deferrals": self._deferrals,
+            }
+
+
+# 全局调度器实例
+_scheduler_instance = None
+_scheduler_lock = threading.Lock()
+# 计算工作线程数时使用的服务商配置（配置更新后 Config 换成新的配置对象，此时重新计算）
+_scheduler_config = None
+
+
+def get_scheduler() -> FairScheduler:
+    """获取全局调度器（工作线程数跟随服务商并发上限配置，只在配置更新后重新计算）"""
+    global _scheduler_instance, _scheduler_config
+    config = Config.load_image_providers_config()
+    if _scheduler_instance is not None and config is _scheduler_config:
+        return _scheduler_instance
+    with _scheduler_lock:
+        if _scheduler_instance is None or config is not _scheduler_config:
+            workers = Config.get_image_scheduler_workers()
+            if _scheduler_instance is None:
+                _scheduler_instance = FairScheduler(workers)
+            else:
+                _scheduler_instance.resize(workers)
+            _scheduler_config = config
+    return _scheduler_instance
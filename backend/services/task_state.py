@@ -0,0 +1,431 @@
+"""
+任务状态存储
+
+保存每个图片任务重试所需的上下文：页面、大纲、已生成/失败的页面、封面参考图和用户上传的参考图。
+
+- 内存中只缓存最近使用的任务，按空闲时长（TASK_STATE_TTL_MINUTES）、任务数（TASK_STATE_MAX_TASKS）
+  和内存预算（TASK_STATE_MAX_MB）淘汰最久未使用的任务
+- 每次修改写入任务目录下的 .state/manifest.json：在存储锁内取快照，锁外写文件（其他任务的读写不等待磁盘），
+  同一任务连续修改时只写最新的快照；用户上传的参考图写入 .state 目录，清单中只记录文件名。
+  被淘汰或进程重启后，下次访问时从清单重新加载
+- 封面参考图不写入清单，需要时从已生成的封面文件压缩得到
+"""
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+from backend.config import Config
+from backend.utils.image_pool import write_file_atomic
+from backend.utils.paths import is_single_path_segment
+from backend.utils.reference_asset import ReferenceAsset
+
+logger = logging.getLogger(__name__)
+
+STATE_DIRNAME = ".state"
+MANIFEST_NAME = "manifest.json"
+MANIFEST_VERSION = 1
+# 没有记录封面文件时（旧任务）使用的封面文件名
+DEFAULT_COVER_FILE = "0.png"
+
+_EXTENSIONS = {"image/png": ".png", "image/jpeg": ".jpg", "image/webp": ".webp", "image/gif": ".gif"}
+
+
+class _Entry:
+    """内存中的一个任务状态"""
+
+    __slots__ = ("state", "size", "last_access")
+
+    def __init__(self, state: Dict[str, Any]):
+        self.state = state
+        self.size = 0
+        self.last_access = time.monotonic()
+
+
+class TaskStateStore:
+    """有界、可持久化的任务状态存储"""
+
+    def __init__(self, history_root: str, max_tasks: int, max_bytes: int, ttl_seconds: float):
+        """
+        Args:
+            history_root: history 根目录（各任务目录所在位置）
+            max_tasks: 内存中最多缓存的任务数
+            max_bytes: 内存中任务状态（主要是参考图）的总预算（字节）
+            ttl_seconds: 任务空闲超过该时长后从内存中淘汰
+        """
+        self.history_root = history_root
+        self.max_tasks = max_tasks
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.RLock()
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._bytes = 0
+        # 等待写入的清单快照（每个任务只保留最新的一份）和正在写入清单的任务
+        self._manifest_lock = threading.Lock()
+        self._pending_manifests: Dict[str, Dict[str, Any]] = {}
+        self._writing_manifests: set = set()
+
+        # 统计计数
+        self.loads = 0
+        self.evictions = 0
+
+    # ==================== 读取 ====================
+
+    def get(self, task_id: str) -> Optional[Dict[str, Any]]:
+        """
+        获取任务状态的快照
+
+        Returns:
+            {pages, generated, failed, full_outline, user_topic, user_images, cover_image, has_cover}；
+            任务不存在时返回 None
+        """
+        with self._lock:
+            entry = self._entry(task_id)
+            if entry is None:
+                return None
+            state = entry.state
+            return {
+                **state,
+                "generated": dict(state["generated"]),
+                "failed": dict(state["failed"]),
+                "has_cover": state["cover_image"] is not None or self._cover_path(task_id, state) is not None,
+            }
+
+    def get_cover(self, task_id: str) -> Optional[ReferenceAsset]:
+        """
+        获取封面参考图（压缩后）
+
+        内存中没有时从已生成的封面文件加载，任务状态不存在时尝试默认封面文件 0.png
+
+        Returns:
+            封面参考图；尚未生成封面时返回 None
+        """
+        with self._lock:
+            entry = self._entry(task_id)
+            if entry is not None and entry.state["cover_image"] is not None:
+                return entry.state["cover_image"]
+            cover_path = self._cover_path(task_id, entry.state if entry else None)
+
+        if cover_path is None:
+            return None
+        with open(cover_path, "rb") as f:
+            cover = ReferenceAsset(f.read()).compact()
+
+        with self._lock:
+            entry = self._entries.get(task_id)
+            if entry is not None and entry.state["cover_image"] is None:
+                entry.state["cover_image"] = cover
+                self._resize(entry)
+                self._evict()
+        return cover
+
+    # ==================== 修改 ====================
+
+    def create(
+        self,
+        task_id: str,
+        pages: List[Dict],
+        full_outline: str = "",
+        user_images: Optional[List[ReferenceAsset]] = None,
+        user_topic: str = ""
+    ):
+        """
+        创建（或覆盖）任务状态，用户上传的参考图写入任务目录
+
+        Args:
+            task_id: 任务 ID
+            pages: 页面列表
+            full_outline: 完整大纲文本
+            user_images: 用户上传的参考图
+            user_topic: 用户原始输入
+        """
+        state = {
+            "pages": pages,
+            "generated": {},
+            "failed": {},
+            "full_outline": full_outline,
+            "user_topic": user_topic,
+            "user_images": user_images,
+            "user_image_files": self._save_user_images(task_id, user_images),
+            "cover_file": None,
+            "cover_image": None,
+        }
+        with self._lock:
+            self._drop(task_id)
+            entry = _Entry(state)
+            self._entries[task_id] = entry
+            self._resize(entry)
+            self._save(task_id, state)
+            self._evict()
+        self._flush(task_id)
+
+    def update(self, task_id: str, **fields):
+        """更新任务的页面列表或大纲（pages / full_outline / user_topic）"""
+        with self._lock:
+            entry = self._entry(task_id)
+            if entry is None:
+                return
+            entry.state.update(fields)
+            self._resize(entry)
+            self._save(task_id, entry.state)
+        self._flush(task_id)
+
+    def mark_generated(self, task_id: str, index: int, filename: str, cover: Optional[ReferenceAsset] = None):
+        """
+        记录页面生成成功
+
+        Args:
+            task_id: 任务 ID
+            index: 页码
+            filename: 图片文件名
+            cover: 该页是封面时传入封面参考图
+        """
+        with self._lock:
+            entry = self._entry(task_id)
+            if entry is None:
+                return
+            state = entry.state
+            state["generated"][index] = filename
+            state["failed"].pop(index, None)
+            if cover is not None:
+                state["cover_file"] = filename
+                state["cover_image"] = cover
+            elif filename == self._cover_file(state):
+                # 封面被重新生成，丢弃缓存的旧封面参考图，下次从文件重新加载
+                state["cover_image"] = None
+            self._resize(entry)
+            self._save(task_id, state)
+            self._evict()
+        self._flush(task_id)
+
+    def mark_failed(self, task_id: str, index: int, error: str):
+        """记录页面生成失败"""
+        with self._lock:
+            entry = self._entry(task_id)
+            if entry is None:
+                return
+            entry.state["failed"][index] = error
+            self._save(task_id, entry.state)
+        self._flush(task_id)
+
+    def discard(self, task_id: str):
+        """从内存中移除任务状态（清单保留，下次访问时重新加载）"""
+        with self._lock:
+            self._drop(task_id)
+
+    # ==================== 内部实现（调用方需持有锁） ====================
+
+    def _entry(self, task_id: str) -> Optional[_Entry]:
+        """获取内存中的任务状态，不在内存中时从清单加载"""
+        entry = self._entries.get(task_id)
+        if entry is None:
+            state = self._load(task_id)
+            if state is None:
+                return None
+            entry = _Entry(state)
+            self._entries[task_id] = entry
+            self._resize(entry)
+            self.loads += 1
+        entry.last_access = time.monotonic()
+        self._entries.move_to_end(task_id)
+        self._evict()
+        return entry
+
+    def _resize(self, entry: _Entry):
+        """重新估算任务状态占用的内存"""
+        state = entry.state
+        size = len(state["full_outline"]) * 3 + sum(len(p.get("content", "")) * 3 for p in state["pages"])
+        for asset in (state["user_images"] or []) + [state["cover_image"]]:
+            if asset is not None:
+                size += asset.nbytes
+        self._bytes += size - entry.size
+        entry.size = size
+
+    def _drop(self, task_id: str):
+        entry = self._entries.pop(task_id, None)
+        if entry is not None:
+            self._bytes -= entry.size
+
+    def _evict(self):
+        """淘汰空闲超时的任务，再按最久未使用淘汰到任务数和内存预算以内"""
+        now = time.monotonic()
+        while self._entries:
+            task_id, entry = next(iter(self._entries.items()))
+            expired = now - entry.last_access > self.ttl_seconds
+            # 至少保留最近使用的一个任务
+            over_budget = len(self._entries) > 1 and (
+                len(self._entries) > self.max_tasks or self._bytes > self.max_bytes
+            )
+            if not (expired or over_budget):
+                break
+            self._drop(task_id)
+            self.evictions += 1
+            logger.debug(f"任务状态移出内存: {task_id} ({entry.size // 1024}KB)")
+
+    def _state_dir(self, task_id: str) -> str:
+        return os.path.join(self.history_root, task_id, STATE_DIRNAME)
+
+    def _cover_file(self, state: Optional[Dict[str, Any]]) -> str:
+        return (state or {}).get("cover_file") or DEFAULT_COVER_FILE
+
+    def _cover_path(self, task_id: str, state: Optional[Dict[str, Any]]) -> Optional[str]:
+        if not is_single_path_segment(task_id):
+            return None
+        path = os.path.join(self.history_root, task_id, self._cover_file(state))
+        return path if os.path.exists(path) else None
+
+    def _save_user_images(self, task_id: str, user_images: Optional[List[ReferenceAsset]]) -> List[str]:
+        """用户上传的参考图写入任务目录，返回文件名列表"""
+        if not user_images:
+            return []
+        state_dir = self._state_dir(task_id)
+        os.makedirs(state_dir, exist_ok=True)
+        filenames = []
+        for i, asset in enumerate(user_images):
+            filename = f"user_{i}{_EXTENSIONS.get(asset.mime, '.bin')}"
+            write_file_atomic(os.path.join(state_dir, filename), asset.raw)
+            filenames.append(filename)
+        return filenames
+
+    def _save(self, task_id: str, state: Dict[str, Any]):
+        """
+        取清单快照，由 _flush 在锁外写入
+
+        在存储锁内放入待写队列，快照入队的顺序与修改顺序一致，不会用旧快照覆盖新快照
+        """
+        manifest = {
+            "version": MANIFEST_VERSION,
+            "task_id": task_id,
+            "pages": list(state["pages"]),
+            "generated": dict(state["generated"]),
+            "failed": dict(state["failed"]),
+            "full_outline": state["full_outline"],
+            "user_topic": state["user_topic"],
+            "user_images": list(state["user_image_files"]),
+            "cover_file": state["cover_file"],
+            "updated_at": time.time(),
+        }
+        with self._manifest_lock:
+            self._pending_manifests[task_id] = manifest
+
+    def _load(self, task_id: str) -> Optional[Dict[str, Any]]:
+        """从清单加载任务状态"""
+        if not is_single_path_segment(task_id):
+            return None
+        state_dir = self._state_dir(task_id)
+        with self._manifest_lock:
+            # 清单还没有写入磁盘时（如刚修改就被淘汰）使用待写入的快照
+            manifest = self._pending_manifests.get(task_id)
+        try:
+            if manifest is None:
+                with open(os.path.join(state_dir, MANIFEST_NAME), "r", encoding="utf-8") as f:
+                    manifest = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning(f"读取任务状态清单失败: {task_id}: {e}")
+            return None
+
+        user_images = []
+        for filename in manifest.get("user_images", []):
+            try:
+                with open(os.path.join(state_dir, filename), "rb") as f:
+                    user_images.append(ReferenceAsset(f.read()))
+            except OSError as e:
+                logger.warning(f"读取用户参考图失败: {task_id}/{filename}: {e}")
+
+        logger.debug(f"从清单加载任务状态: {task_id}")
+        return {
+            "pages": manifest.get("pages", []),
+            "generated": {int(k): v for k, v in manifest.get("generated", {}).items()},
+            "failed": {int(k): v for k, v in manifest.get("failed", {}).items()},
+            "full_outline": manifest.get("full_outline", ""),
+            "user_topic": manifest.get("user_topic", ""),
+            "user_images": user_images or None,
+            "user_image_files": manifest.get("user_images", []),
+            "cover_file": manifest.get("cover_file"),
+            "cover_image": None,
+        }
+
+    # ==================== 清单写入（不持有存储锁） ====================
+
+    def _flush(self, task_id: str):
+        """
+        写入任务最新的清单快照
+
+        同一任务已有线程在写入时直接返回，由该线程接着写入最新的快照
+        """
+        with self._manifest_lock:
+            if task_id in self._writing_manifests:
+                return
+            self._writing_manifests.add(task_id)
+        try:
+            while True:
+                with self._manifest_lock:
+                    manifest = self._pending_manifests.get(task_id)
+                    if manifest is None:
+                        self._writing_manifests.discard(task_id)
+                        return
+                self._write_manifest(task_id, manifest)
+                with self._manifest_lock:
+                    # 写入完成前快照仍留在队列中，_load 读到的不会是旧文件
+                    if self._pending_manifests.get(task_id) is manifest:
+                        del self._pending_manifests[task_id]
+        except BaseException:
+            with self._manifest_lock:
+                self._writing_manifests.discard(task_id)
+            raise
+
+    def _write_manifest(self, task_id: str, manifest: Dict[str, Any]):
+        """写入清单文件"""
+        state_dir = self._state_dir(task_id)
+        try:
+            os.makedirs(state_dir, exist_ok=True)
+            write_file_atomic(
+                os.path.join(state_dir, MANIFEST_NAME),
+                json.dumps(manifest, ensure_ascii=False).encode("utf-8")
+            )
+        except OSError as e:
+            logger.warning(f"写入任务状态清单失败: {task_id}: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        """获取任务状态存储统计"""
+        with self._lock:
+            return {
+                "tasks": len(self._entries),
+                "bytes": self._bytes,
+                "max_tasks": self.max_tasks,
+                "max_bytes": self.max_bytes,
+                "loads": self.loads,
+                "evictions": self.evictions,
+            }
+
+
+# 全局任务状态存储
+_store_instance: Optional[TaskStateStore] = None
+_store_lock = threading.Lock()
+
+
+def get_task_state_store() -> TaskStateStore:
+    """获取全局任务状态存储（ImageService 重建后任务状态仍然保留）"""
+    global _store_instance
+    if _store_instance is None:
+        with _store_lock:
+            if _store_instance is None:
+                history_root = os.path.join(
+                    os.path.dirname(os.path.dirname(os.path.dirname(__file__))),
+                    "history"
+                )
+                _store_instance = TaskStateStore(
+                    history_root,
+                    max_tasks=Config.TASK_STATE_MAX_TASKS,
+                    max_bytes=Config.TASK_STATE_MAX_MB * 1024 * 1024,
+                    ttl_seconds=Config.TASK_STATE_TTL_MINUTES * 60
+                )
+                logger.info(
+                    f"初始化任务状态存储: max={Config.TASK_STATE_MAX_MB}MB, "
+                    f"tasks={Config.TASK_STATE_MAX_TASKS}, ttl={Config.TASK_STATE_TTL_MINUTES}min"
+                )
+    return _store_instance
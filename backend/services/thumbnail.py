@@ -0,0 +1,189 @@
+"""缩略图服务（后台线程池生成，按需补齐）"""
+import logging
+import os
+import queue
+import threading
+from typing import Dict, Any, Optional
+from backend.config import Config
+from backend.utils.image_pool import get_image_pool
+from backend.utils.paths import is_single_path_segment
+from backend.utils.single_flight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+THUMBNAIL_PREFIX = "thumb_"
+
+
+def thumbnail_filename(filename: str) -> str:
+    """原图文件名对应的缩略图文件名"""
+    return f"{THUMBNAIL_PREFIX}{filename}"
+
+
+class ThumbnailService:
+    """
+    缩略图服务
+
+    生成路径只负责写原图并投递缩略图任务，由后台线程池异步生成；
+    图片接口发现缩略图缺失时按需生成。同一张图的生成通过 single-flight 合并，
+    后台任务和按需请求不会重复压缩。压缩本身交给图片处理进程池执行。
+    """
+
+    THUMBNAIL_SIZE_KB = 50  # 缩略图目标大小
+
+    def __init__(self, workers: int = 2, queue_size: int = 64):
+        """
+        初始化缩略图服务
+
+        Args:
+            workers: 后台工作线程数
+            queue_size: 待处理队列上限，队列满时丢弃任务（由按需生成兜底）
+        """
+        self.workers = workers
+        self._queue: "queue.Queue" = queue.Queue(maxsize=queue_size)
+        self._single_flight = SingleFlight()
+        self._threads = []
+        self._start_lock = threading.Lock()
+
+        # 统计计数
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            "queued": 0,
+            "dropped": 0,
+            "generated": 0,
+            "on_demand": 0,
+            "failed": 0,
+        }
+
+    def _incr(self, key: str):
+        with self._stats_lock:
+            self._stats[key] += 1
+
+    def _ensure_workers(self):
+        """懒启动后台工作线程"""
+        if self._threads:
+            return
+        with self._start_lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(
+                    target=self._worker_loop,
+                    name=f"thumbnail-worker-{i}",
+                    daemon=True
+                )
+                thread.start()
+                self._threads.append(thread)
+            logger.info(f"缩略图工作线程已启动: workers={self.workers}")
+
+    def _worker_loop(self):
+        """后台线程：逐个处理缩略图任务"""
+        while True:
+            task_dir, filename = self._queue.get()
+            try:
+                self.ensure_thumbnail(task_dir, filename)
+            except Exception as e:
+                logger.warning(f"后台生成缩略图失败: {filename}, {e}")
+            finally:
+                self._queue.task_done()
+
+    def submit(self, task_dir: str, filename: str) -> bool:
+        """
+        投递缩略图生成任务（不阻塞）
+
+        Args:
+            task_dir: 任务目录
+            filename: 原图文件名
+
+        Returns:
+            是否成功入队；队列已满时返回 False，缩略图会在首次访问时按需生成
+        """
+        self._ensure_workers()
+        try:
+            self._queue.put_nowait((task_dir, filename))
+            self._incr("queued")
+            return True
+        except queue.Full:
+            self._incr("dropped")
+            logger.warning(f"缩略图队列已满，改为按需生成: {filename}")
+            return False
+
+    def invalidate(self, task_dir: str, filename: str):
+        """删除旧缩略图（原图即将被覆盖时调用）"""
+        thumb_path = os.path.join(task_dir, thumbnail_filename(filename))
+        try:
+            os.remove(thumb_path)
+        except FileNotFoundError:
+            pass
+
+    def ensure_thumbnail(self, task_dir: str, filename: str, on_demand: bool = False) -> Optional[str]:
+        """
+        确保缩略图存在且不早于原图，必要时生成
+
+        Args:
+            task_dir: 任务目录
+            filename: 原图文件名
+            on_demand: 是否由图片接口按需触发（仅用于统计）
+
+        Returns:
+            缩略图路径；原图不存在时返回 None
+
+        Raises:
+            ValueError: filename 不是单层文件名
+        """
+        if not is_single_path_segment(filename):
+            raise ValueError(f"无效的图片文件名: {filename}")
+        source_path = os.path.join(task_dir, filename)
+        thumb_path = os.path.join(task_dir, thumbnail_filename(filename))
+
+        def build() -> Optional[str]:
+            try:
+                source_mtime_ns = os.stat(source_path).st_mtime_ns
+            except FileNotFoundError:
+                return None
+            try:
+                if os.stat(thumb_path).st_mtime_ns >= source_mtime_ns:
+                    return thumb_path
+            except FileNotFoundError:
+                pass
+
+            try:
+                # 在图片处理进程池中读取、压缩并写入，只传递文件路径
+                get_image_pool().compress_file(source_path, thumb_path, self.THUMBNAIL_SIZE_KB)
+                # 缩略图的修改时间记为渲染前原图的修改时间：渲染期间原图被覆盖时，
+                # 新原图更晚，这次写入的旧缩略图会在下次访问时重新生成
+                os.utime(thumb_path, ns=(source_mtime_ns, source_mtime_ns))
+            except Exception:
+                self._incr("failed")
+                raise
+
+            self._incr("on_demand" if on_demand else "generated")
+            logger.debug(f"缩略图已生成: {thumb_path}")
+            return thumb_path
+
+        return self._single_flight.do(thumb_path, build)
+
+    def stats(self) -> Dict[str, Any]:
+        """获取缩略图服务统计信息"""
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats["workers"] = self.workers
+        stats["pending"] = self._queue.qsize()
+        return stats
+
+
+# 全局服务实例
+_service_instance = None
+_service_lock = threading.Lock()
+
+
+def get_thumbnail_service() -> ThumbnailService:
+    """获取全局缩略图服务实例"""
+    global _service_instance
+    if _service_instance is None:
+        with _service_lock:
+            if _service_instance is None:
+                _service_instance = ThumbnailService(
+                    workers=Config.THUMBNAIL_WORKERS,
+                    queue_size=Config.THUMBNAIL_QUEUE_SIZE
+                )
+    return _service_instance
@@ -0,0 +1,349 @@
+"""
+自适应并发限制（AIMD）
+
+每个服务商一个限制器：
+- 延迟和错误率正常时，每完成约一个窗口（当前上限个数）的成功请求，上限 +1
+- 遇到限流（429 / RESOURCE_EXHAUSTED）或超时，上限减半
+
+上限只是一个计数，调整时不会重建信号量，正在执行的请求不受影响。
+线程（acquire）和异步生成引擎中的协程（aacquire）共用同一个计数；
+图片生成调度器用 try_acquire 不阻塞地申请名额，申请不到时把调用放回队列，名额释放时由监听回调唤醒
+"""
+import asyncio
+import logging
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+from backend.config import Config
+from backend.utils.retry_policy import (
+    KIND_CANCELLED, KIND_RATE_LIMIT, KIND_TIMEOUT, RequestCancelled, classify_error
+)
+
+logger = logging.getLogger(__name__)
+
+# 延迟超过基线的该倍数视为不健康，不再加并发
+LATENCY_TOLERANCE = 2.0
+# 错误率（指数滑动平均）超过该值时不再加并发
+ERROR_RATE_THRESHOLD = 0.2
+# 指数滑动平均的平滑系数
+EWMA_ALPHA = 0.2
+# 带撤销信号等待名额时检查撤销的间隔（秒）
+CANCEL_CHECK_INTERVAL = 0.2
+
+
+def classify_outcome(error: Optional[BaseException]) -> str:
+    """
+    将一次调用的结果归类
+
+    Returns:
+        "success" / "overload"（限流或超时，需要降并发） / "cancelled"（主动撤销，不计入统计） / "error"（其他错误）
+    """
+    if error is None:
+        return "success"
+    kind = classify_error(error)
+    if kind == KIND_CANCELLED:
+        return "cancelled"
+    if kind in (KIND_RATE_LIMIT, KIND_TIMEOUT):
+        return "overload"
+    return "error"
+
+
+def _wake(waiter: "asyncio.Future"):
+    if not waiter.done():
+        waiter.set_result(None)
+
+
+class AdaptiveLimiter:
+    """按 AIMD 规则自动调整上限的并发限制器"""
+
+    def __init__(self, name: str, initial: int, min_limit: int = 1, max_limit: int = 15):
+        """
+        Args:
+            name: 限制器名称（服务商名）
+            initial: 初始并发上限
+            min_limit: 并发上限的下界
+            max_limit: 并发上限的上界
+        """
+        self.name = name
+        self._cond = threading.Condition()
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self.limit = min(max(initial, self.min_limit), self.max_limit)
+        self.inflight = 0
+        # 等待名额的协程：(事件循环, 唤醒用的 Future)
+        self._async_waiters: List[Tuple[asyncio.AbstractEventLoop, "asyncio.Future"]] = []
+        # 名额释放或上限变化时的回调（如唤醒调度器中等待准入的调用）
+        self._listeners: List[Callable[[], None]] = []
+
+        # 上一次降并发的时间：在此之前发出的请求再报告限流不会重复降并发
+        self._last_decrease = 0.0
+        self._successes_since_change = 0
+        self._latency_ewma: Optional[float] = None
+        self._latency_baseline: Optional[float] = None
+        self._error_rate = 0.0
+
+        # 统计计数
+        self.increases = 0
+        self.decreases = 0
+        self.overloads = 0
+
+    def configure(self, min_limit: int, max_limit: int):
+        """
+        在线调整上下界（配置变更时调用），当前上限被夹到新区间内
+
+        每次获取限制器都会调用，上下界没有变化时不唤醒等待方
+        """
+        with self._cond:
+            min_limit = max(1, min_limit)
+            max_limit = max(min_limit, max_limit)
+            if (min_limit, max_limit) == (self.min_limit, self.max_limit):
+                return
+            self.min_limit = min_limit
+            self.max_limit = max_limit
+            self.limit = min(max(self.limit, self.min_limit), self.max_limit)
+            self._notify_all()
+        self._notify_listeners()
+
+    def add_listener(self, callback: Callable[[], None]):
+        """注册名额释放或上限变化时的回调（在锁外调用，不应阻塞），同一回调只注册一次"""
+        with self._cond:
+            if callback not in self._listeners:
+                self._listeners.append(callback)
+
+    def _notify_listeners(self):
+        """通知监听方（调用方不得持有锁）"""
+        with self._cond:
+            listeners = list(self._listeners)
+        for callback in listeners:
+            try:
+                callback()
+            except Exception as e:
+                logger.warning(f"[{self.name}] 并发名额监听回调异常: {e}")
+
+    def acquire(self, cancel_event: Optional[threading.Event] = None) -> float:
+        """
+        等待并占用一个并发名额
+
+        Args:
+            cancel_event: 置位时停止等待并抛出 RequestCancelled（对冲请求中落败的一方）
+
+        Returns:
+            占用名额的时间戳（release 时传回）
+        """
+        with self._cond:
+            while self.inflight >= self.limit:
+                if cancel_event is None:
+                    self._cond.wait()
+                    continue
+                if cancel_event.is_set():
+                    raise RequestCancelled()
+                self._cond.wait(CANCEL_CHECK_INTERVAL)
+            self.inflight += 1
+            return time.monotonic()
+
+    def try_acquire(self) -> Optional[float]:
+        """
+        不等待地占用一个并发名额
+
+        Returns:
+            占用名额的时间戳（release 时传回）；没有空闲名额时返回 None
+        """
+        with self._cond:
+            if self.inflight >= self.limit:
+                return None
+            self.inflight += 1
+            return time.monotonic()
+
+    async def aacquire(self) -> float:
+        """
+        acquire 的异步版本：等待名额期间让出事件循环
+
+        Returns:
+            占用名额的时间戳（release 时传回）
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            with self._cond:
+                if self.inflight < self.limit:
+                    self.inflight += 1
+                    return time.monotonic()
+                waiter = loop.create_future()
+                entry = (loop, waiter)
+                self._async_waiters.append(entry)
+            try:
+                await waiter
+            finally:
+                with self._cond:
+                    if entry in self._async_waiters:
+                        self._async_waiters.remove(entry)
+
+    def _notify_all(self):
+        """唤醒所有等待名额的线程和协程（调用方需持有锁）"""
+        self._cond.notify_all()
+        waiters, self._async_waiters = self._async_waiters, []
+        for loop, waiter in waiters:
+            loop.call_soon_threadsafe(_wake, waiter)
+
+    def release(self, acquired_at: float, outcome: str):
+        """
+        释放名额并根据结果调整上限
+
+        Args:
+            acquired_at: acquire 返回的时间戳
+            outcome: classify_outcome 的结果
+        """
+        now = time.monotonic()
+        latency = now - acquired_at
+
+        with self._cond:
+            self.inflight -= 1
+            if outcome != "cancelled":
+                self._adjust(acquired_at, now, latency, outcome)
+            self._notify_all()
+        self._notify_listeners()
+
+    def cancel(self):
+        """
+        归还 try_acquire 占用但没有使用的名额（准入失败时回滚）
+
+        不通知监听方：回滚不代表有新的空闲名额，避免反复唤醒等待准入的调用
+        """
+        with self._cond:
+            self.inflight -= 1
+            self._notify_all()
+
+    def _adjust(self, acquired_at: float, now: float, latency: float, outcome: str):
+        """根据一次调用的结果调整上限（调用方需持有锁）"""
+        self._error_rate = (1 - EWMA_ALPHA) * self._error_rate + EWMA_ALPHA * (outcome != "success")
+
+        if outcome == "overload":
+            self.overloads += 1
+            # 同一批请求的多次限流只降一次
+            if acquired_at >= self._last_decrease:
+                self._decrease(now)
+        elif outcome == "success":
+            self._observe_latency(latency)
+            self._successes_since_change += 1
+            if self._successes_since_change >= self.limit and self._healthy():
+                self._increase()
+
+    def _observe_latency(self, latency: float):
+        """更新延迟滑动平均和基线（基线取见过的最低平均延迟，缓慢上浮以适应长期变化）"""
+        if self._latency_ewma is None:
+            self._latency_ewma = latency
+        else:
+            self._latency_ewma = (1 - EWMA_ALPHA) * self._latency_ewma + EWMA_ALPHA * latency
+
+        if self._latency_baseline is None or self._latency_ewma < self._latency_baseline:
+            self._latency_baseline = self._latency_ewma
+        else:
+            self._latency_baseline *= 1.01
+
+    def _healthy(self) -> bool:
+        """延迟和错误率是否允许继续加并发"""
+        if self._error_rate > ERROR_RATE_THRESHOLD:
+            return False
+        if self._latency_baseline and self._latency_ewma > self._latency_baseline * LATENCY_TOLERANCE:
+            return False
+        return True
+
+    def _increase(self):
+        self._successes_since_change = 0
+        if self.limit < self.max_limit:
+            self.limit += 1
+            self.increases += 1
+            logger.debug(f"[{self.name}] 并发上限 +1 -> {self.limit}")
+
+    def _decrease(self, now: float):
+        self._successes_since_change = 0
+        self._last_decrease = now
+        new_limit = max(self.min_limit, self.limit // 2)
+        if new_limit < self.limit:
+            logger.warning(f"[{self.name}] 遇到限流/超时，并发上限 {self.limit} -> {new_limit}")
+            self.limit = new_limit
+            self.decreases += 1
+
+    def call(self, fn: Callable, *args, **kwargs) -> Any:
+        """在一个并发名额内执行 fn，并用执行结果调整上限"""
+        return self.run(self.acquire(), fn, *args, **kwargs)
+
+    def run(self, acquired_at: float, fn: Callable, *args, **kwargs) -> Any:
+        """在已占用的名额（try_acquire / acquire 的返回值）内执行 fn，结束后释放名额并调整上限"""
+        error = None
+        try:
+            return fn(*args, **kwargs)
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            self.release(acquired_at, classify_outcome(error))
+
+    async def acall(self, fn: Callable[..., Awaitable], *args, **kwargs) -> Any:
+        """call 的异步版本：fn 为协程函数"""
+        return await self.arun(await self.aacquire(), fn, *args, **kwargs)
+
+    async def arun(self, acquired_at: float, fn: Callable[..., Awaitable], *args, **kwargs) -> Any:
+        """run 的异步版本：fn 为协程函数"""
+        error = None
+        try:
+            return await fn(*args, **kwargs)
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            self.release(acquired_at, classify_outcome(error))
+
+    def stats(self) -> Dict[str, Any]:
+        """获取限制器状态"""
+        with self._cond:
+            return {
+                "limit": self.limit,
+                "inflight": self.inflight,
+                "min": self.min_limit,
+                "max": self.max_limit,
+                "latency_ms": int(self._latency_ewma * 1000) if self._latency_ewma else None,
+                "error_rate": round(self._error_rate, 4),
+                "increases": self.increases,
+                "decreases": self.decreases,
+                "overloads": self.overloads,
+            }
+
+
+# 全局限制器（按服务商名）
+_limiters: Dict[str, AdaptiveLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_provider_limiter(provider_name: str, provider_config: Dict[str, Any]) -> AdaptiveLimiter:
+    """
+    获取服务商的并发限制器，不存在时按配置创建；已存在时同步最新的上下界
+
+    服务商配置项（均可选）：
+    - max_concurrent: 初始并发上限（默认全局 max_concurrent），健康时从这里向上探测
+    - max_concurrent_ceiling: 并发上限的上界（默认 max_concurrent 的 CONCURRENCY_CEILING_FACTOR 倍）
+    - min_concurrent: 并发上限的下界（默认 1）
+    - initial_concurrent: 初始并发上限（覆盖 max_concurrent 作为起始值）
+    """
+    max_concurrent, max_limit = Config.get_provider_concurrency(provider_config)
+    min_limit = int(provider_config.get('min_concurrent') or 1)
+
+    with _limiters_lock:
+        limiter = _limiters.get(provider_name)
+        if limiter is None:
+            initial = int(provider_config.get('initial_concurrent') or max_concurrent)
+            limiter = AdaptiveLimiter(provider_name, initial, min_limit, max_limit)
+            _limiters[provider_name] = limiter
+            logger.info(
+                f"初始化服务商并发限制器: {provider_name}, "
+                f"initial={limiter.limit}, range=[{limiter.min_limit}, {limiter.max_limit}]"
+            )
+        else:
+            limiter.configure(min_limit, max_limit)
+    return limiter
+
+
+def get_limiter_stats() -> Dict[str, Dict[str, Any]]:
+    """获取所有服务商限制器的状态"""
+    with _limiters_lock:
+        limiters = dict(_limiters)
+    return {name: limiter.stats() for name, limiter in limiters.items()}
@@ -0,0 +1,304 @@
+"""
+服务商熔断器
+
+每个服务商一个熔断器，由该服务商的所有调用方共享：
+- closed（闭合）：正常放行，统计最近一批调用的失败率
+- open（断开）：失败率超过阈值后断开，期间的调用直接失败（CircuitOpenError），不再占用线程和并发名额
+- half_open（半开）：断开一段时间后放行少量试探调用，成功则恢复闭合，失败则再次断开（断开时间加倍）
+
+内容相关的错误（安全过滤、参数错误）、本地代码错误和主动撤销不计入失败
+"""
+import logging
+import threading
+import time
+from collections import deque
+from functools import wraps
+from typing import Any, AsyncIterator, Awaitable, Callable, Deque, Dict, Iterator, Optional
+from .retry_policy import (
+    KIND_CANCELLED, KIND_CIRCUIT_OPEN, KIND_INTERNAL, KIND_INVALID, KIND_SAFETY, ProviderError, classify_error
+)
+
+logger = logging.getLogger(__name__)
+
+STATE_CLOSED = "closed"
+STATE_OPEN = "open"
+STATE_HALF_OPEN = "half_open"
+
+# 不代表服务商故障的错误类型
+_NEUTRAL_KINDS = (KIND_CANCELLED, KIND_CIRCUIT_OPEN, KIND_INTERNAL, KIND_INVALID, KIND_SAFETY)
+# 连续断开时断开时长的上限（秒）
+MAX_OPEN_SECONDS = 600
+
+
+class CircuitOpenError(ProviderError):
+    """熔断器处于断开状态，调用被直接拒绝"""
+
+    def __init__(self, name: str, retry_in: float):
+        super().__init__(
+            f"⛔ 服务商 [{name}] 已熔断：近期请求失败率过高，暂停调用 {retry_in:.0f} 秒后自动试探恢复\n\n"
+            "【解决方案】\n"
+            "1. 稍后再试\n"
+            "2. 检查服务商状态或网络连接\n"
+            "3. 在系统设置中切换到其他服务商",
+            kind=KIND_CIRCUIT_OPEN
+        )
+        self.circuit = name
+        self.retry_in = retry_in
+
+
+class CircuitBreaker:
+    """按失败率熔断的熔断器"""
+
+    def __init__(
+        self,
+        name: str,
+        failure_rate: float = 0.5,
+        window: int = 20,
+        min_calls: int = 5,
+        open_seconds: float = 30,
+        half_open_calls: int = 1
+    ):
+        """
+        Args:
+            name: 名称（"text:服务商名" / "image:服务商名"）
+            failure_rate: 触发熔断的失败率
+            window: 统计失败率的最近调用数
+            min_calls: 窗口内至少有这么多调用才判断失败率
+            open_seconds: 首次断开的时长（秒），连续断开时加倍
+            half_open_calls: 半开状态允许同时进行的试探调用数
+        """
+        self.name = name
+        self._lock = threading.Lock()
+        self._outcomes: Deque[bool] = deque(maxlen=window)
+        self.state = STATE_CLOSED
+        self._opened_at = 0.0
+        self._open_for = open_seconds
+        self._half_open_inflight = 0
+        self.configure(failure_rate, window, min_calls, open_seconds, half_open_calls)
+
+        # 统计计数
+        self.rejected = 0
+        self.opened = 0
+
+    def configure(
+        self,
+        failure_rate: float,
+        window: int,
+        min_calls: int,
+        open_seconds: float,
+        half_open_calls: int
+    ):
+        """在线调整熔断参数"""
+        with self._lock:
+            self.failure_rate = failure_rate
+            self.min_calls = max(1, min_calls)
+            self.open_seconds = open_seconds
+            self.half_open_calls = max(1, half_open_calls)
+            if self._outcomes.maxlen != window:
+                self._outcomes = deque(self._outcomes, maxlen=max(self.min_calls, window))
+            if self.state == STATE_CLOSED:
+                self._open_for = open_seconds
+
+    def _current_state(self, now: float) -> str:
+        """断开时间已到则转为半开（调用方需持有锁）"""
+        if self.state == STATE_OPEN and now - self._opened_at >= self._open_for:
+            self.state = STATE_HALF_OPEN
+            self._half_open_inflight = 0
+            logger.info(f"[{self.name}] 熔断器半开，开始试探调用")
+        return self.state
+
+    def retry_in(self) -> float:
+        """断开状态剩余的秒数（未断开时为 0）"""
+        with self._lock:
+            if self._current_state(time.monotonic()) != STATE_OPEN:
+                return 0.0
+            return max(0.0, self._opened_at + self._open_for - time.monotonic())
+
+    def is_open(self) -> bool:
+        """是否处于断开状态（半开视为未断开）"""
+        return self.retry_in() > 0
+
+    def before_call(self):
+        """调用前检查，断开或半开试探名额已满时抛出 CircuitOpenError"""
+        with self._lock:
+            now = time.monotonic()
+            state = self._current_state(now)
+            if state == STATE_CLOSED:
+                return
+            if state == STATE_HALF_OPEN and self._half_open_inflight < self.half_open_calls:
+                self._half_open_inflight += 1
+                return
+            self.rejected += 1
+            retry_in = max(1.0, self._opened_at + self._open_for - now)
+        raise CircuitOpenError(self.name, retry_in)
+
+    def record(self, error: Optional[BaseException]):
+        """
+        记录一次调用的结果
+
+        Args:
+            error: 调用抛出的异常，成功时为 None
+        """
+        if error is not None and classify_error(error) in _NEUTRAL_KINDS:
+            with self._lock:
+                if self.state == STATE_HALF_OPEN:
+                    self._half_open_inflight = max(0, self._half_open_inflight - 1)
+            return
+
+        success = error is None
+        with self._lock:
+            if self.state == STATE_HALF_OPEN:
+                self._half_open_inflight = max(0, self._half_open_inflight - 1)
+                if success:
+                    logger.info(f"[{self.name}] 试探调用成功，熔断器闭合")
+                    self.state = STATE_CLOSED
+                    self._outcomes.clear()
+                    self._open_for = self.open_seconds
+                else:
+                    self._open(time.monotonic(), min(MAX_OPEN_SECONDS, self._open_for * 2))
+                return
+
+            if self.state == STATE_OPEN:
+                # 断开前已经发出的调用，结果不再影响状态
+                return
+
+            self._outcomes.append(success)
+            failures = self._outcomes.count(False)
+            if len(self._outcomes) >= self.min_calls and failures / len(self._outcomes) >= self.failure_rate:
+                self._open(time.monotonic(), self.open_seconds)
+
+    def _open(self, now: float, open_for: float):
+        """断开熔断器（调用方需持有锁）"""
+        self.state = STATE_OPEN
+        self._opened_at = now
+        self._open_for = open_for
+        self.opened += 1
+        logger.warning(f"[{self.name}] 失败率过高，熔断 {open_for:.0f} 秒")
+
+    def call(self, fn: Callable, *args, **kwargs) -> Any:
+        """经过熔断器执行 fn"""
+        self.before_call()
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as e:
+            self.record(e)
+            raise
+        self.record(None)
+        return result
+
+    def guard_stream(self, stream: Iterator) -> Iterator:
+        """经过熔断器消费一个流式生成器（客户端中途断开不计入结果）"""
+        self.before_call()
+        try:
+            yield from stream
+        except GeneratorExit:
+            self.record(ProviderError("stream closed", kind=KIND_CANCELLED))
+            raise
+        except Exception as e:
+            self.record(e)
+            raise
+        self.record(None)
+
+    async def acall(self, fn: Callable[..., Awaitable], *args, **kwargs) -> Any:
+        """call 的异步版本：fn 为协程函数，协程被撤销不计入结果"""
+        self.before_call()
+        try:
+            result = await fn(*args, **kwargs)
+        except BaseException as e:
+            self.record(e)
+            raise
+        self.record(None)
+        return result
+
+    async def aguard_stream(self, stream: AsyncIterator) -> AsyncIterator:
+        """guard_stream 的异步版本"""
+        self.before_call()
+        try:
+            async for item in stream:
+                yield item
+        except GeneratorExit:
+            self.record(ProviderError("stream closed", kind=KIND_CANCELLED))
+            raise
+        except BaseException as e:
+            self.record(e)
+            raise
+        self.record(None)
+
+    def stats(self) -> Dict[str, Any]:
+        """获取熔断器状态"""
+        retry_in = self.retry_in()
+        with self._lock:
+            total = len(self._outcomes)
+            return {
+                "state": self.state,
+                "failure_rate": round(self._outcomes.count(False) / total, 2) if total else 0.0,
+                "window_calls": total,
+                "retry_in": round(retry_in, 1),
+                "opened": self.opened,
+                "rejected": self.rejected,
+            }
+
+
+def circuit_protected(method: Callable) -> Callable:
+    """方法装饰器：经过实例的 circuit_breaker 属性执行"""
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        return self.circuit_breaker.call(method, self, *args, **kwargs)
+    return wrapper
+
+
+def circuit_protected_stream(method: Callable) -> Callable:
+    """流式方法装饰器：经过实例的 circuit_breaker 属性消费返回的生成器"""
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        return self.circuit_breaker.guard_stream(method(self, *args, **kwargs))
+    return wrapper
+
+
+def circuit_protected_astream(method: Callable) -> Callable:
+    """异步流式方法装饰器：经过实例的 circuit_breaker 属性消费返回的异步生成器"""
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        return self.circuit_breaker.aguard_stream(method(self, *args, **kwargs))
+    return wrapper
+
+
+# 全局熔断器（按 "类别:服务商名"）
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def get_circuit_breaker(kind: str, provider_name: str, provider_config: Dict[str, Any]) -> CircuitBreaker:
+    """
+    获取服务商的熔断器，不存在时创建；已存在时同步最新配置
+
+    服务商配置项（均可选）：
+    - circuit_failure_rate: 触发熔断的失败率（默认 0.5）
+    - circuit_window: 统计失败率的最近调用数（默认 20）
+    - circuit_min_calls: 判断失败率所需的最少调用数（默认 5）
+    - circuit_open_seconds: 首次熔断时长，秒（默认 30）
+    """
+    key = f"{kind}:{provider_name}"
+    params = (
+        float(provider_config.get('circuit_failure_rate') or 0.5),
+        int(provider_config.get('circuit_window') or 20),
+        int(provider_config.get('circuit_min_calls') or 5),
+        float(provider_config.get('circuit_open_seconds') or 30),
+        1,
+    )
+
+    with _breakers_lock:
+        breaker = _breakers.get(key)
+        if breaker is None:
+            breaker = CircuitBreaker(key, *params)
+            _breakers[key] = breaker
+        else:
+            breaker.configure(*params)
+    return breaker
+
+
+def get_circuit_stats() -> Dict[str, Dict[str, Any]]:
+    """获取所有熔断器的状态"""
+    with _breakers_lock:
+        breakers = dict(_breakers)
+    return {key: breaker.stats() for key, breaker in breakers.items()}
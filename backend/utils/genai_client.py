@@ -1,10 +1,14 @@
 """Google GenAI 客户端封装"""
-import time
-import random
 import logging
-from functools import wraps
+from typing import Optional, Tuple
 from google import genai
 from google.genai import types
+from .reference_asset import ReferenceAsset
+from .rate_limiter import TokenBucket
+from .retry_policy import KIND_UNKNOWN, ProviderError, RetryPolicy, classify_error, retry_with_policy
+from .circuit_breaker import (
+    CircuitBreaker, circuit_protected, circuit_protected_astream, circuit_protected_stream
+)
 
 # 导入统一的错误解析函数
 from ..generators.google_genai import parse_genai_error
@@ -12,62 +16,17 @@ from ..generators.google_genai import parse_genai_error
 logger = logging.getLogger(__name__)
 
 
-def retry_on_429(max_retries=3, base_delay=2):
-    """429 错误自动重试装饰器（带智能错误解析）"""
-    def decorator(func):
-        @wraps(func)
-        def wrapper(*args, **kwargs):
-            last_error = None
-            for attempt in range(max_retries):
-                try:
-                    return func(*args, **kwargs)
-                except Exception as e:
-                    last_error = e
-                    error_str = str(e).lower()
-
-                    # 不可重试的错误类型
-                    non_retryable = [
-                        "401", "unauthenticated",  # 认证错误
-                        "403", "permission_denied", "forbidden",  # 权限错误
-                        "404", "not_found",  # 资源不存在
-                        "invalid_argument",  # 参数错误
-                        "safety", "blocked", "filter",  # 安全过滤
-                    ]
-
-                    should_retry = True
-                    for keyword in non_retryable:
-                        if keyword in error_str:
-                            should_retry = False
-                            break
-
-                    if not should_retry:
-                        # 直接抛出，不重试
-                        raise Exception(parse_genai_error(e))
-
-                    # 可重试的错误
-                    if attempt < max_retries - 1:
-                        if "429" in error_str or "resource_exhausted" in error_str:
-                            wait_time = (base_delay ** attempt) + random.uniform(0, 1)
-                            print(f"[重试] 遇到资源限制，{wait_time:.1f}秒后重试 (尝试 {attempt + 2}/{max_retries})")
-                        else:
-                            wait_time = min(2 ** attempt, 10) + random.uniform(0, 1)
-                            print(f"[重试] 请求失败，{wait_time:.1f}秒后重试 (尝试 {attempt + 2}/{max_retries})")
-                        time.sleep(wait_time)
-                        continue
-
-                    # 重试次数耗尽
-                    raise Exception(parse_genai_error(e))
-
-            # 理论上不会到这里，但保险起见
-            raise Exception(parse_genai_error(last_error))
-        return wrapper
-    return decorator
-
-
 class GenAIClient:
     """GenAI 客户端封装类（已弃用，请使用 GoogleGenAIGenerator）"""
 
-    def __init__(self, api_key: str = None, base_url: str = None):
+    def __init__(
+        self,
+        api_key: str = None,
+        base_url: str = None,
+        rate_limiter: TokenBucket = None,
+        retry_policy: RetryPolicy = None,
+        circuit_breaker: CircuitBreaker = None
+    ):
         self.api_key = api_key
         if not self.api_key:
             raise ValueError(
@@ -91,6 +50,13 @@ class GenAIClient:
 
         self.client = genai.Client(**client_kwargs)
 
+        # 请求速率限制（同一服务商的所有客户端共享一个令牌桶）
+        self.rate_limiter = rate_limiter or TokenBucket("genai")
+        # 非流式请求的重试策略
+        self.retry_policy = retry_policy or RetryPolicy()
+        # 熔断器（同一服务商共享）
+        self.circuit_breaker = circuit_breaker or CircuitBreaker("genai")
+
         # 默认安全设置：全部关闭
         self.default_safety_settings = [
             types.SafetySetting(category="HARM_CATEGORY_HATE_SPEECH", threshold="OFF"),
@@ -99,6 +65,7 @@ class GenAIClient:
             types.SafetySetting(category="HARM_CATEGORY_HARASSMENT", threshold="OFF"),
         ]
 
+    @circuit_protected_stream
     def generate_text_stream(
         self,
         prompt: str,
@@ -121,22 +88,103 @@ class GenAIClient:
             max_output_tokens: 最大输出 token
             use_search: 是否使用搜索
             use_thinking: 是否启用思考模式
-            images: 图片列表
+            images: 图片列表（ReferenceAsset 或二进制数据）
             system_prompt: 系统提示词
 
         Yields:
             生成的文本片段
         """
         logger.debug(f"🔄 GenAI 流式生成开始: model={model}")
+        contents, generate_content_config = self._stream_request(
+            prompt, temperature, max_output_tokens, use_search, use_thinking, images
+        )
+
+        chunk_count = 0
+        self.rate_limiter.acquire()
+        try:
+            for chunk in self.client.models.generate_content_stream(
+                model=model,
+                contents=contents,
+                config=generate_content_config,
+            ):
+                if not chunk.candidates or not chunk.candidates[0].content or not chunk.candidates[0].content.parts:
+                    continue
+                if chunk.text:
+                    chunk_count += 1
+                    logger.debug(f"📥 GenAI chunk #{chunk_count}: {len(chunk.text)} 字符")
+                    yield chunk.text
+        except Exception as e:
+            self.rate_limiter.observe_error(e)
+            raise ProviderError(parse_genai_error(e), kind=classify_error(e)) from e
+
+        logger.debug(f"✅ GenAI 流式生成完成，共 {chunk_count} 个 chunk")
+
+    @circuit_protected_astream
+    async def agenerate_text_stream(
+        self,
+        prompt: str,
+        model: str = "gemini-3-pro-preview",
+        temperature: float = 1.0,
+        max_output_tokens: int = 8000,
+        use_search: bool = False,
+        use_thinking: bool = False,
+        images: list = None,
+        system_prompt: str = None,
+        **kwargs
+    ):
+        """
+        generate_text_stream 的异步版本（异步生成器，client.aio）
+
+        Yields:
+            生成的文本片段
+        """
+        logger.debug(f"🔄 GenAI 异步流式生成开始: model={model}")
+        contents, generate_content_config = self._stream_request(
+            prompt, temperature, max_output_tokens, use_search, use_thinking, images
+        )
+
+        chunk_count = 0
+        await self.rate_limiter.aacquire()
+        try:
+            stream = await self.client.aio.models.generate_content_stream(
+                model=model,
+                contents=contents,
+                config=generate_content_config,
+            )
+            async for chunk in stream:
+                if not chunk.candidates or not chunk.candidates[0].content or not chunk.candidates[0].content.parts:
+                    continue
+                if chunk.text:
+                    chunk_count += 1
+                    logger.debug(f"📥 GenAI chunk #{chunk_count}: {len(chunk.text)} 字符")
+                    yield chunk.text
+        except Exception as e:
+            self.rate_limiter.observe_error(e)
+            raise ProviderError(parse_genai_error(e), kind=classify_error(e)) from e
+
+        logger.debug(f"✅ GenAI 异步流式生成完成，共 {chunk_count} 个 chunk")
+
+    def _stream_request(
+        self,
+        prompt: str,
+        temperature: float,
+        max_output_tokens: int,
+        use_search: bool,
+        use_thinking: bool,
+        images: Optional[list]
+    ) -> Tuple[list, "types.GenerateContentConfig"]:
+        """构建流式请求的内容和生成配置"""
         parts = [types.Part(text=prompt)]
 
         if images:
             for img_data in images:
-                if isinstance(img_data, bytes):
+                if isinstance(img_data, (bytes, ReferenceAsset)):
+                    # 使用压缩后的数据和识别出的真实 MIME 类型
+                    reference = ReferenceAsset.coerce(img_data)
                     parts.append(types.Part(
                         inline_data=types.Blob(
-                            mime_type="image/png",
-                            data=img_data
+                            mime_type=reference.compressed_mime,
+                            data=reference.compressed
                         )
                     ))
 
@@ -163,23 +211,10 @@ class GenAIClient:
             config_kwargs["thinking_config"] = types.ThinkingConfig(thinking_level="HIGH")
 
         generate_content_config = types.GenerateContentConfig(**config_kwargs)
+        return contents, generate_content_config
 
-        chunk_count = 0
-        for chunk in self.client.models.generate_content_stream(
-            model=model,
-            contents=contents,
-            config=generate_content_config,
-        ):
-            if not chunk.candidates or not chunk.candidates[0].content or not chunk.candidates[0].content.parts:
-                continue
-            if chunk.text:
-                chunk_count += 1
-                logger.debug(f"📥 GenAI chunk #{chunk_count}: {len(chunk.text)} 字符")
-                yield chunk.text
-
-        logger.debug(f"✅ GenAI 流式生成完成，共 {chunk_count} 个 chunk")
-
-    @retry_on_429(max_retries=3, base_delay=2)
+    @retry_with_policy
+    @circuit_protected
     def generate_text(
         self,
         prompt: str,
@@ -202,7 +237,7 @@ class GenAIClient:
             max_output_tokens: 最大输出 token
             use_search: 是否使用搜索
             use_thinking: 是否启用思考模式
-            images: 图片列表（暂不支持）
+            images: 图片列表（ReferenceAsset 或二进制数据）
             system_prompt: 系统提示词（暂不支持）
 
         Returns:
@@ -212,11 +247,13 @@ class GenAIClient:
 
         if images:
             for img_data in images:
-                if isinstance(img_data, bytes):
+                if isinstance(img_data, (bytes, ReferenceAsset)):
+                    # 使用压缩后的数据和识别出的真实 MIME 类型
+                    reference = ReferenceAsset.coerce(img_data)
                     parts.append(types.Part(
                         inline_data=types.Blob(
-                            mime_type="image/png",
-                            data=img_data
+                            mime_type=reference.compressed_mime,
+                            data=reference.compressed
                         )
                     ))
 
@@ -245,18 +282,24 @@ class GenAIClient:
         generate_content_config = types.GenerateContentConfig(**config_kwargs)
 
         result = ""
-        for chunk in self.client.models.generate_content_stream(
-            model=model,
-            contents=contents,
-            config=generate_content_config,
-        ):
-            if not chunk.candidates or not chunk.candidates[0].content or not chunk.candidates[0].content.parts:
-                continue
-            result += chunk.text
+        self.rate_limiter.acquire()
+        try:
+            for chunk in self.client.models.generate_content_stream(
+                model=model,
+                contents=contents,
+                config=generate_content_config,
+            ):
+                if not chunk.candidates or not chunk.candidates[0].content or not chunk.candidates[0].content.parts:
+                    continue
+                result += chunk.text
+        except Exception as e:
+            self.rate_limiter.observe_error(e)
+            raise ProviderError(parse_genai_error(e), kind=classify_error(e)) from e
 
         return result
 
-    @retry_on_429(max_retries=5, base_delay=3)  # 图片生成重试更多次
+    @retry_with_policy
+    @circuit_protected
     def generate_image(
         self,
         prompt: str,
@@ -296,20 +339,25 @@ class GenAIClient:
         )
 
         image_data = None
-        for chunk in self.client.models.generate_content_stream(
-            model=model,
-            contents=contents,
-            config=generate_content_config,
-        ):
-            if chunk.candidates and chunk.candidates[0].content and chunk.candidates[0].content.parts:
-                for part in chunk.candidates[0].content.parts:
-                    # 检查是否有图片数据
-                    if hasattr(part, 'inline_data') and part.inline_data:
-                        image_data = part.inline_data.data
-                        break
+        self.rate_limiter.acquire()
+        try:
+            for chunk in self.client.models.generate_content_stream(
+                model=model,
+                contents=contents,
+                config=generate_content_config,
+            ):
+                if chunk.candidates and chunk.candidates[0].content and chunk.candidates[0].content.parts:
+                    for part in chunk.candidates[0].content.parts:
+                        # 检查是否有图片数据
+                        if hasattr(part, 'inline_data') and part.inline_data:
+                            image_data = part.inline_data.data
+                            break
+        except Exception as e:
+            self.rate_limiter.observe_error(e)
+            raise ProviderError(parse_genai_error(e), kind=classify_error(e)) from e
 
         if not image_data:
-            raise ValueError(
+            raise ProviderError(
                 "❌ 图片生成失败：API 返回为空\n\n"
                 "【可能原因】\n"
                 "1. 提示词触发了安全过滤（最常见）\n"
@@ -321,7 +369,8 @@ class GenAIClient:
                 "   - 避免涉及真实人物（明星、政治人物等）\n"
                 "   - 使用更中性、积极的描述\n"
                 "2. 尝试简化提示词\n"
-                "3. 检查网络连接后重试"
+                "3. 检查网络连接后重试",
+                kind=KIND_UNKNOWN
             )
 
         return image_data
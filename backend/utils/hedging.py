@@ -0,0 +1,300 @@
+"""
+对冲请求（hedged requests）
+
+同一服务商的单张图片耗时长尾明显：大部分 20 秒左右完成，少数会一直挂到请求超时。
+启用后，一次调用超过该服务商近期耗时的指定分位数仍未完成时，再发出一个相同的请求，
+取先成功的结果，并通知另一个请求放弃：还在等待响应头的请求直接关闭连接，
+不必等到响应返回才释放并发名额和租约；落败一方已经得到的结果交给 discard 清理。
+
+额外请求受预算约束：每个正常请求为预算积累 max_extra_ratio 份额度，
+发起一次对冲消耗 1 份，保证对冲带来的额外负载不超过该比例
+
+异步生成引擎使用 acall：两次请求都是事件循环中的协程，落败的一方直接撤销
+"""
+import asyncio
+import functools
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional
+from backend.utils.retry_policy import CancelEvent
+
+logger = logging.getLogger(__name__)
+
+# 统计分位数所需的最少样本数，样本不足时不对冲
+MIN_SAMPLES = 20
+# 保留的近期耗时样本数
+LATENCY_WINDOW = 200
+# 预算最多积累的对冲次数（避免长时间空闲后集中对冲）
+BUDGET_CAP = 5
+
+
+def _discard_result(discard: Callable[[Any], None], future, winner=None):
+    """对冲中未被采用的调用成功结束时，用 discard 清理其结果"""
+    if future is winner or future.cancelled() or future.exception() is not None:
+        return
+    try:
+        discard(future.result())
+    except Exception as e:
+        logger.warning(f"清理对冲请求结果失败: {e}")
+
+
+class Hedger:
+    """单个服务商的对冲控制器"""
+
+    def __init__(
+        self,
+        name: str,
+        enabled: bool = False,
+        percentile: float = 95,
+        max_extra_ratio: float = 0.1,
+        min_delay: float = 10
+    ):
+        """
+        Args:
+            name: 服务商名称
+            enabled: 是否启用对冲（未启用时仍记录耗时）
+            percentile: 触发对冲的耗时分位数（0-100）
+            max_extra_ratio: 对冲请求占正常请求的比例上限
+            min_delay: 触发对冲的最短等待时间（秒）
+        """
+        self.name = name
+        self._lock = threading.Lock()
+        self._latencies: Deque[float] = deque(maxlen=LATENCY_WINDOW)
+        self._budget = 0.0
+        self.configure(enabled, percentile, max_extra_ratio, min_delay)
+
+        # 统计计数
+        self.calls = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.budget_exhausted = 0
+
+    def configure(self, enabled: bool, percentile: float, max_extra_ratio: float, min_delay: float):
+        """在线调整对冲参数"""
+        with self._lock:
+            self.enabled = enabled
+            self.percentile = min(max(percentile, 50.0), 99.9)
+            self.max_extra_ratio = max(0.0, max_extra_ratio)
+            self.min_delay = max(0.0, min_delay)
+
+    def record(self, latency: float):
+        """记录一次成功调用的耗时"""
+        with self._lock:
+            self._latencies.append(latency)
+
+    def threshold(self) -> Optional[float]:
+        """当前的对冲触发时间（秒）；样本不足时返回 None"""
+        with self._lock:
+            if len(self._latencies) < MIN_SAMPLES:
+                return None
+            ordered = sorted(self._latencies)
+        rank = min(len(ordered) - 1, int(len(ordered) * self.percentile / 100))
+        return max(self.min_delay, ordered[rank])
+
+    def _earn_budget(self) -> bool:
+        """为预算积累额度，返回当前是否够发起一次对冲"""
+        with self._lock:
+            self._budget = min(BUDGET_CAP, self._budget + self.max_extra_ratio)
+            return self._budget >= 1
+
+    def _spend_budget(self) -> bool:
+        """消耗一次对冲额度"""
+        with self._lock:
+            if self._budget < 1:
+                self.budget_exhausted += 1
+                return False
+            self._budget -= 1
+            self.hedged += 1
+            return True
+
+    def call(
+        self,
+        fn: Callable,
+        *args,
+        hedge_fn: Optional[Callable] = None,
+        discard: Optional[Callable[[Any], None]] = None,
+        **kwargs
+    ) -> Any:
+        """
+        执行 fn，必要时发出对冲请求
+
+        fn 必须接受 cancel_event 关键字参数（CancelEvent），置位时应尽快放弃请求
+        （传给 HttpSession 的请求会直接关闭连接）；
+        hedge_fn 为对冲请求使用的函数，参数同 fn（默认与 fn 相同；fn 使用了预先占用的
+        并发名额时，对冲请求需要自己申请名额）；
+        discard 用于清理落败一方也成功返回的结果（如删除临时文件），包括与胜者同时完成的情况
+
+        Returns:
+            先成功的调用结果；都失败时抛出最先出现的异常
+        """
+        with self._lock:
+            self.calls += 1
+
+        threshold = self.threshold() if self.enabled else None
+        if threshold is None or not self._earn_budget():
+            # 不对冲：直接在当前线程执行
+            started = time.monotonic()
+            result = fn(*args, **kwargs)
+            self.record(time.monotonic() - started)
+            return result
+
+        attempts = [self._launch(fn, args, kwargs, "primary")]
+        done, _ = wait([attempts[0][0]], timeout=threshold)
+        if not done and self._spend_budget():
+            logger.info(f"[{self.name}] 请求超过 {threshold:.1f}s 未完成，发起对冲请求")
+            attempts.append(self._launch(hedge_fn or fn, args, kwargs, "hedge"))
+
+        pending = {future for future, _ in attempts}
+        first_error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                error = future.exception()
+                if error is None:
+                    # 通知其他请求放弃，它们成功返回的结果交给 discard
+                    for other, cancel_event in attempts:
+                        if other is not future:
+                            cancel_event.set()
+                            if discard is not None:
+                                other.add_done_callback(functools.partial(_discard_result, discard))
+                    if future is not attempts[0][0]:
+                        with self._lock:
+                            self.hedge_wins += 1
+                    return future.result()
+                if first_error is None:
+                    first_error = error
+        raise first_error
+
+    async def acall(
+        self,
+        fn: Callable[..., Awaitable],
+        *args,
+        hedge_fn: Optional[Callable[..., Awaitable]] = None,
+        discard: Optional[Callable[[Any], None]] = None,
+        **kwargs
+    ) -> Any:
+        """
+        call 的异步版本：fn 为协程函数，落败的一方被撤销（不需要 cancel_event）；
+        hedge_fn、discard 同 call（hedge_fn 为协程函数）
+
+        Returns:
+            先成功的调用结果；都失败时抛出最先出现的异常
+        """
+        with self._lock:
+            self.calls += 1
+
+        threshold = self.threshold() if self.enabled else None
+        if threshold is None or not self._earn_budget():
+            return await self._atimed(fn, args, kwargs)
+
+        attempts = [asyncio.ensure_future(self._atimed(fn, args, kwargs))]
+        winner = None
+        try:
+            done, _ = await asyncio.wait(attempts, timeout=threshold)
+            if not done and self._spend_budget():
+                logger.info(f"[{self.name}] 请求超过 {threshold:.1f}s 未完成，发起对冲请求")
+                attempts.append(asyncio.ensure_future(self._atimed(hedge_fn or fn, args, kwargs)))
+
+            pending = set(attempts)
+            first_error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    error = task.exception()
+                    if error is None:
+                        winner = task
+                        if task is not attempts[0]:
+                            with self._lock:
+                                self.hedge_wins += 1
+                        return task.result()
+                    if first_error is None:
+                        first_error = error
+            raise first_error
+        finally:
+            # 撤销未完成的请求（另一方已成功，或调用方被撤销）；已成功但未被采用的结果交给 discard
+            for task in attempts:
+                if not task.done():
+                    task.cancel()
+                if discard is not None:
+                    task.add_done_callback(functools.partial(_discard_result, discard, winner=winner))
+
+    async def _atimed(self, fn: Callable[..., Awaitable], args: tuple, kwargs: dict) -> Any:
+        """执行一次调用，成功时记录耗时"""
+        started = time.monotonic()
+        result = await fn(*args, **kwargs)
+        self.record(time.monotonic() - started)
+        return result
+
+    def _launch(self, fn: Callable, args: tuple, kwargs: dict, tag: str):
+        """在独立线程中执行一次调用，返回 (Future, cancel_event)"""
+        future: Future = Future()
+        cancel_event = CancelEvent()
+
+        def run():
+            started = time.monotonic()
+            try:
+                result = fn(*args, cancel_event=cancel_event, **kwargs)
+            except BaseException as e:
+                future.set_exception(e)
+            else:
+                self.record(time.monotonic() - started)
+                future.set_result(result)
+
+        threading.Thread(target=run, name=f"hedge-{self.name}-{tag}", daemon=True).start()
+        return future, cancel_event
+
+    def stats(self) -> Dict[str, Any]:
+        """获取对冲状态"""
+        threshold = self.threshold()
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "percentile": self.percentile,
+                "threshold_s": round(threshold, 1) if threshold is not None else None,
+                "samples": len(self._latencies),
+                "calls": self.calls,
+                "hedged": self.hedged,
+                "hedge_wins": self.hedge_wins,
+                "budget_exhausted": self.budget_exhausted,
+                "budget": round(self._budget, 2),
+            }
+
+
+# 全局对冲控制器（按服务商名）
+_hedgers: Dict[str, Hedger] = {}
+_hedgers_lock = threading.Lock()
+
+
+def get_hedger(provider_name: str, provider_config: Dict[str, Any]) -> Hedger:
+    """
+    获取服务商的对冲控制器，不存在时创建；已存在时同步最新配置
+
+    服务商配置项（均可选）：
+    - hedge: 是否启用对冲（默认 false）
+    - hedge_percentile: 触发对冲的耗时分位数（默认 95）
+    - hedge_max_ratio: 对冲请求占比上限（默认 0.1）
+    - hedge_min_delay: 触发对冲的最短等待秒数（默认 10）
+    """
+    enabled = bool(provider_config.get('hedge', False))
+    percentile = float(provider_config.get('hedge_percentile') or 95)
+    max_extra_ratio = float(provider_config.get('hedge_max_ratio') or 0.1)
+    min_delay = float(provider_config.get('hedge_min_delay') or 10)
+
+    with _hedgers_lock:
+        hedger = _hedgers.get(provider_name)
+        if hedger is None:
+            hedger = Hedger(provider_name, enabled, percentile, max_extra_ratio, min_delay)
+            _hedgers[provider_name] = hedger
+        else:
+            hedger.configure(enabled, percentile, max_extra_ratio, min_delay)
+    return hedger
+
+
+def get_hedger_stats() -> Dict[str, Dict[str, Any]]:
+    """获取所有服务商对冲控制器的状态"""
+    with _hedgers_lock:
+        hedgers = dict(_hedgers)
+    return {name: hedger.stats() for name, hedger in hedgers.items()}
@@ -0,0 +1,625 @@
+"""
+服务商 HTTP 连接池
+
+每个服务商共享一个 HTTP 会话，连接保持长连接并在请求间复用，不必为每一页、每次重试、
+每次下载图片重新建立 TCP 和 TLS 连接（海外中转站每次握手要 300–800ms）：
+- 连接池大小跟随服务商并发上限可以探测到的上界（max_concurrent_ceiling）
+- 同一会话同时缓存多个主机的连接池，chat 接口返回图片链接后的下载也复用连接
+- 服务商配置 http2: true 且安装了 h2（uv sync --extra http2）时使用 HTTP/2，
+  多个请求复用同一条连接；未安装时使用 HTTP/1.1 长连接
+
+响应对象和异常与 requests 保持一致，调用方无需区分。
+请求带 cancel_event（CancelEvent）时，置位会关闭该请求正在使用的连接，
+还在建立连接或等待响应头的请求立即以 RequestCancelled 结束（HTTP/1.1 模式）
+
+异步生成引擎使用 AsyncHttpSession（httpx.AsyncClient），按同样的配置为每个服务商保持一个连接池，
+异常同样转换为 requests 的对应异常
+"""
+import codecs
+import importlib.util
+import logging
+import socket
+import threading
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from backend.config import Config
+from backend.utils.retry_policy import RequestCancelled
+
+logger = logging.getLogger(__name__)
+
+# 每个会话缓存的主机连接池数量（服务商接口 + 图片下载 CDN 等）
+MAX_HOSTS = 8
+# 连接池大小在并发上限之外的余量（对冲请求、图片下载）
+POOL_HEADROOM = 2
+
+
+def _http2_available() -> bool:
+    """是否安装了 HTTP/2 所需的依赖（只查找模块，不导入）"""
+    return importlib.util.find_spec("h2") is not None and importlib.util.find_spec("httpx") is not None
+
+
+class _Http2Response:
+    """把 httpx 响应包装成 requests.Response 的常用接口"""
+
+    def __init__(self, response):
+        self._response = response
+        self._chunks: Optional[Iterator[bytes]] = None
+        self.status_code = response.status_code
+        self.headers = response.headers
+        self.url = str(response.url)
+        self.http_version = response.http_version
+
+    @property
+    def content(self) -> bytes:
+        with _translate_errors():
+            return self._response.read()
+
+    @property
+    def text(self) -> str:
+        self.content
+        return self._response.text
+
+    def json(self, **kwargs) -> Any:
+        self.content
+        return self._response.json(**kwargs)
+
+    def _iter_bytes(self, chunk_size: Optional[int] = None) -> Iterator[bytes]:
+        if self._chunks is None:
+            self._chunks = self._response.iter_bytes(chunk_size)
+        try:
+            with _translate_errors():
+                for chunk in self._chunks:
+                    yield chunk
+        finally:
+            self._release()
+
+    def _release(self):
+        """调用方提前结束读取（如读到 [DONE]）时读完剩余数据再关闭，连接才能回到连接池复用"""
+        try:
+            for _ in self._chunks:
+                pass
+        except Exception:
+            pass
+        self._response.close()
+
+    def iter_lines(self, **kwargs) -> Iterator[bytes]:
+        pending = b""
+        for chunk in self._iter_bytes():
+            pending += chunk
+            lines = pending.split(b"\n")
+            pending = lines.pop()
+            for line in lines:
+                yield line.rstrip(b"\r")
+        if pending:
+            yield pending
+
+    def iter_content(self, chunk_size: Optional[int] = None, decode_unicode: bool = False) -> Iterator:
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace") if decode_unicode else None
+        for chunk in self._iter_bytes(chunk_size):
+            yield decoder.decode(chunk) if decoder else chunk
+
+    def close(self):
+        self._response.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def _shutdown(sock):
+    """关闭套接字的读写，阻塞在该套接字上的读写立即失败（连接随后被连接池丢弃）"""
+    if sock is None:
+        return
+    try:
+        # 直接调用 socket.socket 的方法：SSLSocket.shutdown 会在其他线程读写时清空 SSL 对象
+        socket.socket.shutdown(sock, socket.SHUT_RDWR)
+    except OSError:
+        pass
+
+
+class _RequestConnections:
+    """一次可撤销的请求取得的连接（撤销时关闭它们）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._connections: List[HTTPConnection] = []
+        self.aborted = False
+
+    def add(self, conn: HTTPConnection):
+        with self._lock:
+            self._connections.append(conn)
+            aborted = self.aborted
+        if aborted:
+            raise RequestCancelled()
+
+    def connected(self, conn: HTTPConnection):
+        """连接建立后调用：建立连接期间已撤销时立即关闭"""
+        with self._lock:
+            aborted = self.aborted
+        if aborted:
+            _shutdown(conn.sock)
+
+    def abort(self):
+        with self._lock:
+            self.aborted = True
+            connections = list(self._connections)
+        for conn in connections:
+            _shutdown(conn.sock)
+
+    def finish(self):
+        """请求已返回：连接可能已回到连接池给其他请求使用，之后的撤销不再关闭它们"""
+        with self._lock:
+            self._connections = []
+
+
+# 当前线程中正在进行的可撤销请求
+_current = threading.local()
+
+
+class _TrackedConnectionMixin:
+    def connect(self):
+        super().connect()
+        tracker = getattr(_current, "connections", None)
+        if tracker is not None:
+            tracker.connected(self)
+
+
+class _TrackedHTTPConnection(_TrackedConnectionMixin, HTTPConnection):
+    pass
+
+
+class _TrackedHTTPSConnection(_TrackedConnectionMixin, HTTPSConnection):
+    pass
+
+
+class _TrackedPoolMixin:
+    def _get_conn(self, timeout=None):
+        conn = super()._get_conn(timeout)
+        tracker = getattr(_current, "connections", None)
+        if tracker is not None:
+            try:
+                tracker.add(conn)
+            except RequestCancelled:
+                self._put_conn(conn)
+                raise
+        return conn
+
+
+class _TrackedHTTPConnectionPool(_TrackedPoolMixin, HTTPConnectionPool):
+    ConnectionCls = _TrackedHTTPConnection
+
+
+class _TrackedHTTPSConnectionPool(_TrackedPoolMixin, HTTPSConnectionPool):
+    ConnectionCls = _TrackedHTTPSConnection
+
+
+class _translate_errors:
+    """把 httpx 的超时和网络异常转换为 requests 的对应异常（重试策略按 requests 异常分类）"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc is None:
+            return False
+        import httpx
+        if isinstance(exc, httpx.TimeoutException):
+            raise requests.exceptions.Timeout(str(exc)) from exc
+        if isinstance(exc, httpx.TransportError):
+            raise requests.exceptions.ConnectionError(str(exc)) from exc
+        return False
+
+
+class HttpSession:
+    """一个服务商共享的 HTTP 会话"""
+
+    def __init__(self, name: str, pool_size: int = 10, http2: bool = False):
+        """
+        Args:
+            name: 会话名称（如 image:gemini）
+            pool_size: 每个主机保持的最大连接数
+            http2: 是否使用 HTTP/2（需要安装 h2，未安装时使用 HTTP/1.1）
+        """
+        self.name = name
+        self._lock = threading.Lock()
+        self.pool_size = 0
+        self.http2 = False
+        self._session: Optional[requests.Session] = None
+        self._client = None
+        self._http2_warned = False
+
+        # 统计计数
+        self.requests = 0
+        self.errors = 0
+        # HTTP/2 模式下新建的连接数（HTTP/1.1 模式从 urllib3 连接池读取）
+        self._http2_connections = 0
+
+        self.configure(pool_size, http2)
+
+    def configure(self, pool_size: int, http2: bool = False):
+        """按最新配置调整连接池（大小或协议不变时保留现有连接）"""
+        pool_size = max(1, pool_size)
+        if http2 and not _http2_available():
+            if not self._http2_warned:
+                self._http2_warned = True
+                logger.warning(f"[{self.name}] 配置了 http2 但未安装 h2（uv sync --extra http2），使用 HTTP/1.1")
+            http2 = False
+
+        with self._lock:
+            if pool_size == self.pool_size and http2 == self.http2:
+                return
+            old_session, old_client = self._session, self._client
+            self._session, self._client = None, None
+            if http2:
+                import httpx
+                self._client = httpx.Client(
+                    http2=True,
+                    limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+                    follow_redirects=True
+                )
+            else:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=MAX_HOSTS, pool_maxsize=pool_size)
+                # 记录可撤销请求取得的连接
+                adapter.poolmanager.pool_classes_by_scheme = {
+                    "http": _TrackedHTTPConnectionPool,
+                    "https": _TrackedHTTPSConnectionPool,
+                }
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                self._session = session
+            self.pool_size = pool_size
+            self.http2 = http2
+
+        # 旧会话的连接在进行中的请求结束后释放
+        if old_session is not None:
+            old_session.close()
+        if old_client is not None:
+            old_client.close()
+        logger.debug(f"[{self.name}] HTTP 连接池: size={pool_size}, http2={http2}")
+
+    def request(self, method: str, url: str, cancel_event=None, **kwargs) -> Any:
+        """
+        发送请求，参数同 requests.request（支持 headers / json / data / params / timeout / stream）
+
+        Args:
+            cancel_event: CancelEvent（可选），置位时关闭该请求正在使用的连接，
+                还在建立连接或等待响应头的请求以 RequestCancelled 结束（HTTP/2 模式下不支持，等响应返回）
+
+        Returns:
+            requests.Response，或 HTTP/2 模式下接口相同的响应对象
+        """
+        with self._lock:
+            self.requests += 1
+            session, client = self._session, self._client
+        try:
+            if client is not None:
+                return self._request_http2(client, method, url, **kwargs)
+            if cancel_event is None or not hasattr(cancel_event, "add_callback"):
+                return session.request(method, url, **kwargs)
+            return self._request_cancellable(session, method, url, cancel_event, **kwargs)
+        except RequestCancelled:
+            raise
+        except Exception:
+            with self._lock:
+                self.errors += 1
+            raise
+
+    def _request_cancellable(self, session: requests.Session, method: str, url: str, cancel_event, **kwargs):
+        """发送请求，cancel_event 置位时关闭请求正在使用的连接"""
+        tracker = _RequestConnections()
+        remove_callback = cancel_event.add_callback(tracker.abort)
+        _current.connections = tracker
+        try:
+            return session.request(method, url, **kwargs)
+        except Exception as e:
+            if tracker.aborted:
+                raise RequestCancelled() from e
+            raise
+        finally:
+            _current.connections = None
+            remove_callback()
+            tracker.finish()
+
+    def _request_http2(self, client, method: str, url: str, stream: bool = False, **kwargs) -> _Http2Response:
+        """通过 httpx 发送请求"""
+        request = client.build_request(
+            method, url,
+            headers=kwargs.get("headers"),
+            json=kwargs.get("json"),
+            data=kwargs.get("data"),
+            params=kwargs.get("params"),
+            timeout=kwargs.get("timeout"),
+            extensions={"trace": self._trace}
+        )
+        with _translate_errors():
+            response = client.send(request, stream=stream)
+        return _Http2Response(response)
+
+    def _trace(self, event: str, info: Dict[str, Any]):
+        """httpx 连接事件回调：统计新建的连接"""
+        if event == "connection.connect_tcp.complete":
+            with self._lock:
+                self._http2_connections += 1
+
+    def post(self, url: str, **kwargs) -> Any:
+        return self.request("POST", url, **kwargs)
+
+    def get(self, url: str, **kwargs) -> Any:
+        return self.request("GET", url, **kwargs)
+
+    def stats(self) -> Dict[str, Any]:
+        """获取连接池统计"""
+        with self._lock:
+            session = self._session
+            stats = {
+                "http2": self.http2,
+                "pool_size": self.pool_size,
+                "requests": self.requests,
+                "errors": self.errors,
+            }
+            connections = self._http2_connections
+
+        hosts = {}
+        if session is not None:
+            # urllib3 每个主机一个连接池，记录新建连接数和经过该池的请求数
+            pools = session.get_adapter("https://").poolmanager.pools
+            for key in list(pools.keys()):
+                pool = pools.get(key)
+                if pool is None:
+                    continue
+                hosts[pool.host] = {"connections": pool.num_connections, "requests": pool.num_requests}
+            connections = sum(h["connections"] for h in hosts.values())
+        stats["connections"] = connections
+        stats["reused"] = max(0, stats["requests"] - connections)
+        stats["hosts"] = hosts
+        return stats
+
+
+class _AsyncResponse:
+    """httpx 异步响应的包装：读取时把 httpx 异常转换为 requests 的对应异常"""
+
+    def __init__(self, response):
+        self._response = response
+        self.status_code = response.status_code
+        self.headers = response.headers
+        self.url = str(response.url)
+        self.http_version = response.http_version
+
+    async def aread(self) -> bytes:
+        with _translate_errors():
+            return await self._response.aread()
+
+    async def atext(self) -> str:
+        await self.aread()
+        return self._response.text
+
+    async def ajson(self, **kwargs) -> Any:
+        await self.aread()
+        return self._response.json(**kwargs)
+
+    async def aiter_bytes(self, chunk_size: Optional[int] = None) -> AsyncIterator[bytes]:
+        with _translate_errors():
+            async for chunk in self._response.aiter_bytes(chunk_size):
+                yield chunk
+
+
+class AsyncHttpSession:
+    """一个服务商共享的异步 HTTP 会话（只在异步生成引擎的事件循环中使用）"""
+
+    def __init__(self, name: str, pool_size: int = 10, http2: bool = False):
+        """
+        Args:
+            name: 会话名称（如 image:gemini）
+            pool_size: 连接池大小
+            http2: 是否使用 HTTP/2（需要安装 h2，未安装时使用 HTTP/1.1）
+        """
+        self.name = name
+        self._lock = threading.Lock()
+        self.pool_size = max(1, pool_size)
+        self.http2 = False
+        self._client = None
+        # 配置变更后换下的旧客户端，其上进行中的请求全部结束后在事件循环中关闭
+        self._retired: List[Any] = []
+        # 各客户端上进行中的请求数
+        self._inflight: Dict[Any, int] = {}
+
+        # 统计计数
+        self.requests = 0
+        self.errors = 0
+        self._connections = 0
+
+        self.configure(pool_size, http2)
+
+    def configure(self, pool_size: int, http2: bool = False):
+        """按最新配置调整连接池（大小或协议变化时，下一个请求起使用新的客户端）"""
+        pool_size = max(1, pool_size)
+        http2 = bool(http2) and _http2_available()
+        with self._lock:
+            if pool_size == self.pool_size and http2 == self.http2:
+                return
+            self.pool_size = pool_size
+            self.http2 = http2
+            if self._client is not None:
+                self._retired.append(self._client)
+                self._client = None
+
+    def _get_client(self):
+        """
+        当前的 httpx.AsyncClient（首次使用时创建），并记一个进行中的请求
+
+        Returns:
+            (客户端, 已换下且没有进行中请求、可以关闭的旧客户端列表)
+        """
+        import httpx
+        with self._lock:
+            if self._client is None:
+                self._client = httpx.AsyncClient(
+                    http2=self.http2,
+                    limits=httpx.Limits(
+                        max_connections=self.pool_size, max_keepalive_connections=self.pool_size
+                    ),
+                    follow_redirects=True
+                )
+            self._inflight[self._client] = self._inflight.get(self._client, 0) + 1
+            idle = [c for c in self._retired if c not in self._inflight]
+            self._retired = [c for c in self._retired if c in self._inflight]
+            return self._client, idle
+
+    def _finish(self, client) -> bool:
+        """
+        结束客户端上的一个请求
+
+        Returns:
+            客户端已换下且没有其他进行中的请求时返回 True（需要关闭）
+        """
+        with self._lock:
+            count = self._inflight.pop(client) - 1
+            if count:
+                self._inflight[client] = count
+                return False
+            if client in self._retired:
+                self._retired.remove(client)
+                return True
+            return False
+
+    @asynccontextmanager
+    async def stream(self, method: str, url: str, **kwargs) -> AsyncIterator[_AsyncResponse]:
+        """
+        发送请求并流式读取响应，参数同 requests.request（headers / json / data / params / timeout）
+
+        正常退出时读完剩余数据再关闭，连接回到连接池复用；出错或被撤销时直接关闭
+
+        Yields:
+            响应对象（status_code、headers、aread / atext / ajson / aiter_bytes）
+        """
+        client, idle = self._get_client()
+        for old_client in idle:
+            await old_client.aclose()
+
+        try:
+            with self._lock:
+                self.requests += 1
+            request = client.build_request(
+                method, url,
+                headers=kwargs.get("headers"),
+                json=kwargs.get("json"),
+                data=kwargs.get("data"),
+                params=kwargs.get("params"),
+                timeout=kwargs.get("timeout"),
+                extensions={"trace": self._trace}
+            )
+            try:
+                with _translate_errors():
+                    response = await client.send(request, stream=True)
+            except Exception:
+                with self._lock:
+                    self.errors += 1
+                raise
+
+            try:
+                yield _AsyncResponse(response)
+            except BaseException:
+                await response.aclose()
+                raise
+            try:
+                async for _ in response.aiter_raw():
+                    pass
+            except Exception:
+                pass
+            await response.aclose()
+        finally:
+            # 旧客户端等其上的请求全部结束后再关闭，不中断进行中的请求
+            if self._finish(client):
+                await client.aclose()
+
+    async def _trace(self, event: str, info: Dict[str, Any]):
+        """httpx 连接事件回调：统计新建的连接"""
+        if event == "connection.connect_tcp.complete":
+            with self._lock:
+                self._connections += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """获取连接池统计"""
+        with self._lock:
+            return {
+                "http2": self.http2,
+                "pool_size": self.pool_size,
+                "requests": self.requests,
+                "errors": self.errors,
+                "connections": self._connections,
+                "reused": max(0, self.requests - self._connections),
+            }
+
+
+# 全局会话（按 类型:服务商名）
+_sessions: Dict[str, HttpSession] = {}
+_async_sessions: Dict[str, AsyncHttpSession] = {}
+_sessions_lock = threading.Lock()
+
+
+def get_http_session(kind: str, provider_name: str, provider_config: Dict[str, Any]) -> HttpSession:
+    """
+    获取服务商共享的 HTTP 会话，不存在时按配置创建；已存在时同步最新的连接池配置
+
+    服务商配置项（均可选）：
+    - max_concurrent / max_concurrent_ceiling: 并发上限可以探测到的上界决定连接池大小（见 Config.get_provider_concurrency）
+    - http2: 是否使用 HTTP/2（默认 false）
+
+    Args:
+        kind: "image" 或 "text"
+        provider_name: 服务商名称
+        provider_config: 服务商配置
+    """
+    pool_size = Config.get_provider_concurrency(provider_config)[1] + POOL_HEADROOM
+    http2 = bool(provider_config.get('http2', False))
+    key = f"{kind}:{provider_name}"
+
+    with _sessions_lock:
+        session = _sessions.get(key)
+        if session is None:
+            session = HttpSession(key, pool_size, http2)
+            _sessions[key] = session
+            logger.info(f"初始化 HTTP 连接池: {key}, size={session.pool_size}, http2={session.http2}")
+            return session
+    session.configure(pool_size, http2)
+    return session
+
+
+def get_async_http_session(kind: str, provider_name: str, provider_config: Dict[str, Any]) -> AsyncHttpSession:
+    """
+    获取服务商共享的异步 HTTP 会话，配置项同 get_http_session
+
+    会话创建时不建立连接，只在异步生成引擎中第一次请求时创建客户端
+    """
+    pool_size = Config.get_provider_concurrency(provider_config)[1] + POOL_HEADROOM
+    http2 = bool(provider_config.get('http2', False))
+    key = f"{kind}:{provider_name}"
+
+    with _sessions_lock:
+        session = _async_sessions.get(key)
+        if session is None:
+            session = AsyncHttpSession(key, pool_size, http2)
+            _async_sessions[key] = session
+            return session
+    session.configure(pool_size, http2)
+    return session
+
+
+def get_http_pool_stats() -> Dict[str, Dict[str, Any]]:
+    """获取所有服务商 HTTP 连接池的统计（异步会话以 async: 前缀区分，只列出已发过请求的）"""
+    with _sessions_lock:
+        sessions = dict(_sessions)
+        async_sessions = dict(_async_sessions)
+    stats = {key: session.stats() for key, session in sessions.items()}
+    for key, session in async_sessions.items():
+        if session.requests:
+            stats[f"async:{key}"] = session.stats()
+    return stats
+
@@ -0,0 +1,160 @@
+"""
+压缩图片缓存
+
+同一张图片在一次任务中会被反复压缩（封面参考图、用户上传图），
+这里按「内容哈希 + 目标大小」缓存压缩结果，全进程共享，
+按字节预算做 LRU 淘汰
+"""
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, Tuple
+from backend.config import Config
+from .image_pool import get_image_pool
+from .single_flight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+
+def content_hash(image_data: bytes) -> str:
+    """计算图片内容哈希（blake2b-128，比 sha256 更快）"""
+    return hashlib.blake2b(image_data, digest_size=16).hexdigest()
+
+
+class CompressedImageCache:
+    """按字节预算做 LRU 淘汰的压缩结果缓存"""
+
+    def __init__(self, max_bytes: int):
+        """
+        Args:
+            max_bytes: 缓存占用的最大字节数
+        """
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[Tuple[str, int], bytes]" = OrderedDict()
+        self._current_bytes = 0
+        self._lock = threading.Lock()
+        self._single_flight = SingleFlight()
+
+        # 统计计数
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get_or_compress(self, image_data: bytes, max_size_kb: int = 200) -> bytes:
+        """
+        获取压缩结果，未命中时压缩并写入缓存
+
+        同一张图片并发未命中时只压缩一次，其余线程等待共享结果
+
+        Args:
+            image_data: 原始图片数据
+            max_size_kb: 最大文件大小（KB）
+
+        Returns:
+            压缩后的图片数据
+        """
+        # 原图已满足大小要求时压缩会直接返回原图，无需哈希和缓存
+        if len(image_data) <= max_size_kb * 1024:
+            return image_data
+
+        key = (content_hash(image_data), max_size_kb)
+
+        with self._lock:
+            cached = self._entries.get(key)
+            if cached is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return cached
+
+        leader = []
+
+        def compute() -> bytes:
+            leader.append(True)
+            # 等待期间可能已被其他线程写入
+            with self._lock:
+                cached = self._entries.get(key)
+                if cached is not None:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return cached
+                self.misses += 1
+
+            compressed = get_image_pool().compress(image_data, max_size_kb=max_size_kb)
+            self._put(key, compressed)
+            return compressed
+
+        result = self._single_flight.do(key, compute)
+        if not leader:
+            # 等待其他线程压缩完成并共享结果，同样视为命中
+            with self._lock:
+                self.hits += 1
+        return result
+
+    def _put(self, key: Tuple[str, int], data: bytes):
+        """写入缓存并按字节预算淘汰最久未使用的条目"""
+        size = len(data)
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            if key in self._entries:
+                self._current_bytes -= len(self._entries.pop(key))
+            self._entries[key] = data
+            self._current_bytes += size
+
+            while self._current_bytes > self.max_bytes and self._entries:
+                _, evicted = self._entries.popitem(last=False)
+                self._current_bytes -= len(evicted)
+                self.evictions += 1
+
+    def clear(self):
+        """清空缓存（不重置统计计数）"""
+        with self._lock:
+            self._entries.clear()
+            self._current_bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        """获取缓存统计信息"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._current_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            }
+
+
+# 全局缓存实例
+_cache_instance = None
+_cache_lock = threading.Lock()
+
+
+def get_compress_cache() -> CompressedImageCache:
+    """获取全局压缩缓存实例"""
+    global _cache_instance
+    if _cache_instance is None:
+        with _cache_lock:
+            if _cache_instance is None:
+                max_bytes = Config.COMPRESS_CACHE_MAX_MB * 1024 * 1024
+                _cache_instance = CompressedImageCache(max_bytes)
+                logger.info(f"初始化压缩图片缓存: max={Config.COMPRESS_CACHE_MAX_MB}MB")
+    return _cache_instance
+
+
+def compress_image_cached(image_data: bytes, max_size_kb: int = 200) -> bytes:
+    """
+    带缓存的 compress_image，相同内容和目标大小只压缩一次
+
+    Args:
+        image_data: 原始图片数据
+        max_size_kb: 最大文件大小（KB）
+
+    Returns:
+        压缩后的图片数据
+    """
+    return get_compress_cache().get_or_compress(image_data, max_size_kb)
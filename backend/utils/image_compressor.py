@@ -1,7 +1,124 @@
 """图片压缩工具"""
 import io
+import math
+import logging
 from PIL import Image
-from typing import Optional
+from typing import Tuple
+
+logger = logging.getLogger(__name__)
+
+# 质量搜索的收敛精度：上下界差距不超过该值时停止
+QUALITY_TOLERANCE = 2
+# 缩放预测的安全系数（JPEG 体积与像素数并非严格线性，预留一点余量）
+SCALE_SAFETY = 0.9
+# 缩小尺寸的下限（最长边），与旧实现保持一致
+MIN_DIMENSION = 512
+# 缩放预测的最大轮数（正常情况下一轮即可命中）
+MAX_SCALE_ROUNDS = 3
+
+
+def _target_size(size: Tuple[int, int], max_dimension: int) -> Tuple[int, int]:
+    """计算等比缩放到最长边不超过 max_dimension 后的尺寸"""
+    width, height = size
+    ratio = max_dimension / max(width, height)
+    return max(1, round(width * ratio)), max(1, round(height * ratio))
+
+
+def _open_image(image_data: bytes, max_dimension: int) -> Image.Image:
+    """
+    解码图片，大尺寸 JPEG 使用 draft 模式
+
+    draft() 让 JPEG 解码器直接在 DCT 域按 1/2、1/4、1/8 缩放，
+    返回的尺寸保证不小于请求尺寸，之后再精确缩放即可
+    """
+    img = Image.open(io.BytesIO(image_data))
+
+    if img.format == 'JPEG' and max(img.size) > max_dimension:
+        img.draft('RGB', _target_size(img.size, max_dimension))
+
+    return img
+
+
+def _to_rgb(img: Image.Image) -> Image.Image:
+    """转换为 RGB（透明背景填充为白色）"""
+    if img.mode in ('RGBA', 'LA', 'P'):
+        if img.mode == 'P':
+            img = img.convert('RGBA')
+        background = Image.new('RGB', img.size, (255, 255, 255))
+        background.paste(img, mask=img.split()[-1])
+        return background
+    if img.mode != 'RGB':
+        return img.convert('RGB')
+    return img
+
+
+def _resize(img: Image.Image, size: Tuple[int, int]) -> Image.Image:
+    """
+    缩放图片
+
+    先用 reduce() 做整数倍的盒式缩小（成本远低于 LANCZOS），
+    剩余的非整数倍部分再用 LANCZOS 精修
+    """
+    # 调色板模式无法插值缩放，先展开
+    if img.mode == 'P':
+        img = img.convert('RGBA')
+
+    factor = min(img.size[0] // size[0], img.size[1] // size[1])
+    if factor >= 2:
+        img = img.reduce(factor)
+    if img.size == size:
+        return img
+    return img.resize(size, Image.Resampling.LANCZOS)
+
+
+def _encode_jpeg(img: Image.Image, quality: int) -> bytes:
+    """编码为 JPEG"""
+    output = io.BytesIO()
+    img.save(output, format='JPEG', quality=quality)
+    return output.getvalue()
+
+
+def _search_quality(
+    img: Image.Image,
+    max_size_bytes: int,
+    quality_start: int,
+    quality_min: int
+) -> Tuple[bytes, bool]:
+    """
+    在 [quality_min, quality_start] 区间内搜索满足大小限制的最高质量
+
+    先试探两端，再按体积插值猜测质量（夹在区间内部，退化时取中点），
+    通常 3-5 次编码即可收敛
+
+    Returns:
+        (编码结果, 是否满足大小限制)；不满足时返回最低质量的结果
+    """
+    data = _encode_jpeg(img, quality_start)
+    if len(data) <= max_size_bytes:
+        return data, True
+
+    low_data = _encode_jpeg(img, quality_min)
+    if len(low_data) > max_size_bytes:
+        return low_data, False
+
+    # 不变式：lo 满足限制，hi 不满足
+    lo, lo_size, best = quality_min, len(low_data), low_data
+    hi, hi_size = quality_start, len(data)
+
+    while hi - lo > QUALITY_TOLERANCE:
+        if hi_size > lo_size:
+            guess = lo + (hi - lo) * (max_size_bytes - lo_size) / (hi_size - lo_size)
+        else:
+            guess = (lo + hi) / 2
+        quality = min(max(int(guess), lo + 1), hi - 1)
+
+        data = _encode_jpeg(img, quality)
+        if len(data) <= max_size_bytes:
+            lo, lo_size, best = quality, len(data), data
+        else:
+            hi, hi_size = quality, len(data)
+
+    return best, True
 
 
 def compress_image(
@@ -31,66 +148,122 @@ def compress_image(
         return image_data
 
     try:
-        # 打开图片
-        img = Image.open(io.BytesIO(image_data))
-
-        # 转换为 RGB（处理 RGBA 等格式）
-        if img.mode in ('RGBA', 'LA', 'P'):
-            background = Image.new('RGB', img.size, (255, 255, 255))
-            if img.mode == 'P':
-                img = img.convert('RGBA')
-            background.paste(img, mask=img.split()[-1] if img.mode in ('RGBA', 'LA') else None)
-            img = background
-        elif img.mode != 'RGB':
-            img = img.convert('RGB')
+        img = _open_image(image_data, max_dimension)
 
         # 如果图片尺寸过大，先缩小
-        width, height = img.size
-        if width > max_dimension or height > max_dimension:
-            ratio = min(max_dimension / width, max_dimension / height)
-            new_width = int(width * ratio)
-            new_height = int(height * ratio)
-            img = img.resize((new_width, new_height), Image.Resampling.LANCZOS)
-
-        # 逐步降低质量直到满足大小要求
-        quality = quality_start
-        compressed_data = None
+        if max(img.size) > max_dimension:
+            img = _resize(img, _target_size(img.size, max_dimension))
 
-        while quality >= quality_min:
-            output = io.BytesIO()
-            img.save(output, format='JPEG', quality=quality, optimize=True)
-            compressed_data = output.getvalue()
+        img = _to_rgb(img)
 
-            if len(compressed_data) <= max_size_bytes:
-                break
+        compressed_data, fits = _search_quality(img, max_size_bytes, quality_start, quality_min)
 
-            quality -= 5
-
-        # 如果还是太大，进一步缩小尺寸
-        if len(compressed_data) > max_size_bytes:
+        # 最低质量仍然超限：根据最低质量下的每像素字节数预测缩放比例
+        rounds = 0
+        while not fits and max(img.size) > MIN_DIMENSION and rounds < MAX_SCALE_ROUNDS:
+            rounds += 1
             width, height = img.size
-            while len(compressed_data) > max_size_bytes and max(width, height) > 512:
-                width = int(width * 0.9)
-                height = int(height * 0.9)
-                img_resized = img.resize((width, height), Image.Resampling.LANCZOS)
-
-                output = io.BytesIO()
-                img_resized.save(output, format='JPEG', quality=quality_min, optimize=True)
-                compressed_data = output.getvalue()
+            bytes_per_pixel = len(compressed_data) / (width * height)
+            scale = math.sqrt(max_size_bytes * SCALE_SAFETY / bytes_per_pixel / (width * height))
+            new_dimension = max(MIN_DIMENSION, int(max(width, height) * scale))
+            img = _resize(img, _target_size(img.size, new_dimension))
+            compressed_data, fits = _search_quality(img, max_size_bytes, quality_start, quality_min)
 
         original_size_kb = len(image_data) / 1024
         compressed_size_kb = len(compressed_data) / 1024
         compression_ratio = (1 - compressed_size_kb / original_size_kb) * 100
 
-        print(f"[图片压缩] {original_size_kb:.1f}KB → {compressed_size_kb:.1f}KB (压缩 {compression_ratio:.1f}%)")
+        logger.debug(
+            f"[图片压缩] {original_size_kb:.1f}KB → {compressed_size_kb:.1f}KB "
+            f"(压缩 {compression_ratio:.1f}%, 尺寸 {img.size[0]}x{img.size[1]})"
+        )
 
         return compressed_data
 
     except Exception as e:
-        print(f"[图片压缩] 压缩失败，返回原图: {e}")
+        logger.warning(f"[图片压缩] 压缩失败，返回原图: {e}")
         return image_data
 
 
+# 图片文件头魔数 -> MIME 类型
+_IMAGE_SIGNATURES = (
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif'),
+    (b'BM', 'image/bmp'),
+)
+
+
+def detect_image_mime(header: bytes, default: str = 'image/png') -> str:
+    """
+    根据文件头识别图片 MIME 类型
+
+    Args:
+        header: 图片数据的前若干字节（至少 12 字节）
+        default: 无法识别时返回的类型
+
+    Returns:
+        MIME 类型字符串
+    """
+    if header[:4] == b'RIFF' and header[8:12] == b'WEBP':
+        return 'image/webp'
+    for signature, mime in _IMAGE_SIGNATURES:
+        if header.startswith(signature):
+            return mime
+    return default
+
+
+# 衍生图支持的输出格式 -> (Pillow 格式名, MIME 类型)
+DERIVATIVE_FORMATS = {
+    'webp': ('WEBP', 'image/webp'),
+    'jpeg': ('JPEG', 'image/jpeg'),
+}
+
+
+def resize_image(
+    image_data: bytes,
+    width: int,
+    fmt: str = 'webp',
+    quality: int = 80
+) -> bytes:
+    """
+    将图片等比缩放到指定宽度并重新编码（不放大）
+
+    Args:
+        image_data: 原始图片数据
+        width: 目标宽度（像素）
+        fmt: 输出格式（webp / jpeg）
+        quality: 编码质量（1-100）
+
+    Returns:
+        编码后的图片数据
+    """
+    if fmt not in DERIVATIVE_FORMATS:
+        raise ValueError(f"不支持的图片格式: {fmt}，可选: {', '.join(DERIVATIVE_FORMATS)}")
+    pil_format, _ = DERIVATIVE_FORMATS[fmt]
+
+    img = Image.open(io.BytesIO(image_data))
+    src_width, src_height = img.size
+    width = min(width, src_width)
+    size = (width, max(1, round(src_height * width / src_width)))
+
+    if img.format == 'JPEG' and width < src_width:
+        img.draft('RGB', size)
+
+    img = _resize(img, size)
+
+    # WebP 保留透明通道，JPEG 需要填充白底
+    if pil_format == 'WEBP' and img.mode in ('RGBA', 'LA', 'P'):
+        img = img.convert('RGBA')
+    else:
+        img = _to_rgb(img)
+
+    output = io.BytesIO()
+    img.save(output, format=pil_format, quality=quality)
+    return output.getvalue()
+
+
 def compress_images(images: list[bytes], max_size_kb: int = 200) -> list[bytes]:
     """
     批量压缩图片
@@ -0,0 +1,245 @@
+"""
+图片处理进程池
+
+压缩、缩略图、衍生图都是 Pillow 的 CPU 密集型操作，放在等待服务商 HTTP 响应的线程里执行时
+会和其他任务争抢 GIL。这里把它们交给独立的进程池执行：
+
+- 文件到文件的任务（缩略图、衍生图）只传路径，子进程自己读写文件
+- 内存中的图片通过共享内存交给子进程，避免把大块数据 pickle 进管道
+
+进程池关闭（IMAGE_PROCESS_WORKERS=0）或进程池异常时，退回到当前线程执行
+"""
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+from multiprocessing import shared_memory
+from typing import Dict, Any, BinaryIO, Callable, Iterator
+from backend.config import Config
+from .image_compressor import compress_image, resize_image
+
+logger = logging.getLogger(__name__)
+
+
+@contextmanager
+def open_file_atomic(path: str) -> Iterator[BinaryIO]:
+    """
+    以原子替换方式写文件：写入临时文件，正常退出时替换目标文件，出错时删除临时文件
+
+    用于边下载边写入的大文件，读取方不会拿到写了一半的文件
+    """
+    directory, name = os.path.split(path)
+    tmp_path = os.path.join(directory, f".{name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        with open(tmp_path, "wb") as f:
+            yield f
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def write_file_atomic(path: str, data: bytes):
+    """先写临时文件再原子替换，避免读取方拿到写了一半的文件"""
+    with open_file_atomic(path) as f:
+        f.write(data)
+
+
+# ==================== 子进程任务 ====================
+# 以下函数在子进程中执行，必须是模块级函数（spawn 模式下按名称导入）
+
+
+def _compress_shared(name: str, size: int, max_size_kb: int) -> bytes:
+    """从共享内存读取原图并压缩"""
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        image_data = bytes(shm.buf[:size])
+    finally:
+        shm.close()
+    return compress_image(image_data, max_size_kb=max_size_kb)
+
+
+def _compress_file(source_path: str, target_path: str, max_size_kb: int) -> int:
+    """读取原图文件，压缩后原子写入目标文件，返回写入的字节数"""
+    with open(source_path, "rb") as f:
+        image_data = f.read()
+    data = compress_image(image_data, max_size_kb=max_size_kb)
+    write_file_atomic(target_path, data)
+    return len(data)
+
+
+def _resize_file(source_path: str, target_path: str, width: int, fmt: str) -> int:
+    """读取原图文件，缩放并编码后原子写入目标文件，返回写入的字节数"""
+    with open(source_path, "rb") as f:
+        image_data = f.read()
+    data = resize_image(image_data, width, fmt)
+    write_file_atomic(target_path, data)
+    return len(data)
+
+
+# ==================== 进程池 ====================
+
+
+class ImageProcessPool:
+    """
+    图片处理进程池
+
+    子进程懒启动（spawn 模式，避免 fork 继承线程锁状态）；
+    workers 为 0 时所有操作都在调用线程中执行
+    """
+
+    def __init__(self, workers: int):
+        """
+        初始化进程池
+
+        Args:
+            workers: 子进程数，0 表示禁用进程池
+        """
+        self.workers = workers
+        self._executor = None
+        self._lock = threading.Lock()
+
+        # 统计计数
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            "offloaded": 0,
+            "inline": 0,
+            "fallbacks": 0,
+        }
+
+    @property
+    def enabled(self) -> bool:
+        return self.workers > 0
+
+    def _incr(self, key: str):
+        with self._stats_lock:
+            self._stats[key] += 1
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        """懒创建进程池"""
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn")
+                )
+                logger.info(f"图片处理进程池已启动: workers={self.workers}")
+            return self._executor
+
+    def _reset_executor(self, executor: ProcessPoolExecutor):
+        """丢弃已损坏的进程池，下次调用时重建"""
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def _run(self, job: Callable, args: tuple, inline: Callable[[], Any]) -> Any:
+        """
+        在进程池中执行 job(*args)，进程池不可用时执行 inline()
+
+        Args:
+            job: 子进程中执行的模块级函数
+            args: job 的参数（只包含路径、共享内存名等小对象）
+            inline: 在当前线程执行的等价操作
+        """
+        if not self.enabled:
+            self._incr("inline")
+            return inline()
+
+        executor = self._get_executor()
+        try:
+            result = executor.submit(job, *args).result()
+        except BrokenProcessPool as e:
+            logger.warning(f"图片处理进程池异常，改为在当前线程执行: {e}")
+            self._reset_executor(executor)
+            self._incr("fallbacks")
+            return inline()
+
+        self._incr("offloaded")
+        return result
+
+    def compress(self, image_data: bytes, max_size_kb: int = 200) -> bytes:
+        """
+        压缩内存中的图片（参数同 compress_image）
+
+        Args:
+            image_data: 原始图片数据
+            max_size_kb: 最大文件大小（KB）
+
+        Returns:
+            压缩后的图片数据
+        """
+        # 已满足大小要求时 compress_image 会直接返回原图，没必要跨进程
+        if len(image_data) <= max_size_kb * 1024:
+            return image_data
+        if not self.enabled:
+            self._incr("inline")
+            return compress_image(image_data, max_size_kb=max_size_kb)
+
+        shm = shared_memory.SharedMemory(create=True, size=len(image_data))
+        try:
+            shm.buf[:len(image_data)] = image_data
+            return self._run(
+                _compress_shared,
+                (shm.name, len(image_data), max_size_kb),
+                lambda: compress_image(image_data, max_size_kb=max_size_kb)
+            )
+        finally:
+            shm.close()
+            shm.unlink()
+
+    def compress_file(self, source_path: str, target_path: str, max_size_kb: int) -> int:
+        """
+        压缩图片文件并原子写入目标路径
+
+        Returns:
+            写入的字节数
+        """
+        args = (source_path, target_path, max_size_kb)
+        return self._run(_compress_file, args, lambda: _compress_file(*args))
+
+    def resize_file(self, source_path: str, target_path: str, width: int, fmt: str) -> int:
+        """
+        缩放图片文件并原子写入目标路径
+
+        Returns:
+            写入的字节数
+        """
+        args = (source_path, target_path, width, fmt)
+        return self._run(_resize_file, args, lambda: _resize_file(*args))
+
+    def shutdown(self):
+        """关闭进程池"""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+    def stats(self) -> Dict[str, Any]:
+        """获取进程池统计信息"""
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats["workers"] = self.workers
+        stats["started"] = self._executor is not None
+        return stats
+
+
+# 全局进程池实例
+_pool_instance = None
+_pool_lock = threading.Lock()
+
+
+def get_image_pool() -> ImageProcessPool:
+    """获取全局图片处理进程池"""
+    global _pool_instance
+    if _pool_instance is None:
+        with _pool_lock:
+            if _pool_instance is None:
+                _pool_instance = ImageProcessPool(Config.IMAGE_PROCESS_WORKERS)
+    return _pool_instance
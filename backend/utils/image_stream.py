@@ -0,0 +1,481 @@
+"""
+图片响应流式写入
+
+images 接口的 b64_json 响应一张 4K 图就有 20MB 以上，整体 response.json() 之后，
+base64 字符串、解码后的 bytes、保存前的副本会同时驻留内存，并发生成时就是内存尖峰的主要来源。
+这里按块读取响应：
+
+- Base64FieldDecoder 在 JSON 字节流中增量查找 b64_json 字段，边读边解码写入文件，
+  每张图只占用一个读取块的内存
+- copy_response 把图片下载响应按块写入文件
+
+两者都接受 cancel_event，置位时关闭连接并放弃（对冲请求中落败的一方）。
+异步生成引擎使用 adecode_b64_field / acopy_response，撤销通过撤销协程完成
+
+chat 接口通过流式文本返回图片（Markdown 链接或 data URI）时，ChatImageExtractor 边接收边扫描：
+链接完整后立即开始下载，base64 数据边到达边解码写入
+"""
+import binascii
+import json
+import logging
+import re
+from typing import Any, AsyncIterable, Awaitable, BinaryIO, Callable, Iterable, Optional
+from .retry_policy import KIND_NETWORK, KIND_UNKNOWN, ProviderError, RequestCancelled
+
+logger = logging.getLogger(__name__)
+
+# 每次从连接读取的字节数
+STREAM_CHUNK_SIZE = 64 * 1024
+# 未找到图片字段时最多缓存的响应大小（用于按普通 JSON 解析 url 字段或错误信息）
+MAX_BUFFERED = 1024 * 1024
+
+_SEARCH, _VALUE, _DONE = range(3)
+
+
+class Base64FieldDecoder:
+    """
+    增量查找 JSON 响应中第一个指定字段的字符串值，按 base64 分块解码后写入 out
+
+    支持值带 data URI 前缀（data:image/png;base64,）和 JSON 转义的斜杠（\\/）。
+    未找到字段时缓存响应（最多 MAX_BUFFERED 字节），调用方可以用 json() 按普通响应处理
+    """
+
+    def __init__(self, out: BinaryIO, field: str = "b64_json", max_buffered: int = MAX_BUFFERED):
+        """
+        Args:
+            out: 解码结果的写入目标（文件或 BytesIO）
+            field: 字段名
+            max_buffered: 未找到字段时最多缓存的响应大小
+        """
+        self.out = out
+        self.field = field
+        self.max_buffered = max_buffered
+        self.nbytes = 0
+        self.truncated = False
+
+        self._key = b'"' + field.encode("utf-8") + b'"'
+        self._state = _SEARCH
+        self._head = bytearray()
+        # 查找字段时跨块保留的数据（可能被截断的字段名）
+        self._scan = b""
+        # 字段值中跨块保留的数据：未处理完的原始字节（前缀、转义）和不足 4 字节的 base64
+        self._raw = b""
+        self._carry = b""
+        self._prefix_checked = False
+
+    @property
+    def found(self) -> bool:
+        """是否已找到字段"""
+        return self._state != _SEARCH
+
+    def feed(self, chunk: bytes):
+        """处理一块响应数据"""
+        if self._state == _DONE or not chunk:
+            return
+        if self._state == _SEARCH:
+            self._buffer(chunk)
+            chunk = self._find_value(self._scan + chunk)
+            if chunk is None:
+                return
+        self._feed_value(chunk)
+
+    def finish(self) -> int:
+        """
+        响应读取完毕
+
+        Returns:
+            写入的字节数（未找到字段时为 0）
+        """
+        if self._state == _VALUE:
+            # 连接提前断开，按网络错误重试
+            raise ProviderError(
+                f"响应在 {self.field} 数据结束前中断（已写入 {self.nbytes} bytes）",
+                kind=KIND_NETWORK
+            )
+        return self.nbytes
+
+    def json(self) -> Any:
+        """未找到字段时，把缓存的响应按普通 JSON 解析"""
+        if self.truncated:
+            raise ProviderError(
+                f"响应超过 {self.max_buffered // 1024}KB 且未找到 {self.field} 字段\n"
+                f"响应片段: {self.snippet()}",
+                kind=KIND_UNKNOWN
+            )
+        return json.loads(bytes(self._head))
+
+    def snippet(self, limit: int = 500) -> str:
+        """响应开头的片段（用于错误信息）"""
+        return bytes(self._head[:limit]).decode("utf-8", errors="replace")
+
+    def _buffer(self, chunk: bytes):
+        """找到字段前缓存响应，超出上限后只保留开头部分"""
+        if self.truncated:
+            return
+        if len(self._head) + len(chunk) > self.max_buffered:
+            self._head.extend(chunk[:self.max_buffered - len(self._head)])
+            self.truncated = True
+        else:
+            self._head.extend(chunk)
+
+    def _find_value(self, data: bytes) -> Optional[bytes]:
+        """查找 "字段": "，返回值开始之后的数据；还没出现时返回 None"""
+        start = 0
+        while True:
+            idx = data.find(self._key, start)
+            if idx < 0:
+                self._scan = data[-(len(self._key) - 1):]
+                return None
+            start = idx + 1
+            if idx > 0 and data[idx - 1:idx] == b"\\":
+                # 其他字符串值里的转义内容
+                continue
+            rest = data[idx + len(self._key):].lstrip()
+            if not rest:
+                self._scan = data[idx:]
+                return None
+            if rest[:1] != b":":
+                continue
+            value = rest[1:].lstrip()
+            if not value:
+                self._scan = data[idx:]
+                return None
+            if value[:1] != b'"':
+                # null 等非字符串值
+                continue
+            self._state = _VALUE
+            self._scan = b""
+            self._head.clear()
+            return value[1:]
+
+    def _feed_value(self, chunk: bytes):
+        """解码字段值中的一块数据"""
+        data = self._raw + chunk
+        self._raw = b""
+        end = data.find(b'"')
+        done = end >= 0
+        if done:
+            data = data[:end]
+
+        if not self._prefix_checked:
+            # data URI 前缀，前缀完整到达前先保留
+            if not done and len(data) < 5 and b"data:".startswith(data):
+                self._raw = data
+                return
+            if data.startswith(b"data:"):
+                comma = data.find(b",")
+                if comma < 0:
+                    if done:
+                        raise ProviderError(f"{self.field} 字段的 data URI 格式无效", kind=KIND_UNKNOWN)
+                    self._raw = data
+                    return
+                data = data[comma + 1:]
+            self._prefix_checked = True
+
+        if b"\\" in data:
+            if not done and data.endswith(b"\\"):
+                # 转义序列被分块截断，留到下一块
+                data, self._raw = data[:-1], b"\\"
+            data = data.replace(b"\\/", b"/").replace(b"\\n", b"").replace(b"\\r", b"")
+        data = self._carry + data.translate(None, b" \t\r\n")
+
+        if done:
+            usable = data + b"=" * (-len(data) % 4)
+            self._carry = b""
+            self._state = _DONE
+        else:
+            cut = len(data) - len(data) % 4
+            usable, self._carry = data[:cut], data[cut:]
+
+        if usable:
+            try:
+                decoded = binascii.a2b_base64(usable)
+            except binascii.Error as e:
+                raise ProviderError(f"{self.field} 字段不是有效的 base64 数据: {e}", kind=KIND_UNKNOWN) from e
+            self.out.write(decoded)
+            self.nbytes += len(decoded)
+
+
+def _check_cancelled(response, cancel_event):
+    """cancel_event 置位时关闭连接并抛出 RequestCancelled"""
+    if cancel_event is not None and cancel_event.is_set():
+        response.close()
+        raise RequestCancelled()
+
+
+def decode_b64_field(
+    response,
+    out: BinaryIO,
+    field: str = "b64_json",
+    cancel_event=None
+) -> Base64FieldDecoder:
+    """
+    按块读取 JSON 响应（请求需使用 stream=True），把图片字段解码写入 out
+
+    Args:
+        response: requests.Response 或接口相同的响应对象
+        out: 写入目标
+        field: 图片字段名
+        cancel_event: 置位时关闭连接并放弃
+
+    Returns:
+        解码器：found 为 True 时 nbytes 为写入的字节数，否则可用 json() 按普通响应处理
+    """
+    decoder = Base64FieldDecoder(out, field)
+    for chunk in response.iter_content(chunk_size=STREAM_CHUNK_SIZE):
+        _check_cancelled(response, cancel_event)
+        decoder.feed(chunk)
+    decoder.finish()
+    return decoder
+
+
+def copy_response(response, out: BinaryIO, cancel_event=None) -> int:
+    """
+    按块把响应内容写入 out（请求需使用 stream=True）
+
+    Returns:
+        写入的字节数
+    """
+    nbytes = 0
+    for chunk in response.iter_content(chunk_size=STREAM_CHUNK_SIZE):
+        _check_cancelled(response, cancel_event)
+        out.write(chunk)
+        nbytes += len(chunk)
+    return nbytes
+
+
+async def adecode_b64_field(response, out: BinaryIO, field: str = "b64_json") -> Base64FieldDecoder:
+    """
+    decode_b64_field 的异步版本
+
+    Args:
+        response: AsyncHttpSession.stream 产出的响应对象
+        out: 写入目标
+        field: 图片字段名
+    """
+    decoder = Base64FieldDecoder(out, field)
+    async for chunk in response.aiter_bytes(STREAM_CHUNK_SIZE):
+        decoder.feed(chunk)
+    decoder.finish()
+    return decoder
+
+
+async def acopy_response(response, out: BinaryIO) -> int:
+    """copy_response 的异步版本"""
+    nbytes = 0
+    async for chunk in response.aiter_bytes(STREAM_CHUNK_SIZE):
+        out.write(chunk)
+        nbytes += len(chunk)
+    return nbytes
+
+
+# chat 接口内容中的图片起点：data URI 的 base64 数据开始处，或 URL
+_CHAT_IMAGE_START = re.compile(r"data:image/[^;,\s]*;base64,|https?://")
+# URL 结束字符
+_URL_END = re.compile(r"[\s)\"'<>]")
+# base64 数据结束字符
+_BASE64_END = re.compile(r"[^A-Za-z0-9+/=]")
+_IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".gif", ".webp")
+# 判断 URL 是否为 Markdown 图片时向前查看的长度；未识别出图片起点时也保留这么长的尾部
+# （起点标记可能被分块截断，Markdown 图片的 ![alt]( 也需要保留）
+_MARKDOWN_CONTEXT = 256
+# URL 最大长度，超出时放弃该候选
+_MAX_URL_LENGTH = 8192
+
+
+class ChatImageExtractor:
+    """
+    在 chat 接口的流式文本中一次扫描找出图片，文本边到达边处理
+
+    支持的格式（按出现顺序取第一个）：
+    - data:image/xxx;base64,xxx（含 Markdown 图片中的 data URI）：边到达边解码写入 out
+    - Markdown 图片链接 ![xxx](url) 或带图片扩展名的 URL：链接完整后即可下载（url 属性）
+    - 其他 http(s) URL：流结束仍没有更好的结果时作为兜底
+    """
+
+    def __init__(self, out: BinaryIO):
+        """
+        Args:
+            out: base64 图片的写入目标
+        """
+        self.out = out
+        # 图片链接（Markdown 图片、带图片扩展名的 URL，或流结束后的兜底 URL）
+        self.url: Optional[str] = None
+        # base64 图片解码写入的字节数
+        self.nbytes = 0
+        # 收到的文本总长度
+        self.length = 0
+
+        self._head = ""
+        self._buffer = ""
+        self._fallback_url: Optional[str] = None
+        self._in_base64 = False
+        self._carry = ""
+        self._done = False
+
+    @property
+    def found(self) -> bool:
+        """是否已确定图片（base64 已写完，或已得到图片链接）"""
+        return self._done
+
+    @property
+    def is_base64(self) -> bool:
+        """图片是否来自 base64 数据"""
+        return self._done and self.url is None
+
+    def feed(self, text: str):
+        """处理一段文本"""
+        self.length += len(text)
+        if len(self._head) < 500:
+            self._head += text[:500 - len(self._head)]
+        if self._done or not text:
+            return
+
+        self._buffer += text
+        while not self._done:
+            if self._in_base64:
+                self._feed_base64()
+                return
+
+            match = _CHAT_IMAGE_START.search(self._buffer)
+            if match is None:
+                self._buffer = self._buffer[-_MARKDOWN_CONTEXT:]
+                return
+
+            if match.group().startswith("data:"):
+                logger.info("检测到 Base64 图片数据，边接收边解码")
+                self._in_base64 = True
+                self._buffer = self._buffer[match.end():]
+                continue
+
+            end = _URL_END.search(self._buffer, match.end())
+            if end is None:
+                # URL 还没结束，保留起点之前的上下文用于判断是否为 Markdown 图片
+                if len(self._buffer) - match.start() > _MAX_URL_LENGTH:
+                    self._buffer = self._buffer[match.end():]
+                    continue
+                self._buffer = self._buffer[max(0, match.start() - _MARKDOWN_CONTEXT):]
+                return
+            self._accept_url(self._buffer[match.start():end.start()], self._buffer[:match.start()])
+            self._buffer = self._buffer[end.start():]
+
+    def finish(self):
+        """文本结束：完成未结束的 base64 或 URL，没有更好的结果时使用兜底 URL"""
+        if not self._done:
+            if self._in_base64:
+                self._finish_base64()
+            else:
+                match = _CHAT_IMAGE_START.search(self._buffer)
+                if match is not None and match.group().startswith("http"):
+                    self._accept_url(self._buffer[match.start():], self._buffer[:match.start()])
+        self._buffer = ""
+        if not self._done and self._fallback_url:
+            logger.info("检测到可能的图片 URL，尝试下载...")
+            self.url = self._fallback_url
+            self._done = True
+
+    def snippet(self) -> str:
+        """文本开头的片段（用于错误信息）"""
+        return self._head
+
+    def _accept_url(self, url: str, before: str):
+        """记录一个 URL：Markdown 图片或带图片扩展名的 URL 立即采用，其他 URL 作为兜底"""
+        context = before[-_MARKDOWN_CONTEXT:]
+        markdown = context.endswith("](") and "![" in context
+        path = url.split("?", 1)[0].split("#", 1)[0].lower()
+        if markdown or path.endswith(_IMAGE_EXTENSIONS):
+            logger.info(f"检测到图片 URL（{'Markdown' if markdown else '图片扩展名'}）: {url[:100]}")
+            self.url = url
+            self._done = True
+        elif self._fallback_url is None:
+            self._fallback_url = url
+
+    def _feed_base64(self):
+        """解码缓冲区中的 base64 数据，遇到非 base64 字符时结束"""
+        end = _BASE64_END.search(self._buffer)
+        data = self._buffer if end is None else self._buffer[:end.start()]
+        self._buffer = ""
+        if end is not None:
+            self._carry += data
+            self._finish_base64()
+            return
+        data = self._carry + data
+        cut = len(data) - len(data) % 4
+        self._carry = data[cut:]
+        self._write_base64(data[:cut])
+
+    def _finish_base64(self):
+        """写入剩余的 base64 数据"""
+        data = self._carry
+        self._carry = ""
+        if data:
+            self._write_base64(data + "=" * (-len(data) % 4))
+        self._in_base64 = False
+        self._done = self.nbytes > 0
+
+    def _write_base64(self, data: str):
+        if not data:
+            return
+        try:
+            decoded = binascii.a2b_base64(data)
+        except binascii.Error as e:
+            raise ProviderError(f"图片 base64 数据无效: {e}", kind=KIND_UNKNOWN) from e
+        self.out.write(decoded)
+        self.nbytes += len(decoded)
+
+
+def write_chat_image(
+    contents: Iterable[str],
+    out: BinaryIO,
+    download: Callable[[str], int]
+) -> ChatImageExtractor:
+    """
+    从 chat 接口的流式文本中提取图片写入 out
+
+    图片链接一出现就开始下载，不等待流结束；下载完成后继续读完剩余的流，连接可以复用
+
+    Args:
+        contents: 流式文本（如 iter_chat_content 的结果）
+        out: 写入目标
+        download: 下载图片链接并写入 out 的函数，返回写入的字节数
+
+    Returns:
+        提取器：found 为 False 表示没有找到图片，nbytes 为写入的字节数
+    """
+    extractor = ChatImageExtractor(out)
+    downloaded = False
+    for text in contents:
+        extractor.feed(text)
+        if extractor.url and not downloaded:
+            extractor.nbytes = download(extractor.url)
+            downloaded = True
+    extractor.finish()
+    if extractor.url and not downloaded:
+        extractor.nbytes = download(extractor.url)
+    return extractor
+
+
+async def awrite_chat_image(
+    contents: AsyncIterable[str],
+    out: BinaryIO,
+    download: Callable[[str], Awaitable[int]]
+) -> ChatImageExtractor:
+    """
+    write_chat_image 的异步版本
+
+    Args:
+        contents: 流式文本（如 aiter_chat_content 的结果）
+        out: 写入目标
+        download: 下载图片链接并写入 out 的协程函数，返回写入的字节数
+    """
+    extractor = ChatImageExtractor(out)
+    downloaded = False
+    async for text in contents:
+        extractor.feed(text)
+        if extractor.url and not downloaded:
+            extractor.nbytes = await download(extractor.url)
+            downloaded = True
+    extractor.finish()
+    if extractor.url and not downloaded:
+        extractor.nbytes = await download(extractor.url)
+    return extractor
@@ -0,0 +1,486 @@
+"""
+跨进程并发限制（租约）
+
+调度器和自适应并发限制器都只在单个进程内生效。部署多个 gunicorn worker 或多个副本时，
+每个进程各自按 max_concurrent 发请求，合计会远超服务商的并发上限。
+
+LeaseLimiter 在发请求前向共享后端申请一个租约，同一服务商所有进程持有的租约数不超过上限：
+- 租约带有效期，持有期间由后台线程定期续期；进程崩溃或被杀后不再续期，租约到期自动失效
+- 后端可替换：
+  - sqlite：同一台机器上的多个进程共享一个 SQLite 文件（默认 history/leases.db）
+  - redis：多台机器共享一个 Redis（需要安装 redis 包）
+- CONCURRENCY_BACKEND 未配置（默认 local）时不启用，只使用进程内的限制
+
+图片生成调度器在准入时用 try_acquire 申请租约，已达上限时页面回到队列稍后再试，不在工作线程中轮询等待
+"""
+import asyncio
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict, Optional
+from backend.config import Config
+from backend.utils.retry_policy import RequestCancelled
+
+logger = logging.getLogger(__name__)
+
+BACKEND_LOCAL = "local"
+BACKEND_SQLITE = "sqlite"
+BACKEND_REDIS = "redis"
+
+# 等待租约时的轮询间隔（秒）；调度器准入时租约已满的页面也隔这么久再试
+POLL_INTERVAL = 0.2
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS leases (
+    lease_id TEXT PRIMARY KEY,
+    key TEXT NOT NULL,
+    holder TEXT NOT NULL,
+    expires_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_leases_key ON leases (key, expires_at);
+"""
+
+
+class LeaseBackend:
+    """租约后端接口"""
+
+    name = ""
+
+    def try_acquire(self, key: str, limit: int, holder: str, ttl: float) -> Optional[str]:
+        """
+        尝试获取一个租约
+
+        Args:
+            key: 限制的对象（如 image:gemini）
+            limit: 所有进程合计的租约上限
+            holder: 持有方标识（用于排查，如 主机名:进程号）
+            ttl: 租约有效期（秒）
+
+        Returns:
+            租约 ID；已达上限时返回 None
+        """
+        raise NotImplementedError
+
+    def renew(self, key: str, lease_id: str, ttl: float) -> bool:
+        """续期租约，租约已失效时返回 False"""
+        raise NotImplementedError
+
+    def release(self, key: str, lease_id: str):
+        """释放租约"""
+        raise NotImplementedError
+
+    def active(self, key: str) -> int:
+        """当前有效的租约数（所有进程合计）"""
+        raise NotImplementedError
+
+
+class SQLiteLeaseBackend(LeaseBackend):
+    """基于 SQLite 文件的租约后端（同一台机器上的多个进程）"""
+
+    name = BACKEND_SQLITE
+
+    def __init__(self, db_path: str):
+        """
+        Args:
+            db_path: 数据库文件路径
+        """
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+
+    def try_acquire(self, key: str, limit: int, holder: str, ttl: float) -> Optional[str]:
+        lease_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            # BEGIN IMMEDIATE 取得数据库写锁，检查和插入之间其他进程无法插入
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute("DELETE FROM leases WHERE key = ? AND expires_at <= ?", (key, now))
+                (count,) = self._conn.execute(
+                    "SELECT COUNT(*) FROM leases WHERE key = ?", (key,)
+                ).fetchone()
+                acquired = count < limit
+                if acquired:
+                    self._conn.execute(
+                        "INSERT INTO leases (lease_id, key, holder, expires_at) VALUES (?, ?, ?, ?)",
+                        (lease_id, key, holder, now + ttl)
+                    )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return lease_id if acquired else None
+
+    def renew(self, key: str, lease_id: str, ttl: float) -> bool:
+        now = time.time()
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE leases SET expires_at = ? WHERE lease_id = ? AND expires_at > ?",
+                (now + ttl, lease_id, now)
+            )
+        return cursor.rowcount > 0
+
+    def release(self, key: str, lease_id: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM leases WHERE lease_id = ?", (lease_id,))
+
+    def active(self, key: str) -> int:
+        with self._lock:
+            (count,) = self._conn.execute(
+                "SELECT COUNT(*) FROM leases WHERE key = ? AND expires_at > ?", (key, time.time())
+            ).fetchone()
+        return count
+
+
+class RedisLeaseBackend(LeaseBackend):
+    """
+    基于 Redis 的租约后端（多台机器）
+
+    每个限制对象一个有序集合，成员为租约 ID、分数为到期时间（使用 Redis 服务器时间，
+    不受各机器时钟偏差影响）。检查和占用在 WATCH/MULTI 事务中完成
+    """
+
+    name = BACKEND_REDIS
+
+    def __init__(self, url: Optional[str] = None, client: Any = None, prefix: str = "redink:lease:"):
+        """
+        Args:
+            url: Redis 地址，如 redis://localhost:6379/0
+            client: 已创建的 Redis 客户端（与 redis.Redis 接口兼容），传入时忽略 url
+            prefix: 键名前缀
+        """
+        if client is None:
+            try:
+                import redis
+            except ImportError as e:
+                raise RuntimeError("使用 redis 并发后端需要安装 redis 包：pip install redis") from e
+            client = redis.Redis.from_url(url)
+        self._client = client
+        self._prefix = prefix
+
+    def _now(self) -> float:
+        seconds, microseconds = self._client.time()
+        return seconds + microseconds / 1_000_000
+
+    def try_acquire(self, key: str, limit: int, holder: str, ttl: float) -> Optional[str]:
+        from redis.exceptions import WatchError
+
+        name = self._prefix + key
+        lease_id = f"{holder}:{uuid.uuid4().hex}"
+        with self._client.pipeline() as pipe:
+            while True:
+                try:
+                    pipe.watch(name)
+                    now = self._now()
+                    if pipe.zcount(name, f"({now}", "+inf") >= limit:
+                        pipe.unwatch()
+                        return None
+                    pipe.multi()
+                    pipe.zremrangebyscore(name, "-inf", now)
+                    pipe.zadd(name, {lease_id: now + ttl})
+                    # 所有进程都退出后键自动过期
+                    pipe.expire(name, int(ttl) + 60)
+                    pipe.execute()
+                    return lease_id
+                except WatchError:
+                    # 其他进程同时修改了租约，重新检查
+                    continue
+
+    def renew(self, key: str, lease_id: str, ttl: float) -> bool:
+        from redis.exceptions import WatchError
+
+        name = self._prefix + key
+        with self._client.pipeline() as pipe:
+            while True:
+                try:
+                    pipe.watch(name)
+                    now = self._now()
+                    expires_at = pipe.zscore(name, lease_id)
+                    if expires_at is None or expires_at <= now:
+                        pipe.unwatch()
+                        return False
+                    pipe.multi()
+                    pipe.zadd(name, {lease_id: now + ttl}, xx=True)
+                    pipe.expire(name, int(ttl) + 60)
+                    pipe.execute()
+                    return True
+                except WatchError:
+                    continue
+
+    def release(self, key: str, lease_id: str):
+        self._client.zrem(self._prefix + key, lease_id)
+
+    def active(self, key: str) -> int:
+        return self._client.zcount(self._prefix + key, f"({self._now()}", "+inf")
+
+
+class LeaseLimiter:
+    """所有进程共享上限的并发限制器"""
+
+    def __init__(
+        self,
+        backend: LeaseBackend,
+        key: str,
+        limit: int,
+        ttl: float = 30,
+        holder: Optional[str] = None
+    ):
+        """
+        Args:
+            backend: 租约后端
+            key: 限制的对象（如 image:gemini）
+            limit: 所有进程合计的并发上限
+            ttl: 租约有效期（秒），持有期间每 ttl/3 秒续期一次
+            holder: 持有方标识，默认 主机名:进程号
+        """
+        self.backend = backend
+        self.key = key
+        self.limit = max(1, limit)
+        self.ttl = ttl
+        self.holder = holder or f"{_hostname()}:{os.getpid()}"
+        self._lock = threading.Lock()
+        self._held: Dict[str, float] = {}
+        self._renewer: Optional[threading.Thread] = None
+
+        # 统计计数
+        self.acquired = 0
+        self.waited_seconds = 0.0
+        self.lost = 0
+        self.backend_errors = 0
+
+    def _try_backend(self) -> Optional[str]:
+        """
+        向后端申请一次租约
+
+        Returns:
+            租约 ID；已达上限时返回 None；后端不可用时返回空字符串（本次不占用租约）
+        """
+        try:
+            return self.backend.try_acquire(self.key, self.limit, self.holder, self.ttl)
+        except Exception as e:
+            # 后端不可用时不阻塞生成，退回只使用进程内的限制
+            with self._lock:
+                self.backend_errors += 1
+            logger.warning(f"并发租约后端不可用（{self.backend.name}），本次不占用租约: {e}")
+            return ""
+
+    def _hold(self, lease_id: str, started: float):
+        """登记取得的租约并启动续期"""
+        waited = time.monotonic() - started
+        with self._lock:
+            self._held[lease_id] = time.monotonic()
+            self.acquired += 1
+            self.waited_seconds += waited
+            self._ensure_renewer()
+        if waited >= 1:
+            logger.debug(f"等待并发租约 {self.key}: {waited:.1f}s")
+
+    def try_acquire(self) -> Optional[str]:
+        """
+        不等待地获取一个租约（图片生成调度器准入时使用，已达上限时页面回到队列稍后再试）
+
+        Returns:
+            租约 ID；已达上限时返回 None；后端不可用时返回空字符串（本次不占用租约）
+        """
+        started = time.monotonic()
+        lease_id = self._try_backend()
+        if lease_id:
+            self._hold(lease_id, started)
+        return lease_id
+
+    def acquire(self, cancel_event: Optional[threading.Event] = None) -> str:
+        """
+        获取一个租约，已达上限时等待
+
+        Args:
+            cancel_event: 置位时停止等待并抛出 RequestCancelled（对冲请求中落败的一方）
+
+        Returns:
+            租约 ID
+        """
+        started = time.monotonic()
+        while True:
+            lease_id = self._try_backend()
+            if lease_id is not None:
+                break
+            if cancel_event is None:
+                time.sleep(POLL_INTERVAL)
+            elif cancel_event.wait(POLL_INTERVAL):
+                raise RequestCancelled()
+        if lease_id:
+            self._hold(lease_id, started)
+        return lease_id
+
+    async def aacquire(self) -> str:
+        """acquire 的异步版本：后端调用在线程池中执行，轮询等待期间让出事件循环"""
+        started = time.monotonic()
+        while True:
+            lease_id = await asyncio.to_thread(self._try_backend)
+            if lease_id is not None:
+                break
+            await asyncio.sleep(POLL_INTERVAL)
+        if lease_id:
+            self._hold(lease_id, started)
+        return lease_id
+
+    def release(self, lease_id: str):
+        """释放租约"""
+        if not lease_id:
+            return
+        with self._lock:
+            self._held.pop(lease_id, None)
+        try:
+            self.backend.release(self.key, lease_id)
+        except Exception as e:
+            # 释放失败时租约到期后自动失效
+            logger.warning(f"释放并发租约失败 {self.key}: {e}")
+
+    def call(self, fn: Callable, *args, **kwargs) -> Any:
+        """持有一个租约执行 fn"""
+        lease_id = self.acquire()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            self.release(lease_id)
+
+    async def acall(self, fn: Callable[..., Awaitable], *args, **kwargs) -> Any:
+        """call 的异步版本：fn 为协程函数"""
+        lease_id = await self.aacquire()
+        try:
+            return await fn(*args, **kwargs)
+        finally:
+            if lease_id:
+                await asyncio.shield(asyncio.to_thread(self.release, lease_id))
+
+    def _ensure_renewer(self):
+        """启动续期线程（调用方需持有锁）"""
+        if self._renewer is None or not self._renewer.is_alive():
+            self._renewer = threading.Thread(
+                target=self._renew_loop, name=f"lease-renew-{self.key}", daemon=True
+            )
+            self._renewer.start()
+
+    def _renew_loop(self):
+        """定期续期持有中的租约，没有租约时退出"""
+        while True:
+            time.sleep(self.ttl / 3)
+            with self._lock:
+                held = list(self._held)
+                if not held:
+                    self._renewer = None
+                    return
+            for lease_id in held:
+                try:
+                    renewed = self.backend.renew(self.key, lease_id, self.ttl)
+                except Exception as e:
+                    logger.warning(f"续期并发租约失败 {self.key}: {e}")
+                    continue
+                if not renewed:
+                    with self._lock:
+                        if self._held.pop(lease_id, None) is not None:
+                            self.lost += 1
+                    logger.warning(f"并发租约已失效 {self.key}（续期不及时），请求继续执行")
+
+    def stats(self) -> Dict[str, Any]:
+        """获取限制器状态"""
+        try:
+            active = self.backend.active(self.key)
+        except Exception:
+            active = None
+        with self._lock:
+            return {
+                "backend": self.backend.name,
+                "limit": self.limit,
+                "active": active,
+                "held": len(self._held),
+                "acquired": self.acquired,
+                "waited_seconds": round(self.waited_seconds, 3),
+                "lost": self.lost,
+                "backend_errors": self.backend_errors,
+            }
+
+
+def _hostname() -> str:
+    return os.environ.get("HOSTNAME") or socket.gethostname()
+
+
+def create_lease_backend(backend: str) -> Optional[LeaseBackend]:
+    """
+    按名称创建租约后端
+
+    Args:
+        backend: local / sqlite / redis
+
+    Returns:
+        租约后端；local 时返回 None
+    """
+    if backend == BACKEND_SQLITE:
+        db_path = Config.CONCURRENCY_DB_PATH or os.path.join(
+            os.path.dirname(os.path.dirname(os.path.dirname(__file__))), "history", "leases.db"
+        )
+        return SQLiteLeaseBackend(db_path)
+    if backend == BACKEND_REDIS:
+        if not Config.CONCURRENCY_REDIS_URL:
+            raise ValueError("CONCURRENCY_BACKEND=redis 时需要配置 CONCURRENCY_REDIS_URL")
+        return RedisLeaseBackend(Config.CONCURRENCY_REDIS_URL)
+    if backend != BACKEND_LOCAL:
+        raise ValueError(f"未知的并发后端: {backend}（可选 local / sqlite / redis）")
+    return None
+
+
+# 全局租约限制器（按 类型:服务商名）
+_backend: Optional[LeaseBackend] = None
+_backend_created = False
+_limiters: Dict[str, LeaseLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_lease_limiter(kind: str, provider_name: str, provider_config: Dict[str, Any]) -> Optional[LeaseLimiter]:
+    """
+    获取服务商的跨进程并发限制器；未启用跨进程限制时返回 None
+
+    所有进程合计的上限为服务商并发上限可以探测到的上界（max_concurrent_ceiling，
+    见 Config.get_provider_concurrency），各进程的自适应并发上限在其中增减
+
+    Args:
+        kind: "image" 或 "text"
+        provider_name: 服务商名称
+        provider_config: 服务商配置
+    """
+    global _backend, _backend_created
+    limit = Config.get_provider_concurrency(provider_config)[1]
+    key = f"{kind}:{provider_name}"
+
+    with _limiters_lock:
+        if not _backend_created:
+            _backend = create_lease_backend(Config.CONCURRENCY_BACKEND)
+            _backend_created = True
+            if _backend is not None:
+                logger.info(f"启用跨进程并发限制: backend={_backend.name}, ttl={Config.CONCURRENCY_LEASE_TTL}s")
+        if _backend is None:
+            return None
+
+        limiter = _limiters.get(key)
+        if limiter is None:
+            limiter = LeaseLimiter(_backend, key, limit, ttl=Config.CONCURRENCY_LEASE_TTL)
+            _limiters[key] = limiter
+            logger.info(f"初始化跨进程并发限制器: {key}, limit={limiter.limit}")
+        else:
+            # 配置变更后在线生效
+            limiter.limit = max(1, limit)
+    return limiter
+
+
+def get_lease_stats() -> Dict[str, Dict[str, Any]]:
+    """获取所有跨进程并发限制器的状态"""
+    with _limiters_lock:
+        limiters = dict(_limiters)
+    return {key: limiter.stats() for key, limiter in limiters.items()}
@@ -0,0 +1,11 @@
+"""路径工具"""
+import os
+
+
+def is_single_path_segment(name: str) -> bool:
+    """
+    是否为单层文件名或目录名（不含路径分隔符，也不是 "." / ".."）
+
+    用于校验来自请求的任务 ID、图片文件名，拼接到 history 目录下时不会指向目录之外
+    """
+    return bool(name) and name not in (".", "..") and os.sep not in name and "/" not in name
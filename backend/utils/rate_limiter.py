@@ -0,0 +1,341 @@
+"""
+服务商请求速率限制（令牌桶）
+
+每个服务商一个令牌桶，由该服务商的所有调用方共享：
+- 服务商配置 rpm / rps 时按该速率发放令牌，未配置时不限速
+- 响应中带有 Retry-After 或 x-ratelimit-* 头（或 429 错误里带有 retryDelay）时，
+  暂停整个桶直到限额恢复，所有调用方一起等待，而不是各自撞 429 再重试
+
+图片生成调度器在准入时用 try_acquire 取令牌：桶暂停或没有令牌时页面带着 not_before 回到队列，
+不在工作线程中睡眠等待
+"""
+import asyncio
+import email.utils
+import logging
+import re
+import threading
+import time
+from typing import Any, Dict, Mapping, Optional, Tuple
+from backend.utils.retry_policy import RequestCancelled
+
+logger = logging.getLogger(__name__)
+
+# 单次暂停的最长时间，避免异常的响应头把服务商卡死
+MAX_PAUSE_SECONDS = 120
+
+_DURATION_PART = re.compile(r'(\d+(?:\.\d+)?)(ms|h|m|s)')
+_RETRY_DELAY = re.compile(r"""retry[_ ]?delay['"]?\s*[:=]\s*['"]?(\d+(?:\.\d+)?)s""", re.IGNORECASE)
+
+
+def parse_duration(value: str) -> Optional[float]:
+    """
+    解析时长字符串为秒数
+
+    支持纯数字（秒）和 OpenAI 风格的 "1m30s" / "6.5s" / "20ms"
+    """
+    value = (value or "").strip()
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+
+    parts = _DURATION_PART.findall(value)
+    if not parts:
+        return None
+    units = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+    return sum(float(number) * units[unit] for number, unit in parts)
+
+
+def parse_retry_after(value: str) -> Optional[float]:
+    """解析 Retry-After 头（秒数或 HTTP 日期），返回需要等待的秒数"""
+    value = (value or "").strip()
+    if not value:
+        return None
+    if value.replace('.', '', 1).isdigit():
+        return float(value)
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, retry_at.timestamp() - time.time())
+
+
+def wait_from_headers(status_code: int, headers: Mapping[str, str]) -> Optional[float]:
+    """
+    从响应头推算需要暂停的秒数
+
+    Args:
+        status_code: HTTP 状态码
+        headers: 响应头（大小写不敏感的映射）
+
+    Returns:
+        需要暂停的秒数；无需暂停时返回 None
+    """
+    retry_after = parse_retry_after(headers.get('Retry-After', ''))
+    if retry_after is not None and (status_code == 429 or status_code >= 500):
+        return retry_after
+
+    # 请求配额已用尽：等到配额重置
+    for kind in ('requests', 'tokens'):
+        remaining = headers.get(f'x-ratelimit-remaining-{kind}')
+        if remaining is not None and remaining.strip() == '0':
+            reset = parse_duration(headers.get(f'x-ratelimit-reset-{kind}', ''))
+            if reset is not None:
+                return reset
+
+    if status_code == 429:
+        return retry_after
+    return None
+
+
+class TokenBucket:
+    """可暂停的令牌桶"""
+
+    def __init__(self, name: str, rate: Optional[float] = None, burst: int = 1):
+        """
+        Args:
+            name: 名称（用于日志和状态展示）
+            rate: 每秒发放的令牌数，None 表示不限速（仍然支持暂停）
+            burst: 桶容量（允许的突发请求数）
+        """
+        self.name = name
+        self._lock = threading.Lock()
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._updated_at = time.monotonic()
+        self._paused_until = 0.0
+
+        # 统计计数
+        self.acquired = 0
+        self.waited_seconds = 0.0
+        self.pauses = 0
+
+    def configure(self, rate: Optional[float], burst: int):
+        """在线调整速率和容量"""
+        with self._lock:
+            self._refill(time.monotonic())
+            self.rate = rate
+            self.burst = max(1, burst)
+            self._tokens = min(self._tokens, float(self.burst))
+
+    def _refill(self, now: float):
+        """按经过的时间补充令牌（调用方需持有锁）"""
+        if self.rate:
+            self._tokens = min(float(self.burst), self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    def _try_acquire(self) -> Tuple[Optional[float], bool]:
+        """
+        尝试取得令牌
+
+        Returns:
+            (wait, reserved)：wait 为 None 表示已取得；否则需要等待 wait 秒，
+            reserved 为 True 表示已预约令牌，等待后调用 _claim_reserved 确认
+        """
+        with self._lock:
+            now = time.monotonic()
+            if now < self._paused_until:
+                return self._paused_until - now, False
+            if not self.rate:
+                return None, False
+            self._refill(now)
+            # 预约令牌：令牌可以透支，透支部分就是需要等待的时间
+            self._tokens -= 1
+            if self._tokens >= 0:
+                return None, False
+            return -self._tokens / self.rate, True
+
+    def _claim_reserved(self) -> bool:
+        """等待结束后确认预约的令牌；等待期间桶被暂停时归还令牌，返回 False 重新排队"""
+        with self._lock:
+            if time.monotonic() >= self._paused_until:
+                return True
+            self._tokens += 1
+            return False
+
+    def _record_acquired(self, started: float):
+        waited = time.monotonic() - started
+        with self._lock:
+            self.acquired += 1
+            self.waited_seconds += waited
+        if waited > 1:
+            logger.debug(f"[{self.name}] 速率限制等待 {waited:.1f}s")
+
+    def acquire(self, cancel_event: Optional[threading.Event] = None):
+        """
+        取得一个令牌，必要时阻塞等待（包括等待暂停结束）
+
+        Args:
+            cancel_event: 置位时停止等待，归还预约的令牌并抛出 RequestCancelled（对冲请求中落败的一方）
+        """
+        started = time.monotonic()
+        while True:
+            wait, reserved = self._try_acquire()
+            if wait is None:
+                break
+            # 在锁外睡眠，其他调用方可以继续预约后面的令牌
+            if cancel_event is None:
+                time.sleep(min(wait, MAX_PAUSE_SECONDS))
+            elif cancel_event.wait(min(wait, MAX_PAUSE_SECONDS)):
+                if reserved:
+                    with self._lock:
+                        self._tokens += 1
+                raise RequestCancelled()
+            if reserved and self._claim_reserved():
+                break
+        self._record_acquired(started)
+
+    def try_acquire(self) -> Optional[float]:
+        """
+        不等待地取得一个令牌（取不到时不预约，不影响其他调用方）
+
+        Returns:
+            None 表示已取得；否则为预计需要等待的秒数（暂停剩余时间或令牌补充时间）
+        """
+        with self._lock:
+            now = time.monotonic()
+            if now < self._paused_until:
+                return self._paused_until - now
+            if self.rate:
+                self._refill(now)
+                if self._tokens < 1:
+                    return (1 - self._tokens) / self.rate
+                self._tokens -= 1
+            self.acquired += 1
+        return None
+
+    def refund(self):
+        """归还 try_acquire 取得但没有使用的令牌"""
+        with self._lock:
+            if self.rate:
+                self._tokens = min(float(self.burst), self._tokens + 1)
+            self.acquired -= 1
+
+    async def aacquire(self):
+        """acquire 的异步版本：等待期间让出事件循环"""
+        started = time.monotonic()
+        while True:
+            wait, reserved = self._try_acquire()
+            if wait is None:
+                break
+            try:
+                await asyncio.sleep(min(wait, MAX_PAUSE_SECONDS))
+            except asyncio.CancelledError:
+                if reserved:
+                    # 等待期间被撤销：归还预约的令牌
+                    with self._lock:
+                        self._tokens += 1
+                raise
+            if reserved and self._claim_reserved():
+                break
+        self._record_acquired(started)
+
+    def pause(self, seconds: float, reason: str = ""):
+        """暂停发放令牌（所有调用方共享）"""
+        seconds = min(max(0.0, seconds), MAX_PAUSE_SECONDS)
+        if seconds <= 0:
+            return
+        with self._lock:
+            until = time.monotonic() + seconds
+            if until <= self._paused_until:
+                return
+            self._paused_until = until
+            # 恢复后从空桶开始，按速率逐个放行，避免暂停结束时集中涌出
+            self._tokens = min(self._tokens, 0.0)
+            self.pauses += 1
+        logger.warning(f"[{self.name}] 服务商限流，暂停请求 {seconds:.1f}s {reason}".rstrip())
+
+    def paused_for(self) -> float:
+        """距离暂停结束的剩余秒数（未暂停时为 0）"""
+        with self._lock:
+            return max(0.0, self._paused_until - time.monotonic())
+
+    def observe_response(self, status_code: int, headers: Mapping[str, str]):
+        """根据响应状态码和响应头决定是否暂停"""
+        wait = wait_from_headers(status_code, headers)
+        if wait:
+            self.pause(wait, f"(HTTP {status_code})")
+
+    def observe_error(self, error: BaseException):
+        """
+        根据异常决定是否暂停（用于 SDK 调用，拿不到原始响应时从错误信息中提取 retryDelay）
+        """
+        response = getattr(error, 'response', None)
+        headers = getattr(response, 'headers', None)
+        status_code = getattr(error, 'code', None) or getattr(response, 'status_code', None) or 0
+        if headers is not None:
+            wait = wait_from_headers(int(status_code), headers)
+            if wait:
+                self.pause(wait, f"(HTTP {status_code})")
+                return
+
+        match = _RETRY_DELAY.search(str(error))
+        if match:
+            self.pause(float(match.group(1)), "(retryDelay)")
+
+    def stats(self) -> Dict[str, Any]:
+        """获取令牌桶状态"""
+        with self._lock:
+            self._refill(time.monotonic())
+            paused_for = max(0.0, self._paused_until - time.monotonic())
+            return {
+                "rate_per_sec": self.rate,
+                "burst": self.burst,
+                "tokens": round(self._tokens, 2),
+                "paused_for": round(paused_for, 1),
+                "acquired": self.acquired,
+                "waited_seconds": round(self.waited_seconds, 1),
+                "pauses": self.pauses,
+            }
+
+
+# 全局令牌桶（按 "类别:服务商名"）
+_buckets: Dict[str, TokenBucket] = {}
+_buckets_lock = threading.Lock()
+
+
+def _rate_from_config(provider_config: Dict[str, Any]) -> Optional[float]:
+    """从服务商配置读取速率：rps 优先，其次 rpm"""
+    if provider_config.get('rps'):
+        return float(provider_config['rps'])
+    if provider_config.get('rpm'):
+        return float(provider_config['rpm']) / 60
+    return None
+
+
+def get_rate_limiter(kind: str, provider_name: str, provider_config: Dict[str, Any]) -> TokenBucket:
+    """
+    获取服务商的令牌桶，不存在时创建；已存在时同步最新的速率配置
+
+    Args:
+        kind: 服务类别（text / image）
+        provider_name: 服务商名称
+        provider_config: 服务商配置，可选字段 rpm / rps / burst
+
+    Returns:
+        令牌桶
+    """
+    key = f"{kind}:{provider_name}"
+    rate = _rate_from_config(provider_config)
+    burst = int(provider_config.get('burst') or 1)
+
+    with _buckets_lock:
+        bucket = _buckets.get(key)
+        if bucket is None:
+            bucket = TokenBucket(key, rate, burst)
+            _buckets[key] = bucket
+            if rate:
+                logger.info(f"初始化速率限制: {key}, rate={rate:.3f}/s, burst={burst}")
+        elif bucket.rate != rate or bucket.burst != burst:
+            bucket.configure(rate, burst)
+    return bucket
+
+
+def get_rate_limiter_stats() -> Dict[str, Dict[str, Any]]:
+    """获取所有令牌桶的状态"""
+    with _buckets_lock:
+        buckets = dict(_buckets)
+    return {key: bucket.stats() for key, bucket in buckets.items()}
@@ -0,0 +1,150 @@
+"""
+参考图资源
+
+参考图（用户上传图、封面图）会在同一个任务中被每一页、每一次重试反复使用，
+各生成器和文本客户端又分别需要压缩后的二进制、base64 字符串或 data URI。
+ReferenceAsset 把这些形式挂在同一个对象上，首次使用时计算，之后直接复用
+"""
+import base64
+import threading
+from typing import Iterable, List, Optional, Union
+from .image_cache import compress_image_cached
+from .image_compressor import detect_image_mime
+
+
+class ReferenceAsset:
+    """
+    一张参考图的原始数据及其派生形式
+
+    - mime: 按文件头识别的真实 MIME 类型
+    - compressed / compressed_mime: 压缩到 max_size_kb 以内的数据及其类型
+    - base64 / data_uri: 压缩数据的 base64 编码和 data URI
+
+    派生形式懒计算且只计算一次，对象可在多个线程间共享
+    """
+
+    DEFAULT_MAX_SIZE_KB = 200
+
+    def __init__(self, raw: bytes, max_size_kb: int = DEFAULT_MAX_SIZE_KB):
+        """
+        Args:
+            raw: 原始图片数据
+            max_size_kb: 压缩目标大小（KB）
+        """
+        self.raw = raw
+        self.max_size_kb = max_size_kb
+        self.mime = detect_image_mime(raw[:16])
+
+        self._lock = threading.Lock()
+        self._compressed: Optional[bytes] = None
+        self._compressed_mime: Optional[str] = None
+        self._base64: Optional[str] = None
+
+    @classmethod
+    def coerce(cls, image: Union["ReferenceAsset", bytes]) -> "ReferenceAsset":
+        """将 bytes 包装为 ReferenceAsset，已经是 ReferenceAsset 时原样返回"""
+        if isinstance(image, ReferenceAsset):
+            return image
+        return cls(image)
+
+    @property
+    def compressed(self) -> bytes:
+        """压缩后的图片数据"""
+        if self._compressed is None:
+            with self._lock:
+                if self._compressed is None:
+                    data = compress_image_cached(self.raw, max_size_kb=self.max_size_kb)
+                    self._compressed_mime = detect_image_mime(data[:16], default=self.mime)
+                    self._compressed = data
+        return self._compressed
+
+    @property
+    def compressed_mime(self) -> str:
+        """压缩后数据的 MIME 类型（压缩会转为 JPEG，原图已足够小时保持原格式）"""
+        self.compressed
+        return self._compressed_mime
+
+    @property
+    def base64(self) -> str:
+        """压缩数据的 base64 编码"""
+        if self._base64 is None:
+            data = self.compressed
+            with self._lock:
+                if self._base64 is None:
+                    self._base64 = base64.b64encode(data).decode('utf-8')
+        return self._base64
+
+    @property
+    def data_uri(self) -> str:
+        """压缩数据的 data URI"""
+        return f"data:{self.compressed_mime};base64,{self.base64}"
+
+    def compact(self) -> "ReferenceAsset":
+        """
+        压缩后丢弃原始数据，只保留压缩结果
+
+        用于需要长期保存在任务状态中的参考图（如封面），避免常驻原始大图
+
+        Returns:
+            self，便于链式调用
+        """
+        data = self.compressed
+        with self._lock:
+            self.raw = data
+            self.mime = self._compressed_mime
+        return self
+
+    @property
+    def nbytes(self) -> int:
+        """原始数据和已计算的派生形式占用的字节数（估算内存占用）"""
+        size = len(self.raw)
+        if self._compressed is not None and self._compressed is not self.raw:
+            size += len(self._compressed)
+        if self._base64 is not None:
+            size += len(self._base64)
+        return size
+
+    def __len__(self) -> int:
+        return len(self.raw)
+
+    def __repr__(self) -> str:
+        return f"ReferenceAsset(mime={self.mime}, size={len(self.raw)})"
+
+
+def as_reference_assets(
+    images: Optional[Iterable[Union[ReferenceAsset, bytes]]]
+) -> Optional[List[ReferenceAsset]]:
+    """
+    将图片列表统一转为 ReferenceAsset 列表
+
+    Args:
+        images: bytes 或 ReferenceAsset 组成的列表
+
+    Returns:
+        ReferenceAsset 列表；输入为空时返回 None
+    """
+    if not images:
+        return None
+    return [ReferenceAsset.coerce(img) for img in images]
+
+
+def collect_reference_assets(
+    reference_images: Optional[Iterable[Union[ReferenceAsset, bytes]]] = None,
+    reference_image: Optional[Union[ReferenceAsset, bytes]] = None
+) -> List[ReferenceAsset]:
+    """
+    合并多张参考图和单张参考图（向后兼容的参数），去除重复项
+
+    Args:
+        reference_images: 参考图列表
+        reference_image: 单张参考图
+
+    Returns:
+        去重后的 ReferenceAsset 列表
+    """
+    assets = as_reference_assets(reference_images) or []
+    if reference_image:
+        asset = ReferenceAsset.coerce(reference_image)
+        if all(asset is not a and asset.raw != a.raw for a in assets):
+            assets.append(asset)
+    return assets
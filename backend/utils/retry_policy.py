@@ -0,0 +1,282 @@
+"""
+统一重试策略
+
+所有服务商调用共用一套重试规则：
+- 按错误类型决定是否重试（认证、参数、安全过滤等错误不重试）
+- 总尝试次数和总时长（deadline）双重上限
+- 指数退避 + 随机抖动，避免多个请求同时重试
+
+图片生成由调度器执行重试：等待重试期间不占用工作线程和服务商并发名额。
+文本生成等不经过调度器的调用使用 RetryPolicy.call 同步重试
+"""
+import asyncio
+import binascii
+import json
+import logging
+import random
+import socket
+import threading
+import time
+from functools import wraps
+from typing import Any, Callable, Dict, List, Optional
+import httpx
+import requests
+
+logger = logging.getLogger(__name__)
+
+# 错误类型
+KIND_AUTH = "auth"              # 401 / 403：认证或权限错误
+KIND_INVALID = "invalid"        # 400 / 404：参数错误、模型不存在
+KIND_SAFETY = "safety"          # 安全过滤
+KIND_RATE_LIMIT = "rate_limit"  # 429 / 配额
+KIND_TIMEOUT = "timeout"        # 超时
+KIND_SERVER = "server"          # 5xx
+KIND_NETWORK = "network"        # 连接失败
+KIND_UNKNOWN = "unknown"        # 服务商响应无法识别（如响应格式异常），按可重试处理
+KIND_INTERNAL = "internal"      # 本地代码错误（KeyError、TypeError 等），重试也不会成功
+KIND_CANCELLED = "cancelled"    # 调用方主动撤销（如对冲请求中落败的一方）
+KIND_CIRCUIT_OPEN = "circuit_open"  # 服务商熔断中，调用被直接拒绝
+
+RETRYABLE_KINDS = frozenset({
+    KIND_RATE_LIMIT, KIND_TIMEOUT, KIND_SERVER, KIND_NETWORK, KIND_UNKNOWN, KIND_CIRCUIT_OPEN
+})
+
+class ProviderError(Exception):
+    """服务商调用错误，携带已经判定好的错误类型"""
+
+    def __init__(self, message: str, kind: Optional[str] = None, status_code: Optional[int] = None):
+        """
+        Args:
+            message: 面向用户的错误信息
+            kind: 错误类型，不传时按状态码判定
+            status_code: HTTP 状态码（可选）
+        """
+        super().__init__(message)
+        self.status_code = status_code
+        self.kind = kind or (kind_from_status(status_code) if status_code else KIND_UNKNOWN)
+
+
+class RequestCancelled(ProviderError):
+    """请求被调用方撤销"""
+
+    def __init__(self, message: str = "请求已撤销"):
+        super().__init__(message, kind=KIND_CANCELLED)
+
+
+class CancelEvent(threading.Event):
+    """
+    撤销信号：置位时依次调用注册的回调（如关闭还在等待响应头的连接），回调只调用一次
+
+    可以在任何接受 cancel_event 的地方代替 threading.Event 使用
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._callbacks_lock = threading.Lock()
+        self._callbacks: List[Callable[[], None]] = []
+
+    def add_callback(self, callback: Callable[[], None]) -> Callable[[], None]:
+        """
+        注册置位时的回调（已置位时立即调用）
+
+        Returns:
+            取消注册的函数
+        """
+        with self._callbacks_lock:
+            if not self.is_set():
+                self._callbacks.append(callback)
+                return lambda: self._remove_callback(callback)
+        callback()
+        return lambda: None
+
+    def _remove_callback(self, callback: Callable[[], None]):
+        with self._callbacks_lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+    def set(self):
+        with self._callbacks_lock:
+            super().set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                logger.debug(f"撤销回调异常: {e}")
+
+
+def raise_if_cancelled(cancel_event) -> None:
+    """cancel_event 已置位时抛出 RequestCancelled"""
+    if cancel_event is not None and cancel_event.is_set():
+        raise RequestCancelled()
+
+
+def kind_from_status(status_code: int) -> str:
+    """按 HTTP 状态码判定错误类型"""
+    if status_code in (401, 403):
+        return KIND_AUTH
+    if status_code == 429:
+        return KIND_RATE_LIMIT
+    if status_code in (408, 504):
+        return KIND_TIMEOUT
+    if status_code >= 500:
+        return KIND_SERVER
+    if status_code >= 400:
+        return KIND_INVALID
+    return KIND_UNKNOWN
+
+
+# 服务商响应异常时 HTTP 客户端、JSON 和 base64 解码抛出的异常
+_RESPONSE_ERRORS = (requests.exceptions.RequestException, httpx.HTTPError, json.JSONDecodeError, binascii.Error)
+
+
+def classify_error(error: BaseException) -> str:
+    """
+    判定错误类型
+
+    Args:
+        error: 调用抛出的异常
+
+    Returns:
+        错误类型（KIND_* 常量之一）
+    """
+    if isinstance(error, ProviderError):
+        return error.kind
+    if isinstance(error, asyncio.CancelledError):
+        # 异步生成引擎中被撤销的协程（对冲请求中落败的一方、客户端断开）
+        return KIND_CANCELLED
+    if isinstance(error, (requests.exceptions.Timeout, httpx.TimeoutException, socket.timeout, TimeoutError)):
+        return KIND_TIMEOUT
+    if isinstance(error, (requests.exceptions.ConnectionError, httpx.TransportError, ConnectionError)):
+        return KIND_NETWORK
+
+    # 只按状态码判定，不匹配错误信息文本：信息中的提示语、响应片段里的数字都会误判
+    status_code = getattr(error, 'code', None) or getattr(error, 'status_code', None)
+    if isinstance(status_code, int) and status_code >= 400:
+        return kind_from_status(status_code)
+    # 其他 HTTP 层错误和无法解析的响应体来自服务商；其余异常是本地代码错误，不重试
+    if isinstance(error, _RESPONSE_ERRORS):
+        return KIND_UNKNOWN
+    return KIND_INTERNAL
+
+
+def is_retryable(error: BaseException) -> bool:
+    """错误是否值得重试"""
+    return classify_error(error) in RETRYABLE_KINDS
+
+
+class RetryPolicy:
+    """重试策略：尝试次数上限 + 总时长上限 + 带抖动的指数退避"""
+
+    def __init__(
+        self,
+        max_attempts: int = 3,
+        deadline: float = 600,
+        base_delay: float = 2,
+        max_delay: float = 30,
+        min_delay_fn: Optional[Callable[[], float]] = None
+    ):
+        """
+        Args:
+            max_attempts: 总尝试次数（含第一次）
+            deadline: 从第一次尝试开始计算的总时长上限（秒），超过后不再重试
+            base_delay: 退避基数（秒），第 n 次重试的退避上限为 base_delay * 2^(n-1)
+            max_delay: 单次退避的上限（秒）
+            min_delay_fn: 返回最短等待时间的函数（如服务商令牌桶的剩余暂停时间）
+        """
+        self.max_attempts = max(1, max_attempts)
+        self.deadline = deadline
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.min_delay_fn = min_delay_fn
+
+    @classmethod
+    def from_config(
+        cls,
+        provider_config: Dict[str, Any],
+        default_attempts: int = 3,
+        min_delay_fn: Optional[Callable[[], float]] = None
+    ) -> "RetryPolicy":
+        """
+        按服务商配置创建重试策略
+
+        服务商配置项（均可选）：
+        - retry_max_attempts: 总尝试次数（默认 default_attempts）
+        - retry_deadline: 总时长上限，秒（默认 600）
+        - retry_base_delay: 退避基数，秒（默认 2）
+        """
+        return cls(
+            max_attempts=int(provider_config.get('retry_max_attempts') or default_attempts),
+            deadline=float(provider_config.get('retry_deadline') or 600),
+            base_delay=float(provider_config.get('retry_base_delay') or 2),
+            min_delay_fn=min_delay_fn
+        )
+
+    def backoff(self, attempt: int, kind: str) -> float:
+        """
+        计算第 attempt 次失败后的等待时间
+
+        取 [上限/2, 上限] 内的随机值；限流错误的上限加倍
+        """
+        cap = min(self.max_delay, self.base_delay * (2 ** (attempt - 1)))
+        if kind == KIND_RATE_LIMIT:
+            cap = min(self.max_delay, cap * 2)
+        delay = cap / 2 + random.uniform(0, cap / 2)
+        if self.min_delay_fn:
+            delay = max(delay, self.min_delay_fn())
+        return delay
+
+    def next_delay(self, attempt: int, error: BaseException, started_at: float) -> Optional[float]:
+        """
+        判断失败后是否重试
+
+        Args:
+            attempt: 已经完成的尝试次数（从 1 开始）
+            error: 本次尝试的异常
+            started_at: 第一次尝试开始的时间（time.monotonic()）
+
+        Returns:
+            需要等待的秒数；不再重试时返回 None
+        """
+        kind = classify_error(error)
+        if kind not in RETRYABLE_KINDS:
+            logger.debug(f"错误类型 {kind} 不可重试: {str(error)[:100]}")
+            return None
+        if attempt >= self.max_attempts:
+            return None
+
+        delay = self.backoff(attempt, kind)
+        if time.monotonic() + delay - started_at > self.deadline:
+            logger.debug(f"重试将超过总时长上限 {self.deadline}s，放弃重试")
+            return None
+        return delay
+
+    def call(self, fn: Callable, *args, **kwargs) -> Any:
+        """
+        同步执行 fn，失败时按策略在当前线程中等待并重试
+
+        用于不经过调度器的调用；最后一次的异常原样抛出
+        """
+        started_at = time.monotonic()
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                return fn(*args, **kwargs)
+            except Exception as e:
+                delay = self.next_delay(attempt, e, started_at)
+                if delay is None:
+                    raise
+                logger.warning(
+                    f"⏳ 请求失败（{classify_error(e)}），{delay:.1f}秒后重试 "
+                    f"(尝试 {attempt + 1}/{self.max_attempts}): {str(e)[:100]}"
+                )
+                time.sleep(delay)
+
+
+def retry_with_policy(method: Callable) -> Callable:
+    """方法装饰器：按实例的 retry_policy 属性重试"""
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        return self.retry_policy.call(method, self, *args, **kwargs)
+    return wrapper
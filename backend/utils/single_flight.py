@@ -0,0 +1,66 @@
+"""Single-flight 工具：同一个 key 同时只执行一次计算，其余调用方等待并共享结果"""
+import threading
+from typing import Any, Callable, Dict, Hashable
+
+
+class _Call:
+    """一次正在进行中的计算"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: BaseException = None
+
+
+class SingleFlight:
+    """
+    合并并发的重复计算
+
+    第一个调用 do(key, fn) 的线程负责执行 fn，
+    在它完成之前到达的同 key 调用会阻塞等待，并拿到同一个结果（或同一个异常）。
+    计算完成后记录即被移除，不做结果缓存（缓存由调用方自己负责）。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, _Call] = {}
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        """
+        执行或等待 key 对应的计算
+
+        Args:
+            key: 计算的唯一标识
+            fn: 无参计算函数
+
+        Returns:
+            fn 的返回值
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+
+    def in_flight(self, key: Hashable) -> bool:
+        """key 对应的计算是否正在进行"""
+        with self._lock:
+            return key in self._calls
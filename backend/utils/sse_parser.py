@@ -0,0 +1,278 @@
+"""
+SSE 流解析
+
+文本客户端和两个 OpenAI 兼容图片生成器都通过 SSE 接收流式响应。这里提供一个统一的增量解析器：
+
+- 按字节分块输入，按 SSE 规范解析 event / data / id / retry 字段，多行 data 以换行拼接
+- 行结束符支持 \\n、\\r\\n 和 \\r，注释行（:ping、:heart 等心跳）可选择产出
+- 只在完整的行上做 UTF-8 解码，多字节字符被分块截断也能正确解码
+- 只扫描新到达的数据，单行数 MB 的 data（chat 接口返回的 base64 图片）也是线性时间
+"""
+import json
+import logging
+from typing import Any, AsyncIterator, Iterable, Iterator, List, Optional, Tuple
+from .retry_policy import RequestCancelled
+
+logger = logging.getLogger(__name__)
+
+# 注释行的事件类型
+COMMENT = "comment"
+
+
+class SSEEvent:
+    """一个 SSE 事件（或注释行）"""
+
+    __slots__ = ("event", "data", "id", "retry")
+
+    def __init__(self, event: str, data: str, id: Optional[str] = None, retry: Optional[int] = None):
+        """
+        Args:
+            event: 事件类型（未指定时为 "message"，注释行为 COMMENT）
+            data: 事件数据（多行 data 以换行拼接；注释行为注释内容）
+            id: 最近一次 id 字段的值
+            retry: 本事件中 retry 字段的值（毫秒）
+        """
+        self.event = event
+        self.data = data
+        self.id = id
+        self.retry = retry
+
+    @property
+    def is_comment(self) -> bool:
+        return self.event == COMMENT
+
+    def json(self) -> Any:
+        """把 data 解析为 JSON"""
+        return json.loads(self.data)
+
+    def __repr__(self) -> str:
+        return f"SSEEvent(event={self.event!r}, data={self.data[:50]!r}, id={self.id!r})"
+
+
+class SSEParser:
+    """增量 SSE 解析器"""
+
+    def __init__(self, include_comments: bool = False):
+        """
+        Args:
+            include_comments: 是否把注释行（心跳）作为 COMMENT 事件产出
+        """
+        self.include_comments = include_comments
+        self.last_event_id: Optional[str] = None
+
+        self._buffer = bytearray()
+        # 缓冲区中已确认没有换行的长度，下次只扫描之后的新数据
+        self._scanned = 0
+        # 上一块以 \r 结尾，需要看下一块是否以 \n 开头
+        self._pending_cr = False
+        self._started = False
+
+        self._event = ""
+        self._data: List[str] = []
+        self._retry: Optional[int] = None
+
+    def feed(self, chunk: bytes) -> List[SSEEvent]:
+        """
+        输入一块数据
+
+        Returns:
+            这块数据完成的事件列表
+        """
+        if not chunk:
+            return []
+        if self._pending_cr:
+            self._pending_cr = False
+            if chunk.startswith(b"\n"):
+                chunk = chunk[1:]
+        if b"\r" in chunk:
+            if chunk.endswith(b"\r"):
+                chunk = chunk[:-1]
+                self._pending_cr = True
+                chunk = chunk.replace(b"\r\n", b"\n").replace(b"\r", b"\n") + b"\n"
+            else:
+                chunk = chunk.replace(b"\r\n", b"\n").replace(b"\r", b"\n")
+
+        buffer = self._buffer
+        buffer.extend(chunk)
+        last = buffer.rfind(b"\n", self._scanned)
+        if last < 0:
+            self._scanned = len(buffer)
+            return []
+        # 换行不会出现在多字节字符中间，完整的行可以整块解码
+        block = buffer[:last].decode("utf-8", errors="replace")
+        del buffer[:last + 1]
+        self._scanned = len(buffer)
+        return self._process_lines(block.split("\n"))
+
+    def close(self) -> List[SSEEvent]:
+        """
+        输入结束：处理最后一行，并产出末尾缺少空行的事件（部分服务商最后一个事件后不空行）
+
+        Returns:
+            剩余的事件列表
+        """
+        lines = []
+        if self._buffer:
+            lines.append(self._buffer.decode("utf-8", errors="replace"))
+            self._buffer.clear()
+            self._scanned = 0
+        events = self._process_lines(lines)
+        event = self._dispatch()
+        if event is not None:
+            events.append(event)
+        return events
+
+    def _process_lines(self, lines: List[str]) -> List[SSEEvent]:
+        """处理若干完整的行，返回其中空行完成的事件"""
+        if lines and not self._started:
+            self._started = True
+            if lines[0].startswith("\ufeff"):
+                lines[0] = lines[0][1:]
+
+        events: List[SSEEvent] = []
+        for line in lines:
+            if not line:
+                event = self._dispatch()
+                if event is not None:
+                    events.append(event)
+                continue
+
+            if line[0] == ":":
+                if self.include_comments:
+                    events.append(SSEEvent(COMMENT, line[1:].strip(), self.last_event_id))
+                continue
+
+            field, sep, value = line.partition(":")
+            if sep and value[:1] == " ":
+                value = value[1:]
+
+            if field == "data":
+                self._data.append(value)
+            elif field == "event":
+                self._event = value
+            elif field == "id":
+                if "\0" not in value:
+                    self.last_event_id = value
+            elif field == "retry":
+                if value.isdigit():
+                    self._retry = int(value)
+        return events
+
+    def _dispatch(self) -> Optional[SSEEvent]:
+        """完成当前事件；没有 data 时不产出事件"""
+        data, event, retry = self._data, self._event, self._retry
+        self._data, self._event, self._retry = [], "", None
+        if not data:
+            return None
+        return SSEEvent(event or "message", "\n".join(data), self.last_event_id, retry)
+
+
+def iter_sse(chunks: Iterable[bytes], include_comments: bool = False) -> Iterator[SSEEvent]:
+    """
+    解析字节块序列中的 SSE 事件
+
+    Args:
+        chunks: 字节块序列（如 response.iter_content(chunk_size=None)）
+        include_comments: 是否产出注释行（心跳）
+    """
+    parser = SSEParser(include_comments)
+    for chunk in chunks:
+        yield from parser.feed(chunk)
+    yield from parser.close()
+
+
+def _parse_chat_chunks(data: str) -> List[Any]:
+    """
+    解析 chat 流式事件的 data
+
+    部分服务商的事件之间不空行，多个 data 行会被拼成一个事件，整体不是合法 JSON 时逐行解析
+    """
+    try:
+        return [json.loads(data)]
+    except json.JSONDecodeError:
+        if "\n" not in data:
+            raise
+    chunks = []
+    for line in data.split("\n"):
+        line = line.strip()
+        if not line or line == "[DONE]":
+            continue
+        chunks.append(json.loads(line))
+    return chunks
+
+
+def _chat_contents(events: List[SSEEvent]) -> Tuple[List[str], bool]:
+    """
+    取出一批 chat 流式事件中 choices[0].delta.content 的文本
+
+    Returns:
+        (文本列表, 是否收到 [DONE])
+    """
+    contents = []
+    for event in events:
+        if event.is_comment:
+            # SSE 注释行（心跳包等），如 :heart, :ping，跳过但保持连接
+            logger.debug(f"收到心跳: {event.data}")
+            continue
+
+        data = event.data.strip()
+        if data == "[DONE]":
+            logger.debug("✅ 收到 [DONE] 信号")
+            return contents, True
+
+        try:
+            payloads = _parse_chat_chunks(data)
+        except json.JSONDecodeError:
+            logger.debug(f"跳过非JSON数据: {data[:50]}")
+            continue
+
+        for payload in payloads:
+            choices = payload.get("choices") if isinstance(payload, dict) else None
+            if choices:
+                content = (choices[0].get("delta") or {}).get("content")
+                if content:
+                    contents.append(content)
+    return contents, False
+
+
+def iter_chat_content(response, cancel_event=None) -> Iterator[str]:
+    """
+    读取 OpenAI 兼容 chat/completions 的流式响应（请求需使用 stream=True），
+    逐个产出 choices[0].delta.content 中的文本，收到 [DONE] 时结束
+
+    Args:
+        response: requests.Response 或接口相同的响应对象
+        cancel_event: 置位时关闭连接并抛出 RequestCancelled（每收到一块数据检查一次，心跳也算）
+    """
+    parser = SSEParser(include_comments=True)
+    chunks = response.iter_content(chunk_size=None)
+    while True:
+        chunk = next(chunks, None)
+        if cancel_event is not None and cancel_event.is_set():
+            response.close()
+            raise RequestCancelled()
+        events = parser.feed(chunk) if chunk is not None else parser.close()
+
+        contents, done = _chat_contents(events)
+        yield from contents
+        if done or chunk is None:
+            return
+
+
+async def aiter_chat_content(response) -> AsyncIterator[str]:
+    """
+    iter_chat_content 的异步版本
+
+    Args:
+        response: AsyncHttpSession.stream 产出的响应对象（撤销通过撤销协程完成）
+    """
+    parser = SSEParser(include_comments=True)
+    async for chunk in response.aiter_bytes():
+        contents, done = _chat_contents(parser.feed(chunk))
+        for content in contents:
+            yield content
+        if done:
+            return
+    contents, _ = _chat_contents(parser.close())
+    for content in contents:
+        yield content
@@ -1,49 +1,32 @@
 """Text API 客户端封装"""
-import time
-import random
-import base64
 import logging
-import requests
-from functools import wraps
-from typing import List, Optional, Union
-from .image_compressor import compress_image
+from typing import List, Optional, Tuple, Union
+from .reference_asset import ReferenceAsset
+from .retry_policy import KIND_UNKNOWN, ProviderError, RetryPolicy, retry_with_policy
+from .circuit_breaker import (
+    CircuitBreaker, circuit_protected, circuit_protected_astream, circuit_protected_stream, get_circuit_breaker
+)
+from .rate_limiter import TokenBucket, get_rate_limiter
+from .http_pool import AsyncHttpSession, HttpSession, get_async_http_session, get_http_session
+from .sse_parser import aiter_chat_content, iter_chat_content
 
 logger = logging.getLogger(__name__)
 
 
-def retry_on_429(max_retries=3, base_delay=2):
-    """429 错误自动重试装饰器"""
-    def decorator(func):
-        @wraps(func)
-        def wrapper(*args, **kwargs):
-            for attempt in range(max_retries):
-                try:
-                    return func(*args, **kwargs)
-                except Exception as e:
-                    error_str = str(e)
-                    if "429" in error_str or "rate" in error_str.lower():
-                        if attempt < max_retries - 1:
-                            wait_time = (base_delay ** attempt) + random.uniform(0, 1)
-                            print(f"[重试] 遇到限流，{wait_time:.1f}秒后重试 (尝试 {attempt + 2}/{max_retries})")
-                            time.sleep(wait_time)
-                            continue
-                    raise
-            raise Exception(
-                f"Text API 重试 {max_retries} 次后仍失败。\n"
-                "可能原因：\n"
-                "1. API持续限流或配额不足\n"
-                "2. 网络连接持续不稳定\n"
-                "3. API服务暂时不可用\n"
-                "建议：稍后再试，或联系API服务提供商"
-            )
-        return wrapper
-    return decorator
-
-
 class TextChatClient:
     """Text API 客户端封装类"""
 
-    def __init__(self, api_key: str = None, base_url: str = None, endpoint_type: str = None):
+    def __init__(
+        self,
+        api_key: str = None,
+        base_url: str = None,
+        endpoint_type: str = None,
+        rate_limiter: Optional[TokenBucket] = None,
+        retry_policy: Optional[RetryPolicy] = None,
+        circuit_breaker: Optional[CircuitBreaker] = None,
+        http_session: Optional[HttpSession] = None,
+        async_http_session: Optional[AsyncHttpSession] = None
+    ):
         self.api_key = api_key
         if not self.api_key:
             raise ValueError(
@@ -60,21 +43,28 @@ class TextChatClient:
             endpoint = '/' + endpoint
         self.chat_endpoint = f"{self.base_url}{endpoint}"
 
-    def _encode_image_to_base64(self, image_data: bytes) -> str:
-        """将图片数据编码为 base64"""
-        return base64.b64encode(image_data).decode('utf-8')
+        # 请求速率限制（同一服务商的所有客户端共享一个令牌桶）
+        self.rate_limiter = rate_limiter or TokenBucket(self.chat_endpoint)
+        # 非流式请求的重试策略
+        self.retry_policy = retry_policy or RetryPolicy()
+        # 熔断器（同一服务商共享）
+        self.circuit_breaker = circuit_breaker or CircuitBreaker(self.chat_endpoint)
+        # HTTP 连接池（同一服务商共享长连接）
+        self.http = http_session or HttpSession(self.chat_endpoint)
+        # 异步生成引擎使用的 HTTP 连接池
+        self.ahttp = async_http_session or AsyncHttpSession(self.chat_endpoint)
 
     def _build_content_with_images(
         self,
         text: str,
-        images: List[Union[bytes, str]] = None
+        images: List[Union[ReferenceAsset, bytes, str]] = None
     ) -> Union[str, List[dict]]:
         """
         构建包含图片的 content
 
         Args:
             text: 文本内容
-            images: 图片列表，可以是 bytes（图片数据）或 str（URL）
+            images: 图片列表，可以是 ReferenceAsset、bytes（图片数据）或 str（URL）
 
         Returns:
             如果没有图片，返回纯文本；有图片则返回多模态内容列表
@@ -85,12 +75,9 @@ class TextChatClient:
         content = [{"type": "text", "text": text}]
 
         for img in images:
-            if isinstance(img, bytes):
-                # 压缩图片到 200KB 以内
-                compressed_img = compress_image(img, max_size_kb=200)
-                # 图片数据，转为 base64 data URL
-                base64_data = self._encode_image_to_base64(compressed_img)
-                image_url = f"data:image/png;base64,{base64_data}"
+            if isinstance(img, (bytes, ReferenceAsset)):
+                # 图片数据，使用压缩到 200KB 以内后的 base64 data URL
+                image_url = ReferenceAsset.coerce(img).data_uri
             else:
                 # 已经是 URL
                 image_url = img
@@ -102,6 +89,7 @@ class TextChatClient:
 
         return content
 
+    @circuit_protected_stream
     def generate_text_stream(
         self,
         prompt: str,
@@ -127,6 +115,87 @@ class TextChatClient:
             生成的文本片段
         """
         logger.info(f"🔄 OpenAI 兼容 API 流式生成开始: model={model}, endpoint={self.chat_endpoint}")
+        payload, headers = self._stream_request(prompt, model, temperature, max_output_tokens, images, system_prompt)
+
+        logger.debug(f"📤 发送请求到: {self.chat_endpoint}")
+
+        self.rate_limiter.acquire()
+        # 出错或调用方提前结束读取时关闭连接
+        with self.http.post(
+            self.chat_endpoint,
+            json=payload,
+            headers=headers,
+            timeout=300,
+            stream=True
+        ) as response:
+            self.rate_limiter.observe_response(response.status_code, response.headers)
+
+            if response.status_code != 200:
+                error_detail = response.text[:500]
+                raise ProviderError(
+                    f"API 请求失败 (状态码: {response.status_code}): {error_detail}",
+                    status_code=response.status_code
+                )
+
+            logger.debug(f"📥 收到响应，开始解析 SSE 流...")
+
+            # 增量解析 SSE 流，每收到一块数据立即产出其中的文本
+            chunk_count = 0
+            for text_content in iter_chat_content(response):
+                chunk_count += 1
+                logger.debug(f"📥 chunk #{chunk_count}: {len(text_content)} 字符")
+                yield text_content
+
+        logger.info(f"✅ OpenAI 兼容 API 流式生成完成，共 {chunk_count} 个 chunk")
+
+    @circuit_protected_astream
+    async def agenerate_text_stream(
+        self,
+        prompt: str,
+        model: str = "gemini-3-pro-preview",
+        temperature: float = 1.0,
+        max_output_tokens: int = 8000,
+        images: List[Union[bytes, str]] = None,
+        system_prompt: str = None,
+        **kwargs
+    ):
+        """
+        generate_text_stream 的异步版本（异步生成器，httpx.AsyncClient）
+
+        Yields:
+            生成的文本片段
+        """
+        logger.info(f"🔄 OpenAI 兼容 API 异步流式生成开始: model={model}, endpoint={self.chat_endpoint}")
+        payload, headers = self._stream_request(prompt, model, temperature, max_output_tokens, images, system_prompt)
+
+        await self.rate_limiter.aacquire()
+        async with self.ahttp.stream("POST", self.chat_endpoint, json=payload, headers=headers, timeout=300) as response:
+            self.rate_limiter.observe_response(response.status_code, response.headers)
+            if response.status_code != 200:
+                error_detail = (await response.atext())[:500]
+                raise ProviderError(
+                    f"API 请求失败 (状态码: {response.status_code}): {error_detail}",
+                    status_code=response.status_code
+                )
+
+            chunk_count = 0
+            async for text_content in aiter_chat_content(response):
+                chunk_count += 1
+                logger.debug(f"📥 chunk #{chunk_count}: {len(text_content)} 字符")
+                yield text_content
+
+        logger.info(f"✅ OpenAI 兼容 API 异步流式生成完成，共 {chunk_count} 个 chunk")
+
+    def _stream_request(
+        self,
+        prompt: str,
+        model: str,
+        temperature: float,
+        max_output_tokens: int,
+        images: Optional[List[Union[bytes, str]]],
+        system_prompt: Optional[str]
+    ) -> Tuple[dict, dict]:
+        """构建流式请求的请求体和请求头"""
         messages = []
 
         # 添加系统提示词
@@ -156,64 +225,10 @@ class TextChatClient:
             "Accept": "text/event-stream",
             "Authorization": f"Bearer {self.api_key}"
         }
+        return payload, headers
 
-        logger.debug(f"📤 发送请求到: {self.chat_endpoint}")
-
-        response = requests.post(
-            self.chat_endpoint,
-            json=payload,
-            headers=headers,
-            timeout=300,
-            stream=True
-        )
-
-        if response.status_code != 200:
-            error_detail = response.text[:500]
-            raise Exception(f"API 请求失败 (状态码: {response.status_code}): {error_detail}")
-
-        logger.debug(f"📥 收到响应，开始解析 SSE 流...")
-
-        # 使用 iter_content 替代 iter_lines，更实时
-        import json
-        buffer = ""
-        chunk_count = 0
-
-        for raw_chunk in response.iter_content(chunk_size=None, decode_unicode=True):
-            if not raw_chunk:
-                continue
-
-            buffer += raw_chunk
-
-            # 按行处理
-            while '\n' in buffer:
-                line, buffer = buffer.split('\n', 1)
-                line = line.strip()
-
-                if not line:
-                    continue
-
-                if line.startswith('data: '):
-                    data = line[6:]
-                    if data == '[DONE]':
-                        logger.debug(f"✅ 收到 [DONE] 信号")
-                        return
-
-                    try:
-                        chunk_data = json.loads(data)
-                        if 'choices' in chunk_data and len(chunk_data['choices']) > 0:
-                            delta = chunk_data['choices'][0].get('delta', {})
-                            text_content = delta.get('content', '')
-                            if text_content:
-                                chunk_count += 1
-                                logger.debug(f"📥 chunk #{chunk_count}: {len(text_content)} 字符")
-                                yield text_content
-                    except json.JSONDecodeError as e:
-                        logger.warning(f"JSON 解析失败: {e}, data: {data[:100]}")
-                        continue
-
-        logger.info(f"✅ OpenAI 兼容 API 流式生成完成，共 {chunk_count} 个 chunk")
-
-    @retry_on_429(max_retries=3, base_delay=2)
+    @retry_with_policy
+    @circuit_protected
     def generate_text(
         self,
         prompt: str,
@@ -268,12 +283,14 @@ class TextChatClient:
             "Authorization": f"Bearer {self.api_key}"
         }
 
-        response = requests.post(
+        self.rate_limiter.acquire()
+        response = self.http.post(
             self.chat_endpoint,
             json=payload,
             headers=headers,
             timeout=300  # 5分钟超时
         )
+        self.rate_limiter.observe_response(response.status_code, response.headers)
 
         if response.status_code != 200:
             error_detail = response.text[:500]
@@ -281,7 +298,7 @@ class TextChatClient:
 
             # 根据状态码给出更详细的错误信息
             if status_code == 401:
-                raise Exception(
+                raise ProviderError(
                     "❌ API Key 认证失败\n\n"
                     "【可能原因】\n"
                     "1. API Key 无效或已过期\n"
@@ -290,10 +307,11 @@ class TextChatClient:
                     "【解决方案】\n"
                     "1. 在系统设置页面检查 API Key 是否正确\n"
                     "2. 重新获取 API Key\n"
-                    f"\n【请求地址】{self.chat_endpoint}"
+                    f"\n【请求地址】{self.chat_endpoint}",
+                    status_code=status_code
                 )
             elif status_code == 403:
-                raise Exception(
+                raise ProviderError(
                     "❌ 权限被拒绝\n\n"
                     "【可能原因】\n"
                     "1. API Key 没有访问该模型的权限\n"
@@ -302,10 +320,11 @@ class TextChatClient:
                     "【解决方案】\n"
                     "1. 检查 API 权限配置\n"
                     "2. 尝试使用其他模型\n"
-                    f"\n【原始错误】{error_detail[:200]}"
+                    f"\n【原始错误】{error_detail[:200]}",
+                    status_code=status_code
                 )
             elif status_code == 404:
-                raise Exception(
+                raise ProviderError(
                     "❌ 模型不存在或 API 端点错误\n\n"
                     "【可能原因】\n"
                     f"1. 模型 '{model}' 不存在或已下线\n"
@@ -313,29 +332,32 @@ class TextChatClient:
                     "【解决方案】\n"
                     "1. 检查模型名称是否正确\n"
                     "2. 检查 Base URL 配置\n"
-                    f"\n【请求地址】{self.chat_endpoint}"
+                    f"\n【请求地址】{self.chat_endpoint}",
+                    status_code=status_code
                 )
             elif status_code == 429:
-                raise Exception(
+                raise ProviderError(
                     "⏳ API 配额或速率限制\n\n"
                     "【说明】\n"
                     "请求频率过高或配额已用尽。\n\n"
                     "【解决方案】\n"
                     "1. 稍后再试（等待 1-2 分钟）\n"
                     "2. 检查 API 配额使用情况\n"
-                    "3. 考虑升级计划获取更多配额"
+                    "3. 考虑升级计划获取更多配额",
+                    status_code=status_code
                 )
             elif status_code >= 500:
-                raise Exception(
+                raise ProviderError(
                     f"⚠️ API 服务器错误 ({status_code})\n\n"
                     "【说明】\n"
                     "这是服务端的临时故障，与您的配置无关。\n\n"
                     "【解决方案】\n"
                     "1. 稍等几分钟后重试\n"
-                    "2. 如果持续出现，检查服务商状态页"
+                    "2. 如果持续出现，检查服务商状态页",
+                    status_code=status_code
                 )
             else:
-                raise Exception(
+                raise ProviderError(
                     f"❌ API 请求失败 (状态码: {status_code})\n\n"
                     f"【原始错误】\n{error_detail}\n\n"
                     f"【请求地址】{self.chat_endpoint}\n"
@@ -343,7 +365,8 @@ class TextChatClient:
                     "【通用解决方案】\n"
                     "1. 检查 API Key 是否正确\n"
                     "2. 检查 Base URL 配置\n"
-                    "3. 检查模型名称是否正确"
+                    "3. 检查模型名称是否正确",
+                    status_code=status_code
                 )
 
         result = response.json()
@@ -352,18 +375,19 @@ class TextChatClient:
         if "choices" in result and len(result["choices"]) > 0:
             return result["choices"][0]["message"]["content"]
         else:
-            raise Exception(
+            raise ProviderError(
                 f"Text API 响应格式异常：未找到生成的文本。\n"
                 f"响应数据: {str(result)[:500]}\n"
                 "可能原因：\n"
                 "1. API返回格式与OpenAI标准不一致\n"
                 "2. 请求被拒绝或过滤\n"
                 "3. 模型输出为空\n"
-                "建议：检查API文档确认响应格式"
+                "建议：检查API文档确认响应格式",
+                kind=KIND_UNKNOWN
             )
 
 
-def get_text_chat_client(provider_config: dict):
+def get_text_chat_client(provider_config: dict, provider_name: str = None):
     """
     获取 Text Chat 客户端实例（根据 type 返回对应客户端）
 
@@ -373,6 +397,11 @@ def get_text_chat_client(provider_config: dict):
             - api_key: API密钥
             - base_url: API基础URL（可选）
             - endpoint_type: 自定义端点路径（可选）
+            - rpm / rps / burst: 请求速率限制（可选）
+            - retry_max_attempts / retry_deadline / retry_base_delay: 重试策略（可选）
+            - circuit_*: 熔断参数（可选）
+            - max_concurrent / http2: HTTP 连接池大小和协议（可选）
+        provider_name: 服务商名称，同名服务商共享一个令牌桶（默认使用 type）
 
     Returns:
         GenAIClient 或 TextChatClient
@@ -381,9 +410,27 @@ def get_text_chat_client(provider_config: dict):
     api_key = provider_config.get('api_key')
     base_url = provider_config.get('base_url')
     endpoint_type = provider_config.get('endpoint_type')
+    rate_limiter = get_rate_limiter('text', provider_name or provider_type, provider_config)
+    retry_policy = RetryPolicy.from_config(provider_config, min_delay_fn=rate_limiter.paused_for)
+    circuit_breaker = get_circuit_breaker('text', provider_name or provider_type, provider_config)
 
     if provider_type == 'google_gemini':
         from .genai_client import GenAIClient
-        return GenAIClient(api_key=api_key, base_url=base_url)
+        return GenAIClient(
+            api_key=api_key,
+            base_url=base_url,
+            rate_limiter=rate_limiter,
+            retry_policy=retry_policy,
+            circuit_breaker=circuit_breaker
+        )
     else:
-        return TextChatClient(api_key=api_key, base_url=base_url, endpoint_type=endpoint_type)
+        return TextChatClient(
+            api_key=api_key,
+            base_url=base_url,
+            endpoint_type=endpoint_type,
+            rate_limiter=rate_limiter,
+            retry_policy=retry_policy,
+            circuit_breaker=circuit_breaker,
+            http_session=get_http_session('text', provider_name or provider_type, provider_config),
+            async_http_session=get_async_http_session('text', provider_name or provider_type, provider_config)
+        )
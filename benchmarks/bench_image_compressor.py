@@ -0,0 +1,81 @@
+"""
+compress_image 微基准测试
+
+对 images/ 目录下的示例图片逐一调用 compress_image，
+记录每次调用的平均耗时（ms）和输出大小。
+
+用法：
+    python benchmarks/bench_image_compressor.py
+    python benchmarks/bench_image_compressor.py --sizes 50 200 --repeat 5
+    python benchmarks/bench_image_compressor.py --json > bench_output.json
+"""
+import sys
+import json
+import time
+import argparse
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT_DIR))
+
+from backend.utils.image_compressor import compress_image  # noqa: E402
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.webp')
+
+
+def run_benchmark(image_dir: Path, sizes: list, repeat: int) -> list:
+    """对每张图片、每个目标大小执行 repeat 次压缩，返回结果列表"""
+    results = []
+    image_files = sorted(
+        p for p in image_dir.iterdir()
+        if p.suffix.lower() in IMAGE_EXTENSIONS
+    )
+
+    for path in image_files:
+        image_data = path.read_bytes()
+        for max_size_kb in sizes:
+            # 预热一次，排除首次加载解码器的开销
+            output = compress_image(image_data, max_size_kb=max_size_kb)
+
+            start = time.perf_counter()
+            for _ in range(repeat):
+                output = compress_image(image_data, max_size_kb=max_size_kb)
+            elapsed_ms = (time.perf_counter() - start) / repeat * 1000
+
+            results.append({
+                "image": path.name,
+                "input_kb": round(len(image_data) / 1024, 1),
+                "target_kb": max_size_kb,
+                "output_kb": round(len(output) / 1024, 1),
+                "ms_per_call": round(elapsed_ms, 1),
+            })
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="compress_image 微基准测试")
+    parser.add_argument("--dir", default=str(ROOT_DIR / "images"), help="示例图片目录")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[50, 200], help="目标大小（KB）")
+    parser.add_argument("--repeat", type=int, default=3, help="每个用例重复次数")
+    parser.add_argument("--json", action="store_true", help="以 JSON 格式输出")
+    args = parser.parse_args()
+
+    results = run_benchmark(Path(args.dir), args.sizes, args.repeat)
+
+    if args.json:
+        print(json.dumps(results, ensure_ascii=False, indent=2))
+        return
+
+    print(f"{'image':<22}{'input':>10}{'target':>8}{'output':>10}{'ms/call':>10}")
+    for r in results:
+        print(
+            f"{r['image']:<22}{r['input_kb']:>8.1f}KB{r['target_kb']:>6}KB"
+            f"{r['output_kb']:>8.1f}KB{r['ms_per_call']:>10.1f}"
+        )
+    total_ms = sum(r["ms_per_call"] for r in results)
+    print(f"\n共 {len(results)} 个用例，单轮总耗时 {total_ms:.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
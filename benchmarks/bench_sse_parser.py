@@ -0,0 +1,175 @@
+"""
+SSE 解析微基准测试
+
+构造几种典型的 chat 流式响应，按不同的分块大小输入，对比：
+- sse_parser：backend/utils/sse_parser.py 的增量解析器
+- str_buffer：原文本客户端的做法（buffer += chunk，split('\\n', 1) 逐行切分）
+- iter_lines：原图片生成器的做法（requests 的 iter_lines 逐行切分后解析 data 行）
+
+记录每种场景的平均耗时（ms）和吞吐（MB/s）。
+
+用法：
+    python benchmarks/bench_sse_parser.py
+    python benchmarks/bench_sse_parser.py --image-mb 8 --chunks 1024 65536 --repeat 5
+    python benchmarks/bench_sse_parser.py --json > bench_output.json
+"""
+import sys
+import json
+import time
+import base64
+import argparse
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT_DIR))
+
+from backend.utils.sse_parser import SSEParser  # noqa: E402
+
+
+def _delta_event(content: str) -> str:
+    return "data: " + json.dumps({"choices": [{"delta": {"content": content}}]}) + "\n\n"
+
+
+def build_streams(image_mb: float) -> dict:
+    """构造测试用的 SSE 流"""
+    # 伪造的图片 base64（内容不影响解析，只需长度）
+    image_b64 = base64.b64encode(b"\x89PNG" * int(image_mb * 1024 * 1024 / 4)).decode()
+    data_uri = f"![image](data:image/png;base64,{image_b64})"
+
+    text = "小红书图文大纲，" * 40000
+    return {
+        # 文本流：大量短 delta，夹带心跳
+        "text_deltas": "".join(
+            (": ping\n\n" if i % 50 == 0 else "") + _delta_event(text[i:i + 20])
+            for i in range(0, len(text), 20)
+        ).encode("utf-8"),
+        # 整张图片在一个 delta 中（单行数 MB 的 data）
+        "image_one_delta": (_delta_event(data_uri) + "data: [DONE]\n\n").encode("utf-8"),
+        # 图片按 4KB 拆成多个 delta
+        "image_4k_deltas": ("".join(
+            _delta_event(data_uri[i:i + 4096]) for i in range(0, len(data_uri), 4096)
+        ) + "data: [DONE]\n\n").encode("utf-8"),
+    }
+
+
+def _split(stream: bytes, chunk_size: int) -> list:
+    return [stream[i:i + chunk_size] for i in range(0, len(stream), chunk_size)]
+
+
+def _extract(data: str, parts: list):
+    if data == "[DONE]":
+        return
+    chunk = json.loads(data)
+    parts.append(chunk["choices"][0]["delta"].get("content", ""))
+
+
+def parse_sse_parser(chunks: list) -> str:
+    """增量解析器"""
+    parser = SSEParser()
+    parts = []
+    for chunk in chunks:
+        for event in parser.feed(chunk):
+            _extract(event.data, parts)
+    for event in parser.close():
+        _extract(event.data, parts)
+    return "".join(parts)
+
+
+def parse_str_buffer(chunks: list) -> str:
+    """原文本客户端：字符串缓冲区逐行切分"""
+    parts = []
+    buffer = ""
+    for raw_chunk in chunks:
+        buffer += raw_chunk.decode("utf-8", errors="replace")
+        while "\n" in buffer:
+            line, buffer = buffer.split("\n", 1)
+            line = line.strip()
+            if line.startswith("data: "):
+                _extract(line[6:], parts)
+    return "".join(parts)
+
+
+def parse_iter_lines(chunks: list) -> str:
+    """原图片生成器：requests.Response.iter_lines 的切分方式"""
+    parts = []
+
+    def iter_lines():
+        pending = None
+        for chunk in chunks:
+            if pending is not None:
+                chunk = pending + chunk
+            lines = chunk.splitlines()
+            if lines and lines[-1] and chunk and lines[-1][-1] == chunk[-1]:
+                pending = lines.pop()
+            else:
+                pending = None
+            yield from lines
+        if pending is not None:
+            yield pending
+
+    for line in iter_lines():
+        line_str = line.decode("utf-8")
+        if line_str.startswith("data:"):
+            _extract(line_str[5:].strip(), parts)
+    return "".join(parts)
+
+
+PARSERS = {
+    "sse_parser": parse_sse_parser,
+    "str_buffer": parse_str_buffer,
+    "iter_lines": parse_iter_lines,
+}
+
+
+def run_benchmark(streams: dict, chunk_sizes: list, repeat: int) -> list:
+    """对每个流、每种分块大小、每种解析方式执行 repeat 次，返回结果列表"""
+    results = []
+    for stream_name, stream in streams.items():
+        for chunk_size in chunk_sizes:
+            chunks = _split(stream, chunk_size)
+            expected = parse_sse_parser(chunks)
+            for parser_name, parse in PARSERS.items():
+                # 预热一次，同时校验解析结果一致
+                if parse(chunks) != expected:
+                    raise AssertionError(f"{parser_name} 解析结果与 sse_parser 不一致: {stream_name}")
+
+                start = time.perf_counter()
+                for _ in range(repeat):
+                    parse(chunks)
+                elapsed = (time.perf_counter() - start) / repeat
+
+                results.append({
+                    "stream": stream_name,
+                    "stream_mb": round(len(stream) / 1024 / 1024, 2),
+                    "chunk_size": chunk_size,
+                    "parser": parser_name,
+                    "ms_per_call": round(elapsed * 1000, 1),
+                    "mb_per_s": round(len(stream) / 1024 / 1024 / elapsed, 1),
+                })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SSE 解析微基准测试")
+    parser.add_argument("--image-mb", type=float, default=4, help="模拟图片大小（MB，base64 前）")
+    parser.add_argument("--chunks", type=int, nargs="+", default=[1024, 16384], help="分块大小（字节）")
+    parser.add_argument("--repeat", type=int, default=3, help="每个用例重复次数")
+    parser.add_argument("--json", action="store_true", help="以 JSON 格式输出")
+    args = parser.parse_args()
+
+    results = run_benchmark(build_streams(args.image_mb), args.chunks, args.repeat)
+
+    if args.json:
+        print(json.dumps(results, ensure_ascii=False, indent=2))
+        return
+
+    print(f"{'stream':<18}{'size':>9}{'chunk':>8}  {'parser':<12}{'ms/call':>10}{'MB/s':>9}")
+    for r in results:
+        print(
+            f"{r['stream']:<18}{r['stream_mb']:>7.2f}MB{r['chunk_size']:>8}  "
+            f"{r['parser']:<12}{r['ms_per_call']:>10.1f}{r['mb_per_s']:>9.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -232,6 +232,11 @@ export async function retryFailedImages(
       })
     })
 
+    if (response.status === 409) {
+      // 该任务的批量重试正在进行，且本次请求包含其他页面
+      const data = await response.json().catch(() => null)
+      throw new Error(data?.error || '该任务的批量重试正在进行，请稍后再试')
+    }
     if (!response.ok) {
       throw new Error(`HTTP error! status: ${response.status}`)
     }
@@ -559,6 +564,7 @@ export async function generateImagesPost(
       )
     }
 
+    // 提交后台生成任务（生成不依赖本次连接，断开后可继续读取进度）
     const response = await fetch(`${API_BASE_URL}/generate`, {
       method: 'POST',
       headers: {
@@ -577,56 +583,105 @@ export async function generateImagesPost(
       throw new Error(`HTTP error! status: ${response.status}`)
     }
 
-    const reader = response.body?.getReader()
-    if (!reader) {
-      throw new Error('无法读取响应流')
+    const result = await response.json()
+    if (!result.success) {
+      throw new Error(result.error || '提交生成任务失败')
     }
 
-    const decoder = new TextDecoder()
-    let buffer = ''
+    await streamJobEvents(result.job_id, (eventType, data) => {
+      switch (eventType) {
+        case 'progress':
+          onProgress(data)
+          break
+        case 'complete':
+          onComplete(data)
+          break
+        case 'error':
+          onError(data)
+          break
+        case 'finish':
+          onFinish(data)
+          break
+      }
+    })
+  } catch (error) {
+    onStreamError(error as Error)
+  }
+}
 
-    while (true) {
-      const { done, value } = await reader.read()
+// 获取后台任务状态：queued / running / done / failed
+export async function getJobStatus(jobId: string): Promise<string> {
+  const response = await axios.get(`${API_BASE_URL}/jobs/${jobId}`)
+  return response.data.job.status
+}
 
-      if (done) break
+// 读取后台任务的进度事件，连接断开时从最后收到的事件继续读取
+export async function streamJobEvents(
+  jobId: string,
+  onEvent: (eventType: string, data: any) => void,
+  maxRetries: number = 8
+) {
+  let lastId = 0
+  let retries = 0
 
-      buffer += decoder.decode(value, { stream: true })
-      const lines = buffer.split('\n\n')
-      buffer = lines.pop() || ''
+  while (true) {
+    try {
+      const response = await fetch(`${API_BASE_URL}/jobs/${jobId}/events?after=${lastId}`)
+      if (!response.ok) {
+        throw new Error(`HTTP error! status: ${response.status}`)
+      }
 
-      for (const line of lines) {
-        if (!line.trim()) continue
+      const reader = response.body?.getReader()
+      if (!reader) {
+        throw new Error('无法读取响应流')
+      }
 
-        const [eventLine, dataLine] = line.split('\n')
-        if (!eventLine || !dataLine) continue
+      const decoder = new TextDecoder()
+      let buffer = ''
 
-        const eventType = eventLine.replace('event: ', '').trim()
-        const eventData = dataLine.replace('data: ', '').trim()
+      while (true) {
+        const { done, value } = await reader.read()
 
-        try {
-          const data = JSON.parse(eventData)
+        if (done) {
+          // 服务端在任务结束且事件全部发送后关闭连接；代理超时、服务重启也会正常关闭连接，
+          // 任务仍在排队或执行时从最后收到的事件继续读取
+          const status = await getJobStatus(jobId)
+          if (status !== 'queued' && status !== 'running') return
+          break
+        }
 
-          switch (eventType) {
-            case 'progress':
-              onProgress(data)
-              break
-            case 'complete':
-              onComplete(data)
-              break
-            case 'error':
-              onError(data)
-              break
-            case 'finish':
-              onFinish(data)
-              break
+        buffer += decoder.decode(value, { stream: true })
+        const blocks = buffer.split('\n\n')
+        buffer = blocks.pop() || ''
+
+        for (const block of blocks) {
+          let eventType = ''
+          let eventData = ''
+          for (const line of block.split('\n')) {
+            if (line.startsWith('id: ')) lastId = Number(line.slice(4)) || lastId
+            else if (line.startsWith('event: ')) eventType = line.slice(7).trim()
+            else if (line.startsWith('data: ')) eventData = line.slice(6).trim()
+          }
+          if (!eventType || !eventData || eventType === 'heartbeat') continue
+
+          retries = 0
+          try {
+            onEvent(eventType, JSON.parse(eventData))
+          } catch (e) {
+            console.error('解析 SSE 数据失败:', e)
           }
-        } catch (e) {
-          console.error('解析 SSE 数据失败:', e)
         }
       }
+      console.warn('进度连接已关闭，任务仍在进行，重新连接')
+      await new Promise(resolve => setTimeout(resolve, 1000))
+    } catch (error) {
+      retries += 1
+      if (retries > maxRetries) {
+        throw error
+      }
+      console.warn(`进度连接中断，${retries} 秒后重连:`, error)
+      await new Promise(resolve => setTimeout(resolve, Math.min(retries, 5) * 1000))
     }
-  } catch (error) {
-    onStreamError(error as Error)
   }
 }
 
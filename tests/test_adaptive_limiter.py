@@ -0,0 +1,49 @@
+"""
+自适应并发限制测试
+"""
+import uuid
+
+from backend.config import Config
+from backend.utils.adaptive_limiter import AdaptiveLimiter, get_provider_limiter
+
+
+def _run_round(limiter: AdaptiveLimiter, outcome: str = "success"):
+    """占满当前上限后全部以 outcome 结束（每次调用约 100ms，延迟稳定）"""
+    tokens = [limiter.try_acquire() for _ in range(limiter.limit)]
+    assert None not in tokens
+    for acquired_at in tokens:
+        limiter.release(acquired_at - 0.1, outcome)
+
+
+def test_starts_at_max_concurrent_and_probes_above_it():
+    limiter = get_provider_limiter(f"test-{uuid.uuid4().hex}", {"max_concurrent": 4})
+    assert limiter.limit == 4
+    assert limiter.max_limit == int(4 * Config.CONCURRENCY_CEILING_FACTOR)
+
+    for _ in range(3):
+        _run_round(limiter)
+    # 健康时加性增长越过静态的 max_concurrent
+    assert limiter.limit == 7
+
+
+def test_ceiling_caps_additive_increase():
+    limiter = get_provider_limiter(
+        f"test-{uuid.uuid4().hex}", {"max_concurrent": 2, "max_concurrent_ceiling": 3}
+    )
+    assert (limiter.limit, limiter.max_limit) == (2, 3)
+    for _ in range(5):
+        _run_round(limiter)
+    assert limiter.limit == 3
+
+
+def test_overload_halves_limit_once_per_batch():
+    limiter = AdaptiveLimiter("test", initial=8, max_limit=32)
+    tokens = [limiter.try_acquire() for _ in range(8)]
+    for acquired_at in tokens:
+        limiter.release(acquired_at, "overload")
+    assert limiter.limit == 4
+    assert limiter.decreases == 1
+
+
+def test_ceiling_never_below_max_concurrent():
+    assert Config.get_provider_concurrency({"max_concurrent": 10, "max_concurrent_ceiling": 5}) == (10, 10)
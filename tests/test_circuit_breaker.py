@@ -0,0 +1,180 @@
+"""
+服务商熔断器测试
+"""
+import pytest
+
+from backend.utils import circuit_breaker as circuit_module
+from backend.utils.circuit_breaker import (
+    MAX_OPEN_SECONDS, STATE_CLOSED, STATE_HALF_OPEN, STATE_OPEN, CircuitBreaker, CircuitOpenError
+)
+from backend.utils.retry_policy import (
+    KIND_CANCELLED, KIND_CIRCUIT_OPEN, KIND_INVALID, KIND_SAFETY, KIND_SERVER, ProviderError
+)
+
+SERVER_ERROR = ProviderError("502", kind=KIND_SERVER)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(circuit_module.time, "monotonic", clock)
+    return clock
+
+
+def _breaker(**kwargs) -> CircuitBreaker:
+    params = dict(failure_rate=0.5, window=4, min_calls=4, open_seconds=10, half_open_calls=1)
+    params.update(kwargs)
+    return CircuitBreaker("image:test", **params)
+
+
+def _record(breaker, outcomes):
+    for success in outcomes:
+        breaker.record(None if success else SERVER_ERROR)
+
+
+def test_opens_when_failure_rate_reached(clock):
+    breaker = _breaker()
+    _record(breaker, [True, False, True])
+    assert breaker.state == STATE_CLOSED
+    _record(breaker, [False])
+    assert breaker.state == STATE_OPEN
+    assert breaker.is_open()
+    assert breaker.stats()["opened"] == 1
+
+    with pytest.raises(CircuitOpenError) as exc_info:
+        breaker.before_call()
+    assert exc_info.value.kind == KIND_CIRCUIT_OPEN
+    assert exc_info.value.retry_in == pytest.approx(10)
+    assert breaker.stats()["rejected"] == 1
+
+
+def test_min_calls_required_before_opening(clock):
+    breaker = _breaker(min_calls=3, window=10)
+    _record(breaker, [False, False])
+    assert breaker.state == STATE_CLOSED
+    _record(breaker, [False])
+    assert breaker.state == STATE_OPEN
+
+
+def test_failure_rate_over_sliding_window(clock):
+    breaker = _breaker(failure_rate=0.75)
+    # 早期的失败滑出窗口后不再计入
+    _record(breaker, [False, False, True, True, True, True])
+    assert breaker.stats()["failure_rate"] == 0.0
+    _record(breaker, [False, False])
+    assert breaker.state == STATE_CLOSED
+    assert breaker.stats()["failure_rate"] == 0.5
+    _record(breaker, [False])
+    assert breaker.state == STATE_OPEN
+
+
+def test_half_open_probe_success_closes(clock):
+    breaker = _breaker()
+    _record(breaker, [False] * 4)
+    clock.now += 10
+    assert not breaker.is_open()
+    assert breaker.state == STATE_HALF_OPEN
+
+    breaker.before_call()
+    # 半开状态只放行 half_open_calls 个试探调用
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    breaker.record(None)
+    assert breaker.state == STATE_CLOSED
+    assert breaker.stats()["window_calls"] == 0
+    breaker.before_call()
+
+
+def test_half_open_probe_limit(clock):
+    breaker = _breaker(half_open_calls=2)
+    _record(breaker, [False] * 4)
+    clock.now += 10
+    breaker.before_call()
+    breaker.before_call()
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+
+def test_failed_probe_doubles_open_time(clock):
+    breaker = _breaker()
+    _record(breaker, [False] * 4)
+    for expected in (20, 40, 80):
+        clock.now += breaker._open_for
+        breaker.before_call()
+        breaker.record(SERVER_ERROR)
+        assert breaker.state == STATE_OPEN
+        assert breaker.retry_in() == pytest.approx(expected)
+
+    # 断开时长有上限
+    breaker._open_for = MAX_OPEN_SECONDS
+    clock.now += MAX_OPEN_SECONDS
+    breaker.before_call()
+    breaker.record(SERVER_ERROR)
+    assert breaker.retry_in() == pytest.approx(MAX_OPEN_SECONDS)
+
+    # 试探成功后恢复初始断开时长
+    clock.now += MAX_OPEN_SECONDS
+    breaker.before_call()
+    breaker.record(None)
+    _record(breaker, [False] * 4)
+    assert breaker.retry_in() == pytest.approx(10)
+
+
+@pytest.mark.parametrize("kind", [KIND_CANCELLED, KIND_CIRCUIT_OPEN, KIND_INVALID, KIND_SAFETY])
+def test_neutral_kinds_not_counted(clock, kind):
+    breaker = _breaker()
+    for _ in range(8):
+        breaker.record(ProviderError("neutral", kind=kind))
+    assert breaker.state == STATE_CLOSED
+    assert breaker.stats()["window_calls"] == 0
+
+
+def test_neutral_probe_result_frees_half_open_slot(clock):
+    breaker = _breaker()
+    _record(breaker, [False] * 4)
+    clock.now += 10
+    breaker.before_call()
+    breaker.record(ProviderError("撤销", kind=KIND_CANCELLED))
+    assert breaker.state == STATE_HALF_OPEN
+    breaker.before_call()
+
+
+def test_results_while_open_ignored(clock):
+    breaker = _breaker()
+    _record(breaker, [False] * 4)
+    # 断开前已发出的调用返回
+    _record(breaker, [True, True])
+    assert breaker.state == STATE_OPEN
+
+
+def test_call_records_outcome(clock):
+    breaker = _breaker(min_calls=1, window=1)
+    assert breaker.call(lambda x: x + 1, 1) == 2
+
+    def fail():
+        raise SERVER_ERROR
+
+    with pytest.raises(ProviderError):
+        breaker.call(fail)
+    assert breaker.state == STATE_OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.call(lambda: None)
+
+
+def test_closed_stream_not_counted(clock):
+    breaker = _breaker(min_calls=1, window=1)
+    stream = breaker.guard_stream(iter([1, 2, 3]))
+    assert next(stream) == 1
+    # 客户端中途断开
+    stream.close()
+    assert breaker.state == STATE_CLOSED
+    assert list(breaker.guard_stream(iter([1, 2]))) == [1, 2]
+    assert breaker.stats()["window_calls"] == 1
@@ -0,0 +1,142 @@
+"""
+任务事件总线测试
+"""
+import asyncio
+import threading
+import uuid
+
+from backend.services.event_bus import EventBus, arun_producer, get_event_bus
+from backend.utils.sse_parser import iter_sse
+
+
+def _collect(bus: EventBus, stream_id: str, last_event_id: int = 0):
+    """订阅直到事件流结束，忽略心跳"""
+    return [item for item in bus.subscribe(stream_id, last_event_id, heartbeat=0.05) if item is not None]
+
+
+def test_resume_after_last_event_id():
+    bus = EventBus()
+    started, from_seq = bus.begin("task", "job")
+    assert (started, from_seq) == (True, 0)
+    for i in range(5):
+        assert bus.publish("task", "progress", {"index": i}) == i + 1
+    bus.end("task", "job")
+
+    assert [seq for seq, _, _ in _collect(bus, "task")] == [1, 2, 3, 4, 5]
+    assert _collect(bus, "task", 3) == [(4, "progress", {"index": 3}), (5, "progress", {"index": 4})]
+    assert _collect(bus, "task", 5) == []
+
+
+def test_truncated_when_requested_events_evicted():
+    bus = EventBus(max_events=3)
+    bus.begin("task", "job")
+    for i in range(10):
+        bus.publish("task", "progress", {"index": i})
+    bus.end("task", "job")
+
+    events = _collect(bus, "task", 2)
+    assert events[0] == (0, "truncated", {"first_id": 8})
+    assert [seq for seq, _, _ in events[1:]] == [8, 9, 10]
+    # 请求的事件仍在保留范围内时不产出 truncated
+    assert [seq for seq, _, _ in _collect(bus, "task", 7)] == [8, 9, 10]
+
+
+def test_chunk_events_do_not_evict_other_events():
+    """流式大纲的文本片段不占用保留数量，页面事件不会被挤出日志"""
+    bus = EventBus(max_events=3, max_transient=2)
+    bus.begin("outline", "outline")
+    bus.publish("outline", "start", {})
+    for i in range(10):
+        bus.publish("outline", "chunk", {"content": str(i)})
+    bus.publish("outline", "page", {"index": 0})
+    bus.end("outline", "outline")
+
+    events = _collect(bus, "outline")
+    # 被淘汰的只有片段，不产出 truncated
+    assert [(seq, event) for seq, event, _ in events] == [
+        (1, "start"), (10, "chunk"), (11, "chunk"), (12, "page")
+    ]
+
+
+def test_begin_continues_from_last_seq():
+    bus = EventBus()
+    assert bus.begin("task", "job", last_seq=5) == (True, 5)
+    assert bus.publish("task", "progress", {}) == 6
+    bus.end("task", "job")
+    # 序号不会回退
+    bus.begin("task", "job", last_seq=2)
+    assert bus.publish("task", "progress", {}) == 7
+
+
+def test_subscribers_follow_live_producers_until_all_end():
+    bus = EventBus()
+    bus.begin("task", "job")
+    started, from_seq = bus.begin("task", "retry_failed")
+    assert started and from_seq == 0
+    # 同一发布方在运行时不会重复启动
+    assert bus.begin("task", "job") == (False, 0)
+
+    results = [[], []]
+    subscribers = [
+        threading.Thread(target=lambda out=out: out.extend(_collect(bus, "task")))
+        for out in results
+    ]
+    for thread in subscribers:
+        thread.start()
+
+    bus.publish("task", "progress", {"index": 0})
+    bus.end("task", "job")
+    bus.publish("task", "complete", {"index": 1})
+    bus.end("task", "retry_failed")
+    for thread in subscribers:
+        thread.join(5)
+        assert not thread.is_alive()
+
+    assert results[0] == results[1] == [
+        (1, "progress", {"index": 0}), (2, "complete", {"index": 1})
+    ]
+    assert bus.stats()["active"] == 0
+
+
+def test_ended_streams_evicted_after_retention():
+    bus = EventBus(retention_seconds=0, max_streams=2)
+    bus.begin("old", "job")
+    bus.end("old", "job")
+    bus.begin("live", "job")
+    assert not bus.exists("old")
+    assert bus.exists("live")
+
+
+def test_events_route_resumes_from_last_event_id_header(client):
+    bus = get_event_bus()
+    stream_id = f"test-{uuid.uuid4().hex}"
+    bus.begin(stream_id, "job")
+    for i in range(3):
+        bus.publish(stream_id, "progress", {"index": i})
+    bus.end(stream_id, "job")
+
+    response = client.get(f"/api/events/{stream_id}", headers={"Last-Event-ID": "1"})
+    assert response.status_code == 200
+    events = list(iter_sse([response.get_data()]))
+    assert [(e.event, e.id, e.json()["index"]) for e in events] == [("progress", "2", 1), ("progress", "3", 2)]
+
+    assert client.get("/api/events/missing-stream").status_code == 404
+
+
+def test_async_producer_publishes_and_ends_stream():
+    """协程发布方（异步生成引擎）：事件按顺序发布，异常转为 error 事件，结束时登记发布方结束"""
+    bus = get_event_bus()
+    stream_id = f"outline_{uuid.uuid4().hex[:12]}"
+    bus.begin(stream_id, "outline")
+
+    async def events():
+        yield {"event": "start", "data": {}}
+        yield {"event": "chunk", "data": {"content": "a"}}
+        raise RuntimeError("模型断开")
+
+    asyncio.run(arun_producer(stream_id, "outline", events()))
+    assert _collect(bus, stream_id) == [
+        (1, "start", {}),
+        (2, "chunk", {"content": "a"}),
+        (3, "error", {"error": "模型断开"}),
+    ]
@@ -0,0 +1,126 @@
+"""
+对冲请求测试
+"""
+import asyncio
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from backend.utils.hedging import Hedger
+from backend.utils.http_pool import HttpSession
+from backend.utils.retry_policy import CancelEvent, RequestCancelled
+
+
+def _hedger() -> Hedger:
+    """样本充足、每次调用都有对冲额度、超过 50ms 即对冲的控制器"""
+    hedger = Hedger("test", enabled=True, percentile=50, max_extra_ratio=1, min_delay=0)
+    for _ in range(20):
+        hedger.record(0.05)
+    return hedger
+
+
+def test_loser_finishing_with_winner_is_discarded():
+    """两次调用在同一批次中成功返回时，未被采用的结果交给 discard"""
+    release = threading.Event()
+    calls = []
+    discarded = []
+
+    def fn(cancel_event):
+        calls.append(cancel_event)
+        index = len(calls)
+        if index == 1:
+            # 等对冲请求发出后两次调用同时返回
+            threading.Timer(0.1, release.set).start()
+        release.wait(5)
+        return f"result-{index}"
+
+    result = _hedger().call(fn, discard=discarded.append)
+    time.sleep(0.1)
+
+    assert len(calls) == 2
+    assert all(isinstance(event, CancelEvent) for event in calls)
+    assert sorted([result] + discarded) == ["result-1", "result-2"]
+
+
+def test_loser_is_cancelled_and_late_result_discarded():
+    """落败的一方收到撤销信号；撤销后仍成功返回的结果交给 discard"""
+    discarded = []
+    cancelled = threading.Event()
+
+    def slow(cancel_event):
+        cancel_event.add_callback(cancelled.set)
+        time.sleep(0.3)
+        return "slow"
+
+    def fast(cancel_event):
+        return "fast"
+
+    result = _hedger().call(slow, hedge_fn=fast, discard=discarded.append)
+    assert result == "fast"
+    assert cancelled.wait(1)
+    time.sleep(0.4)
+    assert discarded == ["slow"]
+
+
+def test_async_loser_finishing_with_winner_is_discarded():
+    discarded = []
+
+    async def main():
+        release = asyncio.Event()
+        calls = []
+
+        async def fn():
+            calls.append(None)
+            index = len(calls)
+            if index == 1:
+                asyncio.get_running_loop().call_later(0.1, release.set)
+            await release.wait()
+            return f"result-{index}"
+
+        result = await _hedger().acall(fn, discard=discarded.append)
+        await asyncio.sleep(0)
+        return result
+
+    result = asyncio.run(main())
+    assert sorted([result] + discarded) == ["result-1", "result-2"]
+
+
+@pytest.fixture
+def slow_server():
+    """响应头延迟 3 秒返回的 HTTP 服务"""
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            if self.path == "/slow":
+                time.sleep(3)
+            self.send_response(200)
+            self.send_header("Content-Length", "2")
+            self.end_headers()
+            self.wfile.write(b"ok")
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+def test_cancel_aborts_request_waiting_for_headers(slow_server):
+    session = HttpSession("test", 2)
+    cancel_event = CancelEvent()
+    threading.Timer(0.2, cancel_event.set).start()
+
+    started = time.monotonic()
+    with pytest.raises(RequestCancelled):
+        session.get(f"{slow_server}/slow", timeout=10, cancel_event=cancel_event)
+    assert time.monotonic() - started < 1
+
+    # 撤销不影响会话上的其他请求
+    assert session.get(f"{slow_server}/fast", timeout=10).text == "ok"
+    assert session.stats()["errors"] == 0
@@ -0,0 +1,106 @@
+"""
+服务商 HTTP 连接池测试
+"""
+import asyncio
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from backend.utils import http_pool
+from backend.utils.http_pool import AsyncHttpSession, HttpSession, get_http_session
+from backend.utils.retry_policy import CancelEvent, RequestCancelled
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        if self.path == "/slow":
+            time.sleep(2)
+        body = b"ok"
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server_url():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+def test_reuses_connections(server_url):
+    session = HttpSession("image:test", pool_size=2)
+    for _ in range(3):
+        response = session.get(f"{server_url}/", timeout=5)
+        assert response.status_code == 200
+        assert response.text == "ok"
+
+    stats = session.stats()
+    assert (stats["requests"], stats["connections"], stats["reused"]) == (3, 1, 2)
+    assert stats["hosts"]["127.0.0.1"]["requests"] == 3
+
+
+def test_cancel_event_aborts_waiting_request(server_url):
+    session = HttpSession("image:test")
+    cancel_event = CancelEvent()
+    threading.Timer(0.2, cancel_event.set).start()
+
+    started = time.monotonic()
+    with pytest.raises(RequestCancelled):
+        session.get(f"{server_url}/slow", timeout=5, cancel_event=cancel_event)
+    assert time.monotonic() - started < 1.5
+    # 撤销不计入错误
+    assert session.stats()["errors"] == 0
+
+
+def test_http2_falls_back_without_h2(monkeypatch):
+    monkeypatch.setattr(http_pool.importlib.util, "find_spec", lambda name: None)
+    session = HttpSession("image:test", pool_size=4, http2=True)
+    assert session.http2 is False
+    assert AsyncHttpSession("image:test", http2=True).http2 is False
+
+
+def test_configure_keeps_session_when_unchanged():
+    session = HttpSession("image:test", pool_size=4)
+    inner = session._session
+    session.configure(4)
+    assert session._session is inner
+    session.configure(8)
+    assert session._session is not inner
+    assert session.pool_size == 8
+
+
+def test_get_http_session_shared_per_provider(monkeypatch):
+    monkeypatch.setattr(http_pool, "_sessions", {})
+    config = {"max_concurrent": 3}
+    session = get_http_session("image", "test", config)
+    assert get_http_session("image", "test", config) is session
+    assert get_http_session("text", "test", config) is not session
+    assert session.pool_size == http_pool.Config.get_provider_concurrency(config)[1] + http_pool.POOL_HEADROOM
+
+
+def test_async_session_reuses_connections(server_url):
+    session = AsyncHttpSession("image:test", pool_size=2)
+
+    async def fetch_all():
+        bodies = []
+        for _ in range(3):
+            async with session.stream("GET", f"{server_url}/", timeout=5) as response:
+                bodies.append(await response.atext())
+        return bodies
+
+    assert asyncio.run(fetch_all()) == ["ok"] * 3
+    stats = session.stats()
+    assert (stats["requests"], stats["connections"], stats["reused"]) == (3, 1, 2)
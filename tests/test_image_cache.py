@@ -0,0 +1,100 @@
+"""
+压缩图片缓存测试
+"""
+import threading
+
+from backend.utils import image_cache
+from backend.utils.image_cache import CompressedImageCache
+
+
+class FakeImagePool:
+    def __init__(self, delay_event=None):
+        self.calls = 0
+        self.delay_event = delay_event
+
+    def compress(self, image_data, max_size_kb=200):
+        self.calls += 1
+        if self.delay_event:
+            self.delay_event.wait(5)
+        return image_data[:max_size_kb]
+
+
+def _pool(monkeypatch, **kwargs) -> FakeImagePool:
+    pool = FakeImagePool(**kwargs)
+    monkeypatch.setattr(image_cache, "get_image_pool", lambda: pool)
+    return pool
+
+
+def test_small_image_bypasses_cache(monkeypatch):
+    pool = _pool(monkeypatch)
+    cache = CompressedImageCache(1024 * 1024)
+    data = b"x" * 100
+    assert cache.get_or_compress(data, max_size_kb=1) is data
+    assert pool.calls == 0
+    assert cache.stats()["entries"] == 0
+
+
+def test_hit_by_content_and_target_size(monkeypatch):
+    pool = _pool(monkeypatch)
+    cache = CompressedImageCache(1024 * 1024)
+    data = b"a" * 4096
+    first = cache.get_or_compress(data, max_size_kb=1)
+    # 内容相同的另一个对象同样命中
+    assert cache.get_or_compress(bytes(bytearray(data)), max_size_kb=1) == first
+    assert pool.calls == 1
+    # 目标大小不同视为不同条目
+    cache.get_or_compress(data, max_size_kb=2)
+    assert pool.calls == 2
+
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["entries"]) == (1, 2, 2)
+
+
+def test_lru_eviction_by_bytes(monkeypatch):
+    _pool(monkeypatch)
+    cache = CompressedImageCache(max_bytes=2)
+    a, b, c = b"a" * 2048, b"b" * 2048, b"c" * 2048
+    cache.get_or_compress(a, max_size_kb=1)
+    cache.get_or_compress(b, max_size_kb=1)
+    cache.get_or_compress(a, max_size_kb=1)
+    cache.get_or_compress(c, max_size_kb=1)
+    # b 最久未使用，被淘汰
+    assert cache.stats()["evictions"] == 1
+    assert cache.stats()["bytes"] == 2
+    misses = cache.stats()["misses"]
+    cache.get_or_compress(a, max_size_kb=1)
+    assert cache.stats()["misses"] == misses
+    cache.get_or_compress(b, max_size_kb=1)
+    assert cache.stats()["misses"] == misses + 1
+
+
+def test_entry_larger_than_budget_not_cached(monkeypatch):
+    pool = _pool(monkeypatch)
+    cache = CompressedImageCache(max_bytes=1)
+    data = b"a" * 4096
+    cache.get_or_compress(data, max_size_kb=2)
+    cache.get_or_compress(data, max_size_kb=2)
+    assert pool.calls == 2
+    assert cache.stats()["entries"] == 0
+
+
+def test_concurrent_misses_compress_once(monkeypatch):
+    release = threading.Event()
+    pool = _pool(monkeypatch, delay_event=release)
+    cache = CompressedImageCache(1024 * 1024)
+    data = b"a" * 4096
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(cache.get_or_compress(data, max_size_kb=1)))
+        for _ in range(4)
+    ]
+    for thread in threads:
+        thread.start()
+    threading.Timer(0.2, release.set).start()
+    for thread in threads:
+        thread.join(5)
+
+    assert pool.calls == 1
+    assert len(results) == 4 and len(set(results)) == 1
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"]) == (3, 1)
@@ -0,0 +1,103 @@
+"""
+图片压缩测试
+"""
+import io
+import os
+
+import pytest
+from PIL import Image
+
+from backend.utils import image_compressor
+from backend.utils.image_compressor import compress_image, detect_image_mime, resize_image
+
+
+def _noise(size, fmt="PNG", mode="RGB") -> bytes:
+    """随机噪声图（难以压缩，体积接近原始像素数据）"""
+    img = Image.frombytes("RGB", size, os.urandom(size[0] * size[1] * 3))
+    if mode != "RGB":
+        img = img.convert(mode)
+    buffer = io.BytesIO()
+    img.save(buffer, format=fmt, **({"quality": 95} if fmt == "JPEG" else {}))
+    return buffer.getvalue()
+
+
+def _open(data: bytes) -> Image.Image:
+    return Image.open(io.BytesIO(data))
+
+
+def test_small_image_returned_unchanged():
+    data = _noise((8, 8))
+    assert compress_image(data, max_size_kb=200) is data
+
+
+@pytest.mark.parametrize("max_size_kb", [60, 150])
+def test_compresses_within_limit(max_size_kb):
+    data = _noise((600, 400))
+    compressed = compress_image(data, max_size_kb=max_size_kb)
+    assert len(compressed) <= max_size_kb * 1024
+    img = _open(compressed)
+    assert img.format == "JPEG"
+    assert img.size == (600, 400)
+
+
+def test_quality_search_uses_few_encodes(monkeypatch):
+    """插值搜索在少量编码内收敛，选中的质量与超限的最低质量相差不超过收敛精度"""
+    sizes = {}
+    encode = image_compressor._encode_jpeg
+
+    def recording_encode(img, quality):
+        data = encode(img, quality)
+        sizes[quality] = len(data)
+        return data
+
+    monkeypatch.setattr(image_compressor, "_encode_jpeg", recording_encode)
+    limit = 100 * 1024
+    compressed = compress_image(_noise((600, 400)), max_size_kb=100)
+
+    assert len(sizes) <= 8
+    fitting = max(q for q, size in sizes.items() if size <= limit)
+    too_large = min(q for q, size in sizes.items() if size > limit)
+    assert sizes[fitting] == len(compressed)
+    assert 0 < too_large - fitting <= image_compressor.QUALITY_TOLERANCE
+
+
+def test_large_image_downscaled_to_max_dimension():
+    data = _noise((3000, 1500), fmt="JPEG")
+    compressed = compress_image(data, max_size_kb=2000, max_dimension=1024)
+    assert _open(compressed).size == (1024, 512)
+
+
+def test_shrinks_when_lowest_quality_too_large():
+    data = _noise((1600, 1600))
+    compressed = compress_image(data, max_size_kb=40)
+    assert len(compressed) <= 40 * 1024
+    assert max(_open(compressed).size) >= image_compressor.MIN_DIMENSION
+
+
+def test_transparent_image_flattened_to_rgb():
+    compressed = compress_image(_noise((400, 400), mode="RGBA"), max_size_kb=50)
+    assert _open(compressed).mode == "RGB"
+
+
+def test_invalid_data_returned_unchanged():
+    data = b"not an image" * 10000
+    assert compress_image(data, max_size_kb=1) is data
+
+
+def test_resize_image_does_not_upscale():
+    data = _noise((300, 200))
+    assert _open(resize_image(data, 150, "webp")).size == (150, 100)
+    assert _open(resize_image(data, 1000, "jpeg")).size == (300, 200)
+    with pytest.raises(ValueError):
+        resize_image(data, 150, "gif")
+
+
+@pytest.mark.parametrize("header, mime", [
+    (b"\x89PNG\r\n\x1a\n0000", "image/png"),
+    (b"\xff\xd8\xff\xe0", "image/jpeg"),
+    (b"GIF89a", "image/gif"),
+    (b"RIFF0000WEBP", "image/webp"),
+    (b"unknown", "image/png"),
+])
+def test_detect_image_mime(header, mime):
+    assert detect_image_mime(header) == mime
@@ -0,0 +1,47 @@
+"""
+图片接口路径校验测试
+"""
+import os
+
+import pytest
+
+from backend.services.derivative import DerivativeService
+from backend.services.thumbnail import ThumbnailService
+from backend.utils.paths import is_single_path_segment
+
+
+@pytest.mark.parametrize("name, expected", [
+    ("task_x", True),
+    ("1.png", True),
+    ("..a.png", True),
+    ("", False),
+    (".", False),
+    ("..", False),
+    ("sub/1.png", False),
+    (os.path.join("sub", "1.png"), False),
+])
+def test_is_single_path_segment(name, expected):
+    assert is_single_path_segment(name) is expected
+
+
+@pytest.mark.parametrize("path", [
+    "/api/images/%2E%2E/app.py",
+    "/api/images/task_x/..",
+    "/api/images/task_x/..?w=256",
+    "/api/images/task_x/..?thumbnail=false",
+])
+def test_rejects_paths_outside_task_dir(client, path):
+    response = client.get(path)
+    assert response.status_code == 400
+    assert response.get_json()["success"] is False
+
+
+@pytest.mark.parametrize("filename", ["..", "../1.png", "sub/1.png", ""])
+def test_services_reject_multi_segment_filenames(temp_history_dir, filename):
+    task_dir = os.path.join(temp_history_dir, "task_x")
+    with pytest.raises(ValueError):
+        ThumbnailService().ensure_thumbnail(task_dir, filename)
+    with pytest.raises(ValueError):
+        DerivativeService(temp_history_dir, 1024 * 1024).get_derivative(task_dir, filename, 256, "webp")
+    # 校验在任何写入之前
+    assert os.listdir(temp_history_dir) == []
@@ -0,0 +1,88 @@
+"""
+图片处理进程池测试
+"""
+import io
+import os
+
+import pytest
+from PIL import Image
+
+from backend.utils import image_pool
+from backend.utils.image_pool import ImageProcessPool, open_file_atomic, write_file_atomic
+
+
+def _noise_png(size=(300, 300)) -> bytes:
+    img = Image.frombytes("RGB", size, os.urandom(size[0] * size[1] * 3))
+    buffer = io.BytesIO()
+    img.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def process_pool():
+    pool = ImageProcessPool(workers=1)
+    yield pool
+    pool.shutdown()
+
+
+def test_compress_in_subprocess(process_pool):
+    data = _noise_png()
+    compressed = process_pool.compress(data, max_size_kb=50)
+    assert len(compressed) <= 50 * 1024
+    assert Image.open(io.BytesIO(compressed)).format == "JPEG"
+    stats = process_pool.stats()
+    assert stats["offloaded"] == 1 and stats["started"] is True
+
+
+def test_file_jobs_in_subprocess(process_pool, temp_history_dir):
+    source = os.path.join(temp_history_dir, "0.png")
+    write_file_atomic(source, _noise_png())
+
+    thumb = os.path.join(temp_history_dir, "thumb_0.png")
+    size = process_pool.compress_file(source, thumb, 20)
+    assert os.path.getsize(thumb) == size <= 20 * 1024
+
+    derivative = os.path.join(temp_history_dir, "0_150.webp")
+    process_pool.resize_file(source, derivative, 150, "webp")
+    assert Image.open(derivative).size == (150, 150)
+    assert process_pool.stats()["offloaded"] == 2
+
+
+def test_disabled_pool_runs_inline():
+    pool = ImageProcessPool(workers=0)
+    small = b"x" * 10
+    assert pool.compress(small, max_size_kb=1) is small
+    assert len(pool.compress(_noise_png(), max_size_kb=50)) <= 50 * 1024
+    stats = pool.stats()
+    assert stats["inline"] == 1 and stats["started"] is False
+
+
+def test_broken_pool_falls_back_inline(monkeypatch):
+    pool = ImageProcessPool(workers=1)
+
+    class BrokenExecutor:
+        def submit(self, *args):
+            raise image_pool.BrokenProcessPool("boom")
+
+        def shutdown(self, **kwargs):
+            pass
+
+    broken = BrokenExecutor()
+    monkeypatch.setattr(pool, "_get_executor", lambda: broken)
+    pool._executor = broken
+    assert pool._run(len, (b"abc",), lambda: "inline") == "inline"
+    assert pool.stats()["fallbacks"] == 1
+    # 损坏的进程池被丢弃，下次调用时重建
+    assert pool._executor is None
+
+
+def test_atomic_write_removes_temp_file_on_error(temp_history_dir):
+    path = os.path.join(temp_history_dir, "0.png")
+    write_file_atomic(path, b"old")
+    with pytest.raises(RuntimeError):
+        with open_file_atomic(path) as f:
+            f.write(b"partial")
+            raise RuntimeError("下载中断")
+    with open(path, "rb") as f:
+        assert f.read() == b"old"
+    assert os.listdir(temp_history_dir) == ["0.png"]
@@ -0,0 +1,169 @@
+"""
+图片生成服务测试
+"""
+import asyncio
+import os
+import threading
+import uuid
+from types import SimpleNamespace
+
+import pytest
+
+from backend.config import Config
+from backend.generators.base import ImageGeneratorBase
+from backend.services import image as image_module
+from backend.services import provider_pool
+from backend.services.image import ImageService
+from backend.services.provider_pool import ProviderPool
+from backend.services.task_state import TaskStateStore
+from backend.services.thumbnail import ThumbnailService
+
+_IMAGE = b"\x89PNG\r\n\x1a\n" + os.urandom(4096)
+
+
+class ChunkedGenerator(ImageGeneratorBase):
+    """分块写入固定图片的生成器"""
+
+    def generate_image(self, prompt, **kwargs):
+        return _IMAGE
+
+    def write_image(self, out, prompt, **kwargs):
+        for i in range(0, len(_IMAGE), 1000):
+            out.write(_IMAGE[i:i + 1000])
+        return len(_IMAGE)
+
+    def validate_config(self):
+        return True
+
+
+@pytest.fixture
+def member():
+    config = {"name": f"test-{uuid.uuid4().hex}", "type": "image_api", "max_concurrent": 1}
+    return SimpleNamespace(name=config["name"], type="image_api", config=config, generator=ChunkedGenerator(config))
+
+
+@pytest.mark.parametrize("keep_data", [False, True])
+def test_call_generator_keeps_cover_data_without_reading_back(member, temp_history_dir, keep_data):
+    """封面写入文件的同时保留数据，后续页面的参考图不必再读回文件"""
+    service = ImageService.__new__(ImageService)
+    part_path, data = service._call_generator(
+        member, "prompt", target_path=os.path.join(temp_history_dir, "0.png"), keep_data=keep_data
+    )
+    with open(part_path, "rb") as f:
+        assert f.read() == _IMAGE
+    assert data == (_IMAGE if keep_data else None)
+
+
+def test_async_call_generator_keeps_cover_data(member, temp_history_dir):
+    service = ImageService.__new__(ImageService)
+    part_path, data = asyncio.run(service._acall_generator(
+        member, "prompt", target_path=os.path.join(temp_history_dir, "0.png"), keep_data=True
+    ))
+    with open(part_path, "rb") as f:
+        assert f.read() == data == _IMAGE
+
+
+class RecordingGenerator(ChunkedGenerator):
+    """记录每次调用的提示词和参考图，第一次调用（封面）时置位 cover_started"""
+
+    def __init__(self, config):
+        super().__init__(config)
+        self.calls = []
+        self.cover_started = threading.Event()
+
+    def write_image(self, out, prompt, reference_images=None, **kwargs):
+        self.calls.append((prompt, reference_images))
+        self.cover_started.set()
+        return super().write_image(out, prompt)
+
+
+@pytest.fixture
+def pipeline_service(monkeypatch, temp_history_dir):
+    """只有一个 image_api 服务商、使用临时任务目录的 ImageService"""
+    name = f"test-{uuid.uuid4().hex}"
+    config = {"name": name, "type": "image_api", "max_concurrent": 2, "short_prompt": False}
+    generator = RecordingGenerator(config)
+    monkeypatch.setattr(Config, "GENERATION_ENGINE", "thread")
+    monkeypatch.setattr(provider_pool.ImageGeneratorFactory, "create", lambda provider_type, cfg: generator)
+    monkeypatch.setattr(provider_pool, "get_lease_limiter", lambda kind, name, config: None)
+    monkeypatch.setattr(
+        image_module, "create_provider_pool",
+        lambda provider_name=None: ProviderPool([provider_pool.PoolMember(name, config)])
+    )
+    # 缩略图在当前线程中同步生成，测试结束删除临时目录时没有进行中的后台任务
+    thumbnails = ThumbnailService()
+    monkeypatch.setattr(thumbnails, "submit", thumbnails.ensure_thumbnail)
+    monkeypatch.setattr(image_module, "get_thumbnail_service", lambda: thumbnails)
+    monkeypatch.setattr(image_module, "get_task_state_store", lambda: TaskStateStore(temp_history_dir, 10, 1024 * 1024, 600))
+    service = ImageService()
+    service.history_root_dir = temp_history_dir
+    service.prompt_template = "{page_content}\n{full_outline}"
+    return service, generator
+
+
+def test_pipelined_cover_starts_while_outline_streams(pipeline_service):
+    """封面在大纲还在生成时就开始，内容页以封面为参考图"""
+    service, generator = pipeline_service
+
+    def outline_chunks():
+        yield "[封面]\n标题"
+        yield "<page>[内容]\n第一页"
+        # 第一页完成（遇到下一页的分隔符）后封面应当已经开始生成
+        assert generator.cover_started.wait(5)
+        yield "<page>[内容]\n第二页"
+
+    events = list(service.generate_images_pipelined(outline_chunks(), task_id="task_pipe"))
+    names = [e["event"] for e in events]
+    assert "error" not in names
+    # 封面的生成进度先于大纲完成事件
+    cover_progress = next(i for i, e in enumerate(events) if e["data"].get("phase") == "cover")
+    assert cover_progress < names.index("done")
+
+    finish = events[-1]["data"]
+    assert finish["success"] is True
+    assert sorted(finish["images"]) == ["0.png", "1.png", "2.png"]
+
+    cover_prompt, cover_refs = generator.calls[0]
+    assert cover_prompt.startswith("[封面]") and cover_refs is None
+    for prompt, refs in generator.calls[1:]:
+        assert prompt.startswith("[内容]")
+        assert [ref.raw for ref in refs] == [_IMAGE]
+
+    state = service.task_states.get("task_pipe")
+    assert [p["type"] for p in state["pages"]] == ["cover", "content", "content"]
+    assert set(state["generated"]) == {0, 1, 2}
+
+
+def test_pipelined_outline_error_finishes_submitted_pages(pipeline_service):
+    service, generator = pipeline_service
+
+    def outline_chunks():
+        yield "[封面]\n标题<page>"
+        raise RuntimeError("大纲接口断开")
+
+    events = list(service.generate_images_pipelined(outline_chunks(), task_id="task_pipe_err"))
+    errors = [e["data"] for e in events if e["event"] == "error"]
+    assert errors == [{"error": "大纲接口断开", "phase": "outline"}]
+    finish = events[-1]["data"]
+    assert finish["images"] == ["0.png"]
+    assert finish["total"] == 1
+
+
+def test_admitted_page_uses_picked_member_retry_policy(monkeypatch):
+    """重试策略按准入时实际选中的服务商的配置"""
+    monkeypatch.setattr(provider_pool.ImageGeneratorFactory, "create", lambda provider_type, cfg: ChunkedGenerator(cfg))
+    monkeypatch.setattr(provider_pool, "get_lease_limiter", lambda kind, name, config: None)
+    prefix = uuid.uuid4().hex
+    first = provider_pool.PoolMember(f"{prefix}-a", {"type": "image_api", "retry_max_attempts": 5})
+    second = provider_pool.PoolMember(f"{prefix}-b", {"type": "image_api", "retry_max_attempts": 2})
+    service = ImageService.__new__(ImageService)
+    service.pool = ProviderPool([first, second])
+    monkeypatch.setattr(ProviderPool, "_choose", lambda self, candidates: second)
+
+    admission = service._admit_page(None, None)
+    try:
+        assert admission.member is second
+        assert admission.retry_policy.max_attempts == 2
+    finally:
+        admission.release()
+    assert service._retry_policy().max_attempts == 5
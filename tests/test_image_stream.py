@@ -0,0 +1,137 @@
+"""
+图片响应流式解码测试
+"""
+import base64
+import io
+import json
+import random
+
+import pytest
+
+from backend.utils.image_stream import Base64FieldDecoder, ChatImageExtractor, write_chat_image
+from backend.utils.retry_policy import KIND_NETWORK, ProviderError, is_retryable
+
+_IMAGE = bytes(random.Random(0).randrange(256) for _ in range(3001))
+_B64 = base64.b64encode(_IMAGE).decode("ascii")
+
+
+def _random_split(rng: random.Random, data):
+    """按随机位置切分（字节或文本）"""
+    pos = 0
+    while pos < len(data):
+        size = rng.choice([1, 2, 3, 5, rng.randint(1, 200)])
+        yield data[pos:pos + size]
+        pos += size
+
+
+def _decode(chunks, **kwargs) -> Base64FieldDecoder:
+    decoder = Base64FieldDecoder(io.BytesIO(), **kwargs)
+    for chunk in chunks:
+        decoder.feed(chunk)
+    return decoder
+
+
+def _json_body(value: str) -> bytes:
+    body = {
+        "created": 1,
+        "note": "字段名出现在其他字符串中: \"b64_json\": \"x\"",
+        "data": [{"url": None, "b64_json": value, "revised_prompt": "小红书"}],
+    }
+    return json.dumps(body, ensure_ascii=False).encode("utf-8")
+
+
+@pytest.mark.parametrize("value", [
+    _B64,
+    "data:image/png;base64," + _B64,
+    # JSON 转义的斜杠和换行
+    "\n".join(_B64[i:i + 76] for i in range(0, len(_B64), 76)),
+])
+def test_b64_field_random_chunking(value):
+    body = _json_body(value).replace(b"/", b"\\/")
+    rng = random.Random(value[:40])
+    for _ in range(100):
+        decoder = _decode(_random_split(rng, body))
+        assert decoder.found
+        assert decoder.finish() == len(_IMAGE)
+        assert decoder.out.getvalue() == _IMAGE
+
+
+def test_b64_field_truncated_stream_is_network_error():
+    body = _json_body(_B64)
+    cut = body.index(_B64.encode()) + len(_B64) // 2
+    decoder = _decode(_random_split(random.Random(1), body[:cut]))
+    with pytest.raises(ProviderError) as exc:
+        decoder.finish()
+    assert exc.value.kind == KIND_NETWORK
+    # 已写入的数据是原图的前缀
+    assert _IMAGE.startswith(decoder.out.getvalue())
+
+
+def test_b64_field_missing_falls_back_to_json():
+    body = json.dumps({"data": [{"url": "https://example.com/a.png", "b64_json": None}]}).encode()
+    decoder = _decode(_random_split(random.Random(2), body))
+    assert not decoder.found
+    assert decoder.finish() == 0
+    assert decoder.json()["data"][0]["url"] == "https://example.com/a.png"
+
+
+def test_b64_field_missing_in_large_response_is_truncated():
+    body = json.dumps({"error": "x" * 5000}).encode()
+    decoder = _decode(_random_split(random.Random(3), body), max_buffered=1024)
+    assert decoder.truncated
+    assert len(decoder.snippet(limit=2000)) == 1024
+    # 服务商响应异常，按可重试的 unknown 处理
+    with pytest.raises(ProviderError) as exc_info:
+        decoder.json()
+    assert is_retryable(exc_info.value)
+
+
+def _extract(chunks) -> ChatImageExtractor:
+    downloads = []
+
+    def download(url):
+        downloads.append(url)
+        return 1
+
+    extractor = write_chat_image(chunks, io.BytesIO(), download)
+    extractor.downloads = downloads
+    return extractor
+
+
+def test_chat_base64_random_chunking():
+    text = f"好的，这是生成的图片：\n\n![图片](data:image/png;base64,{_B64})\n\n希望你喜欢 https://example.com/page"
+    rng = random.Random(4)
+    for _ in range(100):
+        extractor = _extract(_random_split(rng, text))
+        assert extractor.is_base64
+        assert extractor.out.getvalue() == _IMAGE
+        assert extractor.downloads == []
+
+
+@pytest.mark.parametrize("cut", [4 * 300, 4 * 300 + 2, 4 * 300 + 3])
+def test_chat_base64_truncated_keeps_decoded_prefix(cut):
+    text = "data:image/jpeg;base64," + _B64[:cut]
+    extractor = _extract(_random_split(random.Random(cut), text))
+    assert extractor.is_base64
+    assert extractor.out.getvalue() == base64.b64decode(_B64[:cut] + "=" * (-cut % 4))
+
+
+def test_chat_markdown_url_preferred_over_earlier_plain_url():
+    text = "参考 https://example.com/page 生成：![cover](https://cdn.example.com/img?id=1) 完成"
+    rng = random.Random(5)
+    for _ in range(100):
+        extractor = _extract(_random_split(rng, text))
+        assert extractor.url == "https://cdn.example.com/img?id=1"
+        assert extractor.downloads == [extractor.url]
+
+
+def test_chat_plain_url_used_as_fallback():
+    extractor = _extract(_random_split(random.Random(6), "图片地址：https://example.com/result"))
+    assert extractor.found and not extractor.is_base64
+    assert extractor.downloads == ["https://example.com/result"]
+
+
+def test_chat_without_image():
+    extractor = _extract(["抱歉，", "我无法生成图片。"])
+    assert not extractor.found
+    assert extractor.snippet() == "抱歉，我无法生成图片。"
@@ -0,0 +1,246 @@
+"""
+后台任务队列测试
+"""
+import threading
+import time
+import uuid
+
+import pytest
+
+from backend.services.event_bus import get_event_bus
+from backend.services.jobs import JOB_DONE, JOB_FAILED, JOB_QUEUED, JOB_RUNNING, JobManager, JobStore
+
+
+# 执行方：LIVE 的租约有效，DEAD 的租约已过期（模拟已退出的进程）
+LIVE, DEAD = ("live", 60), ("dead", -1)
+
+
+@pytest.fixture
+def store(tmp_path):
+    return JobStore(str(tmp_path / "jobs.db"))
+
+
+def _wait_finished(store: JobStore, job_id: str, timeout: float = 5):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = store.get(job_id)
+        if job["status"] in (JOB_DONE, JOB_FAILED):
+            return job
+        time.sleep(0.02)
+    raise AssertionError(f"任务未结束: {job_id}")
+
+
+def test_claim_in_creation_order(store):
+    first = store.create("generate_images", {"n": 1}, task_id="task_a")
+    second = store.create("generate_images", {"n": 2})
+
+    job = store.claim(*LIVE)
+    assert job["id"] == first
+    assert job["payload"] == {"n": 1}
+    assert job["task_id"] == "task_a"
+    # 返回取出前的执行次数
+    assert job["attempts"] == 0
+    assert store.get(first)["status"] == JOB_RUNNING
+    assert store.get(first)["attempts"] == 1
+    assert store.get(first)["owner"] == "live"
+
+    assert store.claim(*LIVE)["id"] == second
+    assert store.claim(*LIVE) is None
+
+
+def test_requeue_only_expired_leases(store):
+    job_id = store.create("generate_images", {})
+    live = store.create("generate_images", {})
+    store.claim(*DEAD)
+    store.claim(*LIVE)
+    assert store.requeue_expired() == 1
+    assert store.get(job_id)["status"] == JOB_QUEUED
+    # 其他仍在运行的执行方的任务不受影响
+    assert store.get(live)["status"] == JOB_RUNNING
+
+    job = store.claim(*DEAD)
+    assert job["id"] == job_id
+    assert job["attempts"] == 1
+
+
+def test_fail_exhausted_caps_attempts(store):
+    exhausted = store.create("generate_images", {})
+    for _ in range(2):
+        store.claim(*DEAD)
+        store.requeue_expired()
+    fresh = store.create("generate_images", {})
+    # 两个任务都在执行中时进程退出：exhausted 已执行 3 次，fresh 1 次
+    store.claim(*DEAD)
+    store.claim(*DEAD)
+    assert store.get(exhausted)["attempts"] == 3
+    assert store.get(fresh)["attempts"] == 1
+
+    assert store.fail_exhausted(3, "多次中断") == [exhausted]
+    assert store.requeue_expired() == 1
+    assert store.get(exhausted)["status"] == JOB_FAILED
+    assert store.get(exhausted)["error"] == "多次中断"
+    assert store.get(fresh)["status"] == JOB_QUEUED
+
+
+def test_live_job_past_attempt_cap_is_not_failed(store):
+    job_id = store.create("generate_images", {})
+    for _ in range(2):
+        store.claim(*DEAD)
+        store.requeue_expired()
+    store.claim(*LIVE)
+    assert store.fail_exhausted(3, "多次中断") == []
+    assert store.requeue_expired() == 0
+    assert store.get(job_id)["status"] == JOB_RUNNING
+
+
+def test_renew_and_finish_by_owner(store):
+    job_id = store.create("generate_images", {})
+    store.claim(*DEAD)
+    assert store.renew("other", 60) == []
+    assert store.renew("dead", 60) == [job_id]
+    # 续约后不再被回收
+    assert store.requeue_expired() == 0
+    assert not store.finish(job_id, "other", JOB_DONE)
+    assert store.finish(job_id, "dead", JOB_DONE)
+    assert store.get(job_id)["status"] == JOB_DONE
+
+
+def test_manager_leaves_other_owners_running_jobs(store):
+    """新启动（或被回收重启）的进程不会把其他存活进程正在执行的任务重新排队"""
+    job_id = store.create("echo", {})
+    store.claim(*LIVE)
+
+    manager = JobManager(store, workers=1, max_attempts=3)
+    manager.register("echo", lambda payload: iter(()))
+    manager.start()
+    time.sleep(0.1)
+
+    job = store.get(job_id)
+    assert job["status"] == JOB_RUNNING
+    assert job["owner"] == "live"
+
+
+def test_events_after(store):
+    job_id = store.create("generate_images", {})
+    assert store.append_event(job_id, "progress", {"current": 1}) == 1
+    assert store.append_event(job_id, "finish", {"success": True}) == 2
+    assert [seq for seq, _, _ in store.events(job_id)] == [1, 2]
+    assert store.events(job_id, after=1) == [(2, "finish", {"success": True})]
+
+
+def test_restarted_job_resumes(store):
+    """服务重启后重新执行的任务带 resume=True，并先写入 restart 事件"""
+    job_id = store.create("echo", {"value": 1})
+    store.claim(*DEAD)
+
+    payloads = []
+
+    def handler(payload):
+        payloads.append(payload)
+        yield {"event": "finish", "data": {"success": True}}
+
+    manager = JobManager(store, workers=1, max_attempts=3)
+    manager.register("echo", handler)
+    manager.start()
+
+    job = _wait_finished(store, job_id)
+    assert job["status"] == JOB_DONE
+    assert payloads == [{"value": 1, "resume": True}]
+    assert [event for _, event, _ in store.events(job_id)] == ["restart", "finish"]
+
+
+def test_job_events_share_ids_with_event_stream(store):
+    """后台任务事件日志与 /events/<task_id> 事件流使用同一序号；重新执行时从日志中的序号继续"""
+    task_id = f"task_{uuid.uuid4().hex[:8]}"
+    job_id = store.create("echo", {}, task_id=task_id)
+    store.claim(*DEAD)
+    store.append_event(job_id, "progress", {"current": 1})
+    store.append_event(job_id, "progress", {"current": 2})
+
+    def handler(payload):
+        yield {"event": "finish", "data": {"success": True}}
+
+    manager = JobManager(store, workers=1, max_attempts=3)
+    manager.register("echo", handler)
+    manager.start()
+    _wait_finished(store, job_id)
+
+    logged = [(seq, event) for seq, event, _ in store.events(job_id)]
+    assert logged == [(1, "progress"), (2, "progress"), (3, "restart"), (4, "finish")]
+    streamed = [
+        (seq, event) for seq, event, _ in
+        (item for item in get_event_bus().subscribe(task_id, 2, heartbeat=0.05) if item is not None)
+    ]
+    assert streamed == logged[2:]
+
+
+def test_start_fails_jobs_past_attempt_cap(store):
+    job_id = store.create("echo", {})
+    for _ in range(2):
+        store.claim(*DEAD)
+        store.requeue_expired()
+    store.claim(*DEAD)
+
+    manager = JobManager(store, workers=1, max_attempts=3)
+    manager.register("echo", lambda payload: iter(()))
+    manager.start()
+
+    job = store.get(job_id)
+    assert job["status"] == JOB_FAILED
+    events = store.events(job_id)
+    assert [event for _, event, _ in events] == ["error"]
+    assert events[0][2]["retryable"] is True
+
+
+def test_job_stops_when_lease_taken_over(store):
+    """续约时发现任务已被其他执行方接手：停止执行，不覆盖任务状态"""
+    job_id = store.create("slow", {})
+    closed = []
+
+    def handler(payload):
+        try:
+            for i in range(100):
+                yield {"event": "progress", "data": {"current": i}}
+                time.sleep(0.05)
+        finally:
+            closed.append(True)
+
+    manager = JobManager(store, workers=1, max_attempts=3, lease_seconds=1)
+    manager.register("slow", handler)
+    manager.start()
+    time.sleep(0.1)
+    # 模拟租约过期后被其他执行方重新取出
+    store._execute("UPDATE jobs SET owner = 'other' WHERE id = ?", (job_id,))
+
+    deadline = time.monotonic() + 3
+    while not closed and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert closed
+    job = store.get(job_id)
+    assert job["status"] == JOB_RUNNING
+    assert job["owner"] == "other"
+    assert len(store.events(job_id)) < 100
+
+
+def test_jobs_not_limited_by_worker_threads(store):
+    """默认不限制同时执行的任务数：任务线程只转发事件，不应让后来的任务排在整个任务之后"""
+    release = threading.Event()
+    started = []
+
+    def handler(payload):
+        started.append(payload["n"])
+        release.wait(5)
+        yield {"event": "finish", "data": {"success": True}}
+
+    manager = JobManager(store, max_attempts=3)
+    manager.register("wait", handler)
+    manager.start()
+    job_ids = [manager.submit("wait", {"n": n}) for n in range(5)]
+
+    deadline = time.monotonic() + 3
+    while len(started) < 5 and time.monotonic() < deadline:
+        time.sleep(0.02)
+    assert sorted(started) == [0, 1, 2, 3, 4]
+    release.set()
+    for job_id in job_ids:
+        assert _wait_finished(store, job_id)["status"] == JOB_DONE
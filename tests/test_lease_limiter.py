@@ -0,0 +1,184 @@
+"""
+跨进程并发限制（租约）测试
+"""
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+from backend.utils.lease_limiter import LeaseLimiter, RedisLeaseBackend, SQLiteLeaseBackend
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 另一个进程：按命令持有租约。输入 acquire / renew / release / exit，每条命令输出一行结果
+_HOLDER_SCRIPT = """
+import sys, time
+from backend.utils.lease_limiter import LeaseLimiter, SQLiteLeaseBackend
+
+db_path, limit, ttl = sys.argv[1], int(sys.argv[2]), float(sys.argv[3])
+limiter = LeaseLimiter(SQLiteLeaseBackend(db_path), "image:test", limit, ttl=ttl, holder="child")
+held = []
+for line in sys.stdin:
+    command = line.strip()
+    if command == "acquire":
+        lease_id = limiter.try_acquire()
+        if lease_id:
+            held.append(lease_id)
+        print(lease_id or "full", flush=True)
+    elif command == "release":
+        limiter.release(held.pop())
+        print("released", flush=True)
+    elif command == "exit":
+        break
+"""
+
+
+class _Holder:
+    """在子进程中持有租约"""
+
+    def __init__(self, db_path: str, limit: int, ttl: float):
+        self.proc = subprocess.Popen(
+            [sys.executable, "-c", _HOLDER_SCRIPT, db_path, str(limit), str(ttl)],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True, cwd=ROOT_DIR,
+            env=dict(os.environ, PYTHONPATH=ROOT_DIR)
+        )
+
+    def send(self, command: str) -> str:
+        self.proc.stdin.write(command + "\n")
+        self.proc.stdin.flush()
+        return self.proc.stdout.readline().strip()
+
+    def kill(self):
+        """模拟进程崩溃：不释放租约"""
+        self.proc.kill()
+        self.proc.wait(timeout=10)
+
+    def close(self):
+        if self.proc.poll() is None:
+            self.proc.stdin.write("exit\n")
+            self.proc.stdin.close()
+            self.proc.wait(timeout=10)
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / "leases.db")
+
+
+@pytest.fixture
+def holder(db_path):
+    holders = []
+
+    def start(limit: int, ttl: float = 30) -> _Holder:
+        h = _Holder(db_path, limit, ttl)
+        holders.append(h)
+        return h
+    yield start
+    for h in holders:
+        h.close()
+
+
+def test_sqlite_limit_shared_between_processes(db_path, holder):
+    other = holder(limit=3)
+    assert other.send("acquire") != "full"
+    assert other.send("acquire") != "full"
+
+    limiter = LeaseLimiter(SQLiteLeaseBackend(db_path), "image:test", 3)
+    lease_id = limiter.try_acquire()
+    assert lease_id
+    # 两个进程合计已达上限
+    assert limiter.try_acquire() is None
+    assert other.send("acquire") == "full"
+    assert limiter.stats()["active"] == 3
+
+    # 另一个进程释放后本进程可以取得
+    assert other.send("release") == "released"
+    assert limiter.try_acquire()
+
+
+def test_sqlite_lease_expires_after_holder_dies(db_path, holder):
+    other = holder(limit=1, ttl=0.5)
+    assert other.send("acquire") != "full"
+    other.kill()
+
+    limiter = LeaseLimiter(SQLiteLeaseBackend(db_path), "image:test", 1, ttl=0.5)
+    assert limiter.try_acquire() is None
+    time.sleep(0.7)
+    assert limiter.try_acquire()
+
+
+def test_sqlite_renewal_keeps_lease_past_ttl(db_path, holder):
+    """持有方存活时租约按 ttl/3 续期，超过 ttl 也不会被其他进程拿走；释放后立即可用"""
+    other = holder(limit=1, ttl=0.6)
+    assert other.send("acquire") != "full"
+
+    limiter = LeaseLimiter(SQLiteLeaseBackend(db_path), "image:test", 1, ttl=0.6)
+    time.sleep(1.5)
+    assert limiter.try_acquire() is None
+
+    assert other.send("release") == "released"
+    assert limiter.try_acquire()
+
+
+def test_sqlite_renew_and_release(db_path):
+    backend = SQLiteLeaseBackend(db_path)
+    lease_id = backend.try_acquire("image:test", 1, "me", 0.3)
+    assert lease_id
+    assert backend.renew("image:test", lease_id, 0.3)
+    backend.release("image:test", lease_id)
+    assert not backend.renew("image:test", lease_id, 0.3)
+    assert backend.active("image:test") == 0
+
+
+@pytest.fixture
+def redis_backend():
+    fakeredis = pytest.importorskip("fakeredis")
+    return RedisLeaseBackend(client=fakeredis.FakeRedis())
+
+
+def test_redis_limit_and_release(redis_backend):
+    first = redis_backend.try_acquire("image:test", 2, "a", 30)
+    second = redis_backend.try_acquire("image:test", 2, "b", 30)
+    assert first and second and first != second
+    assert redis_backend.try_acquire("image:test", 2, "c", 30) is None
+    assert redis_backend.active("image:test") == 2
+    # 不同限制对象互不影响
+    assert redis_backend.try_acquire("image:other", 1, "a", 30)
+
+    redis_backend.release("image:test", first)
+    assert redis_backend.active("image:test") == 1
+    assert redis_backend.try_acquire("image:test", 2, "c", 30)
+
+
+def test_redis_lease_expires(redis_backend):
+    lease_id = redis_backend.try_acquire("image:test", 1, "a", 0.3)
+    assert lease_id
+    assert redis_backend.try_acquire("image:test", 1, "b", 0.3) is None
+    time.sleep(0.4)
+    assert not redis_backend.renew("image:test", lease_id, 0.3)
+    assert redis_backend.try_acquire("image:test", 1, "b", 0.3)
+
+
+def test_redis_renew_extends_lease(redis_backend):
+    lease_id = redis_backend.try_acquire("image:test", 1, "a", 0.4)
+    time.sleep(0.25)
+    assert redis_backend.renew("image:test", lease_id, 0.4)
+    time.sleep(0.25)
+    # 续期后仍然有效
+    assert redis_backend.active("image:test") == 1
+    assert redis_backend.try_acquire("image:test", 1, "b", 0.4) is None
+
+
+def test_limiter_falls_back_when_backend_fails():
+    class BrokenBackend(SQLiteLeaseBackend):
+        def __init__(self):
+            self.name = "broken"
+
+        def try_acquire(self, key, limit, holder, ttl):
+            raise ConnectionError("backend down")
+
+    limiter = LeaseLimiter(BrokenBackend(), "image:test", 1)
+    assert limiter.try_acquire() == ""
+    assert limiter.stats()["backend_errors"] == 1
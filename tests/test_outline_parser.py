@@ -0,0 +1,83 @@
+"""
+流式大纲解析测试：任意切分的流式输入与完整文本的解析结果一致
+"""
+import random
+
+import pytest
+
+from backend.services.outline_parser import (
+    MODE_LEGACY, MODE_PAGE, IncrementalOutlineParser, parse_outline
+)
+
+_PIECES = [
+    "[封面]\n秋季显白美甲", "[内容]\n第一步：修甲型", "[总结]\n记得收藏", "[未知]\n其他类型",
+    "正文中的 - 和 -- 不是分隔符", "中文、emoji 💅 和\r\n换行", "  ", "\n",
+]
+
+
+def _outline(rng: random.Random, separator: str) -> str:
+    """随机生成一份大纲：前后可能有空白，页面之间用 separator 分隔，可能出现空页"""
+    pages = [rng.choice(_PIECES) for _ in range(rng.randint(0, 8))]
+    text = separator.join(pages)
+    if rng.random() < 0.5:
+        text = separator + text
+    if rng.random() < 0.3:
+        text += separator
+    return rng.choice(["", "好的，以下是大纲：\n"]) + text
+
+
+def _chunks(rng: random.Random, text: str):
+    """把文本切成随机长度的片段（包括把分隔符拆开）"""
+    pos = 0
+    while pos < len(text):
+        size = rng.randint(1, 7)
+        yield text[pos:pos + size]
+        pos += size
+
+
+def _stream_parse(chunks):
+    parser = IncrementalOutlineParser()
+    pages = []
+    for chunk in chunks:
+        pages.extend(parser.feed(chunk))
+    pages.extend(parser.finish())
+    return parser, pages
+
+
+@pytest.mark.parametrize("separator", ["<page>", "<PAGE>", "\n<page>\n", "---", "\n---\n"])
+def test_random_chunking_matches_full_parse(separator):
+    rng = random.Random(separator)
+    for _ in range(300):
+        text = _outline(rng, separator)
+        parser, pages = _stream_parse(_chunks(rng, text))
+        assert parser.text == text
+        assert not parser.diverged
+        assert pages == parse_outline(text), repr(text)
+
+
+def test_page_tag_split_across_chunks():
+    parser, pages = _stream_parse(["[封面]\n标题<pa", "ge>[内容]\n正文<", "page", ">[总结]\n结尾"])
+    assert parser.mode == MODE_PAGE
+    assert [p["type"] for p in pages] == ["cover", "content", "summary"]
+
+
+def test_pages_are_emitted_before_stream_ends():
+    parser = IncrementalOutlineParser()
+    assert parser.feed("[封面]\n标题") == []
+    first = parser.feed("<page>[内容]\n正文")
+    assert [p["index"] for p in first] == [0]
+    assert parser.finish() == [{"index": 1, "type": "content", "content": "[内容]\n正文"}]
+
+
+def test_page_tag_after_legacy_separator_defers_to_full_parse():
+    """先出现 --- 后出现 <page>：完整解析改用 <page> 分割，增量解析停止产出"""
+    text = "[封面]\n标题---[内容]\n正文<page>[总结]\n结尾"
+    rng = random.Random(0)
+    for _ in range(50):
+        parser, pages = _stream_parse(_chunks(rng, text))
+        assert parser.mode == MODE_LEGACY
+        assert parser.diverged
+        assert parser.text == text
+        # 已产出的页面只可能是出现 <page> 之前的 --- 分割结果
+        assert all(p["content"] == "[封面]\n标题" for p in pages)
+    assert [p["type"] for p in parse_outline(text)] == ["cover", "summary"]
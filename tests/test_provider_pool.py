@@ -0,0 +1,276 @@
+"""
+服务商池挑选与准入测试
+"""
+import asyncio
+import threading
+import time
+import uuid
+from types import SimpleNamespace
+
+import pytest
+
+from backend.services import provider_pool
+from backend.services.provider_pool import ProviderPool
+from backend.utils.adaptive_limiter import get_provider_limiter
+from backend.utils.circuit_breaker import CircuitBreaker
+from backend.utils.rate_limiter import TokenBucket
+from backend.utils.retry_policy import KIND_SERVER, CancelEvent, ProviderError, RequestCancelled
+
+
+class FakeLeaseLimiter:
+    """记录申请和释放的跨进程限制器（不限量）"""
+
+    def __init__(self):
+        self.acquired = []
+        self.released = []
+
+    def acquire(self, cancel_event=None):
+        lease_id = f"lease-{len(self.acquired)}"
+        self.acquired.append(lease_id)
+        return lease_id
+
+    def try_acquire(self):
+        return self.acquire()
+
+    async def aacquire(self):
+        return self.acquire()
+
+    def release(self, lease_id):
+        self.released.append(lease_id)
+
+    def call(self, fn, *args, **kwargs):
+        lease_id = self.acquire()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            self.release(lease_id)
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    """只有一个服务商、并发上限为 1 的服务商池"""
+    name = f"test-{uuid.uuid4().hex}"
+    config = {"max_concurrent": 1, "max_concurrent_ceiling": 1}
+    member = SimpleNamespace(
+        name=name, config=config, weight=1.0, type="image_api", supports_reference=True,
+        generator=SimpleNamespace(rate_limiter=TokenBucket(name))
+    )
+    leases = FakeLeaseLimiter()
+    monkeypatch.setattr(provider_pool, "get_lease_limiter", lambda kind, name, config: leases)
+    pool = ProviderPool([member])
+    pool.leases = leases
+    pool.limiter = get_provider_limiter(name, config)
+    return pool
+
+
+def test_admit_takes_local_slot_before_lease(pool):
+    """进程内名额已满时等待名额，等待期间不占用跨进程租约"""
+    held = pool.limiter.try_acquire()
+    admitted = []
+    thread = threading.Thread(target=lambda: admitted.append(pool.admit()))
+    thread.start()
+    time.sleep(0.2)
+    assert admitted == []
+    assert pool.leases.acquired == []
+
+    pool.limiter.release(held, "success")
+    thread.join(2)
+    assert len(admitted) == 1
+    assert pool.leases.acquired == ["lease-0"]
+    admitted[0].release()
+    assert pool.leases.released == ["lease-0"]
+    assert pool.limiter.inflight == 0
+
+
+def test_hedge_takes_local_slot_before_lease(pool):
+    admission, _ = pool.try_admit()
+    results = []
+    thread = threading.Thread(
+        target=lambda: results.append(admission.hedge(lambda **kwargs: "hedged"))
+    )
+    thread.start()
+    time.sleep(0.2)
+    # 准入时的名额仍被主请求占用：对冲请求在等名额，只持有准入时的一个租约
+    assert results == []
+    assert pool.leases.acquired == ["lease-0"]
+
+    admission.release()
+    thread.join(2)
+    assert results == ["hedged"]
+    assert pool.leases.acquired == ["lease-0", "lease-1"]
+    assert pool.leases.released == ["lease-0", "lease-1"]
+
+
+def test_cancelled_hedge_stops_waiting_and_returns_what_it_took(pool):
+    """主请求先成功时，还在等待名额的对冲请求停止等待，不占用租约、名额和令牌"""
+    admission, _ = pool.try_admit()
+    bucket = admission.member.generator.rate_limiter
+    cancel_event = CancelEvent()
+    calls = []
+    errors = []
+
+    def hedge():
+        try:
+            admission.hedge(lambda **kwargs: calls.append(kwargs), cancel_event=cancel_event)
+        except RequestCancelled as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=hedge)
+    thread.start()
+    time.sleep(0.1)
+    cancel_event.set()
+    thread.join(2)
+    assert not thread.is_alive()
+    assert len(errors) == 1 and calls == []
+    assert pool.leases.acquired == ["lease-0"]
+    # 令牌已归还：只剩准入时取得的一个
+    assert bucket.acquired == 1
+
+    admission.release()
+    assert pool.limiter.inflight == 0
+
+
+def test_token_bucket_wait_is_cancellable():
+    bucket = TokenBucket("test", rate=0.1, burst=1)
+    bucket.acquire()
+    cancel_event = CancelEvent()
+    threading.Timer(0.1, cancel_event.set).start()
+    started = time.monotonic()
+    with pytest.raises(RequestCancelled):
+        bucket.acquire(cancel_event)
+    assert time.monotonic() - started < 1
+    # 预约的令牌已归还，不影响之后的调用方
+    assert bucket.try_acquire() == pytest.approx(10, abs=0.5)
+
+
+def test_async_run_uses_admitted_slot_and_lease(pool):
+    """异步生成引擎使用准入时取得的令牌、名额和租约，结束后释放"""
+    admission, _ = pool.try_admit()
+    calls = []
+
+    async def fn(**kwargs):
+        calls.append((kwargs, pool.limiter.inflight))
+        return "done"
+
+    assert asyncio.run(admission.arun(fn)) == "done"
+    assert calls == [({"rate_token_acquired": True}, 1)]
+    assert pool.leases.released == ["lease-0"]
+    assert pool.limiter.inflight == 0
+    # 已执行过，release 不重复释放
+    admission.release()
+    assert pool.limiter.inflight == 0
+
+
+def test_cancelled_async_hedge_returns_what_it_took(pool):
+    """对冲协程在等待名额时被撤销：不占用租约，归还令牌"""
+    admission, _ = pool.try_admit()
+    bucket = admission.member.generator.rate_limiter
+    calls = []
+
+    async def fn(**kwargs):
+        calls.append(kwargs)
+
+    async def hedge_then_cancel():
+        task = asyncio.ensure_future(admission.ahedge(fn))
+        await asyncio.sleep(0.1)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(hedge_then_cancel())
+    assert calls == []
+    assert pool.leases.acquired == ["lease-0"]
+    assert bucket.acquired == 1
+
+    admission.release()
+    assert pool.limiter.inflight == 0
+
+
+def _members(monkeypatch, specs):
+    """按 (类型, 权重) 创建服务商（生成器只带令牌桶和熔断器）"""
+    monkeypatch.setattr(
+        provider_pool.ImageGeneratorFactory, "create",
+        lambda provider_type, config: SimpleNamespace(
+            rate_limiter=TokenBucket(provider_type), circuit_breaker=CircuitBreaker(provider_type)
+        )
+    )
+    monkeypatch.setattr(provider_pool, "get_lease_limiter", lambda kind, name, config: None)
+    prefix = uuid.uuid4().hex
+    return [
+        provider_pool.PoolMember(f"{prefix}-{i}", {"type": provider_type, "max_concurrent": 2}, weight)
+        for i, (provider_type, weight) in enumerate(specs)
+    ]
+
+
+def _capture_weights(monkeypatch):
+    calls = []
+
+    def choices(candidates, weights):
+        calls.append(dict(zip([m.name for m in candidates], weights)))
+        return [candidates[weights.index(max(weights))]]
+
+    monkeypatch.setattr(provider_pool.random, "choices", choices)
+    return calls
+
+
+def test_pick_prefers_reference_capable_members(monkeypatch):
+    genai, openai = _members(monkeypatch, [("google_genai", 1.0), ("openai_compatible", 1.0)])
+    pool = ProviderPool([genai, openai])
+    assert all(pool.pick(need_reference=True) is genai for _ in range(20))
+    # 都不支持参考图时从全部服务商中挑选
+    only_openai = ProviderPool([openai])
+    assert only_openai.pick(need_reference=True) is openai
+    assert pool.stats()[genai.name]["picks"] == 20
+
+
+def test_pick_weights_by_base_weight_health_and_latency(monkeypatch):
+    fast, slow, flaky = _members(monkeypatch, [("image_api", 2.0), ("image_api", 2.0), ("image_api", 2.0)])
+    get_provider_limiter(fast.name, fast.config)._latency_ewma = 1.0
+    get_provider_limiter(slow.name, slow.config)._latency_ewma = 4.0
+    get_provider_limiter(flaky.name, flaky.config)._error_rate = 0.5
+    calls = _capture_weights(monkeypatch)
+
+    assert ProviderPool([fast, slow, flaky]).pick() is fast
+    weights = calls[0]
+    assert weights[fast.name] == pytest.approx(2.0)
+    assert weights[slow.name] == pytest.approx(0.5)
+    assert weights[flaky.name] == pytest.approx(0.5)
+
+
+def test_pick_skips_paused_and_open_members(monkeypatch):
+    ok, paused, broken = _members(monkeypatch, [("image_api", 1.0), ("image_api", 10.0), ("image_api", 10.0)])
+    paused.generator.rate_limiter.pause(30)
+    for _ in range(5):
+        broken.generator.circuit_breaker.record(ProviderError("502", kind=KIND_SERVER))
+    pool = ProviderPool([ok, paused, broken])
+    assert all(pool.pick() is ok for _ in range(20))
+    assert pool.paused_for() == 0
+
+
+def test_pick_falls_back_to_base_weight_when_all_unavailable(monkeypatch):
+    light, heavy = _members(monkeypatch, [("image_api", 1.0), ("image_api", 3.0)])
+    light.generator.rate_limiter.pause(10)
+    heavy.generator.rate_limiter.pause(30)
+    calls = _capture_weights(monkeypatch)
+    pool = ProviderPool([light, heavy])
+    assert pool.pick() is heavy
+    assert calls[0] == {light.name: 1.0, heavy.name: 3.0}
+    assert pool.paused_for() == pytest.approx(10, abs=1)
+
+
+def test_try_admit_moves_to_member_with_tokens(monkeypatch):
+    first, second = _members(monkeypatch, [("image_api", 10.0), ("image_api", 1.0)])
+    first.generator.rate_limiter = TokenBucket(first.name, rate=0.01)
+    first.generator.rate_limiter.try_acquire()
+    monkeypatch.setattr(provider_pool.ProviderPool, "_choose", lambda self, candidates: first)
+    pool = ProviderPool([first, second])
+
+    admission, wait = pool.try_admit()
+    assert admission.member is second and wait is None
+    admission.release()
+    assert pool.stats()[second.name]["picks"] == 1
+
+    second.generator.rate_limiter.pause(5)
+    admission, wait = pool.try_admit()
+    assert admission is None
+    assert wait == pytest.approx(5, abs=0.5)
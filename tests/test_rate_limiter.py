@@ -0,0 +1,50 @@
+"""
+服务商请求速率限制（令牌桶）测试
+"""
+import time
+
+import pytest
+
+from backend.utils.rate_limiter import TokenBucket
+
+
+def test_try_acquire_takes_tokens_up_to_burst():
+    bucket = TokenBucket("test", rate=1, burst=2)
+    assert bucket.try_acquire() is None
+    assert bucket.try_acquire() is None
+    wait = bucket.try_acquire()
+    assert wait == pytest.approx(1, abs=0.1)
+    assert bucket.stats()["acquired"] == 2
+
+
+def test_try_acquire_does_not_reserve_on_failure():
+    """取不到令牌时不透支，不影响后面的调用方"""
+    bucket = TokenBucket("test", rate=10, burst=1)
+    assert bucket.try_acquire() is None
+    for _ in range(5):
+        assert bucket.try_acquire() is not None
+    time.sleep(0.12)
+    assert bucket.try_acquire() is None
+
+
+def test_try_acquire_reports_pause_without_sleeping():
+    bucket = TokenBucket("test")
+    bucket.pause(30, "(HTTP 429)")
+    started = time.monotonic()
+    wait = bucket.try_acquire()
+    assert time.monotonic() - started < 0.1
+    assert 29 < wait <= 30
+
+
+def test_unlimited_bucket_always_grants():
+    bucket = TokenBucket("test")
+    assert all(bucket.try_acquire() is None for _ in range(100))
+
+
+def test_refund_returns_token():
+    bucket = TokenBucket("test", rate=0.1, burst=1)
+    assert bucket.try_acquire() is None
+    assert bucket.try_acquire() is not None
+    bucket.refund()
+    assert bucket.try_acquire() is None
+    assert bucket.stats()["acquired"] == 1
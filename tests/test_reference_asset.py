@@ -0,0 +1,62 @@
+"""
+参考图资源测试
+"""
+import base64
+import io
+
+from PIL import Image
+
+from backend.utils import reference_asset as reference_asset_module
+from backend.utils.reference_asset import ReferenceAsset, as_reference_assets, collect_reference_assets
+
+
+def _png(color=(255, 0, 0), size=(8, 8)) -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGB", size, color).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def test_derived_forms_computed_once(monkeypatch):
+    calls = []
+
+    def fake_compress(data, max_size_kb=200):
+        calls.append(max_size_kb)
+        return b"\xff\xd8\xff" + data[:8]
+
+    monkeypatch.setattr(reference_asset_module, "compress_image_cached", fake_compress)
+    asset = ReferenceAsset(_png(), max_size_kb=100)
+
+    assert asset.mime == "image/png"
+    assert asset.compressed_mime == "image/jpeg"
+    assert asset.base64 == base64.b64encode(asset.compressed).decode("utf-8")
+    assert asset.data_uri == f"data:image/jpeg;base64,{asset.base64}"
+    assert calls == [100]
+
+
+def test_small_image_keeps_original_format():
+    raw = _png()
+    asset = ReferenceAsset(raw)
+    assert asset.compressed == raw
+    assert asset.compressed_mime == "image/png"
+
+
+def test_compact_drops_raw_data(monkeypatch):
+    monkeypatch.setattr(reference_asset_module, "compress_image_cached", lambda data, max_size_kb=200: b"\xff\xd8\xffsmall")
+    asset = ReferenceAsset(_png(size=(64, 64)))
+    assert asset.compact() is asset
+    assert asset.raw == b"\xff\xd8\xffsmall"
+    assert asset.mime == "image/jpeg"
+    assert asset.nbytes == len(asset.raw)
+
+
+def test_coerce_and_collect():
+    red, blue = _png(), _png(color=(0, 0, 255))
+    asset = ReferenceAsset(red)
+    assert ReferenceAsset.coerce(asset) is asset
+    assert as_reference_assets(None) is None
+    assert [a.raw for a in as_reference_assets([red, asset])] == [red, red]
+
+    # 单张参考图与列表中内容相同时不重复添加
+    assert [a.raw for a in collect_reference_assets([asset], red)] == [red]
+    assert [a.raw for a in collect_reference_assets([asset], blue)] == [red, blue]
+    assert [a.raw for a in collect_reference_assets(None, blue)] == [blue]
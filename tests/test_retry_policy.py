@@ -0,0 +1,133 @@
+"""
+错误分类和重试策略测试
+"""
+import asyncio
+import binascii
+import io
+import json
+import socket
+import time
+
+import httpx
+import pytest
+import requests
+
+from backend.utils.circuit_breaker import CircuitBreaker
+from backend.utils.image_stream import Base64FieldDecoder
+from backend.utils.retry_policy import (
+    KIND_AUTH, KIND_CANCELLED, KIND_INTERNAL, KIND_INVALID, KIND_NETWORK, KIND_RATE_LIMIT, KIND_SAFETY,
+    KIND_SERVER, KIND_TIMEOUT, KIND_UNKNOWN, ProviderError, RequestCancelled, RetryPolicy,
+    classify_error, is_retryable
+)
+
+
+class _StatusError(Exception):
+    """带 code 属性的异常（如 google-genai 的 APIError）"""
+
+    def __init__(self, message, code):
+        super().__init__(message)
+        self.code = code
+
+
+@pytest.mark.parametrize("status_code, kind", [
+    (401, KIND_AUTH),
+    (403, KIND_AUTH),
+    (400, KIND_INVALID),
+    (404, KIND_INVALID),
+    (429, KIND_RATE_LIMIT),
+    (408, KIND_TIMEOUT),
+    (504, KIND_TIMEOUT),
+    (500, KIND_SERVER),
+    (503, KIND_SERVER),
+])
+def test_classify_by_status_code(status_code, kind):
+    assert classify_error(ProviderError("失败", status_code=status_code)) == kind
+    assert classify_error(_StatusError("失败", status_code)) == kind
+
+
+@pytest.mark.parametrize("error, kind", [
+    (requests.exceptions.ReadTimeout("read timed out"), KIND_TIMEOUT),
+    (httpx.ReadTimeout("read timed out"), KIND_TIMEOUT),
+    (socket.timeout(), KIND_TIMEOUT),
+    (requests.exceptions.ConnectionError("reset"), KIND_NETWORK),
+    (httpx.RemoteProtocolError("peer closed connection"), KIND_NETWORK),
+    (ConnectionResetError(), KIND_NETWORK),
+    (asyncio.CancelledError(), KIND_CANCELLED),
+    (RequestCancelled(), KIND_CANCELLED),
+])
+def test_classify_by_exception_type(error, kind):
+    assert classify_error(error) == kind
+
+
+@pytest.mark.parametrize("message", [
+    # chat 接口没有返回图片：提示语中提到安全过滤，但服务商没有明确拦截
+    "❌ 无法从 Chat API 响应中提取图片数据\n\n【可能原因】\n3. 提示词被安全过滤",
+    # 响应片段中的时间戳包含 401
+    '图片数据提取失败：未找到 b64_json 数据。\nAPI响应片段: {"created": 1714040150, "data": []}',
+    # 已写入字节数包含 401
+    "响应在 b64_json 数据结束前中断（已写入 40192 bytes）",
+    "server returned 500 items, filter applied",
+])
+def test_message_text_does_not_decide_kind(message):
+    """错误信息文本不参与判定，避免提示语、响应片段中的数字导致误判"""
+    assert classify_error(ProviderError(message)) == KIND_UNKNOWN
+    assert is_retryable(ProviderError(message))
+    assert classify_error(ValueError(message)) == KIND_INTERNAL
+
+
+@pytest.mark.parametrize("error", [
+    requests.exceptions.JSONDecodeError("Expecting value", "<html>", 0),
+    requests.exceptions.ChunkedEncodingError("connection broken"),
+    httpx.DecodingError("invalid gzip"),
+    json.JSONDecodeError("Expecting value", "<html>", 0),
+    binascii.Error("Incorrect padding"),
+])
+def test_unrecognized_provider_responses_are_retryable(error):
+    assert classify_error(error) == KIND_UNKNOWN
+    assert is_retryable(error)
+
+
+@pytest.mark.parametrize("error", [
+    KeyError("choices"), TypeError("'NoneType' object is not subscriptable"),
+    AttributeError("'dict' object has no attribute 'text'"), ValueError("bad"), Exception("bug"),
+])
+def test_local_errors_fail_immediately(error):
+    """本地代码错误不重试，也不计入服务商熔断"""
+    assert classify_error(error) == KIND_INTERNAL
+    assert RetryPolicy(max_attempts=3, base_delay=0.01).next_delay(1, error, time.monotonic()) is None
+
+    breaker = CircuitBreaker("image:test", min_calls=1, window=1)
+    breaker.record(error)
+    assert breaker.stats()["window_calls"] == 0
+
+
+def test_explicit_kind_wins():
+    error = ProviderError("内容被拦截", kind=KIND_SAFETY, status_code=500)
+    assert classify_error(error) == KIND_SAFETY
+    assert not is_retryable(error)
+
+
+def test_truncated_base64_response_is_retryable():
+    """图片数据传输中断按网络错误重试"""
+    decoder = Base64FieldDecoder(io.BytesIO())
+    decoder.feed(b'{"created": 1714040150, "data": [{"b64_json": "iVBORw0KGgo')
+    with pytest.raises(ProviderError) as exc_info:
+        decoder.finish()
+    assert classify_error(exc_info.value) == KIND_NETWORK
+    assert is_retryable(exc_info.value)
+
+
+def test_next_delay_stops_on_terminal_errors():
+    policy = RetryPolicy(max_attempts=3, deadline=600, base_delay=0.01)
+    started = 0.0
+    assert policy.next_delay(1, ProviderError("认证失败", status_code=401), started) is None
+    assert policy.next_delay(1, ProviderError("拦截", kind=KIND_SAFETY), started) is None
+
+
+def test_next_delay_respects_attempts():
+    policy = RetryPolicy(max_attempts=3, deadline=600, base_delay=0.01)
+    started = time.monotonic()
+    error = ProviderError("服务器错误", status_code=503)
+    assert policy.next_delay(1, error, started) is not None
+    assert policy.next_delay(2, error, started) is not None
+    assert policy.next_delay(3, error, started) is None
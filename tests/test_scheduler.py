@@ -0,0 +1,273 @@
+"""
+图片生成公平调度器测试
+"""
+import asyncio
+import threading
+import time
+from concurrent.futures import CancelledError
+from types import SimpleNamespace
+
+import pytest
+
+from backend.services.scheduler import Deferred, FairScheduler
+from backend.utils.adaptive_limiter import AdaptiveLimiter
+from backend.utils.retry_policy import ProviderError, RetryPolicy
+
+
+@pytest.fixture
+def scheduler():
+    scheduler = FairScheduler(workers=2)
+    yield scheduler
+    scheduler.resize(1)
+
+
+def _admit_from(limiter: AdaptiveLimiter, scheduler: FairScheduler):
+    """按限制器名额准入的准入函数"""
+    limiter.add_listener(scheduler.wake_deferred)
+
+    def admit():
+        acquired_at = limiter.try_acquire()
+        if acquired_at is None:
+            raise Deferred(reason="名额已满")
+        return acquired_at
+    return admit
+
+
+def test_deferred_job_does_not_block_other_tasks(scheduler):
+    """一个服务商名额已满时，工作线程去执行其他任务的调用"""
+    limiter = AdaptiveLimiter("busy", initial=1, max_limit=1)
+    gate = threading.Event()
+
+    def slow(admission=None):
+        gate.wait(5)
+        limiter.release(admission, "success")
+        return "slow"
+
+    admit = _admit_from(limiter, scheduler)
+    first = scheduler.submit("a", slow, admit=admit)
+    second = scheduler.submit("a", slow, admit=admit)
+    # 等第一个调用占住唯一的名额，第二个调用回到队列等待准入
+    deadline = time.monotonic() + 2
+    while scheduler.stats()["waiting_admission"] == 0 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert scheduler.stats()["waiting_admission"] == 1
+
+    # 另一个任务不需要该服务商，仍有空闲工作线程可以执行
+    other = scheduler.submit("b", lambda: "other")
+    assert other.result(timeout=2) == "other"
+
+    gate.set()
+    assert first.result(timeout=2) == "slow"
+    assert second.result(timeout=2) == "slow"
+    stats = scheduler.stats()
+    assert stats["deferrals"] >= 1
+    assert stats["waiting_admission"] == 0
+
+
+def test_released_slot_wakes_deferred_job_immediately(scheduler):
+    """名额释放后等待准入的调用立即开始，不等到下一次定时检查"""
+    limiter = AdaptiveLimiter("one", initial=1, max_limit=1)
+    admit = _admit_from(limiter, scheduler)
+    held = limiter.try_acquire()
+
+    started = []
+    future = scheduler.submit(
+        "a", lambda admission=None: limiter.release(admission, "success"),
+        admit=admit, on_start=lambda info: started.append(time.monotonic())
+    )
+    time.sleep(0.1)
+    assert not started
+
+    released_at = time.monotonic()
+    limiter.release(held, "success")
+    future.result(timeout=2)
+    assert started[0] - released_at < 0.5
+
+
+def test_deferral_is_not_an_attempt(scheduler):
+    """等待准入不计入尝试次数，也不会提前触发 on_start"""
+    attempts = {"admit": 0}
+    started = []
+
+    def admit():
+        attempts["admit"] += 1
+        if attempts["admit"] < 3:
+            raise Deferred(delay=0.01)
+        return "ticket"
+
+    future = scheduler.submit(
+        "a", lambda admission=None: admission, admit=admit,
+        on_start=lambda info: started.append(info)
+    )
+    assert future.result(timeout=2) == "ticket"
+    assert attempts["admit"] == 3
+    assert len(started) == 1
+
+
+def test_cancel_deferred_job(scheduler):
+    def admit():
+        raise Deferred(delay=10)
+
+    future = scheduler.submit("a", lambda admission=None: None, admit=admit)
+    deadline = time.monotonic() + 2
+    while scheduler.stats()["waiting_admission"] == 0 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert scheduler.cancel("a", future)
+    assert future.done()
+    assert scheduler.stats()["queued"] == 0
+
+
+def test_unchanged_limiter_config_does_not_wake_deferred_jobs():
+    """每次获取限制器都会同步配置，上下界没变时不应唤醒等待准入的调用（否则准入会空转）"""
+    limiter = AdaptiveLimiter("cfg", initial=2, min_limit=1, max_limit=2)
+    calls = []
+    limiter.add_listener(lambda: calls.append(1))
+    limiter.configure(1, 2)
+    assert calls == []
+    limiter.configure(1, 3)
+    assert calls == [1]
+
+
+def test_small_task_not_starved_behind_large_task():
+    """先提交的大任务占满队列时，后提交的小任务按轮询穿插执行，不用等大任务全部完成"""
+    scheduler = FairScheduler(workers=1)
+    order = []
+    gate = threading.Event()
+
+    def run(name):
+        if name == "big-0":
+            gate.wait(5)
+        time.sleep(0.005)
+        order.append(name)
+        return name
+
+    big = [scheduler.submit("big", run, f"big-{i}") for i in range(20)]
+    # 大任务的第一个调用已在执行时提交小任务
+    deadline = time.monotonic() + 2
+    while scheduler.stats()["busy"] == 0 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    small = [scheduler.submit("small", run, f"small-{i}") for i in range(2)]
+    gate.set()
+
+    for future in small + big:
+        future.result(timeout=5)
+    # 轮询：big-0, big-1, small-0, big-2, small-1, ...
+    assert order.index("small-1") <= 5
+    assert order.index("big-19") == len(order) - 1
+    scheduler.resize(1)
+
+
+def test_get_scheduler_recomputes_workers_only_after_config_change(monkeypatch):
+    from backend.config import Config
+    from backend.services import scheduler as scheduler_module
+
+    calls = []
+    monkeypatch.setattr(scheduler_module, "_scheduler_instance", None)
+    monkeypatch.setattr(scheduler_module, "_scheduler_config", None)
+    monkeypatch.setattr(Config, "_image_providers_config", {"max_concurrent": 2})
+    monkeypatch.setattr(Config, "get_image_scheduler_workers", lambda: calls.append(1) or 2)
+
+    first = scheduler_module.get_scheduler()
+    for _ in range(5):
+        assert scheduler_module.get_scheduler() is first
+    assert len(calls) == 1
+
+    # 配置更新后（Config 换成新的配置对象）重新计算
+    monkeypatch.setattr(Config, "_image_providers_config", {"max_concurrent": 3})
+    assert scheduler_module.get_scheduler() is first
+    assert len(calls) == 2
+    first.resize(1)
+
+
+def test_coroutine_jobs_do_not_hold_worker_threads(scheduler):
+    """协程交给异步生成引擎执行：等待期间工作线程去执行其他调用"""
+    async def run(i):
+        await asyncio.sleep(0.3)
+        return i
+
+    started = time.monotonic()
+    futures = [scheduler.submit(f"task-{i}", run, i) for i in range(6)]
+    assert [f.result(timeout=5) for f in futures] == list(range(6))
+    # 2 个工作线程串行执行需要 0.9s
+    assert time.monotonic() - started < 0.8
+    assert scheduler.stats()["async_running"] == 0
+
+
+def test_coroutine_jobs_keep_inflight_limit_and_retry(scheduler):
+    running = []
+    peak = []
+    attempts = []
+
+    async def run(i):
+        running.append(i)
+        peak.append(len(running))
+        try:
+            await asyncio.sleep(0.05)
+            if i == 0 and len(attempts) < 1:
+                attempts.append(i)
+                raise TimeoutError("超时")
+            return i
+        finally:
+            running.remove(i)
+
+    futures = [
+        scheduler.submit("task", run, i, max_inflight=1, retry_policy=RetryPolicy(max_attempts=3, base_delay=0.01))
+        for i in range(3)
+    ]
+    assert [f.result(timeout=5) for f in futures] == [0, 1, 2]
+    assert attempts == [0]
+    assert max(peak) == 1
+
+
+def test_cancel_running_coroutine_job(scheduler):
+    cancelled = threading.Event()
+
+    async def run():
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    future = scheduler.submit("task", run)
+    deadline = time.monotonic() + 2
+    while scheduler.stats()["async_running"] == 0 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert scheduler.cancel("task", future)
+    assert cancelled.wait(2)
+    with pytest.raises(CancelledError):
+        future.result(timeout=2)
+    assert scheduler.queue_depth("task") == 0
+    assert scheduler.stats()["tasks"] == {}
+
+
+def test_admission_retry_policy_overrides_submitted_policy(scheduler):
+    """失败后按准入时选中的服务商的重试策略判断是否重试"""
+    policies = iter([RetryPolicy(max_attempts=3, base_delay=0.01), RetryPolicy(max_attempts=1)])
+    attempts = []
+
+    def admit():
+        return SimpleNamespace(retry_policy=next(policies))
+
+    def fail(admission=None):
+        attempts.append(admission.retry_policy.max_attempts)
+        raise ProviderError("服务器错误", status_code=503)
+
+    future = scheduler.submit("a", fail, retry_policy=RetryPolicy(max_attempts=5, base_delay=0.01), admit=admit)
+    with pytest.raises(ProviderError):
+        future.result(timeout=2)
+    # 第二次尝试选中的服务商只允许尝试 1 次
+    assert attempts == [3, 1]
+
+
+def test_internal_errors_are_not_retried(scheduler):
+    attempts = []
+
+    def fail():
+        attempts.append(1)
+        raise KeyError("choices")
+
+    future = scheduler.submit("a", fail, retry_policy=RetryPolicy(max_attempts=3, base_delay=0.01))
+    with pytest.raises(KeyError):
+        future.result(timeout=2)
+    assert len(attempts) == 1
@@ -0,0 +1,110 @@
+"""
+SSE 增量解析测试
+"""
+import json
+import random
+
+import pytest
+
+from backend.utils.sse_parser import COMMENT, SSEParser, iter_chat_content, iter_sse
+
+
+def _events(chunks, include_comments=True):
+    return [(e.event, e.data, e.id, e.retry) for e in iter_sse(chunks, include_comments)]
+
+
+def _random_chunks(rng: random.Random, data: bytes):
+    """按随机字节位置切分（会切开 \\r\\n 和多字节 UTF-8 字符）"""
+    pos = 0
+    while pos < len(data):
+        size = rng.choice([1, 1, 2, 3, rng.randint(1, 64)])
+        yield data[pos:pos + size]
+        pos += size
+
+
+_STREAM = (
+    "﻿: 连接建立\n"
+    "event: progress\n"
+    "id: 1\n"
+    "data: {\"text\": \"你好，世界 💅\"}\n"
+    "\n"
+    "retry: 3000\n"
+    "data: 第一行\n"
+    "data:第二行\n"
+    "data\n"
+    "\n"
+    ":ping\n"
+    "id: 2\n"
+    "event: done\n"
+    "data: [DONE]\n"
+    "\n"
+    "data: 末尾没有空行的事件"
+)
+
+
+@pytest.mark.parametrize("newline", ["\n", "\r\n", "\r"])
+def test_random_chunking_matches_single_chunk(newline):
+    data = _STREAM.replace("\n", newline).encode("utf-8")
+    expected = _events([data])
+    assert expected == [
+        (COMMENT, "连接建立", None, None),
+        ("progress", "{\"text\": \"你好，世界 💅\"}", "1", None),
+        ("message", "第一行\n第二行\n", "1", 3000),
+        (COMMENT, "ping", "1", None),
+        ("done", "[DONE]", "2", None),
+        ("message", "末尾没有空行的事件", "2", None),
+    ]
+    rng = random.Random(newline)
+    for _ in range(200):
+        assert _events(_random_chunks(rng, data)) == expected
+
+
+def test_cr_at_chunk_end_followed_by_lf():
+    """\\r\\n 被拆在两块之间时只算一个换行"""
+    events = _events([b"data: a\r", b"\n\r", b"\ndata: b\r\n\r\n"])
+    assert [data for _, data, _, _ in events] == ["a", "b"]
+
+
+def test_utf8_split_inside_character():
+    data = "data: 中文\n\n".encode("utf-8")
+    split = data.index("文".encode("utf-8")) + 1
+    parser = SSEParser()
+    assert parser.feed(data[:split]) == []
+    events = parser.feed(data[split:])
+    assert [e.data for e in events] == ["中文"]
+
+
+def test_comments_skipped_by_default():
+    assert _events([b":heart\n\ndata: x\n\n"], include_comments=False) == [("message", "x", None, None)]
+
+
+def test_id_with_null_is_ignored():
+    assert _events([b"id: 1\ndata: a\n\nid: 2\0\ndata: b\n\n"]) == [
+        ("message", "a", "1", None), ("message", "b", "1", None)
+    ]
+
+
+class _Response:
+    """iter_content 按给定的块返回的响应"""
+
+    def __init__(self, chunks):
+        self._chunks = chunks
+        self.closed = False
+
+    def iter_content(self, chunk_size=None):
+        return iter(self._chunks)
+
+    def close(self):
+        self.closed = True
+
+
+def test_chat_content_with_random_chunking():
+    words = ["你", "好", " 💅", "!"]
+    body = "".join(
+        "data: " + json.dumps({"choices": [{"delta": {"content": w}}]}, ensure_ascii=False) + "\r\n\r\n"
+        for w in words
+    ) + ":ping\r\n\r\ndata: [DONE]\r\n\r\ndata: 之后的数据不再读取\r\n\r\n"
+    rng = random.Random(1)
+    for _ in range(100):
+        chunks = list(_random_chunks(rng, body.encode("utf-8")))
+        assert list(iter_chat_content(_Response(chunks))) == words
@@ -0,0 +1,116 @@
+"""
+任务状态存储测试
+"""
+import json
+import os
+import threading
+import time
+
+from backend.services.task_state import MANIFEST_NAME, STATE_DIRNAME, TaskStateStore
+from backend.utils.reference_asset import ReferenceAsset
+
+PAGES = [{"index": 0, "type": "cover", "content": "封面"}, {"index": 1, "type": "content", "content": "内容"}]
+
+
+def _store(root, max_tasks=10, max_bytes=1024 * 1024, ttl_seconds=600):
+    return TaskStateStore(str(root), max_tasks=max_tasks, max_bytes=max_bytes, ttl_seconds=ttl_seconds)
+
+
+def _manifest(root, task_id):
+    with open(os.path.join(str(root), task_id, STATE_DIRNAME, MANIFEST_NAME), encoding="utf-8") as f:
+        return json.load(f)
+
+
+def test_resume_from_manifest_after_restart(tmp_path):
+    """进程重启后（新的存储实例）从清单恢复页面、生成结果和用户参考图"""
+    store = _store(tmp_path)
+    user_image = ReferenceAsset(b"user-image")
+    store.create("task", PAGES, "大纲", [user_image], "主题")
+    store.mark_generated("task", 0, "0.png")
+    store.mark_failed("task", 1, "超时")
+
+    state = _store(tmp_path).get("task")
+    assert state["pages"] == PAGES
+    assert state["generated"] == {0: "0.png"}
+    assert state["failed"] == {1: "超时"}
+    assert (state["full_outline"], state["user_topic"]) == ("大纲", "主题")
+    assert [asset.raw for asset in state["user_images"]] == [b"user-image"]
+
+
+def test_evicts_idle_tasks_after_ttl(tmp_path):
+    store = _store(tmp_path, ttl_seconds=0.05)
+    store.create("old", PAGES)
+    time.sleep(0.1)
+    store.create("new", PAGES)
+    assert store.stats()["tasks"] == 1
+    assert store.stats()["evictions"] == 1
+    # 淘汰后仍可从清单重新加载
+    assert store.get("old")["pages"] == PAGES
+    assert store.stats()["loads"] == 1
+
+
+def test_evicts_least_recently_used_over_task_count(tmp_path):
+    store = _store(tmp_path, max_tasks=2)
+    store.create("a", PAGES)
+    store.create("b", PAGES)
+    store.get("a")
+    store.create("c", PAGES)
+    # b 最久未使用
+    assert list(store._entries) == ["a", "c"]
+
+
+def test_evicts_over_memory_budget(tmp_path):
+    store = _store(tmp_path, max_bytes=3000)
+    store.create("a", PAGES, user_images=[ReferenceAsset(b"a" * 2000)])
+    store.create("b", PAGES, user_images=[ReferenceAsset(b"b" * 2000)])
+    assert list(store._entries) == ["b"]
+    assert store.stats()["bytes"] <= 3000
+    # 至少保留最近使用的一个任务，即使它本身超出预算
+    store.create("c", PAGES, user_images=[ReferenceAsset(b"c" * 4000)])
+    assert list(store._entries) == ["c"]
+
+
+def test_manifest_written_outside_store_lock(tmp_path, monkeypatch):
+    """写清单期间其他线程可以访问存储"""
+    store = _store(tmp_path)
+    store.create("other", PAGES)
+    write_manifest = store._write_manifest
+    accessed = []
+
+    def slow_write(task_id, manifest):
+        if task_id == "task":
+            thread = threading.Thread(target=lambda: accessed.append(store.get("other")))
+            thread.start()
+            thread.join(2)
+        write_manifest(task_id, manifest)
+
+    monkeypatch.setattr(store, "_write_manifest", slow_write)
+    store.create("task", PAGES)
+    assert accessed and accessed[0]["pages"] == PAGES
+
+
+def test_latest_manifest_wins_under_concurrent_updates(tmp_path):
+    store = _store(tmp_path)
+    store.create("task", [{"index": i, "type": "content", "content": ""} for i in range(20)])
+    threads = [
+        threading.Thread(target=store.mark_generated, args=("task", i, f"{i}.png")) for i in range(20)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(_manifest(tmp_path, "task")["generated"]) == 20
+    assert store._pending_manifests == {}
+
+
+def test_pending_manifest_used_before_written(tmp_path):
+    """快照尚未写入磁盘时被淘汰，再次访问使用待写入的快照，而不是磁盘上的旧清单"""
+    store = _store(tmp_path)
+    store.create("task", PAGES)
+    with store._lock:
+        state = store._entries["task"].state
+        state["failed"][1] = "超时"
+        store._save("task", state)
+        store.discard("task")
+    assert _manifest(tmp_path, "task")["failed"] == {}
+    assert store.get("task")["failed"] == {1: "超时"}
@@ -0,0 +1,87 @@
+"""
+缩略图服务测试
+"""
+import os
+
+from backend.services import thumbnail as thumbnail_module
+from backend.services.thumbnail import ThumbnailService, thumbnail_filename
+
+
+class FakeImagePool:
+    """按调用写入缩略图，可在渲染期间执行回调模拟原图被覆盖"""
+
+    def __init__(self, during_render=None):
+        self.calls = 0
+        self.during_render = during_render
+
+    def compress_file(self, source_path, target_path, max_size_kb):
+        self.calls += 1
+        with open(source_path, "rb") as f:
+            data = f.read()
+        if self.during_render:
+            callback, self.during_render = self.during_render, None
+            callback()
+        with open(target_path, "wb") as f:
+            f.write(b"thumb:" + data)
+        return len(data)
+
+
+def _write(path, data, mtime_ns):
+    with open(path, "wb") as f:
+        f.write(data)
+    os.utime(path, ns=(mtime_ns, mtime_ns))
+
+
+def _read(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def test_reuses_fresh_thumbnail(temp_history_dir, monkeypatch):
+    pool = FakeImagePool()
+    monkeypatch.setattr(thumbnail_module, "get_image_pool", lambda: pool)
+    _write(os.path.join(temp_history_dir, "0.png"), b"v1", 1_000_000_000)
+    service = ThumbnailService()
+
+    thumb_path = service.ensure_thumbnail(temp_history_dir, "0.png")
+    assert service.ensure_thumbnail(temp_history_dir, "0.png") == thumb_path
+    assert pool.calls == 1
+    assert _read(thumb_path) == b"thumb:v1"
+
+
+def test_missing_source_returns_none(temp_history_dir):
+    assert ThumbnailService().ensure_thumbnail(temp_history_dir, "0.png") is None
+
+
+def test_stale_write_after_invalidate_is_regenerated(temp_history_dir, monkeypatch):
+    """渲染期间原图被覆盖（并已 invalidate），迟到的旧缩略图不会被当作最新"""
+    source_path = os.path.join(temp_history_dir, "0.png")
+    _write(source_path, b"v1", 1_000_000_000)
+    service = ThumbnailService()
+
+    def replace_source():
+        service.invalidate(temp_history_dir, "0.png")
+        _write(source_path, b"v2", 2_000_000_000)
+
+    pool = FakeImagePool(during_render=replace_source)
+    monkeypatch.setattr(thumbnail_module, "get_image_pool", lambda: pool)
+
+    thumb_path = service.ensure_thumbnail(temp_history_dir, "0.png")
+    assert _read(thumb_path) == b"thumb:v1"
+    assert os.stat(thumb_path).st_mtime_ns == 1_000_000_000
+
+    # 下次访问发现缩略图早于新原图，重新生成
+    assert service.ensure_thumbnail(temp_history_dir, "0.png", on_demand=True) == thumb_path
+    assert _read(thumb_path) == b"thumb:v2"
+    assert pool.calls == 2
+    assert service.stats()["on_demand"] == 1
+
+
+def test_invalidate_removes_thumbnail(temp_history_dir):
+    thumb_path = os.path.join(temp_history_dir, thumbnail_filename("0.png"))
+    _write(thumb_path, b"thumb", 1_000_000_000)
+    service = ThumbnailService()
+    service.invalidate(temp_history_dir, "0.png")
+    assert not os.path.exists(thumb_path)
+    # 缩略图不存在时不报错
+    service.invalidate(temp_history_dir, "0.png")